@@ -0,0 +1,204 @@
+"""
+Segmented AES-GCM format of encrypted storage files.
+
+    header: MAGIC (8) | chunk size (4, big endian) | nonce prefix (7)
+    chunks: AES-GCM of every chunk size bytes of the file with 16 bytes tag,
+            the last chunk may be shorter (empty for empty file)
+
+Nonce of a chunk is nonce prefix | chunk index (4) | last chunk flag (1) and
+header is associated data of every chunk, so chunks can't be reordered,
+dropped or moved to another file and header can't be changed unnoticed.
+
+Files are encrypted while uploading and decrypted chunk by chunk on read,
+so memory use doesn't depend on the file size. Files of the legacy format
+(nonce (12) | AES-GCM of the whole file) don't start with MAGIC.
+"""
+
+import io
+import os
+import struct
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+MAGIC = b"FMRSAES1"
+HEADER_FORMAT = ">8sI7s"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def is_segmented(file) -> bool:
+    """True if the file is in segmented format, file is rewound"""
+    file.seek(0)
+    magic = file.read(len(MAGIC))
+    file.seek(0)
+
+    return magic == MAGIC
+
+
+def _get_nonce(nonce_prefix: bytes, index: int, last: bool) -> bytes:
+    return nonce_prefix + struct.pack(">IB", index, int(last))
+
+
+def _read_exactly(file, size: int) -> bytes:
+    """Read size bytes unless the end of file, file.read() may return less"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = file.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+
+    return bytes(data)
+
+
+class EncryptingStream(io.RawIOBase):
+    """Readable stream of the encrypted content of the source file"""
+
+    def __init__(self, source, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__()
+        self._source = source
+        self._aesgcm = AESGCM(key)
+        self._chunk_size = chunk_size
+        self._nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self._header = struct.pack(HEADER_FORMAT, MAGIC, chunk_size, self._nonce_prefix)
+        self._start()
+
+    def _start(self):
+        self._index = 0
+        self._buffer = memoryview(self._header)
+        self._next_chunk = _read_exactly(self._source, self._chunk_size)
+        self._finished = False
+
+    def _encrypt_next_chunk(self) -> bytes:
+        chunk = self._next_chunk
+        self._next_chunk = _read_exactly(self._source, self._chunk_size)
+        last = not self._next_chunk
+
+        nonce = _get_nonce(self._nonce_prefix, self._index, last)
+        self._index += 1
+        self._finished = last
+
+        return self._aesgcm.encrypt(nonce, chunk, self._header)
+
+    @property
+    def size(self) -> int:
+        """Size of the encrypted content, source must have size"""
+        source_size = self._source.size
+        chunks_count = max(-(-source_size // self._chunk_size), 1)
+
+        return HEADER_SIZE + source_size + chunks_count * TAG_SIZE
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._finished:
+            self._buffer = memoryview(self._encrypt_next_chunk())
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # only rewind is supported, storages seek to the start before upload
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("EncryptingStream can only be rewound")
+
+        self._source.seek(0)
+        self._start()
+
+        return 0
+
+
+class DecryptingStream(io.RawIOBase):
+    """Readable and seekable stream of the decrypted content of segmented file"""
+
+    def __init__(self, source, key: bytes):
+        super().__init__()
+        self._source = source
+        self._aesgcm = AESGCM(key)
+
+        source.seek(0)
+        self._header = _read_exactly(source, HEADER_SIZE)
+        magic, self._chunk_size, self._nonce_prefix = struct.unpack(
+            HEADER_FORMAT, self._header
+        )
+        if magic != MAGIC or not self._chunk_size:
+            raise ValueError("Invalid header of encrypted file")
+
+        source.seek(0, io.SEEK_END)
+        body_size = source.tell() - HEADER_SIZE
+        self._encrypted_chunk_size = self._chunk_size + TAG_SIZE
+        self._chunks_count = max(
+            (body_size + self._encrypted_chunk_size - 1) // self._encrypted_chunk_size,
+            1,
+        )
+        last_chunk_size = (
+            body_size - (self._chunks_count - 1) * self._encrypted_chunk_size - TAG_SIZE
+        )
+        if last_chunk_size < 0:
+            raise ValueError("Encrypted file is truncated")
+
+        self.size = (self._chunks_count - 1) * self._chunk_size + last_chunk_size
+        self._position = 0
+        self._chunk_index = None
+        self._chunk = b""
+
+    def _load_chunk(self, index: int):
+        if index == self._chunk_index:
+            return
+
+        self._source.seek(HEADER_SIZE + index * self._encrypted_chunk_size)
+        encrypted_chunk = _read_exactly(self._source, self._encrypted_chunk_size)
+        last = index == self._chunks_count - 1
+        nonce = _get_nonce(self._nonce_prefix, index, last)
+
+        self._chunk = self._aesgcm.decrypt(nonce, encrypted_chunk, self._header)
+        self._chunk_index = index
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._position >= self.size:
+            return 0
+
+        index, offset = divmod(self._position, self._chunk_size)
+        self._load_chunk(index)
+
+        data = self._chunk[offset : offset + len(b)]
+        b[: len(data)] = data
+        self._position += len(data)
+
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+
+        self._position = position
+
+        return position
+
+    def close(self):
+        self._source.close()
+        super().close()
@@ -13,7 +13,6 @@ from django.db.models import (
     CharField,
     DateField,
     FloatField,
-    ForeignKey,
     IntegerField,
     Q,
     TextField,
@@ -23,6 +22,12 @@ from rest_framework.exceptions import ValidationError
 from dateutil.parser import parse
 
 from poms.obj_attrs.models import GenericAttribute, GenericAttributeType
+from poms.search.documents import (
+    SEARCH_MODELS_WITHOUT_ATTRIBUTES,
+    get_search_relation_fields,
+    is_search_indexed,
+    search_queryset,
+)
 
 _l = logging.getLogger("poms.common")
 
@@ -753,25 +758,22 @@ def handle_filters(qs, filter_settings, master_user, content_type):
 
 def handle_global_table_search(qs, global_table_search, model, content_type):
     start_time = time.time()
+
+    if settings.GLOBAL_TABLE_SEARCH_INDEX and is_search_indexed(model):
+        qs = search_queryset(qs, global_table_search)
+        if content_type.model not in SEARCH_MODELS_WITHOUT_ATTRIBUTES:
+            qs = qs.filter(is_deleted=False)
+
+        _l.debug(
+            "handle_global_table_search by index done in %s seconds "
+            % "{:3.3f}".format(time.time() - start_time)
+        )
+
+        return qs
+
     q = Q()
 
-    relation_fields = [
-        f
-        for f in model._meta.fields
-        if isinstance(f, ForeignKey)
-        and f.name != "master_user"
-        and f.name != "owner"
-        and f.name != "procedure_instance"
-        and f.name != "complex_transaction"
-        and f.name != "event_schedule"
-        and f.name != "member"
-        and f.name != "action"
-        and f.name != "previous_date_record"
-        and f.name != "transaction"
-        and f.name != "status"
-        and f.name != "linked_import_task"
-        and f.name != "content_type"
-    ]
+    relation_fields = get_search_relation_fields(model)
 
     relation_queries_short_name = [
         Q(**{f"{f.name}__short_name__icontains": global_table_search})
@@ -843,19 +845,7 @@ def handle_global_table_search(qs, global_table_search, model, content_type):
     for query in float_queries:
         q = q | query
 
-    if content_type.model not in {
-        "currencyhistory",
-        "pricehistory",
-        "transaction",
-        "currencyhistoryerror",
-        "portfoliohistory",
-        "complextransactionimportscheme",
-        "csvimportscheme",
-        "pricehistoryerror",
-        "generatedevent",
-        "portfolioregisterrecord",
-        "complextransaction",
-    }:
+    if content_type.model not in SEARCH_MODELS_WITHOUT_ATTRIBUTES:
         string_attr_query = Q(
             **{"attributes__value_float__icontains": global_table_search}
         )
@@ -1,7 +1,10 @@
 import calendar
 import logging
+from bisect import bisect_right
 from datetime import date, timedelta
+from typing import List
 
+import numpy as np
 import QuantLib as ql
 from dateutil import relativedelta, rrule
 
@@ -59,8 +62,6 @@ def calculate_accrual_schedule_factor(
     dt3=None,
     maturity_date=None,
 ) -> float:
-    from poms.instruments.models import AccrualCalculationModel
-
     # day_convention_code - accrual_calculation_model
     # freq
     # dt1 - first accrual date - берется из AccrualCalculationSchedule
@@ -141,17 +142,28 @@ def calculate_accrual_schedule_factor(
     else:
         dt3 = maturity_date
 
-    if accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_NONE:
+    return _get_day_count_factor(
+        accrual_calculation_model.id, freq, dt1, dt2, dt3, maturity_date
+    )
+
+
+def _get_day_count_factor(
+    accrual_calculation_model_id, freq, dt1, dt2, dt3, maturity_date
+) -> float:
+    """Accrual factor of dt2 in the coupon period dt1 - dt3"""
+    from poms.instruments.models import AccrualCalculationModel
+
+    if accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_NONE:
         # Case 0  'none
         #     CouponAccrualFactor = 0
         return 0
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_ACT_ACT_ICMA:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_ACT_ACT_ICMA:
         # Case 1  'ACT/ACT
         #     CouponAccrualFactor = (dt2 - dt1) / (dt3 - dt1) / freq
         return (dt2 - dt1).days / (dt3 - dt1).days / freq
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_ACT_ACT_ISDA:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_ACT_ACT_ISDA:
         # Case 100  'ACT/ACT  - ISDA
         #     Ndays1 = DateSerial(y1, 1, 1) - DateSerial(y1, 12, 31)
         #     Ndays2 = DateSerial(y2, 1, 1) - DateSerial(y2, 12, 31)
@@ -173,17 +185,17 @@ def calculate_accrual_schedule_factor(
         else:
             return (dt2 - dt1).days / 365
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_ACT_360:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_ACT_360:
         # Case 2  'ACT/360
         #     CouponAccrualFactor = (dt2 - dt1) / 360
         return (dt2 - dt1).days / 360
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_ACT_365:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_ACT_365:
         # Case 3  'ACT/365
         #     CouponAccrualFactor = (dt2 - dt1) / 365
         return (dt2 - dt1).days / 365
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_ACT_366:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_ACT_366:
         # Case 107  'Act/365(366)
         #     If y1 < y2 Then
         #         If (Month(DateSerial(y1, 2, 29)) = 2 Or Month(DateSerial(y2, 2, 29)) = 2) And _
@@ -205,20 +217,20 @@ def calculate_accrual_schedule_factor(
                 return ((dt2 - dt1).days + 1) / 365
         return 0
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_ACT_365A:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_ACT_365A:
         # Case 104  'Act+1/365
         #     CouponAccrualFactor = (dt2 - dt1 + 1) / 365
         return ((dt2 - dt1).days + 1) / 365
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_30_360_US:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_30_360_US:
         return _accrual_factor_30_360(dt1, dt2)
 
     elif (
-        accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_30_360_GERMAN
+        accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_30_360_GERMAN
     ):
         return _accrual_factor_30_360(dt1, dt2)
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_NL_365:  # 14
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_NL_365:  # 14
         # Case 9  'NL/365
         #     Y1_leap = Month(DateSerial(Year(dt1), 2, 29)) = 2
         #     Y2_leap = Month(DateSerial(Year(dt2), 2, 29)) = 2
@@ -235,7 +247,7 @@ def calculate_accrual_schedule_factor(
             k = 1
         return ((dt2 - dt1).days - k) / 365
 
-    elif accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_BD_252:
+    elif accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_BD_252:
         # Case 33  'BUS DAYS/252
         #     CouponAccrualFactor = (DateDiff("d", dt1, dt2) - DateDiff("ww", dt1, dt2, vbSaturday) - _
         #         DateDiff("ww", dt1, dt2, vbSunday)) / 252
@@ -244,8 +256,8 @@ def calculate_accrual_schedule_factor(
         ) / 252
 
     elif (
-        accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_30_360_ISDA
-        or accrual_calculation_model.id == AccrualCalculationModel.DAY_COUNT_30E_360
+        accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_30_360_ISDA
+        or accrual_calculation_model_id == AccrualCalculationModel.DAY_COUNT_30E_360
     ):
         # 11 & 28
         # Case 35  'GERMAN-30/360 (EOM)
@@ -273,7 +285,7 @@ def calculate_accrual_schedule_factor(
         ) / 360
 
     else:
-        err_msg = f"unknown accrual_calculation_model.id={accrual_calculation_model.id}"
+        err_msg = f"unknown accrual_calculation_model.id={accrual_calculation_model_id}"
         _l.error(f"coupon_accrual_factor - {err_msg}")
         raise FormulaAccrualsError(
             error_key="coupon_accrual_factor",
@@ -297,6 +309,114 @@ def _accrual_factor_30_360(dt1, dt2):
     ) / 360
 
 
+def calculate_accrual_event_factors(coupon, price_dates: List[date]) -> List[float]:
+    """calculate_accrual_event_factor for every date of the coupon"""
+    ql_day_counter = coupon.accrual_calculation_model.get_quantlib_day_count(
+        coupon.accrual_calculation_model_id
+    )
+    start_date = ql.Date(
+        coupon.start_date.day, coupon.start_date.month, coupon.start_date.year
+    )
+    end_date = ql.Date(coupon.end_date.day, coupon.end_date.month, coupon.end_date.year)
+
+    coupon_days = ql_day_counter.dayCount(start_date, end_date)
+    if coupon_days == 0:
+        raise ValueError("Coupon period has zero days, can't compute factor")
+
+    return [
+        round(
+            ql_day_counter.dayCount(
+                start_date, ql.Date(price_date.day, price_date.month, price_date.year)
+            )
+            / coupon_days,
+            6,
+        )
+        for price_date in price_dates
+    ]
+
+
+def calculate_accrual_schedule_factors(
+    accrual_calculation_schedule, dt1, dates: List[date], dt3, maturity_date=None
+) -> np.ndarray:
+    """
+    calculate_accrual_schedule_factor for every date (sorted).
+    Coupon dates are calculated once and coupon period of the date is found
+    by binary search, factors of linear day count conventions are
+    calculated by numpy for all dates at once.
+    """
+    from poms.instruments.models import AccrualCalculationModel
+
+    result = np.zeros(len(dates))
+
+    accrual_calculation_model = accrual_calculation_schedule.accrual_calculation_model
+    periodicity = accrual_calculation_schedule.periodicity
+    if maturity_date is None:
+        maturity_date = accrual_calculation_schedule.instrument.maturity_date
+
+    if (
+        not dates
+        or accrual_calculation_model is None
+        or periodicity is None
+        or dt1 is None
+        or dt3 is None
+    ):
+        return result
+
+    freq = periodicity.to_freq()
+
+    if 0 < freq <= 12:
+        coupon_dates = [dt3]
+        while coupon_dates[-1] <= dates[-1]:
+            coupon_dates.append(dt3 + periodicity.to_timedelta(i=len(coupon_dates)))
+        period_length = periodicity.to_timedelta(i=1)
+
+        periods = []
+        for dt2 in dates:
+            k = bisect_right(coupon_dates, dt2)
+            period_end = coupon_dates[k]
+            period_start = period_end - period_length if k > 0 else dt1
+            if maturity_date is not None and period_end >= maturity_date > dt2:
+                period_end = maturity_date
+            periods.append((period_start, period_end))
+
+    elif freq >= 12:
+        return result
+    elif freq == 0:
+        freq = 1
+        periods = [(dt1, dt1 + relativedelta.relativedelta(years=1))] * len(dates)
+    else:
+        periods = [(dt1, maturity_date)] * len(dates)
+
+    model_id = accrual_calculation_model.id
+    if model_id == AccrualCalculationModel.DAY_COUNT_NONE:
+        return result
+
+    # factor = (dt2 - dt1 + days offset) / denominator, None is the coupon period
+    linear_day_counts = {
+        AccrualCalculationModel.DAY_COUNT_ACT_360: (0, 360),
+        AccrualCalculationModel.DAY_COUNT_ACT_365: (0, 365),
+        AccrualCalculationModel.DAY_COUNT_ACT_365A: (1, 365),
+        AccrualCalculationModel.DAY_COUNT_ACT_ACT_ICMA: (0, None),
+    }
+    if model_id in linear_day_counts:
+        days_offset, denominator = linear_day_counts[model_id]
+        day1 = np.array([start.toordinal() for start, _ in periods])
+        day2 = np.array([dt2.toordinal() for dt2 in dates])
+        days = day2 - day1 + days_offset
+        if denominator is None:
+            day3 = np.array([end.toordinal() for _, end in periods])
+            with np.errstate(divide="raise", invalid="raise"):
+                return days / (day3 - day1) / freq
+        return days / denominator
+
+    for i, (dt2, (period_start, period_end)) in enumerate(zip(dates, periods)):
+        result[i] = _get_day_count_factor(
+            model_id, freq, period_start, dt2, period_end, maturity_date
+        )
+
+    return result
+
+
 def get_coupon(accrual, dt1, dt2, maturity_date=None, factor=False):
     # accruals = [
     #     {
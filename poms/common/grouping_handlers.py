@@ -2,13 +2,13 @@ import logging
 import time
 
 from django.apps import apps
-from django.db.models import F, Q
+from django.db.models import Count, F, OuterRef, Q, Subquery
 from rest_framework.exceptions import ValidationError
 
 from poms.common.filtering_handlers import handle_filters, handle_global_table_search
-from poms.common.filters import filter_items_for_group, get_q_obj_for_attribute_type
+from poms.common.filters import filter_items_for_group
 from poms.common.utils import attr_is_relation
-from poms.obj_attrs.models import GenericAttributeType
+from poms.obj_attrs.models import GenericAttribute, GenericAttributeType
 
 _l = logging.getLogger("poms.common")
 
@@ -264,6 +264,65 @@ def handle_groups(
     return query_set
 
 
+def get_group_key_expression(
+    groups_type, master_user, content_type, content_type_key
+):
+    """
+    Expression of the value the objects are grouped by, equal to
+    group_identifier of the group rows
+    """
+    if has_attribute(groups_type):
+        attribute_code = groups_type.split(ATTRIBUTE_PREFIX)[1]
+        if not attribute_code:
+            raise ValidationError(
+                f"Invalid attribute code {groups_type} for attribute type"
+            )
+
+        attribute_type = GenericAttributeType.objects.get(
+            user_code__exact=attribute_code,
+            master_user=master_user,
+            content_type=content_type,
+        )
+        value_type_to_field_map = {
+            10: "value_string",
+            20: "value_float",
+            30: "classifier",
+            40: "value_date",
+        }
+
+        return Subquery(
+            GenericAttribute.objects.filter(
+                content_type=content_type,
+                object_id=OuterRef("pk"),
+                attribute_type=attribute_type,
+            ).values(value_type_to_field_map[attribute_type.value_type])[:1]
+        )
+
+    if attr_is_relation(content_type_key, groups_type):
+        return F(f"{groups_type}__user_code")
+
+    return F(groups_type)
+
+
+def get_group_counts(queryset, group_key, identifiers) -> dict:
+    """Count of objects of every group in one GROUP BY query"""
+    identifiers = list(identifiers)
+    q = Q(group_key__in=[value for value in identifiers if value is not None])
+    if None in identifiers:
+        q = q | Q(group_key__isnull=True)
+
+    counts = (
+        queryset.annotate(group_key=group_key)
+        .filter(q)
+        .order_by()
+        .values("group_key")
+        .annotate(count=Count("id"))
+        .values_list("group_key", "count")
+    )
+
+    return dict(counts)
+
+
 def count_groups(
     query_set,
     groups_types,
@@ -274,6 +333,11 @@ def count_groups(
     ev_options,
     global_table_search,
 ):
+    """
+    Set items_count_raw and items_count of the group rows (usually the page of
+    them), both counted by a single aggregated query over the objects of all
+    the groups
+    """
     start_time = time.time()
 
     Model = apps.get_model(
@@ -281,109 +345,86 @@ def count_groups(
     )
     content_type_key = f"{content_type.app_label}.{content_type.model}"
 
-    for item in query_set:
-        q = Q()
-        index = 0
-        for groups_type in groups_types:
-            has_attribute_prefix = has_attribute(groups_type)
-            attribute_code = (
-                groups_type.split(ATTRIBUTE_PREFIX)[1] if has_attribute_prefix else None
+    q = Q()
+    for index, groups_type in enumerate(groups_types[: len(group_values)]):
+        if has_attribute(groups_type):
+            group_key = get_group_key_expression(
+                groups_type, master_user, content_type, content_type_key
+            )
+            q = q & Q(
+                id__in=Model.objects.annotate(group_key=group_key)
+                .filter(group_key=group_values[index])
+                .values("id")
             )
-            if has_attribute_prefix:
-                if not attribute_code:
-                    raise ValidationError(
-                        f"Invalid attribute code {groups_type} for attribute type"
-                    )
-
-                attribute_type = GenericAttributeType.objects.get(
-                    user_code__exact=attribute_code,
-                    master_user=master_user,
-                    content_type=content_type,
-                )
-
-                if len(group_values) and index < len(group_values):
-                    value = group_values[index]
-                else:
-                    value = item["group_identifier"]
-
-                attr_type_q = get_q_obj_for_attribute_type(attribute_type, value)
-
-                result = []
-                if attr_type_q != Q():
-                    result = Model.objects.filter(q & attr_type_q).values_list(
-                        "id", flat=True
-                    )
-
-                key = "id__in"
-                if len(result):
-                    q = q & Q(**{f"{key}": result})
-
-            else:
-                key = groups_type
-
-                if attr_is_relation(content_type_key, key):
-                    key = f"{key}__user_code"
-
-                if len(group_values) and index < len(group_values):
-                    q = q & Q(**{f"{key}": group_values[index]})
-                else:
-                    q = q & Q(**{f"{key}": item["group_identifier"]})
-
-            index = index + 1
-
-        if content_type.model in {"currencyhistory", "currencyhistoryerror"}:
-            q = q & Q(currency__master_user_id=master_user.pk)
-        elif content_type.model in {"pricehistory", "pricehistoryerror"}:
-            q = q & Q(instrument__master_user_id=master_user.pk)
         else:
-            q = q & Q(master_user_id=master_user.pk)
+            key = groups_type
+
+            if attr_is_relation(content_type_key, key):
+                key = f"{key}__user_code"
+
+            q = q & Q(**{f"{key}": group_values[index]})
 
+    if content_type.model in {"currencyhistory", "currencyhistoryerror"}:
+        q = q & Q(currency__master_user_id=master_user.pk)
+    elif content_type.model in {"pricehistory", "pricehistoryerror"}:
+        q = q & Q(instrument__master_user_id=master_user.pk)
+    else:
+        q = q & Q(master_user_id=master_user.pk)
+
+        if (
+            content_type.model
+            not in {
+                "portfolioregisterrecord",
+                "portfoliohistory",
+                "portfolioreconcilehistory",
+            }
+            and ev_options["entity_filters"]
+        ):
             if (
-                content_type.model
-                not in {
-                    "portfolioregisterrecord",
-                    "portfoliohistory",
-                    "portfolioreconcilehistory",
-                }
-                and ev_options["entity_filters"]
+                content_type.model not in {"objecthistory4entry", "generatedevent"}
+                and "deleted" not in ev_options["entity_filters"]
             ):
+                q = q & Q(is_deleted=False)
+
+            if content_type.model in ["instrument"]:
                 if (
-                    content_type.model not in {"objecthistory4entry", "generatedevent"}
-                    and "deleted" not in ev_options["entity_filters"]
+                    "active" in ev_options["entity_filters"]
+                    and "inactive" not in ev_options["entity_filters"]
                 ):
-                    q = q & Q(is_deleted=False)
-
-                if content_type.model in ["instrument"]:
-                    if (
-                        "active" in ev_options["entity_filters"]
-                        and "inactive" not in ev_options["entity_filters"]
-                    ):
-                        q = q & Q(is_active=True)
-
-                    if (
-                        "inactive" in ev_options["entity_filters"]
-                        and "active" not in ev_options["entity_filters"]
-                    ):
-                        q = q & Q(is_active=False)
+                    q = q & Q(is_active=True)
 
                 if (
-                    content_type.model not in ["complextransaction"]
-                    and "disabled" not in ev_options["entity_filters"]
+                    "inactive" in ev_options["entity_filters"]
+                    and "active" not in ev_options["entity_filters"]
                 ):
-                    q = q & Q(is_enabled=True)
+                    q = q & Q(is_active=False)
 
-        if content_type.model in ["complextransaction"]:
-            q = q & Q(is_deleted=False)
+            if (
+                content_type.model not in ["complextransaction"]
+                and "disabled" not in ev_options["entity_filters"]
+            ):
+                q = q & Q(is_enabled=True)
 
-        count_cs = Model.objects.filter(q)
+    if content_type.model in ["complextransaction"]:
+        q = q & Q(is_deleted=False)
 
-        item["items_count_raw"] = count_cs.count()
-        count_cs = handle_filters(count_cs, filter_settings, master_user, content_type)
-        if global_table_search:
-            count_cs = handle_global_table_search(
-                count_cs, global_table_search, Model, content_type
-            )
-        item["items_count"] = count_cs.count()
+    count_cs = Model.objects.filter(q)
+    group_key = get_group_key_expression(
+        groups_types[-1], master_user, content_type, content_type_key
+    )
+    identifiers = [item["group_identifier"] for item in query_set]
+
+    counts_raw = get_group_counts(count_cs, group_key, identifiers)
+    count_cs = handle_filters(count_cs, filter_settings, master_user, content_type)
+    if global_table_search:
+        count_cs = handle_global_table_search(
+            count_cs, global_table_search, Model, content_type
+        )
+    counts = get_group_counts(count_cs, group_key, identifiers)
+
+    for item in query_set:
+        item["items_count_raw"] = counts_raw.get(item["group_identifier"], 0)
+        item["items_count"] = counts.get(item["group_identifier"], 0)
 
     _l.info(f"count_groups {groups_types} took {str(time.time() - start_time)} secs")
 
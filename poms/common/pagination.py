@@ -1,10 +1,18 @@
+import base64
+import json
 import logging
 import sys
 import time
+from collections import OrderedDict
 
 from django.core.paginator import InvalidPage
+from django.db import connection
+from django.db.models import Q
 from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from poms.common.sorting import KEYSET_VALUE
 
 _l = logging.getLogger("poms.common")
 
@@ -22,9 +30,45 @@ def _positive_int(integer_string, strict=False, cutoff=None):
     return ret
 
 
+def estimate_count(queryset) -> int:
+    """Number of rows of the queryset estimated by the planner, without COUNT(*)"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _after_value(value, descending: bool) -> Q:
+    """Rows after the value of KEYSET_VALUE, NULLs are last in ascending order"""
+    if descending:
+        if value is None:
+            return Q(**{f"{KEYSET_VALUE}__isnull": False})
+        return Q(**{f"{KEYSET_VALUE}__lt": value})
+
+    if value is None:
+        return Q(pk__in=[])
+    return Q(**{f"{KEYSET_VALUE}__gt": value}) | Q(**{f"{KEYSET_VALUE}__isnull": True})
+
+
+def _same_value(value) -> Q:
+    if value is None:
+        return Q(**{f"{KEYSET_VALUE}__isnull": True})
+    return Q(**{KEYSET_VALUE: value})
+
+
 class PageNumberPaginationExt(PageNumberPagination):
     page_size_query_param = "page_size"
     max_page_size = 1000  # api_settings.PAGE_SIZE * 10
+    invalid_cursor_message = "Invalid cursor"
+
+    cursor_mode = False
+    next_cursor = None
+    count = None
 
     def post_paginate_queryset(self, queryset, request, view=None):
         # TODO Refactor this in more readable way
@@ -77,6 +121,80 @@ class PageNumberPaginationExt(PageNumberPagination):
 
         return res
 
+    def encode_cursor(self, ordering, value, pk) -> str:
+        # str keeps microseconds of datetimes
+        data = json.dumps([ordering, value, pk], default=str)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor, ordering) -> tuple:
+        try:
+            cursor_ordering, value, pk = json.loads(base64.urlsafe_b64decode(cursor))
+        except Exception as exc:
+            raise NotFound(self.invalid_cursor_message) from exc
+
+        if cursor_ordering != ordering:
+            raise NotFound(self.invalid_cursor_message)
+
+        return value, pk
+
+    def post_cursor_paginate_queryset(
+        self, queryset, request, ordering=None, descending=False
+    ):
+        """
+        Keyset pagination of the queryset ordered by sort_by_keyset: the page
+        starts after the row of the "cursor" from request, so no OFFSET
+        is used. Count is calculated only if asked by "count_mode":
+        "exact" or "estimate" (from planner statistics).
+        """
+        self.cursor_mode = True
+        self.request = request
+
+        page_size = request.data.get("page_size", self.page_size)
+        try:
+            page_size = min(int(page_size), self.max_page_size)
+        except Exception:
+            page_size = 40
+
+        count_mode = request.data.get("count_mode")
+        if count_mode == "exact":
+            self.count = queryset.count()
+        elif count_mode == "estimate":
+            self.count = estimate_count(queryset)
+
+        cursor = request.data.get("cursor")
+        if cursor:
+            value, pk = self.decode_cursor(cursor, ordering)
+            queryset = queryset.filter(
+                _after_value(value, descending)
+                | _same_value(value) & Q(pk__gt=pk)
+            )
+
+        res = list(queryset[: page_size + 1])
+
+        self.next_cursor = None
+        if len(res) > page_size:
+            res = res[:page_size]
+            last = res[-1]
+            self.next_cursor = self.encode_cursor(
+                ordering, getattr(last, KEYSET_VALUE), last.pk
+            )
+
+        return res
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+
+        return Response(
+            OrderedDict(
+                [
+                    ("count", self.count),
+                    ("next_cursor", self.next_cursor),
+                    ("results", data),
+                ]
+            )
+        )
+
 
 class BigPagination(PageNumberPagination):
     page_size_query_param = "page_size"
@@ -1,8 +1,9 @@
 import logging
 import math
 import time
+from datetime import date
 
-from django.db.models import Value
+from django.db.models import F, OuterRef, Subquery, Value
 from django.db.models.functions import Coalesce
 
 from poms.obj_attrs.models import GenericAttributeType, GenericAttribute
@@ -127,3 +128,61 @@ def sort_by_dynamic_attrs(queryset, ordering, master_user, content_type):
         )
 
     return queryset
+
+
+KEYSET_VALUE = "keyset_value"
+
+# value_type of attribute: (value field, value of missing attribute)
+ATTRIBUTE_ORDERING_VALUES = {
+    10: ("value_string", Value("")),
+    20: ("value_float", Value(-math.inf)),
+    30: ("classifier__name", Value("-")),
+    40: ("value_date", Value(date.min)),
+}
+
+
+def sort_by_keyset(queryset, ordering, master_user, content_type):
+    """
+    Same ordering as sort_by_dynamic_attrs, but sort value is annotated as
+    KEYSET_VALUE and id is a tiebreaker, as required by cursor pagination.
+    Returns queryset and if the ordering is descending.
+    """
+    descending = bool(ordering) and ordering.startswith("-")
+    parts = ordering.split("attributes.") if ordering else []
+    attribute_type = None
+
+    if parts and len(parts) == 2:
+        attribute_type = GenericAttributeType.objects.get(
+            user_code__exact=parts[1], master_user=master_user, content_type=content_type
+        )
+
+    if attribute_type and attribute_type.value_type in ATTRIBUTE_ORDERING_VALUES:
+        value_field, missing_value = ATTRIBUTE_ORDERING_VALUES[attribute_type.value_type]
+        attributes = GenericAttribute.objects.filter(attribute_type=attribute_type)
+        queryset = queryset.filter(pk__in=attributes.values("object_id")).annotate(
+            **{
+                KEYSET_VALUE: Coalesce(
+                    Subquery(
+                        attributes.filter(object_id=OuterRef("pk")).values(
+                            value_field
+                        )[:1]
+                    ),
+                    missing_value,
+                )
+            }
+        )
+
+    else:
+        field = ordering.lstrip("-") if ordering and not attribute_type else "id"
+        content_type_key = content_type.app_label + "." + content_type.model
+        if attr_is_relation(content_type_key, field):
+            field = field + "__name"
+
+        queryset = queryset.annotate(**{KEYSET_VALUE: F(field)})
+
+    if descending:
+        order = F(KEYSET_VALUE).desc(nulls_first=True)
+    else:
+        order = F(KEYSET_VALUE).asc(nulls_last=True)
+
+    return queryset.order_by(order, "id"), descending
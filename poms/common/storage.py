@@ -1,4 +1,5 @@
 import contextlib
+import io
 import logging
 import math
 import os
@@ -16,6 +17,11 @@ from storages.backends.azure_storage import AzureStorage
 from storages.backends.s3boto3 import S3Boto3Storage
 from storages.backends.sftpstorage import SFTPStorage
 
+from poms.common.encrypted_stream import (
+    DecryptingStream,
+    EncryptingStream,
+    is_segmented,
+)
 from poms_app import settings
 
 _l = logging.getLogger("poms.common")
@@ -84,33 +90,23 @@ class EncryptedStorageMixin:
         pass
 
     def _encrypt_file(self, file):
-        # Encrypt the file content using the symmetric key
-        file_content = file.read()
+        # Encrypt the file content using the symmetric key while it is uploaded
+        file.seek(0)
+        encrypted_stream = EncryptingStream(file, self.symmetric_key)
 
-        # Generate a random nonce
-        # You can generate a random nonce using os.urandom(12) for AES-256-GCM.
-        # The recommended length for the nonce in AES-GCM is 12 bytes (96 bits).
-        # Ensure that you securely store and associate the nonce with the encrypted data
-        # so that you can use the same nonce during decryption.
-        nonce = os.urandom(12)
-
-        aesgcm = AESGCM(self.symmetric_key)
-        encrypted_content = aesgcm.encrypt(nonce, file_content, None)
-
-        encrypted_data = nonce + encrypted_content
-
-        return ContentFile(encrypted_data)
+        return File(encrypted_stream, name=getattr(file, "name", None))
 
     def _decrypt_file(self, file):
         # Decrypt the file content using the symmetric key
 
+        if is_segmented(file):
+            # decrypted chunk by chunk on read
+            decrypted_stream = DecryptingStream(file, self.symmetric_key)
+            return File(io.BufferedReader(decrypted_stream), name=file.name)
+
+        # Legacy format: nonce and AES-256-GCM of the whole file
         encrypted_data = file.read()
 
-        # Generate a random nonce
-        # You can generate a random nonce using os.urandom(12) for AES-256-GCM.
-        # The recommended length for the nonce in AES-GCM is 12 bytes (96 bits).
-        # Ensure that you securely store and associate the nonce with the encrypted data
-        # so that you can use the same nonce during decryption.
         # Extract the nonce from the encrypted data
         nonce = encrypted_data[:12]
 
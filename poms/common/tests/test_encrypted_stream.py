@@ -0,0 +1,81 @@
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from poms.common.encrypted_stream import (
+    DecryptingStream,
+    EncryptingStream,
+    is_segmented,
+)
+from poms.common.storage import EncryptedStorageMixin
+
+KEY = AESGCM.generate_key(bit_length=256)
+CHUNK_SIZE = 16
+
+
+def encrypt(content: bytes) -> bytes:
+    stream = EncryptingStream(ContentFile(content), KEY, chunk_size=CHUNK_SIZE)
+    return stream.read()
+
+
+class EncryptedStreamTest(SimpleTestCase):
+    def test_round_trip(self):
+        for size in (0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE * 3 + 5):
+            with self.subTest(size=size):
+                content = os.urandom(size)
+                encrypted = encrypt(content)
+                self.assertEqual(
+                    len(encrypted),
+                    EncryptingStream(ContentFile(content), KEY, CHUNK_SIZE).size,
+                )
+
+                self.assertTrue(is_segmented(io.BytesIO(encrypted)))
+                stream = DecryptingStream(io.BytesIO(encrypted), KEY)
+                self.assertEqual(stream.size, size)
+                self.assertEqual(stream.read(), content)
+
+    def test_seek(self):
+        content = os.urandom(CHUNK_SIZE * 4)
+        stream = io.BufferedReader(
+            DecryptingStream(io.BytesIO(encrypt(content)), KEY)
+        )
+
+        stream.seek(CHUNK_SIZE * 2 + 3)
+        self.assertEqual(
+            stream.read(CHUNK_SIZE), content[CHUNK_SIZE * 2 + 3 : CHUNK_SIZE * 3 + 3]
+        )
+        stream.seek(-5, io.SEEK_END)
+        self.assertEqual(stream.read(), content[-5:])
+
+    def test_truncated_file_is_rejected(self):
+        encrypted = encrypt(os.urandom(CHUNK_SIZE * 3))
+        # drop the last chunk, previous chunk is not the last one
+        truncated = encrypted[: -(CHUNK_SIZE + 16)]
+
+        with self.assertRaises(InvalidTag):
+            DecryptingStream(io.BytesIO(truncated), KEY).read()
+
+    def test_legacy_format(self):
+        storage = EncryptedStorageMixin()
+        storage.symmetric_key = KEY
+        nonce = os.urandom(12)
+        legacy = nonce + AESGCM(KEY).encrypt(nonce, b"legacy content", None)
+        legacy_file = ContentFile(legacy, name="legacy.txt")
+
+        self.assertFalse(is_segmented(legacy_file))
+        self.assertEqual(storage._decrypt_file(legacy_file).read(), b"legacy content")
+
+    def test_storage_round_trip(self):
+        storage = EncryptedStorageMixin()
+        storage.symmetric_key = KEY
+        content = os.urandom(200 * 1024)
+
+        encrypted = storage._encrypt_file(ContentFile(content, name="file.csv"))
+        encrypted_file = ContentFile(encrypted.read(), name="file.csv")
+
+        self.assertEqual(storage._decrypt_file(encrypted_file).read(), content)
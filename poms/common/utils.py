@@ -6,13 +6,14 @@ import logging
 import math
 from datetime import timedelta
 from http import HTTPStatus
+from typing import Callable, Hashable, Iterable
 
 import pandas as pd
 
 from django.conf import settings
 from django.contrib.admin.utils import NestedObjects
 from django.contrib.contenttypes.models import ContentType
-from django.db import connection, router
+from django.db import connection, router, transaction
 from django.utils.timezone import now
 from django.views.generic.dates import timezone_today
 from rest_framework.views import exception_handler
@@ -1009,6 +1010,49 @@ def get_current_schema():
         return cursor.fetchone()[0]
 
 
+def collect_on_commit(
+    key: Hashable, values: Iterable, callback: Callable[[set], None]
+):
+    """
+    Collect values by the key during the current db transaction,
+    callback(values) is called once with all of them on commit,
+    right away if there is no transaction
+    """
+    db = transaction.get_connection()
+    # atomic blocks of TestCase never commit, their hooks are run by tests
+    # (captureOnCommitCallbacks), so each of them is a hook on its own
+    block = next(
+        (b for b in db.atomic_blocks if not getattr(b, "_from_testcase", False)),
+        None,
+    )
+    if block is None:
+        values = set(values)
+        transaction.on_commit(lambda: callback(values))
+        return
+
+    # list of commit hooks is replaced on commit and rollback, values
+    # collected for the replaced list are already handled or discarded
+    pending = getattr(db, "collected_on_commit", None)
+    if (
+        pending is None
+        or pending[0] is not block
+        or pending[1] is not db.run_on_commit
+    ):
+        pending = db.collected_on_commit = (block, db.run_on_commit, {})
+
+    collected = pending[2].get(key)
+    if collected is None:
+        collected = pending[2][key] = set()
+
+        def run():
+            pending[2].pop(key, None)
+            callback(collected)
+
+        transaction.on_commit(run)
+
+    collected.update(values)
+
+
 class FinmarsNestedObjects(NestedObjects):
     def __init__(self, instance):
         using = router.db_for_write(instance._meta.model)
@@ -39,7 +39,7 @@ from poms.common.mixins import (
     UpdateModelMixinExt,
 )
 from poms.common.serializers import RealmMigrateSchemeSerializer
-from poms.common.sorting import sort_by_dynamic_attrs
+from poms.common.sorting import sort_by_dynamic_attrs, sort_by_keyset
 from poms.common.tasks import apply_migration_to_space
 from poms.iam.views import AbstractFinmarsAccessPolicyViewSet
 from poms.obj_attrs.models import GenericAttribute, GenericAttributeType
@@ -224,10 +224,11 @@ class AbstractModelViewSet(
         queryset = handle_filters(queryset, filter_settings, master_user, content_type)
 
         ordering = request.data.get("ordering", None)
+        cursor_mode = request.data.get("pagination_mode") == "cursor"
 
         _l.debug(f"ordering {ordering}")
 
-        if ordering:
+        if ordering and not cursor_mode:
             queryset = sort_by_dynamic_attrs(
                 queryset, ordering, master_user, content_type
             )
@@ -240,7 +241,15 @@ class AbstractModelViewSet(
                 content_type,
             )
 
-        page = self.paginator.post_paginate_queryset(queryset, request)
+        if cursor_mode:
+            queryset, descending = sort_by_keyset(
+                queryset, ordering, master_user, content_type
+            )
+            page = self.paginator.post_cursor_paginate_queryset(
+                queryset, request, ordering=ordering, descending=descending
+            )
+        else:
+            page = self.paginator.post_paginate_queryset(queryset, request)
 
         serializer = self.get_serializer(page, many=True)
 
@@ -302,8 +311,10 @@ class AbstractModelViewSet(
             content_type,
         )
 
-        filtered_qs = count_groups(
-            filtered_qs,
+        page = self.paginator.post_paginate_queryset(filtered_qs, request)
+
+        page = count_groups(
+            page,
             groups_types,
             groups_values,
             master_user,
@@ -313,8 +324,6 @@ class AbstractModelViewSet(
             global_table_search,
         )
 
-        page = self.paginator.post_paginate_queryset(filtered_qs, request)
-
         if content_type.model == "transactiontype":  # FIXME refactor someday
             from poms.transactions.models import TransactionTypeGroup
 
@@ -976,8 +985,12 @@ class AbstractEvGroupViewSet(
             content_type,
         )
 
-        filtered_qs = count_groups(
-            filtered_qs,
+        # print('len after handle groups %s' % len(filtered_qs))
+
+        page = self.paginator.post_paginate_queryset(filtered_qs, request)
+
+        page = count_groups(
+            page,
             groups_types,
             groups_values,
             master_user,
@@ -987,10 +1000,6 @@ class AbstractEvGroupViewSet(
             global_table_search,
         )
 
-        # print('len after handle groups %s' % len(filtered_qs))
-
-        page = self.paginator.post_paginate_queryset(filtered_qs, request)
-
         _l.debug(f"Filtered EV Group List {str(time.time() - start_time)} seconds ")
 
         if page is not None:
@@ -1,25 +1,17 @@
 import copy
-import csv
 import json
-import os
-import re
 import traceback
 from datetime import datetime, date
 from functools import reduce
 from logging import getLogger
 from operator import or_
-from tempfile import NamedTemporaryFile
-from typing import Any, Optional
+from typing import Any, Dict, Optional
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
-from django.utils.dateparse import parse_date
+from django.db.models import Prefetch, Q
 from django.utils.timezone import now
 
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
-
 from poms.accounts.models import AccountType
 from poms.celery_tasks.models import CeleryTask
 from poms.common.models import ProxyRequest, ProxyUser
@@ -35,13 +27,25 @@ from poms.csv_import.models import (
     SimpleImportProcessPreprocessItem,
     SimpleImportResult,
 )
+from poms.csv_import.readers import iter_csv_rows, iter_excel_rows, read_file_items
 from poms.csv_import.serializers import SimpleImportResultSerializer
 from poms.csv_import.tasks import simple_import_bulk_insert_final_updates_procedure
+from poms.csv_import.upsert import (
+    INSERTED,
+    SKIPPED,
+    TIME_SERIES_KEY_FIELDS,
+    UPDATED,
+    upsert_time_series,
+)
 from poms.currencies.models import Currency
 from poms.expressions_engine import formula
 from poms.file_reports.models import FileReport
+from poms.history.journal import journal_changes
+from poms.iam.allowed_objects import allowed_objects_changed, has_user_code
 from poms.instruments.models import (
     AccrualCalculationModel,
+    AccrualCalculationSchedule,
+    AccrualEvent,
     Country,
     DailyPricingModel,
     Instrument,
@@ -53,6 +57,7 @@ from poms.instruments.models import (
 )
 from poms.obj_attrs.models import GenericAttributeType, GenericClassifier
 from poms.procedures.models import RequestDataFileProcedureInstance
+from poms.reports.result_cache import report_data_changed
 from poms.strategies.models import (
     Strategy1Subgroup,
     Strategy2Subgroup,
@@ -60,6 +65,7 @@ from poms.strategies.models import (
 )
 from poms.system_messages.handlers import send_system_message
 from poms.users.models import EcosystemDefault
+from poms.widgets.snapshots import history_changed
 from poms.portfolios.models import PortfolioType
 from dateutil.parser import parse
 
@@ -68,6 +74,9 @@ storage = get_storage()
 
 _l = getLogger("poms.csv_import")
 
+# PriceHistory fields calculated from instrument if they are null in the file
+PRICE_HISTORY_CALCULATED_FIELDS = ("accrued_price", "factor")
+
 ACCRUAL_MAP = {
     "Actual/Actual (AFB)": AccrualCalculationModel.DAY_COUNT_ACT_ACT_AFB,
     "Actual/Actual (ICMA)": AccrualCalculationModel.DAY_COUNT_ACT_ACT_ICMA,
@@ -942,33 +951,23 @@ class SimpleImportProcess:
                 _l.info(f"ProcessType.CSV self.file_path {self.file_path}")
 
                 with storage.open(self.file_path, "rb") as f:
-                    with NamedTemporaryFile() as tmpf:
-                        for chunk in f.chunks():
-                            tmpf.write(chunk)
-                        tmpf.flush()
-
-                        # TODO check encoding (maybe should be taken from scheme)
-                        with open(
-                            tmpf.name,
-                            mode="rt",
-                            encoding="utf_8_sig",
-                            errors="ignore",
-                        ) as cf:
-                            # TODO check quotechar (maybe should be taken from scheme)
-                            reader = csv.reader(
-                                cf,
-                                delimiter=self.scheme.delimiter,
-                                quotechar='"',
-                                strict=False,
-                                skipinitialspace=True,
-                            )
-
-                            self.append_and_count_file_items(reader)
+                    # file is read once, reading stops after the limit
+                    # and the check below fails the import
+                    self.file_items = read_file_items(
+                        iter_csv_rows(f, self.scheme.delimiter),
+                        settings.MAX_ITEMS_IMPORT + 1,
+                    )
 
             elif self.process_type == ProcessType.EXCEL:
                 with storage.open(self.file_path, "rb") as f:
-                    with NamedTemporaryFile() as tmpf:
-                        self.read_from_excel_file(f, tmpf)
+                    self.file_items = read_file_items(
+                        iter_excel_rows(
+                            f,
+                            self.scheme.spreadsheet_active_tab_name,
+                            self.scheme.spreadsheet_start_cell,
+                        ),
+                        settings.MAX_ITEMS_IMPORT + 1,
+                    )
 
             else:
                 raise ValueError(
@@ -1002,66 +1001,6 @@ class SimpleImportProcess:
             _l.error(err_msg)
             raise e
 
-    def read_from_excel_file(self, f, tmpf):
-        for chunk in f.chunks():
-            tmpf.write(chunk)
-
-        tmpf.flush()
-
-        os.link(tmpf.name, f"{tmpf.name}.xlsx")
-
-        _l.info(f"self.file_path {self.file_path}")
-        _l.info(f"tmpf.name {tmpf.name}")
-
-        wb = load_workbook(filename=f"{tmpf.name}.xlsx")
-
-        ws = (
-            wb[self.scheme.spreadsheet_active_tab_name]
-            if (
-                self.scheme.spreadsheet_active_tab_name
-                and self.scheme.spreadsheet_active_tab_name in wb.sheetnames
-            )
-            else wb.active
-        )
-        reader = []
-
-        if self.scheme.spreadsheet_start_cell == "A1":
-            reader.extend([cell.value for cell in r] for r in ws.rows)
-        else:
-            start_cell_row_number = int(
-                re.search(r"\d+", self.scheme.spreadsheet_start_cell)[0]
-            )
-            start_cell_letter = self.scheme.spreadsheet_start_cell.split(
-                str(start_cell_row_number)
-            )[0]
-
-            start_cell_column_number = column_index_from_string(start_cell_letter)
-
-            for row_number, r in enumerate(ws.rows, start=1):
-                if row_number >= start_cell_row_number:
-                    row_values = [
-                        cell.value
-                        for cell in r
-                        if cell.column >= start_cell_column_number
-                    ]
-                    reader.append(row_values)
-
-        self.append_and_count_file_items(reader)
-
-    def append_and_count_file_items(self, reader):
-        column_row = None
-
-        for row_index, row in enumerate(reader):
-            if row_index == 0:
-                column_row = row
-
-            else:
-                file_item = {
-                    column_row[column_index]: value
-                    for column_index, value in enumerate(row)
-                }
-                self.file_items.append(file_item)
-
     def whole_file_preprocess(self):
         if self.scheme.data_preprocess_expression:
             names = {"data": self.file_items}
@@ -1081,7 +1020,7 @@ class SimpleImportProcess:
                 _l.error(f"Could not execute preprocess expression. Error {e}")
                 raise e
 
-        _l.info(f"whole_file_preprocess.file_items {len(self.file_items)}")
+            _l.info(f"whole_file_preprocess.file_items {len(self.file_items)}")
 
         return self.file_items
 
@@ -1115,9 +1054,11 @@ class SimpleImportProcess:
             raise e
 
     def apply_conversion_to_raw_items(self):
-        for row_number, raw_item in enumerate(self.raw_items, start=1):
+        for row_number, (file_item, raw_item) in enumerate(
+            zip(self.file_items, self.raw_items), start=1
+        ):
             conversion_item = SimpleImportConversionItem()
-            conversion_item.file_inputs = self.file_items[row_number - 1]
+            conversion_item.file_inputs = file_item
             conversion_item.raw_inputs = raw_item
             conversion_item.conversion_inputs = {}
             conversion_item.row_number = row_number
@@ -1364,11 +1305,6 @@ class SimpleImportProcess:
                                 entity_field.attribute_user_code
                             ]
 
-    def __get_key_for_matching_model(
-        self, key_model_user_code="-", pricing_policy__user_code="-", date="-"
-    ):
-        return f"{key_model_user_code}-{pricing_policy__user_code}-{date}"
-
     def __relation_fields_map_for_content_type(self):
         relation_fields_map = RELATION_FIELDS_MAP
 
@@ -1703,47 +1639,114 @@ class SimpleImportProcess:
         Calculates accrued_price & factor for PriceHistory if in the file
         their values are null, and update final_inputs dict
         """
-        if model.lower() != "pricehistory" or not final_inputs:
-            return None
+        return SimpleImportProcess.calculate_pricehistory_null_fields_batch(
+            model, {0: final_inputs}
+        ).get(0)
 
-        _l.info(f"calculate_null_fields: {model} final_inputs={final_inputs}")
+    @staticmethod
+    def calculate_pricehistory_null_fields_batch(
+        model: str, items_final_inputs: Dict[Any, dict]
+    ) -> Dict[Any, str]:
+        """
+        Same as calculate_pricehistory_null_fields for final inputs of all
+        items of the batch: every instrument is loaded once with accrual
+        events, schedules and factor schedules, and values of all its dates
+        are calculated at once. Returns error messages by item key.
+        """
+        if model.lower() != "pricehistory":
+            return {}
+
+        errors = {}
+        # instrument user_code -> {field: [(date, item key)]}
+        instruments_dates = {}
+        for item_key, final_inputs in items_final_inputs.items():
+            null_keys = [
+                key
+                for key in PRICE_HISTORY_CALCULATED_FIELDS
+                if key in (final_inputs or {}) and final_inputs[key] is None
+            ]
+            if not null_keys:
+                continue
 
-        date_str = final_inputs.get("date")
-        try:
-            effective_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        except Exception:
-            err_msg = f"calculate_null_fields: invalid date_str={date_str}"
-            _l.error(err_msg)
-            return err_msg
+            date_str = final_inputs.get("date")
+            try:
+                effective_date = (
+                    date_str
+                    if isinstance(date_str, date)
+                    else datetime.strptime(date_str, "%Y-%m-%d").date()
+                )
+            except Exception:
+                errors[item_key] = (
+                    f"calculate_null_fields: invalid date_str={date_str}"
+                )
+                _l.error(errors[item_key])
+                continue
 
-        user_code = final_inputs.get("instrument")
-        try:
-            instrument = Instrument.objects.get(user_code=user_code)
-        except Exception:
-            err_msg = f"calculate_null_fields: no such instrument user_code={user_code}"
-            _l.error(err_msg)
-            return err_msg
+            user_code = final_inputs.get("instrument")
+            fields_dates = instruments_dates.setdefault(user_code, {})
+            for key in null_keys:
+                fields_dates.setdefault(key, []).append((effective_date, item_key))
+
+        if not instruments_dates:
+            return errors
+
+        instruments = {
+            instrument.user_code: instrument
+            for instrument in Instrument.objects.filter(
+                user_code__in=[code for code in instruments_dates if code]
+            ).prefetch_related(
+                Prefetch(
+                    "accrual_events",
+                    queryset=AccrualEvent.objects.select_related(
+                        "accrual_calculation_model"
+                    ),
+                ),
+                Prefetch(
+                    "accrual_calculation_schedules",
+                    queryset=AccrualCalculationSchedule.objects.select_related(
+                        "accrual_calculation_model", "periodicity"
+                    ),
+                ),
+                "factor_schedules",
+            )
+        }
 
-        error_messages = []
-        for key, value in final_inputs.items():
-            if value is None:
+        for user_code, fields_dates in instruments_dates.items():
+            instrument = instruments.get(user_code)
+            if instrument is None:
+                err_msg = (
+                    f"calculate_null_fields: no such instrument user_code={user_code}"
+                )
+                _l.error(err_msg)
+                for rows in fields_dates.values():
+                    errors.update((item_key, err_msg) for _, item_key in rows)
+                continue
+
+            for key, rows in fields_dates.items():
+                # schedules of the instrument are walked once for sorted dates
+                rows.sort(key=lambda row: row[0])
+                dates = [day for day, _ in rows]
                 try:
                     if key == "accrued_price":
-                        final_inputs[key] = instrument.get_accrued_price(
-                            price_date=effective_date
-                        )
-
-                    elif key == "factor":
-                        final_inputs[key] = instrument.get_factor(fdate=effective_date)
+                        values = instrument.get_accrued_prices(dates).tolist()
+                    else:
+                        values = instrument.get_factors_by_dates(dates)
 
                 except Exception as e:
-                    final_inputs[key] = 1 if key == "factor" else 0
+                    values = [1 if key == "factor" else 0] * len(rows)
                     err_msg = f"calculate_null_fields: {key} {repr(e)}"
                     _l.error(err_msg)
-                    error_messages.append(err_msg)
+                    for _, item_key in rows:
+                        errors[item_key] = (
+                            f"{errors[item_key]}; {err_msg}"
+                            if item_key in errors
+                            else err_msg
+                        )
 
-        if error_messages:
-            return "; ".join(error_messages)
+                for (_, item_key), value in zip(rows, values):
+                    items_final_inputs[item_key][key] = value
+
+        return errors
 
     def import_items_by_batch_indexes(
         self, batch_indexes, filter_for_async_functions_eval
@@ -1786,222 +1789,110 @@ class SimpleImportProcess:
                 self.items[item_index].status = "error"
                 self.items[item_index].error_message += f"; {errors}"
 
-        models_q_filter_list = []
-        for item_index in batch_indexes:
-            try:
-                if self.scheme.content_type.model == "pricehistory":
-                    models_q_filter_list.append(
-                        Q(
-                            instrument_id=self.items[item_index]
-                            .final_inputs["instrument"]
-                            .id,
-                            pricing_policy_id=self.items[item_index]
-                            .final_inputs["pricing_policy"]
-                            .id,
-                            date=parse_date(
-                                self.items[item_index].final_inputs["date"]
-                            ),
-                        )
-                    )
-                else:  # "currencyhistory":
-                    models_q_filter_list.append(
-                        Q(
-                            currency_id=self.items[item_index]
-                            .final_inputs["currency"]
-                            .id,
-                            pricing_policy_id=self.items[item_index]
-                            .final_inputs["pricing_policy"]
-                            .id,
-                            date=parse_date(
-                                self.items[item_index].final_inputs["date"]
-                            ),
-                        )
-                    )
-            except Exception as e:
-                self.items[item_index].status = "error"
-                self.items[item_index].error_message = (
-                    f"{self.items[item_index].error_message} "
-                    f"Relation model error: {repr(e)}"
-                )
-
         model = self.scheme.content_type.model_class()
-        if models_q_filter_list:
-            conditions = reduce(or_, models_q_filter_list)
-            model_objects_for_update = model.objects.filter(conditions)
-        else:
-            model_objects_for_update = []
-
-        # collecting keys of models for select models for update
-        model_for_update_ids = {}
-        if model_objects_for_update:
-            for model_object in model_objects_for_update:
-                if self.scheme.content_type.model == "pricehistory":
-                    model_key_for_matching_model = self.__get_key_for_matching_model(
-                        key_model_user_code=model_object.instrument_id,
-                        pricing_policy__user_code=model_object.pricing_policy_id,
-                        date=model_object.date,
-                    )
-                else:  # "currencyhistory"
-                    model_key_for_matching_model = self.__get_key_for_matching_model(
-                        key_model_user_code=model_object.currency_id,
-                        pricing_policy__user_code=model_object.pricing_policy_id,
-                        date=model_object.date,
-                    )
-                model_for_update_ids[model_key_for_matching_model] = model_object
+        key_fields = TIME_SERIES_KEY_FIELDS[self.scheme.content_type.model]
 
-        # dict for filtering models by key
-        models_for_bulk_insert = {}
-        models_for_bulk_update = {}
+        upsert_indexes = []
         for item_index in batch_indexes:
+            item = self.items[item_index]
             # skip error status items
-            if self.items[item_index].status == "error":
+            if item.status == "error":
                 continue
 
-            if self.scheme.content_type.model == "pricehistory":
-                item_key_for_matching_model = self.__get_key_for_matching_model(
-                    key_model_user_code=self.items[item_index]
-                    .final_inputs["instrument"]
-                    .id,
-                    pricing_policy__user_code=self.items[item_index]
-                    .final_inputs["pricing_policy"]
-                    .id,
-                    date=self.items[item_index].final_inputs["date"],
-                )
-            else:  # "currencyhistory"
-                item_key_for_matching_model = self.__get_key_for_matching_model(
-                    key_model_user_code=self.items[item_index]
-                    .final_inputs["currency"]
-                    .id,
-                    pricing_policy__user_code=self.items[item_index]
-                    .final_inputs["pricing_policy"]
-                    .id,
-                    date=self.items[item_index].final_inputs["date"],
+            invalid_keys = [
+                key
+                for key in key_fields
+                if not item.final_inputs.get(key)
+                or key != "date"
+                and not hasattr(item.final_inputs[key], "id")
+            ]
+            if invalid_keys:
+                item.status = "error"
+                item.error_message = (
+                    f"{item.error_message} Relation model error: "
+                    f"invalid {', '.join(invalid_keys)}"
                 )
+                continue
 
-            if item_key_for_matching_model in model_for_update_ids:
-                # if overwrite allowed
-                if self.scheme.mode == "overwrite":
-                    # updating dict from model by data from import file
-                    for key, value in self.items[item_index].final_inputs.items():
-                        if self.items[item_index].final_inputs[key] is not None:
-                            setattr(
-                                model_for_update_ids[item_key_for_matching_model],
-                                key,
-                                value,
-                            )
+            if (
+                self.scheme.content_type.model == "currencyhistory"
+                and item.final_inputs.get("fx_rate") == 0
+            ):
+                item.status = "error"
+                item.error_message = f"{item.error_message} FX rate must not be zero"
+                continue
 
-                    try:
-                        # models_for_bulk_update.append(model_for_update_ids[item_key_for_matching_model])
-                        models_for_bulk_update[item_key_for_matching_model] = (
-                            model_for_update_ids[item_key_for_matching_model]
-                        )
+            upsert_indexes.append(item_index)
 
-                    except Exception as e:
-                        self.items[item_index].status = "error"
-                        self.items[item_index].error_message = (
-                            f"{self.items[item_index].error_message}==== "
-                            f"Overwrite Exception {e}"
-                        )
+        statuses = upsert_time_series(
+            model,
+            key_fields,
+            [self.items[item_index].final_inputs for item_index in upsert_indexes],
+            overwrite=self.scheme.mode == "overwrite",
+        )
 
-                else:
-                    self.items[item_index].status = "skip"
-                    self.items[item_index].error_message = None
-
-                    # self.items[item_index].status = "error"
-                    # self.items[item_index].error_message = (
-                    #     f"{self.items[item_index].error_message}"
-                    #     f"====  Overwrite disabled"
-                    # )
-            else:
-                result_item = {
-                    key: self.items[item_index].final_inputs[key]
-                    for key, value in self.items[item_index].final_inputs.items()
-                    if self.items[item_index].final_inputs[key] is not None
-                }
-                result_item = self.replace_item_relations_by_ids(
-                    self.items[item_index],
-                    result_item,
-                    relation_models_to_ids,
-                    all_entity_fields_models,
-                )
-                result_item = self.remove_nullable_attributes(result_item)
-                try:
-                    # models_for_bulk_insert.append(model(**result_item))
-                    models_for_bulk_insert[item_key_for_matching_model] = model(
-                        **result_item
-                    )
+        imported_indexes = []
+        for item_index, status in zip(upsert_indexes, statuses):
+            item = self.items[item_index]
+            if status == SKIPPED:
+                item.status = "skip"
+                item.error_message = None
+                continue
 
-                    if self.scheme.content_type.model == "pricehistory":
-                        filter_for_async_functions_eval.append(
-                            {
-                                "instrument_id": self.items[item_index]
-                                .final_inputs["instrument"]
-                                .id,
-                                "pricing_policy_id": self.items[item_index]
-                                .final_inputs["pricing_policy"]
-                                .id,
-                                "date": self.items[item_index].final_inputs["date"],
-                            }
-                        )
-                    else:  # "currencyhistory"
-                        filter_for_async_functions_eval.append(
-                            {
-                                "currency_id": self.items[item_index]
-                                .final_inputs["currency"]
-                                .id,
-                                "pricing_policy_id": self.items[item_index]
-                                .final_inputs["pricing_policy"]
-                                .id,
-                                "date": self.items[item_index].final_inputs["date"],
-                            }
-                        )
+            imported_indexes.append(item_index)
+            # upsert doesn't run save(), accrued price, factor, ytm etc. of
+            # inserted and overwritten rows are calculated by final updates
+            if status in (INSERTED, UPDATED):
+                object_key = key_fields[0]
+                filter_for_async_functions_eval.append(
+                    {
+                        f"{object_key}_id": item.final_inputs[object_key].id,
+                        "pricing_policy_id": item.final_inputs["pricing_policy"].id,
+                        "date": item.final_inputs["date"],
+                    }
+                )
 
-                except Exception as e:
-                    _l.info(
-                        f"{self.items[item_index].error_message}"
-                        f"==== Create Exception dcsd {e}"
-                    )
-                    self.items[item_index].status = "error"
-                    self.items[item_index].error_message = (
-                        f"{self.items[item_index].error_message}"
-                        f"==== Create Exception {e}"
+        if imported_indexes:
+            report_data_changed()
+            history_changed(
+                model,
+                [
+                    (
+                        self.items[item_index].final_inputs[key_fields[0]].id,
+                        self.items[item_index].final_inputs["date"],
                     )
-
-        # mass inserting models
-        batch_rows_count = 0
-        if models_for_bulk_insert:
-            # Attention! bulk_create doesn't use save() method of the model
-            model.objects.bulk_create(models_for_bulk_insert.values())
-            batch_rows_count = batch_rows_count + len(models_for_bulk_insert.values())
-            _l.info(
-                f"SimpleImportProcess.Task bulk_insert count. "
-                f"{len(models_for_bulk_insert.values())} "
-            )
-
-        if models_for_bulk_update:
-            for model_obj in models_for_bulk_update.values():
-                model_obj.save()
-            # todo: by bulk update
-            # model.objects.bulk_update(models_for_bulk_update)
-            batch_rows_count = batch_rows_count + len(models_for_bulk_update.values())
-            _l.info(
-                f"SimpleImportProcess.Task bulk_update count. "
-                f"{len(models_for_bulk_update.values())} "
+                    for item_index in imported_indexes
+                ],
             )
+            # rows are not saved one by one, no signal bumps allowed objects
+            if has_user_code(model):
+                allowed_objects_changed(model)
 
+        _l.info(
+            f"SimpleImportProcess.Task upsert count. "
+            f"inserted {statuses.count(INSERTED)} "
+            f"updated {statuses.count(UPDATED)} "
+            f"skipped {statuses.count(SKIPPED)}"
+        )
         _l.info(
             f"SimpleImportProcess.Task filter_for_async_functions_eval count."
             f" {len(filter_for_async_functions_eval)} "
         )
 
-        self.handle_successful_items_by_batch_import(batch_indexes)
-        return batch_rows_count
+        self.handle_successful_items_by_batch_import(
+            imported_indexes, dict(zip(upsert_indexes, statuses))
+        )
+        return len(imported_indexes)
 
-    def handle_successful_items_by_batch_import(self, batch_indexes: list[int]):
+    def handle_successful_items_by_batch_import(
+        self, batch_indexes: list[int], statuses: dict[int, str]
+    ):
         for item_index in batch_indexes:
-
             self.items[item_index].status = "success"
-            self.items[item_index].message = f"Item Imported {self.scheme.content_type.model}"
+            self.items[item_index].message = (
+                f"Item Imported {self.scheme.content_type.model} "
+                f"({statuses[item_index]})"
+            )
 
     def handle_successful_item_import(self, item, serializer):
         item.status = "success"
@@ -2077,7 +1968,7 @@ class SimpleImportProcess:
         _l.info(f"SimpleImportProcess.Task {self.task}. process_items_batches INIT")
         # mb aren't needed
         self.result.processed_rows = 0
-        items_per_batch = 100
+        items_per_batch = 5000
         batch_indexes = []
         item_index = 0
 
@@ -2146,6 +2037,7 @@ class SimpleImportProcess:
 
         _l.info(f"SimpleImportProcess.Task {self.task}. process_items_batches DONE")
 
+    @journal_changes(coalesce=True)
     def process(self):
         error_flag = False
 
@@ -0,0 +1,112 @@
+"""
+Streaming readers of import files.
+
+Rows are read one by one from the storage file: CSV is decoded chunk by
+chunk, Excel is opened by openpyxl in read-only mode, so the file itself is
+never loaded into memory as a whole.
+"""
+
+import codecs
+import csv
+import re
+from itertools import islice
+from tempfile import NamedTemporaryFile
+from typing import Iterable, Iterator, List, Optional
+
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string
+
+LINE_END_RE = re.compile(r"(\r\n|\r|\n)")
+
+
+def iter_lines(chunks: Iterable[bytes], encoding: str = "utf_8_sig") -> Iterator[str]:
+    """Decoded lines of the binary chunks, line ends are translated to newline"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+    tail = ""
+
+    for chunk in chunks:
+        tail += decoder.decode(chunk)
+        # "\r" at the end can be the first half of "\r\n"
+        complete = tail[:-1] if tail.endswith("\r") else tail
+        lines = LINE_END_RE.split(complete)
+        tail = lines.pop() + tail[len(complete) :]
+
+        for line in lines[::2]:
+            yield line + "\n"
+
+    lines = LINE_END_RE.split(tail + decoder.decode(b"", final=True))
+    tail = lines.pop()
+
+    for line in lines[::2]:
+        yield line + "\n"
+    if tail:
+        yield tail
+
+
+def iter_csv_rows(f, delimiter: str) -> Iterator[list]:
+    """Rows of CSV storage file"""
+    # TODO check encoding and quotechar (maybe should be taken from scheme)
+    yield from csv.reader(
+        iter_lines(f.chunks()),
+        delimiter=delimiter,
+        quotechar='"',
+        strict=False,
+        skipinitialspace=True,
+    )
+
+
+def iter_excel_rows(
+    f, sheet_name: Optional[str] = None, start_cell: Optional[str] = None
+) -> Iterator[list]:
+    """
+    Rows of Excel storage file starting from start_cell (e.g. "B3"),
+    sheet_name or active sheet is read
+    """
+    with NamedTemporaryFile(suffix=".xlsx") as tmpf:
+        # xlsx is zip archive, openpyxl needs seekable file
+        for chunk in f.chunks():
+            tmpf.write(chunk)
+        tmpf.flush()
+
+        wb = load_workbook(filename=tmpf.name, read_only=True)
+        try:
+            if sheet_name and sheet_name in wb.sheetnames:
+                ws = wb[sheet_name]
+            else:
+                ws = wb.active
+            # read-only sheet trusts the stored dimension, which is wrong
+            # in files of some tools, and cuts off rows and columns
+            ws.reset_dimensions()
+
+            start_row, start_column = 1, 1
+            if start_cell and start_cell != "A1":
+                start_row = int(re.search(r"\d+", start_cell)[0])
+                start_column = column_index_from_string(
+                    start_cell.split(str(start_row))[0]
+                )
+
+            width = 0
+            for row in ws.iter_rows(min_row=start_row, values_only=True):
+                row = list(row[start_column - 1 :])
+                # read-only rows have no trailing empty cells
+                width = width or len(row)
+                yield row + [None] * (width - len(row))
+
+        finally:
+            wb.close()
+
+
+def iter_file_items(rows: Iterable[list]) -> Iterator[dict]:
+    """Dicts of rows by the columns of the first row"""
+    rows = iter(rows)
+    column_row = next(rows, None)
+    if column_row is None:
+        return
+
+    for row in rows:
+        yield dict(zip(column_row, row))
+
+
+def read_file_items(rows: Iterable[list], limit: Optional[int] = None) -> List[dict]:
+    """Items of the rows, reading stops after limit items"""
+    return list(islice(iter_file_items(rows), limit))
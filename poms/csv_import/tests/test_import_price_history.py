@@ -1,5 +1,6 @@
 import copy
 import json
+from datetime import date
 from unittest import mock
 
 from django.conf import settings
@@ -278,6 +279,32 @@ class ImportPriceHistoryTest(BaseTestCase):
         self.assertEqual(ph.accrued_price, 0.0)
         self.assertEqual(ph.factor, 1.0)
 
+    @mock.patch("poms.csv_import.handlers.send_system_message")
+    def test_overwritten_price_is_finalized(self, mock_send_message):
+        PriceHistory.objects.create(
+            instrument=self.instrument,
+            pricing_policy=self.pricing_policy,
+            date=date(2024, 1, 5),
+            principal_price=1.0,
+        )
+        task = self.create_task()
+        import_process = SimpleImportProcess(task_id=task.id)
+        import_process.fill_with_file_items()
+        import_process.fill_with_raw_items()
+        import_process.apply_conversion_to_raw_items()
+        import_process.preprocess()
+
+        filter_for_async_functions_eval = []
+        import_process.import_items_by_batch_indexes(
+            [0], filter_for_async_functions_eval
+        )
+
+        self.assertEqual(import_process.items[0].status, "success")
+        self.assertEqual(len(filter_for_async_functions_eval), 1)
+        price = PriceHistory.objects.get(**filter_for_async_functions_eval[0])
+        self.assertEqual(price.instrument_id, self.instrument.id)
+        self.assertEqual(price.principal_price, PRICE_HISTORY_ITEM["principal_price"])
+
     @override_settings(MAX_ITEMS_IMPORT=3)
     def test__error_too_many_line(self):
         task = self.create_task(amount=4)
@@ -285,3 +312,23 @@ class ImportPriceHistoryTest(BaseTestCase):
 
         with self.assertRaises(ValueError):
             process.fill_with_file_items()
+
+    def test_calculate_pricehistory_null_fields_batch(self):
+        user_code = self.instrument.user_code
+        items_final_inputs = {
+            0: {"instrument": user_code, "date": "2024-01-05", "accrued_price": None},
+            1: {"instrument": user_code, "date": "2024-01-04", "factor": None},
+            2: {"instrument": "unknown", "date": "2024-01-05", "factor": None},
+            3: {"instrument": user_code, "date": "05.01.2024", "factor": None},
+            4: {"instrument": "unknown", "date": "2024-01-05", "factor": 0.5},
+        }
+
+        errors = SimpleImportProcess.calculate_pricehistory_null_fields_batch(
+            "pricehistory", items_final_inputs
+        )
+
+        self.assertEqual(set(errors), {2, 3})
+        # accrual schedule of the instrument starts in the future
+        self.assertEqual(items_final_inputs[0]["accrued_price"], 0.0)
+        self.assertEqual(items_final_inputs[1]["factor"], 1)
+        self.assertEqual(items_final_inputs[4]["factor"], 0.5)
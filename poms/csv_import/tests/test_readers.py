@@ -0,0 +1,94 @@
+import re
+import zipfile
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from openpyxl import Workbook
+
+from poms.csv_import.readers import (
+    iter_csv_rows,
+    iter_excel_rows,
+    iter_file_items,
+    iter_lines,
+    read_file_items,
+)
+
+
+class IterLinesTest(SimpleTestCase):
+    def test_lines_split_between_chunks(self):
+        data = "﻿a;b\r\n1;2\r3;4\n5".encode()
+
+        for size in (1, 2, 3, len(data)):
+            with self.subTest(size=size):
+                chunks = [data[i : i + size] for i in range(0, len(data), size)]
+                self.assertEqual(
+                    list(iter_lines(chunks)), ["a;b\n", "1;2\n", "3;4\n", "5"]
+                )
+
+
+class ReadersTest(SimpleTestCase):
+    def test_csv(self):
+        f = ContentFile('name;notes\nAAA;"multi\nline"\nBBB\n'.encode())
+
+        items = list(iter_file_items(iter_csv_rows(f, ";")))
+
+        self.assertEqual(
+            items, [{"name": "AAA", "notes": "multi\nline"}, {"name": "BBB"}]
+        )
+
+    def test_excel_start_cell(self):
+        wb = Workbook()
+        ws = wb.active
+        ws["B2"], ws["C2"], ws["D2"] = "name", "price", "notes"
+        ws["B3"], ws["C3"] = "AAA", 10
+        ws["B4"], ws["C4"], ws["D4"] = "BBB", 20, "last"
+        buffer = BytesIO()
+        wb.save(buffer)
+
+        items = list(
+            iter_file_items(iter_excel_rows(ContentFile(buffer.getvalue()), None, "B2"))
+        )
+
+        self.assertEqual(
+            items,
+            [
+                {"name": "AAA", "price": 10, "notes": None},
+                {"name": "BBB", "price": 20, "notes": "last"},
+            ],
+        )
+
+    def test_excel_wrong_dimension(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(["name", "price"])
+        ws.append(["AAA", 10])
+        ws.append(["BBB", 20])
+        buffer = BytesIO()
+        wb.save(buffer)
+
+        # sheet claims to have the only cell A1
+        broken = BytesIO()
+        with zipfile.ZipFile(buffer) as src, zipfile.ZipFile(broken, "w") as dst:
+            for info in src.infolist():
+                data = src.read(info.filename)
+                if info.filename == "xl/worksheets/sheet1.xml":
+                    data = re.sub(
+                        rb'<dimension ref="[^"]*"', b'<dimension ref="A1"', data
+                    )
+                dst.writestr(info, data)
+
+        items = list(iter_file_items(iter_excel_rows(ContentFile(broken.getvalue()))))
+
+        self.assertEqual(
+            items, [{"name": "AAA", "price": 10}, {"name": "BBB", "price": 20}]
+        )
+
+    def test_reading_stops_after_limit(self):
+        rows = iter([["name"], ["AAA"], ["BBB"], ["CCC"]])
+
+        items = read_file_items(rows, 2)
+
+        self.assertEqual(items, [{"name": "AAA"}, {"name": "BBB"}])
+        self.assertEqual(list(rows), [["CCC"]])
@@ -0,0 +1,70 @@
+from datetime import date
+
+from poms.common.common_base_test import BaseTestCase
+from poms.csv_import.upsert import (
+    INSERTED,
+    SKIPPED,
+    TIME_SERIES_KEY_FIELDS,
+    UPDATED,
+    upsert_time_series,
+)
+from poms.instruments.models import Instrument, PriceHistory
+
+DAY = date(2024, 1, 10)
+
+
+class UpsertTimeSeriesTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.instrument = Instrument.objects.first()
+        self.pricing_policy = self.create_pricing_policy()
+        self.existing = PriceHistory.objects.create(
+            instrument=self.instrument,
+            pricing_policy=self.pricing_policy,
+            date=DAY,
+            principal_price=10,
+            accrued_price=1,
+        )
+
+    def upsert(self, overwrite):
+        rows = [
+            {
+                "instrument": self.instrument,
+                "pricing_policy": self.pricing_policy,
+                "date": "2024-01-10",
+                "principal_price": 20,
+            },
+            {
+                "instrument": self.instrument,
+                "pricing_policy": self.pricing_policy,
+                "date": "2024-01-11",
+                "principal_price": 30,
+            },
+        ]
+        return upsert_time_series(
+            PriceHistory, TIME_SERIES_KEY_FIELDS["pricehistory"], rows, overwrite
+        )
+
+    def test_overwrite(self):
+        self.assertEqual(self.upsert(overwrite=True), [UPDATED, INSERTED])
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.principal_price, 20)
+        # not imported column keeps its value
+        self.assertEqual(self.existing.accrued_price, 1)
+        new_price = PriceHistory.objects.get(
+            instrument=self.instrument,
+            pricing_policy=self.pricing_policy,
+            date=date(2024, 1, 11),
+        )
+        self.assertEqual(new_price.principal_price, 30)
+        self.assertEqual(new_price.factor, 1)
+
+    def test_skip(self):
+        self.assertEqual(self.upsert(overwrite=False), [SKIPPED, INSERTED])
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.principal_price, 10)
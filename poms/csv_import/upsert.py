@@ -0,0 +1,161 @@
+"""
+Bulk upsert of time series rows (PriceHistory, CurrencyHistory).
+
+Rows are streamed by COPY into a temporary staging table and merged into
+the model table by INSERT ... ON CONFLICT on the (object, pricing_policy,
+date) key, one statement per set of imported columns, so that columns
+missing in a row keep their values in existing rows.
+"""
+
+from datetime import date, datetime
+from io import StringIO
+from typing import Dict, List, Sequence
+
+from django.db import connection, transaction
+from django.db.models import DateTimeField
+from django.utils.timezone import now
+
+INSERTED = "inserted"
+UPDATED = "updated"
+SKIPPED = "skipped"
+
+TIME_SERIES_KEY_FIELDS = {
+    "pricehistory": ("instrument", "pricing_policy", "date"),
+    "currencyhistory": ("currency", "pricing_policy", "date"),
+}
+
+GROUP_COLUMN = "upsert_group"
+
+
+def _copy_value(value) -> str:
+    """Value in PostgreSQL COPY text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _get_row_values(fields: list, row: dict, timestamp: datetime) -> list:
+    values = []
+    for field in fields:
+        value = row.get(field.name)
+        if value is None:
+            auto_now = isinstance(field, DateTimeField) and (
+                field.auto_now or field.auto_now_add
+            )
+            value = timestamp if auto_now else field.get_default()
+
+        if field.is_relation:
+            value = field.target_field.to_python(getattr(value, "pk", value))
+        else:
+            value = field.to_python(value)
+
+        values.append(value)
+
+    return values
+
+
+def upsert_time_series(
+    model, key_fields: Sequence[str], rows: List[dict], overwrite: bool
+) -> List[str]:
+    """
+    Insert rows (dicts of field name and value, None values are not imported)
+    into the model table, existing rows with the same key are updated if
+    overwrite, otherwise skipped. Returns INSERTED, UPDATED or SKIPPED of
+    every row, rows with the same key get status of the last of them.
+    """
+    if not rows:
+        return []
+
+    quote = connection.ops.quote_name
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    names = [field.name for field in fields]
+    key_positions = [names.index(name) for name in key_fields]
+    auto_now_columns = [
+        field.column
+        for field in fields
+        if isinstance(field, DateTimeField) and field.auto_now
+    ]
+
+    timestamp = now()
+
+    # last row of every key, rows with the same imported columns are merged together
+    rows_by_key: Dict[tuple, int] = {}
+    row_keys = []
+    values = []
+    for index, row in enumerate(rows):
+        row_values = _get_row_values(fields, row, timestamp)
+        key = tuple(row_values[pos] for pos in key_positions)
+        rows_by_key[key] = index
+        row_keys.append(key)
+        values.append(row_values)
+
+    groups: Dict[frozenset, int] = {}
+    buffer = StringIO()
+    for index in rows_by_key.values():
+        imported = frozenset(
+            name for name in names if rows[index].get(name) is not None
+        )
+        group = groups.setdefault(imported, len(groups))
+        buffer.write(
+            "\t".join(_copy_value(value) for value in values[index] + [group])
+        )
+        buffer.write("\n")
+    buffer.seek(0)
+
+    table = quote(model._meta.db_table)
+    staging = quote(f"{model._meta.db_table}_upsert")
+    columns = ", ".join(quote(field.column) for field in fields)
+    key_columns = ", ".join(quote(fields[pos].column) for pos in key_positions)
+
+    statuses = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging} AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        cursor.execute(f"ALTER TABLE {staging} ADD COLUMN {GROUP_COLUMN} integer")
+        cursor.copy_expert(
+            f"COPY {staging} ({columns}, {GROUP_COLUMN}) FROM STDIN", buffer
+        )
+
+        for imported, group in groups.items():
+            updated_columns = [
+                field.column
+                for field in fields
+                if field.name in imported
+                and field.name not in key_fields
+                and field.column not in auto_now_columns
+            ] + auto_now_columns
+            if overwrite and updated_columns:
+                on_conflict = "DO UPDATE SET " + ", ".join(
+                    f"{quote(column)} = EXCLUDED.{quote(column)}"
+                    for column in updated_columns
+                )
+            else:
+                on_conflict = "DO NOTHING"
+
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"SELECT {columns} FROM {staging} WHERE {GROUP_COLUMN} = %s "
+                f"ON CONFLICT ({key_columns}) {on_conflict} "
+                f"RETURNING {key_columns}, (xmax = 0) AS inserted",
+                [group],
+            )
+            for *key, inserted in cursor.fetchall():
+                statuses[tuple(key)] = INSERTED if inserted else UPDATED
+
+        cursor.execute(f"DROP TABLE {staging}")
+
+    return [statuses.get(key, SKIPPED) for key in row_keys]
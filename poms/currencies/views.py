@@ -31,7 +31,9 @@ from poms.currencies.serializers import (
 )
 from poms.obj_attrs.utils import get_attributes_prefetch
 from poms.obj_attrs.views import GenericAttributeTypeViewSet
+from poms.reports.result_cache import report_data_changed
 from poms.users.filters import OwnerByMasterUserFilter
+from poms.widgets.snapshots import history_changed
 
 _l = logging.getLogger("poms.currencies")
 
@@ -254,6 +256,10 @@ class CurrencyHistoryViewSet(AbstractModelViewSet):
             unique_fields=["currency", "pricing_policy", "date"],
             update_fields=["fx_rate"],
         )
+        report_data_changed()
+        history_changed(
+            CurrencyHistory, [(item.currency_id, item.date) for item in valid_data]
+        )
 
         if errors:
             _l.info(f"CurrencyHistoryViewSet.bulk_create.errors {errors}")
@@ -0,0 +1,245 @@
+import ast
+
+import numpy as np
+
+from poms.expressions_engine.exceptions import InvalidExpression
+from poms.expressions_engine.formula import SimpleEval2
+
+# ints bigger than that are not exact in float64, such rows go to the interpreter
+MAX_VECTOR_INT = 2**53
+
+_ARITHMETIC = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+}
+# python raises ZeroDivisionError for these operators
+_DIVISION = (ast.Div, ast.FloorDiv, ast.Mod)
+
+_COMPARE = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+
+
+class _Vector(object):
+    """
+    Result of vectorized node: values of all rows and mask of rows whose
+    value is not reliable and have to be evaluated by interpreter
+    """
+
+    def __init__(self, values, bad):
+        self.values = values
+        self.bad = bad
+
+
+def _is_vectorizable(node):
+    if isinstance(node, ast.Name):
+        return True
+    if isinstance(node, ast.Attribute):
+        return _is_vectorizable(node.value) and isinstance(node.value, (ast.Name, ast.Attribute))
+    if isinstance(node, ast.Constant):
+        return type(node.value) in (int, float) and abs(node.value) < MAX_VECTOR_INT
+    if isinstance(node, ast.BinOp):
+        return type(node.op) in _ARITHMETIC and _is_vectorizable(node.left) and _is_vectorizable(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, (ast.UAdd, ast.USub, ast.Not)) and _is_vectorizable(node.operand)
+    if isinstance(node, ast.Compare):
+        # interpreter evaluates only first comparison of a chain
+        return (
+            type(node.ops[0]) in _COMPARE
+            and _is_vectorizable(node.left)
+            and _is_vectorizable(node.comparators[0])
+        )
+    if isinstance(node, ast.IfExp):
+        return _is_vectorizable(node.test) and _is_vectorizable(node.body) and _is_vectorizable(node.orelse)
+    return False
+
+
+def _get_vectorizable_expression(expr):
+    """Expression node if expression is a single vectorizable expression, else None"""
+    tree = SimpleEval2.try_parse(expr)
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Expr):
+        return None
+    node = tree.body[0].value
+    return node if _is_vectorizable(node) else None
+
+
+_missing = object()
+
+
+class _Table(object):
+    """Rows given as list of names dicts or as dict of columns"""
+
+    def __init__(self, rows):
+        if isinstance(rows, dict):
+            self.columns = rows
+            self.rows = None
+            self.size = len(next(iter(rows.values()))) if rows else 0
+        else:
+            self.columns = None
+            self.rows = rows
+            self.size = len(rows)
+
+    def row(self, index):
+        if self.rows is not None:
+            return self.rows[index]
+        return {name: values[index] for name, values in self.columns.items()}
+
+    def values(self, path):
+        name, attrs = path[0], path[1:]
+
+        if self.rows is not None:
+            values = [row.get(name, _missing) for row in self.rows]
+        else:
+            values = self.columns.get(name, [_missing] * self.size)
+
+        for attr in attrs:
+            values = [v.get(attr, _missing) if isinstance(v, dict) else _missing for v in values]
+
+        return values
+
+
+class _Vectorizer(object):
+    def __init__(self, table):
+        self.table = table
+        self.size = table.size
+        self.columns = {}
+
+    def eval(self, node):
+        op = getattr(self, f"_on_{type(node).__name__}")
+        return op(node)
+
+    def _column(self, path):
+        if path in self.columns:
+            return self.columns[path]
+
+        values = self.table.values(path)
+        types = [type(v) for v in values]
+
+        if float in types:
+            # python keeps int type of int values, interpreter handles such rows
+            bad = np.array([t is not float for t in types], dtype=bool)
+            data = np.array([v if t is float else 0.0 for v, t in zip(values, types)], dtype=np.float64)
+        else:
+            bad = np.array(
+                [t is not int or abs(v) >= MAX_VECTOR_INT for v, t in zip(values, types)],
+                dtype=bool,
+            )
+            data = np.array([0 if b else v for v, b in zip(values, bad)], dtype=np.int64)
+
+        vector = _Vector(data, bad)
+        self.columns[path] = vector
+        return vector
+
+    def _path(self, node):
+        if isinstance(node, ast.Name):
+            return (node.id,)
+        return self._path(node.value) + (node.attr,)
+
+    def _on_Name(self, node):
+        return self._column(self._path(node))
+
+    _on_Attribute = _on_Name
+
+    def _on_Constant(self, node):
+        dtype = np.int64 if type(node.value) is int else np.float64
+        return _Vector(np.full(self.size, node.value, dtype=dtype), np.zeros(self.size, dtype=bool))
+
+    @staticmethod
+    def _number(values):
+        # python bool is int in arithmetic, numpy bool is not
+        return values.astype(np.int64) if values.dtype == np.bool_ else values
+
+    def _on_BinOp(self, node):
+        left = self.eval(node.left)
+        right = self.eval(node.right)
+        lvalues = self._number(left.values)
+        rvalues = self._number(right.values)
+        bad = left.bad | right.bad
+
+        if isinstance(node.op, _DIVISION):
+            bad = bad | (rvalues == 0)
+
+        with np.errstate(all="ignore"):
+            values = _ARITHMETIC[type(node.op)](lvalues, rvalues)
+
+        if values.dtype == np.int64:
+            # python ints don't overflow
+            with np.errstate(all="ignore"):
+                shadow = _ARITHMETIC[type(node.op)](lvalues.astype(np.float64), rvalues.astype(np.float64))
+            bad = bad | ~(np.abs(shadow) < MAX_VECTOR_INT)
+
+        return _Vector(values, bad)
+
+    def _on_UnaryOp(self, node):
+        operand = self.eval(node.operand)
+        if isinstance(node.op, ast.Not):
+            return _Vector(operand.values == 0, operand.bad)
+        values = self._number(operand.values)
+        if isinstance(node.op, ast.USub):
+            values = np.negative(values)
+        return _Vector(values, operand.bad)
+
+    def _on_Compare(self, node):
+        left = self.eval(node.left)
+        right = self.eval(node.comparators[0])
+        values = _COMPARE[type(node.ops[0])](left.values, right.values)
+        return _Vector(values, left.bad | right.bad)
+
+    def _on_IfExp(self, node):
+        test = self.eval(node.test)
+        body = self.eval(node.body)
+        orelse = self.eval(node.orelse)
+
+        # nan is true in python as well
+        condition = test.values != 0
+        values = np.where(condition, body.values, orelse.values)
+        bad = test.bad | np.where(condition, body.bad, orelse.bad)
+
+        # python returns value of the taken branch as is, rows which
+        # branch type differs from the common one go to the interpreter
+        if body.values.dtype != values.dtype:
+            bad = bad | condition
+        if orelse.values.dtype != values.dtype:
+            bad = bad | ~condition
+
+        return _Vector(values, bad)
+
+
+def safe_eval_batch(expr, rows, evaluator=None, error_value=None, context=None):
+    """
+    Evaluate one expression for all rows, rows are list of names dicts or
+    dict of name -> list of values. Arithmetic, comparison and if expressions
+    over numeric names are evaluated as numpy array operations, other expressions
+    and rows with not numeric values are evaluated by interpreter row by row.
+    Rows failed with InvalidExpression get error_value.
+    """
+    table = _Table(rows)
+
+    if evaluator is None:
+        evaluator = SimpleEval2(allow_assign=True, context=context)
+
+    results = [None] * table.size
+    pending = range(table.size)
+
+    node = _get_vectorizable_expression(expr) if table.size else None
+    if node is not None:
+        vector = _Vectorizer(table).eval(node)
+        results = vector.values.tolist()
+        pending = np.flatnonzero(vector.bad).tolist()
+
+    for index in pending:
+        try:
+            results[index] = evaluator.eval(expr, names=table.row(index))
+        except InvalidExpression:
+            results[index] = error_value
+
+    return results
@@ -1,9 +1,10 @@
 import ast
 import datetime
+import functools
 import logging
 import time
 import types
-from collections import OrderedDict
+from collections import ChainMap, OrderedDict
 
 from django.conf import settings
 from django.utils.functional import Promise, SimpleLazyObject
@@ -29,6 +30,8 @@ MAX_EXPONENT = 10000  # highest exponent
 # MAX_SHIFT = 1000
 MAX_SHIFT = 10
 MAX_LEN = 1000
+# max number of parsed expressions kept in the process-wide cache
+EXPRESSION_CACHE_SIZE = getattr(settings, "EXPRESSION_CACHE_SIZE", 2048)
 
 
 def _op_power(a, b):
@@ -135,6 +138,41 @@ class _UserDef(object):
         return ret
 
 
+def _get_attribute(val, attr):
+    """Attribute access allowed in expressions: dict keys and few safe attributes of builtin types"""
+    if isinstance(val, (dict, OrderedDict, ChainMap)):
+        try:
+            return val[attr]
+        except (IndexError, KeyError, TypeError) as e:
+            raise AttributeDoesNotExist(attr) from e
+
+    elif isinstance(val, list):
+        if attr in ["append", "pop", "remove"]:
+            return getattr(val, attr)
+    elif isinstance(val, datetime.date):
+        if attr in ["year", "month", "day"]:
+            return getattr(val, attr)
+
+    elif isinstance(val, datetime.timedelta):
+        if attr in ["days"]:
+            return getattr(val, attr)
+
+    elif isinstance(val, relativedelta.relativedelta):
+        if attr in [
+            "years",
+            "months",
+            "days",
+            "leapdays",
+            "year",
+            "month",
+            "day",
+            "weekday",
+        ]:
+            return getattr(val, attr)
+
+    raise AttributeDoesNotExist(attr)
+
+
 from poms.expressions_engine.functions import (
     FINMARS_FUNCTIONS,
     SimpleEval2Def,
@@ -147,6 +185,21 @@ from poms.expressions_engine.functions import (
 FUNCTIONS = FINMARS_FUNCTIONS
 
 
+@functools.lru_cache(maxsize=None)
+def _get_functions_table():
+    """Name -> function table, shared by all evaluators as the bottom scope layer"""
+    return {f.name: f for f in FUNCTIONS}
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _parse_expression(expr):
+    """
+    Parsed AST of the expression, cached by the expression text. Evaluator never
+    modifies the tree, so the same AST is safely shared between evaluations.
+    """
+    return ast.parse(expr)
+
+
 empty = object()
 
 SAFE_TYPES = (
@@ -162,6 +215,7 @@ SAFE_TYPES = (
     datetime.timedelta,
     datetime.datetime,
     relativedelta.relativedelta,
+    ChainMap,
     SimpleEval2Def,
     _UserDef,
 )
@@ -176,6 +230,7 @@ class SimpleEval2(object):
         allow_assign=False,
         now=None,
         context=None,
+        compiled=None,
     ):
         # st = time.perf_counter()
 
@@ -185,13 +240,16 @@ class SimpleEval2(object):
         self.tik_time = 0
         self.allow_assign = allow_assign
         self.context = context if context is not None else {}
+        # evaluate expressions compiled to closures instead of walking the AST
+        self.compiled = settings.EXPRESSION_COMPILED if compiled is None else compiled
         # self.imperial_mode = context.get('imperial_mode', False)
 
         self.expr = None
         self.expr_ast = None
         self.result = None
 
-        _globals = {f.name: f for f in FUNCTIONS}
+        # names specific to this evaluator, functions table is shared and read-only
+        _globals = {}
         if callable(now):
             _globals["now"] = SimpleEval2Def("now", now)
         elif isinstance(now, datetime.date):
@@ -199,7 +257,7 @@ class SimpleEval2(object):
 
         # _globals['transaction_import'] = {f.name: f for f in TRANSACTION_IMPORT_FUNCTIONS}
 
-        _globals["globals"] = SimpleEval2Def("globals", lambda: _globals)
+        _globals["globals"] = SimpleEval2Def("globals", lambda: dict(self._globals))
         _globals["locals"] = SimpleEval2Def("locals", lambda: self._table)
 
         _globals["true"] = True
@@ -211,14 +269,15 @@ class SimpleEval2(object):
         if add_print:
             _globals["print"] = _print
 
-        self._table = _globals
+        self._globals = ChainMap(_globals, _get_functions_table())
+        self._table = self._globals
 
     @staticmethod
     def try_parse(expr):
         if not expr:
             raise InvalidExpression("Empty expression")
         try:
-            return ast.parse(expr)
+            return _parse_expression(expr)
         except SyntaxError as e:
             raise ExpressionSyntaxError(e) from e
         except Exception as e:
@@ -281,14 +340,20 @@ class SimpleEval2(object):
         self.expr = expr
         self.expr_ast = SimpleEval2.try_parse(expr)
 
+        # layered scope: assignments go to the new top layer, row names and
+        # globals are only looked up, so nothing is copied per evaluation
         save_table = self._table
-        self._table = save_table.copy()
         if names:
-            for k, v in names.items():
-                self._table[k] = v
+            self._table = ChainMap({}, names, *save_table.maps)
+        else:
+            self._table = save_table.new_child()
         try:
             self.start_time = time.time()
-            self.result = self._eval(self.expr_ast.body)
+            program = _compile_expression(expr) if self.compiled else None
+            if program is not None:
+                self.result = program(self)
+            else:
+                self.result = self._eval(self.expr_ast.body)
             return self.result
         except _Return as e:
             return e.value
@@ -522,48 +587,7 @@ class SimpleEval2(object):
         if isinstance(val, types.FunctionType):
             val = self._eval(node.value)
 
-        if isinstance(val, (dict, OrderedDict)):
-            try:
-                return val[node.attr]
-            except (IndexError, KeyError, TypeError) as e:
-                # _l.debug('AttributeDoesNotExist.node %s' % node)
-                # _l.debug('AttributeDoesNotExist.node.attr %s' % node.attr)
-                # _l.debug('AttributeDoesNotExist.node.value %s' % node.value)
-                # _l.debug('AttributeDoesNotExist.val %s' % val)
-
-                raise AttributeDoesNotExist(node.attr) from e
-
-        elif isinstance(val, list):
-            # _l.debug("list here? %s" % val)
-            # _l.debug("list here? node.value %s" % node.value)
-            # _l.debug("list here? node.attr %s" % node.attr)
-            if node.attr in ["append", "pop", "remove"]:
-                return getattr(val, node.attr)
-        elif isinstance(val, datetime.date):
-            if node.attr in ["year", "month", "day"]:
-                return getattr(val, node.attr)
-
-        elif isinstance(val, datetime.timedelta):
-            if node.attr in ["days"]:
-                return getattr(val, node.attr)
-
-        elif isinstance(val, relativedelta.relativedelta):
-            if node.attr in [
-                "years",
-                "months",
-                "days",
-                "leapdays",
-                "year",
-                "month",
-                "day",
-                "weekday",
-            ]:
-                return getattr(val, node.attr)
-
-        # _l.info('AttributeDoesNotExist.val %s' % val)
-        # _l.info('AttributeDoesNotExist.node %s' % node.__dict__)
-
-        raise AttributeDoesNotExist(node.attr)
+        return _get_attribute(val, node.attr)
 
     def _on_ast_Index(self, node):
         return self._eval(node.value)
@@ -582,6 +606,406 @@ class SimpleEval2(object):
         return slice(lower, upper, step)
 
 
+class _CompiledUserDef(_UserDef):
+    def __init__(self, parent, node, body, defaults):
+        super().__init__(parent, node)
+        self.body = body
+        self.defaults = defaults
+
+    def __call__(self, evaluator, *args, **kwargs):
+        self.parent.check_time()
+
+        kwargs = kwargs.copy()
+        for i, val in enumerate(args):
+            name = self.node.args.args[i].arg
+            kwargs[name] = val
+
+        offset = len(self.node.args.args) - len(self.defaults)
+        for i, arg in enumerate(self.node.args.args):
+            if arg.arg not in kwargs:
+                kwargs[arg.arg] = self.defaults[i - offset](self.parent)
+
+        save_table = self.parent._table
+        try:
+            self.parent._table = save_table.copy()
+            self.parent._table.update(kwargs)
+            try:
+                ret = self.body(self.parent)
+            except _Return as e:
+                ret = e.value
+        finally:
+            self.parent._table = save_table
+
+        return ret
+
+
+class _ClosureCompiler(object):
+    """
+    Translates parsed expression into a tree of python closures. Every closure
+    takes the evaluator as the only argument, so compiled expression doesn't depend
+    on the evaluator and may be cached and shared. Supported nodes and sandbox rules
+    are the same as in SimpleEval2._on_ast_* methods, but time limit is checked
+    only on loop iterations and function calls.
+    """
+
+    def compile(self, node):
+        if isinstance(node, (list, tuple)):
+            return self._compile_many(node)
+
+        op = getattr(self, f"_compile_{type(node).__name__}", None)
+        if op is None:
+            return self._compile_unsupported(node)
+        return op(node)
+
+    def _compile_unsupported(self, node):
+        # fail only when the node is reached, as interpreter does
+        message = f"Sorry, {type(node).__name__} is not available in this evaluator"
+
+        def _unsupported(ev):
+            raise InvalidExpression(message)
+
+        return _unsupported
+
+    def _compile_many(self, nodes):
+        body = [self.compile(n) for n in nodes]
+
+        if len(body) == 1:
+            return body[0]
+
+        def _many(ev):
+            ret = None
+            for f in body:
+                ret = f(ev)
+            return ret
+
+        return _many
+
+    def _compile_Expr(self, node):
+        return self.compile(node.value)
+
+    def _compile_Index(self, node):
+        return self.compile(node.value)
+
+    def _compile_Pass(self, node):
+        return lambda ev: None
+
+    def _compile_Constant(self, node):
+        value = node.value
+        return lambda ev: value
+
+    def _compile_Name(self, node):
+        name = node.id
+        return lambda ev: ev._find_name(name)
+
+    def _compile_Assign(self, node):
+        value = self.compile(node.value)
+        setters = [self._compile_assign_target(t) for t in node.targets]
+
+        message = f"Sorry, {type(node).__name__} is not available in this evaluator"
+
+        def _assign(ev):
+            if not ev.allow_assign:
+                raise InvalidExpression(message)
+            ret = value(ev)
+            for setter in setters:
+                setter(ev, ret)
+            return ret
+
+        return _assign
+
+    def _compile_assign_target(self, target):
+        if isinstance(target, ast.Name):
+            name = target.id
+
+            def _set_name(ev, ret):
+                ev._table[name] = ret
+
+            return _set_name
+
+        elif isinstance(target, ast.Subscript):
+            obj_f = self.compile(target.value)
+            key_f = self.compile(target.slice)
+
+            def _set_item(ev, ret):
+                obj = obj_f(ev)
+                obj[key_f(ev)] = ret
+
+            return _set_item
+
+        elif isinstance(target, ast.Attribute):
+            obj_f = self.compile(target.value)
+            attr = target.attr
+
+            def _set_attr(ev, ret):
+                obj = obj_f(ev)
+                if isinstance(obj, (dict, OrderedDict)):
+                    obj[attr] = ret
+                else:
+                    raise ExpressionSyntaxError("Invalid assign")
+
+            return _set_attr
+
+        def _invalid(ev, ret):
+            raise ExpressionSyntaxError("Invalid assign")
+
+        return _invalid
+
+    def _compile_If(self, node):
+        test = self.compile(node.test)
+        body = self.compile(node.body)
+        orelse = self.compile(node.orelse)
+        return lambda ev: body(ev) if test(ev) else orelse(ev)
+
+    _compile_IfExp = _compile_If
+
+    def _compile_For(self, node):
+        iter_f = self.compile(node.iter)
+        body = self.compile(node.body)
+        name = node.target.id
+
+        def _for(ev):
+            ret = None
+            for val in iter_f(ev):
+                ev.check_time()
+                ev._table[name] = val
+                try:
+                    ret = body(ev)
+                except _Break:
+                    break
+            return ret
+
+        return _for
+
+    def _compile_While(self, node):
+        test = self.compile(node.test)
+        body = self.compile(node.body)
+
+        def _while(ev):
+            ret = None
+            while test(ev):
+                ev.check_time()
+                try:
+                    ret = body(ev)
+                except _Break:
+                    break
+            return ret
+
+        return _while
+
+    def _compile_Break(self, node):
+        def _break(ev):
+            raise _Break()
+
+        return _break
+
+    def _compile_Return(self, node):
+        value = self.compile(node.value)
+
+        def _return(ev):
+            raise _Return(value(ev))
+
+        return _return
+
+    def _compile_FunctionDef(self, node):
+        body = self.compile(node.body)
+        defaults = [self.compile(d) for d in node.args.defaults]
+        name = node.name
+
+        def _function_def(ev):
+            ev._table[name] = _CompiledUserDef(ev, node, body, defaults)
+
+        return _function_def
+
+    def _compile_Try(self, node):
+        body = self.compile(node.body)
+        handlers = [self.compile(n.body) for n in node.handlers if n.body]
+        orelse = self.compile(node.orelse) if node.orelse else None
+        finalbody = self.compile(node.finalbody) if node.finalbody else None
+
+        def _try(ev):
+            ret = None
+            try:
+                ret = body(ev)
+            except:  # noqa: E722 same as interpreter, errors are swallowed by handlers
+                for handler in handlers:
+                    ret = handler(ev)
+            else:
+                if orelse is not None:
+                    ret = orelse(ev)
+            finally:
+                if finalbody is not None:
+                    ret = finalbody(ev)
+
+            return ret
+
+        return _try
+
+    def _compile_Dict(self, node):
+        items = [(self.compile(k), self.compile(v)) for k, v in zip(node.keys, node.values)]
+
+        def _dict(ev):
+            d = {}
+            for k, v in items:
+                k = k(ev)
+                d[k] = v(ev)
+                if len(d) > MAX_LEN:
+                    raise ExpressionEvalError("Max dict length.")
+            return d
+
+        return _dict
+
+    def _compile_List(self, node):
+        elts = [self.compile(v) for v in node.elts]
+
+        def _list(ev):
+            d = []
+            for v in elts:
+                d.append(v(ev))
+                if len(d) > MAX_LEN:
+                    raise ExpressionEvalError("Max list/tuple/set length.")
+            return d
+
+        return _list
+
+    def _compile_Tuple(self, node):
+        elts = self._compile_List(node)
+        return lambda ev: tuple(elts(ev))
+
+    def _compile_Set(self, node):
+        elts = self._compile_List(node)
+        return lambda ev: set(elts(ev))
+
+    def _compile_UnaryOp(self, node):
+        op = OPERATORS[type(node.op)]
+        operand = self.compile(node.operand)
+        return lambda ev: op(operand(ev))
+
+    def _compile_BinOp(self, node):
+        op = OPERATORS[type(node.op)]
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        return lambda ev: op(left(ev), right(ev))
+
+    def _compile_BoolOp(self, node):
+        values = [self.compile(v) for v in node.values]
+
+        if isinstance(node.op, ast.And):
+
+            def _and(ev):
+                res = False
+                for v in values:
+                    res = v(ev)
+                    if not res:
+                        return False
+                return res
+
+            return _and
+
+        def _or(ev):
+            res = True
+            for v in values:
+                res = v(ev)
+                if res:
+                    return res
+            return res
+
+        return _or
+
+    def _compile_Compare(self, node):
+        op = OPERATORS[type(node.ops[0])]
+        left = self.compile(node.left)
+        right = self.compile(node.comparators[0])
+        return lambda ev: op(left(ev), right(ev))
+
+    def _compile_Call(self, node):
+        func = self.compile(node.func)
+        args = [self.compile(a) for a in node.args]
+        kwargs = [(k.arg, self.compile(k.value)) for k in node.keywords]
+        is_list_method = isinstance(node.func, ast.Attribute) and node.func.attr in [
+            "append",
+            "pop",
+            "remove",
+        ]
+
+        def _call(ev):
+            f = func(ev)
+            if not callable(f):
+                raise FunctionNotDefined(node.func.id)
+
+            f_args = [a(ev) for a in args]
+            f_kwargs = {k: v(ev) for k, v in kwargs}
+
+            ev.check_time()
+
+            if is_list_method:
+                try:
+                    return f(*f_args)
+                except Exception:
+                    pass
+
+            return f(ev, *f_args, **f_kwargs)
+
+        return _call
+
+    def _compile_Subscript(self, node):
+        value = self.compile(node.value)
+        index_or_key = self.compile(node.slice)
+
+        def _subscript(ev):
+            val = value(ev)
+            key = index_or_key(ev)
+            try:
+                return ev._check_value(val[key])
+            except (IndexError, KeyError, TypeError):
+                return None
+
+        return _subscript
+
+    def _compile_Attribute(self, node):
+        value = self.compile(node.value)
+        attr = node.attr
+
+        def _attribute(ev):
+            val = value(ev)
+            if val is None:
+                return None
+            if isinstance(val, types.FunctionType):
+                val = value(ev)
+            return _get_attribute(val, attr)
+
+        return _attribute
+
+    def _compile_Slice(self, node):
+        lower = self.compile(node.lower) if node.lower is not None else None
+        upper = self.compile(node.upper) if node.upper is not None else None
+        step = self.compile(node.step) if node.step is not None else None
+
+        def _slice(ev):
+            return slice(
+                lower(ev) if lower is not None else None,
+                upper(ev) if upper is not None else None,
+                step(ev) if step is not None else None,
+            )
+
+        return _slice
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile_expression(expr):
+    """
+    Compiled closure of the expression, cached by the expression text,
+    None if the expression can't be compiled and is left to the interpreter
+    """
+    expr_ast = SimpleEval2.try_parse(expr)
+    try:
+        return _ClosureCompiler().compile(expr_ast.body)
+    except Exception:
+        # e.g. unknown operator or unpacking target, interpreter raises
+        # the same errors as InvalidExpression when the node is reached
+        _l.debug("expression is not compiled: %s", expr, exc_info=True)
+        return None
+
+
 def validate(expr):
     from rest_framework.exceptions import ValidationError
 
@@ -668,6 +1092,8 @@ def register_fun(name, callback):
     else:
         FUNCTIONS[name] = SimpleEval2Def(name, callback)
 
+    _get_functions_table.cache_clear()
+
 
 def value_prepare(orig):
     def _dict(data):
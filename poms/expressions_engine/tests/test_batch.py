@@ -0,0 +1,62 @@
+from django.test import SimpleTestCase
+
+from poms.expressions_engine import formula
+from poms.expressions_engine.batch import safe_eval_batch
+
+INVALID = "Invalid expression"
+
+
+class TestSafeEvalBatch(SimpleTestCase):
+    rows = [
+        {"market_value": 150.0, "nav": 1000.0, "position_size": 10, "item": {"price": 2.5}},
+        {"market_value": -20.5, "nav": 0.0, "position_size": 0, "item": {"price": 1.0}},
+        {"market_value": 1.0, "nav": 3.0, "position_size": 3, "item": {"price": None}},
+        {"market_value": None, "nav": 10.0, "position_size": True, "item": {}},
+        {"market_value": 5, "nav": 2.0, "position_size": 2**60, "item": 1},
+        {"nav": 4.0, "position_size": -7},
+    ]
+
+    expressions = [
+        "market_value / nav * 100",
+        "market_value / nav * 100 if nav else 0",
+        "market_value > 0",
+        "-market_value + 1",
+        "not nav",
+        "position_size * 2",
+        "position_size // 2 + position_size % 2",
+        "position_size * position_size",
+        "item.price * position_size",
+        "position_size > 1 if market_value else position_size",
+        "str(market_value)",
+        "(market_value > 0) + (nav > 0)",
+        "unknown_name + 1",
+    ]
+
+    def expected(self, expr):
+        evaluator = formula.SimpleEval2(allow_assign=True)
+        result = []
+        for row in self.rows:
+            try:
+                result.append(evaluator.eval(expr, names=row))
+            except formula.InvalidExpression:
+                result.append(INVALID)
+        return result
+
+    def test_same_result_as_interpreter(self):
+        for expr in self.expressions:
+            with self.subTest(expr=expr):
+                result = safe_eval_batch(expr, self.rows, error_value=INVALID)
+                expected = self.expected(expr)
+
+                self.assertEqual(result, expected)
+                self.assertEqual([type(v) for v in result], [type(v) for v in expected])
+
+    def test_columns(self):
+        columns = {"a": [1.0, 2.0, None], "b": [2.0, 0.0, 1.0]}
+
+        result = safe_eval_batch("a / b", columns, error_value=INVALID)
+
+        self.assertEqual(result, [0.5, INVALID, INVALID])
+
+    def test_empty(self):
+        self.assertEqual(safe_eval_batch("a + 1", []), [])
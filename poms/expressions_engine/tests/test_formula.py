@@ -0,0 +1,110 @@
+from django.test import SimpleTestCase
+
+from poms.expressions_engine import formula
+
+
+class TestExpressionCache(SimpleTestCase):
+    def test_parsed_expression_is_cached(self):
+        expr = "a * 2 + b"
+
+        self.assertIs(formula.SimpleEval2.try_parse(expr), formula.SimpleEval2.try_parse(expr))
+
+    def test_syntax_error_is_not_cached(self):
+        with self.assertRaises(formula.ExpressionSyntaxError):
+            formula.SimpleEval2.try_parse("a +")
+
+        with self.assertRaises(formula.ExpressionSyntaxError):
+            formula.SimpleEval2.try_parse("a +")
+
+    def test_reused_evaluator_binds_row_names(self):
+        evaluator = formula.SimpleEval2(allow_assign=True)
+        rows = [{"a": 1, "b": 2}, {"a": 10, "b": 20}, {"a": -1, "b": 0}]
+
+        results = [evaluator.eval("a * 2 + b", names=row) for row in rows]
+
+        self.assertEqual(results, [4, 40, -2])
+
+    def test_assignment_does_not_leak_between_evaluations(self):
+        evaluator = formula.SimpleEval2(allow_assign=True)
+        names = {"a": 1}
+
+        self.assertEqual(evaluator.eval("x = a + 1\nx", names=names), 2)
+        self.assertEqual(names, {"a": 1})
+        self.assertFalse(evaluator.has_var("x"))
+        with self.assertRaises(formula.NameNotDefined):
+            evaluator.eval("x", names=names)
+
+    def test_row_names_shadow_functions(self):
+        evaluator = formula.SimpleEval2()
+
+        self.assertEqual(evaluator.eval("str", names={"str": "value"}), "value")
+        self.assertEqual(evaluator.eval("str(1)"), "1")
+
+    def test_user_function(self):
+        expr = "def f(x, y=2):\n    return x * y\nf(3)"
+
+        self.assertEqual(formula.safe_eval(expr), 6)
+
+
+class TestCompiledExpressions(SimpleTestCase):
+    expressions = [
+        ("arithmetic", "a * 2 + b / 4 - 1", {"a": 3, "b": 8}),
+        ("power", "a ** 2", {"a": 3}),
+        ("compare", "a > b", {"a": 3, "b": 8}),
+        ("bool_and", "a and b", {"a": 3, "b": 0}),
+        ("bool_or", "a or b", {"a": 0, "b": 8}),
+        ("if_exp", "'big' if a > 2 else 'small'", {"a": 3}),
+        ("function", "str(a) + '%'", {"a": 3}),
+        ("subscript", "d['x'] + l[1]", {"d": {"x": 1}, "l": [1, 2]}),
+        ("missing_key", "d['y']", {"d": {"x": 1}}),
+        ("attribute", "item.value * 10", {"item": {"value": 5}}),
+        ("slice", "l[1:3]", {"l": [1, 2, 3, 4]}),
+        ("containers", "[a, (a, b), {'k': b}]", {"a": 1, "b": 2}),
+        ("assign", "x = a + 1\nx * 2", {"a": 1}),
+        ("for", "s = 0\nfor i in l:\n    s = s + i\ns", {"l": [1, 2, 3]}),
+        ("while_break", "i = 0\nwhile True:\n    i = i + 1\n    if i > 3:\n        break\ni", {}),
+        ("user_def", "def f(x, y=2):\n    return x * y\nf(a) + f(a, y=3)", {"a": 4}),
+        ("try", "try:\n    v = 1 / a\nexcept:\n    v = -1\nv", {"a": 0}),
+        ("list_append", "l = []\nl.append(a)\nl", {"a": 1}),
+    ]
+
+    def test_same_result_as_interpreter(self):
+        for name, expr, names in self.expressions:
+            with self.subTest(name=name):
+                expected = formula.SimpleEval2(allow_assign=True, compiled=False).eval(expr, names=names)
+                result = formula.SimpleEval2(allow_assign=True, compiled=True).eval(expr, names=names)
+
+                self.assertEqual(result, expected)
+
+    def test_unsupported_node(self):
+        evaluator = formula.SimpleEval2(compiled=True)
+
+        with self.assertRaises(formula.InvalidExpression):
+            evaluator.eval("[i for i in l]", names={"l": [1]})
+
+        self.assertEqual(evaluator.eval("1 if a else [i for i in l]", names={"a": 1, "l": []}), 1)
+
+    def test_assign_not_allowed(self):
+        with self.assertRaises(formula.InvalidExpression):
+            formula.SimpleEval2(allow_assign=False, compiled=True).eval("x = 1")
+
+    def test_unknown_name(self):
+        with self.assertRaises(formula.NameNotDefined):
+            formula.SimpleEval2(compiled=True).eval("a + 1")
+
+    def test_max_time(self):
+        evaluator = formula.SimpleEval2(compiled=True, max_time=0.01)
+
+        with self.settings(DEBUG=False), self.assertRaises(formula.InvalidExpression):
+            evaluator.eval("while True:\n    pass")
+
+    def test_not_compiled_expression(self):
+        for expr, names in (
+            ("a @ b", {"a": 1, "b": 2}),
+            ("for k, v in l:\n    pass", {"l": [(1, 2)]}),
+        ):
+            with self.subTest(expr=expr):
+                self.assertIsNone(formula._compile_expression(expr))
+
+                with self.assertRaises(formula.InvalidExpression):
+                    formula.SimpleEval2(compiled=True).eval(expr, names=names)
@@ -0,0 +1,243 @@
+"""
+Asynchronous history journal.
+
+post_save and post_delete of tracked models serialize the object, look up
+and diff its previous HistoricalRecord and write a new one, that is a few
+queries and a full serializer per save. Inside journal_changes() only cheap
+change events (content type, pk, action) are collected, and on commit the
+write_journal_records task loads, serializes and diffs the objects and
+writes the records by bulk_create.
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from poms.history.models import (
+    HistoricalRecord,
+    get_diff_and_notes,
+    get_model_content_type_as_text,
+    get_record_context,
+    get_serialized_data,
+    get_user_code_from_instance,
+)
+
+_l = logging.getLogger("poms.history")
+
+JOURNAL_BATCH_SIZE = 1000
+
+# {"coalesce": bool, "events": dict of events} of the current block
+_journal: ContextVar[Optional[dict]] = ContextVar("history_journal", default=None)
+
+
+@contextmanager
+def journal_changes(coalesce: bool = False):
+    """
+    Collect change events of tracked models and write history records of
+    them in background on commit, nested blocks are collected by the
+    outermost one. With coalesce only the last change of an object is written.
+    """
+    if _journal.get() is not None:
+        yield
+        return
+
+    journal = {"coalesce": coalesce, "events": {}}
+    token = _journal.set(journal)
+    try:
+        yield
+    finally:
+        _journal.reset(token)
+
+        events = list(journal["events"].values())
+        if events:
+            record_context = get_record_context()
+            transaction.on_commit(
+                lambda: send_journal_events(events, record_context)
+            )
+
+
+def journal_change(sender, instance, update_fields=None, deleted=False) -> bool:
+    """Collect change event of the instance, False if journal is not deferred"""
+    journal = _journal.get()
+    if journal is None:
+        return False
+
+    content_type = ContentType.objects.get_for_model(sender)
+    event = {
+        "content_type_id": content_type.id,
+        "object_id": instance.pk,
+        "action": None,
+    }
+
+    if deleted:
+        # object is gone on commit, keep its serialized data as post_delete does
+        content_type_key = get_model_content_type_as_text(sender)
+        event["action"] = HistoricalRecord.ACTION_DELETE
+        event["user_code"] = get_user_code_from_instance(instance, content_type_key)
+        event["data"] = json.loads(
+            json.dumps(get_serialized_data(sender, instance), cls=DjangoJSONEncoder)
+        )
+
+    elif update_fields and "is_deleted" in update_fields:
+        event["action"] = (
+            HistoricalRecord.ACTION_RECYCLE_BIN
+            if instance.is_deleted
+            else HistoricalRecord.ACTION_CHANGE
+        )
+
+    events = journal["events"]
+    key = (event["content_type_id"], event["object_id"])
+    if not journal["coalesce"]:
+        key += (len(events),)
+    events[key] = event
+
+    return True
+
+
+def send_journal_events(events: list, record_context: dict):
+    from poms.history.tasks import write_journal_records
+
+    master_user = record_context["master_user"]
+    if master_user is None:
+        _l.error(f"send_journal_events: no master user, {len(events)} events lost")
+        return
+
+    member = record_context["member"]
+    write_journal_records.apply_async(
+        kwargs={
+            "events": events,
+            "master_user_id": master_user.id,
+            "member_id": member.id if member else None,
+            "context_url": record_context["context_url"],
+            "context": {
+                "space_code": master_user.space_code,
+                "realm_code": master_user.realm_code,
+            },
+        }
+    )
+
+
+def _get_last_records(content_type_id: int, user_codes: set) -> tuple:
+    """User codes having records and last records used for diffs"""
+    records = HistoricalRecord.objects.filter(
+        content_type_id=content_type_id, user_code__in=user_codes
+    )
+    existing = set(records.values_list("user_code", flat=True).distinct())
+    last_data = {
+        record.user_code: record.data
+        for record in records.filter(
+            action__in=[
+                HistoricalRecord.ACTION_CREATE,
+                HistoricalRecord.ACTION_CHANGE,
+                HistoricalRecord.ACTION_DELETE,
+                HistoricalRecord.ACTION_DANGER,
+            ]
+        )
+        .order_by("user_code", "-created_at")
+        .distinct("user_code")
+        .only("user_code", "json_data")
+    }
+    return existing, last_data
+
+
+def write_events(events: list, master_user, member, context_url) -> int:
+    """Create history records of the events in the same way as post_save/post_delete"""
+    serializer_context = {"master_user": master_user, "member": member}
+
+    content_types = ContentType.objects.in_bulk(
+        {event["content_type_id"] for event in events}
+    )
+
+    instances = {}
+    object_ids = {}
+    for event in events:
+        if event["action"] != HistoricalRecord.ACTION_DELETE:
+            object_ids.setdefault(event["content_type_id"], set()).add(
+                event["object_id"]
+            )
+    for content_type_id, ids in object_ids.items():
+        model = content_types[content_type_id].model_class()
+        for pk, instance in model.objects.in_bulk(ids).items():
+            instances[(content_type_id, pk)] = instance
+
+    # (content_type_id, user_code, instance, event) of objects still existing
+    changes = []
+    for event in events:
+        content_type_id = event["content_type_id"]
+        if event["action"] == HistoricalRecord.ACTION_DELETE:
+            changes.append((content_type_id, event["user_code"], None, event))
+            continue
+
+        instance = instances.get((content_type_id, event["object_id"]))
+        if instance is None:
+            continue
+
+        content_type_key = get_model_content_type_as_text(
+            content_types[content_type_id].model_class()
+        )
+        user_code = get_user_code_from_instance(instance, content_type_key)
+        changes.append((content_type_id, user_code, instance, event))
+
+    last_records = {}
+    for content_type_id in content_types:
+        user_codes = {change[1] for change in changes if change[0] == content_type_id}
+        if user_codes:
+            last_records[content_type_id] = _get_last_records(
+                content_type_id, user_codes
+            )
+
+    records = []
+    for content_type_id, user_code, instance, event in changes:
+        existing, last_data = last_records[content_type_id]
+
+        action = event["action"]
+        if action is None:
+            action = (
+                HistoricalRecord.ACTION_CHANGE
+                if user_code in existing
+                else HistoricalRecord.ACTION_CREATE
+            )
+
+        diff = None
+        notes = None
+        if action == HistoricalRecord.ACTION_RECYCLE_BIN:
+            data = None
+            notes = {"message": "User moved object to Recycle Bin"}
+        else:
+            if action == HistoricalRecord.ACTION_DELETE:
+                data = event["data"]
+            else:
+                data = get_serialized_data(
+                    content_types[content_type_id].model_class(),
+                    instance,
+                    context=serializer_context,
+                )
+                if user_code in last_data:
+                    diff, notes = get_diff_and_notes(last_data[user_code], data)
+
+            last_data[user_code] = HistoricalRecord(data=data).data
+        existing.add(user_code)
+
+        records.append(
+            HistoricalRecord(
+                master_user=master_user,
+                member=member,
+                action=action,
+                context_url=context_url,
+                data=data,
+                diff=diff,
+                notes=notes,
+                user_code=user_code,
+                content_type_id=content_type_id,
+            )
+        )
+
+    HistoricalRecord.objects.bulk_create(records, batch_size=JOURNAL_BATCH_SIZE)
+
+    return len(records)
@@ -233,7 +233,7 @@ def get_model_content_type_as_text(sender):
     return f"{content_type.app_label}.{content_type.model}"
 
 
-def get_serialized_data(sender, instance):
+def get_serialized_data(sender, instance, context=None):
     from poms.accounts.serializers import AccountSerializer, AccountTypeSerializer
     from poms.counterparties.serializers import (
         CounterpartySerializer,
@@ -302,11 +302,12 @@ def get_serialized_data(sender, instance):
         "schedules.schedule": ScheduleSerializer,
     }
 
-    record_context = get_record_context()
-    context = {
-        "master_user": record_context["master_user"],
-        "member": record_context["member"],
-    }
+    if context is None:
+        record_context = get_record_context()
+        context = {
+            "master_user": record_context["master_user"],
+            "member": record_context["member"],
+        }
     try:
         content_type_key = get_model_content_type_as_text(sender)
         result = model_serializer_map[content_type_key](
@@ -376,12 +377,21 @@ def get_notes_for_history_record(user_code, content_type, serialized_data):
             ],
         ).order_by("-created_at")[0]
 
+        diff, notes = get_diff_and_notes(last_record.data, serialized_data)
+
+    return diff, notes
+
+
+def get_diff_and_notes(last_data, serialized_data):
+    diff = None
+    notes = None
+    with contextlib.suppress(Exception):
         everything_is_dict = json.loads(
             json.dumps(serialized_data)
         )  # because deep diff counts different Dict and Ordered dict
 
         result = DeepDiff(
-            json.loads(last_record.data),
+            json.loads(last_data),
             json.loads(everything_is_dict),
             ignore_string_type_changes=True,
             ignore_order=True,
@@ -462,8 +472,14 @@ def post_save(sender, instance, created, using=None, update_fields=None, **kwarg
         # _l.info('post_save.sender %s' % sender)
         # _l.info('post_save.update_fields %s' % update_fields)
 
+        from poms.history.journal import journal_change
         from poms.users.models import MasterUser
 
+        if sender != MasterUser and journal_change(
+            sender, instance, update_fields=update_fields
+        ):
+            return
+
         master_user = MasterUser.objects.all().first()
 
         if sender == MasterUser and instance.journal_status == "disabled":
@@ -564,8 +580,16 @@ def post_save(sender, instance, created, using=None, update_fields=None, **kwarg
 
 
 def post_delete(sender, instance, using=None, **kwargs):
+    from poms.history.journal import journal_change
     from poms.users.models import MasterUser
 
+    try:
+        if journal_change(sender, instance, deleted=True):
+            return
+    except Exception as e:
+        _l.error(f"history.post_delete error {repr(e)} {traceback.format_exc()}")
+        return
+
     master_user = MasterUser.objects.all().first()
 
     if master_user.journal_status != MasterUser.JOURNAL_STATUS_DISABLED:
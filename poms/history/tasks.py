@@ -267,3 +267,35 @@ def common_export_journal_to_storage(self, *args, **kwargs):
             continue
 
         _l.info(f"No records found from {single_date}")
+
+
+@finmars_task(name="history.write_journal_records")
+def write_journal_records(
+    events: list, master_user_id: int, member_id=None, context_url=None, **kwargs
+):
+    """
+    Write history records of change events collected by journal_changes()
+    """
+    from poms.history.journal import JOURNAL_BATCH_SIZE, write_events
+    from poms.users.models import Member
+
+    master_user = MasterUser.objects.filter(id=master_user_id).first()
+    if not master_user:
+        _l.error(f"write_journal_records: no master user id={master_user_id}")
+        return
+
+    if master_user.journal_status == MasterUser.JOURNAL_STATUS_DISABLED:
+        return
+
+    member = Member.objects.filter(id=member_id).first() if member_id else None
+
+    count = 0
+    for start in range(0, len(events), JOURNAL_BATCH_SIZE):
+        count += write_events(
+            events[start : start + JOURNAL_BATCH_SIZE],
+            master_user,
+            member,
+            context_url,
+        )
+
+    _l.info(f"write_journal_records: {count} records from {len(events)} events")
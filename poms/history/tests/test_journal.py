@@ -0,0 +1,96 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+
+from poms.common.common_base_test import BaseTestCase
+from poms.history.journal import journal_change, journal_changes, write_events
+from poms.history.models import HistoricalRecord, post_delete, post_save
+from poms.portfolios.models import Portfolio
+
+
+class JournalChangesTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.portfolio = Portfolio.objects.first()
+        self.content_type = ContentType.objects.get_for_model(Portfolio)
+
+    def test_journal_is_not_deferred_outside_of_block(self):
+        self.assertFalse(journal_change(Portfolio, self.portfolio))
+
+    @mock.patch("poms.history.journal.send_journal_events")
+    def test_events_are_sent_on_commit(self, send_mock):
+        with self.captureOnCommitCallbacks(execute=True):
+            with journal_changes():
+                post_save(Portfolio, self.portfolio, created=False)
+                with journal_changes():
+                    post_save(Portfolio, self.portfolio, created=False)
+
+                send_mock.assert_not_called()
+
+        self.assertFalse(HistoricalRecord.objects.exists())
+        events = send_mock.call_args.args[0]
+        self.assertEqual(len(events), 2)
+        self.assertEqual(
+            events[0],
+            {
+                "content_type_id": self.content_type.id,
+                "object_id": self.portfolio.id,
+                "action": None,
+            },
+        )
+
+    @mock.patch("poms.history.journal.send_journal_events")
+    def test_coalesce(self, send_mock):
+        with self.captureOnCommitCallbacks(execute=True):
+            with journal_changes(coalesce=True):
+                for _ in range(3):
+                    post_save(Portfolio, self.portfolio, created=False)
+
+        self.assertEqual(len(send_mock.call_args.args[0]), 1)
+
+    def test_write_events(self):
+        event = {
+            "content_type_id": self.content_type.id,
+            "object_id": self.portfolio.id,
+            "action": None,
+        }
+
+        count = write_events(
+            [event, event], self.master_user, self.member, "test_write_events"
+        )
+
+        self.assertEqual(count, 2)
+        records = HistoricalRecord.objects.filter(
+            content_type=self.content_type, user_code=self.portfolio.user_code
+        ).order_by("id")
+        self.assertEqual(
+            [record.action for record in records],
+            [HistoricalRecord.ACTION_CREATE, HistoricalRecord.ACTION_CHANGE],
+        )
+        self.assertIsNotNone(records[0].data)
+
+    @mock.patch("poms.history.journal.send_journal_events")
+    def test_deleted_object_data_is_serialized(self, send_mock):
+        with self.captureOnCommitCallbacks(execute=True):
+            with journal_changes():
+                post_delete(Portfolio, self.portfolio)
+
+        events = send_mock.call_args.args[0]
+        write_events(events, self.master_user, self.member, "test_delete")
+
+        record = HistoricalRecord.objects.get(
+            content_type=self.content_type, action=HistoricalRecord.ACTION_DELETE
+        )
+        # same format as data of saved objects
+        self.assertIsInstance(record.data, dict)
+        self.assertEqual(record.data["user_code"], self.portfolio.user_code)
+
+    @mock.patch(
+        "poms.history.journal.get_serialized_data", side_effect=ValueError("broken")
+    )
+    def test_journal_error_does_not_fail_delete(self, _):
+        with journal_changes():
+            post_delete(Portfolio, self.portfolio)
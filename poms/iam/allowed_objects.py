@@ -0,0 +1,185 @@
+"""
+Compiled access policies.
+
+Statements of member's access policies are compiled once per (member, model,
+viewset) into ids of allowed objects, or an "all" flag, and cached. Cache
+key contains version of IAM objects of the schema (changed when access
+policies, roles, groups or resource groups are changed) and version of the
+model objects (changed when objects are created, deleted or their user_code
+is changed), so querysets are filtered by an indexed id lookup instead of
+user_code__icontains clauses.
+"""
+
+import logging
+import uuid
+from functools import lru_cache, reduce
+from operator import or_
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q, QuerySet
+
+from poms.common.utils import collect_on_commit, get_current_schema
+
+_l = logging.getLogger("poms.iam")
+
+RESOURCE_GROUP_PREFIX = "frn:finmars:iam:resourcegroup:"
+
+
+def _get_iam_version_key(schema: str) -> str:
+    return f"{schema}_iam_version"
+
+
+def _get_objects_version_key(schema: str, model) -> str:
+    return f"{schema}_iam_objects_version_{model._meta.label_lower}"
+
+
+def _get_version(key: str) -> str:
+    return cache.get_or_set(key, uuid.uuid4().hex, None)
+
+
+def _bump_version(key: str):
+    try:
+        cache.set(key, uuid.uuid4().hex, None)
+    except Exception as e:
+        _l.error(f"iam _bump_version {key} error {repr(e)}")
+
+
+def _bump_objects_versions(models: set):
+    schema = get_current_schema()
+    for model in models:
+        _bump_version(_get_objects_version_key(schema, model))
+
+
+def iam_changed():
+    """Make compiled policies of all members outdated on commit"""
+    collect_on_commit(
+        "iam_changed",
+        (),
+        lambda _: _bump_version(_get_iam_version_key(get_current_schema())),
+    )
+
+
+def allowed_objects_changed(model):
+    """Make allowed ids of the model outdated on commit"""
+    collect_on_commit("iam_allowed_objects_changed", (model,), _bump_objects_versions)
+
+
+@lru_cache(maxsize=None)
+def has_user_code(model) -> bool:
+    try:
+        model._meta.get_field("user_code")
+    except FieldDoesNotExist:
+        return False
+
+    return True
+
+
+def compile_statements(member, model, viewset: str) -> dict:
+    """
+    Allowed resources of the model from 'allow' statements of the viewset:
+    "all" flag, resource group user codes and user code substrings
+    """
+    from poms.iam.utils import (
+        action_statement_into_object,
+        get_statements,
+        parse_resource_into_object,
+    )
+
+    content_type_key = f"{model._meta.app_label}.{model._meta.model_name}"
+    rule = {"all": False, "resource_groups": set(), "user_codes": set()}
+
+    for statement in get_statements(member):
+        if statement.get("effect") != "allow":
+            continue
+
+        if all(
+            action_statement_into_object(action)["viewset"] != viewset
+            for action in statement.get("action", [])
+        ):
+            continue
+
+        for resource in statement.get("resource", []):
+            if resource == "*":
+                rule["all"] = True
+                return rule
+
+            if resource.startswith(RESOURCE_GROUP_PREFIX):
+                rule["resource_groups"].add(resource.split(":")[-1])
+                continue
+
+            parsed_resource = parse_resource_into_object(resource)
+            if (
+                f"{parsed_resource['app_label']}.{parsed_resource['model']}"
+                != content_type_key
+            ):
+                continue
+
+            # TODO szhitenev
+            # in future release enforce user_code to asci lowercase only
+            rule["user_codes"].add(parsed_resource["user_code"].split("*")[0])
+
+    return rule
+
+
+def _get_allowed_ids(model, rule: dict) -> list:
+    from poms.iam.models import ResourceGroupAssignment
+
+    conditions = []
+
+    if rule["resource_groups"]:
+        content_type = ContentType.objects.get_for_model(model)
+        object_ids = ResourceGroupAssignment.objects.filter(
+            resource_group__user_code__in=rule["resource_groups"],
+            content_type=content_type,
+        ).values_list("object_id", flat=True)
+        conditions.append(Q(id__in=list(object_ids)))
+
+    if rule["user_codes"] and has_user_code(model):
+        conditions.extend(
+            Q(user_code__icontains=user_code) for user_code in rule["user_codes"]
+        )
+
+    if not conditions:
+        return []
+
+    return list(
+        model._base_manager.filter(reduce(or_, conditions)).values_list(
+            "id", flat=True
+        )
+    )
+
+
+def get_allowed_ids(member, model, viewset: str) -> Optional[list]:
+    """Ids of objects of the model allowed for the member, None if all are allowed"""
+    schema = get_current_schema()
+    cache_key = (
+        f"{schema}_iam_allowed_ids_{member.id}_{model._meta.label_lower}_{viewset}_"
+        f"{_get_version(_get_iam_version_key(schema))}_"
+        f"{_get_version(_get_objects_version_key(schema, model))}"
+    )
+
+    allowed = cache.get(cache_key)
+    if allowed is None:
+        rule = compile_statements(member, model, viewset)
+        if rule["all"]:
+            allowed = {"all": True}
+        else:
+            allowed = {"ids": _get_allowed_ids(model, rule)}
+        cache.set(cache_key, allowed, settings.ACCESS_POLICY_CACHE_TTL)
+
+    return None if allowed.get("all") else allowed["ids"]
+
+
+def filter_allowed_queryset(member, queryset: QuerySet, viewset: str) -> QuerySet:
+    """Filter queryset by ids allowed for the member, empty if nothing is allowed"""
+    allowed_ids = get_allowed_ids(member, queryset.model, viewset)
+    if allowed_ids is None:
+        return queryset
+    if not allowed_ids:
+        return queryset.none()
+
+    return queryset.filter(id__in=allowed_ids)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class FinmarsIAMConfig(AppConfig):
     name = "poms.iam"
+
+    def ready(self):
+        from poms.iam.signals import connect_user_code_tracking
+
+        connect_user_code_tracking()
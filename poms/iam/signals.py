@@ -1,8 +1,16 @@
+from django.apps import apps
 from django.core.cache import cache
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
 from django.dispatch import receiver
 
-from poms.iam.models import AccessPolicy, Role, Group
+from poms.iam.allowed_objects import allowed_objects_changed, has_user_code, iam_changed
+from poms.iam.models import (
+    AccessPolicy,
+    Group,
+    ResourceGroup,
+    ResourceGroupAssignment,
+    Role,
+)
 
 import logging
 
@@ -24,6 +32,7 @@ def clear_member_access_policies_cache(member):
 @receiver(post_save, sender=AccessPolicy)
 @receiver(post_delete, sender=AccessPolicy)
 def clear_access_policy_cache(sender, instance, **kwargs):
+    iam_changed()
     # Clear cache for all related users
     for member in instance.members.all():
         clear_member_access_policies_cache(member)
@@ -38,6 +47,7 @@ def clear_access_policy_cache(sender, instance, **kwargs):
 @receiver(post_save, sender=Role)
 @receiver(post_delete, sender=Role)
 def clear_role_cache(sender, instance, **kwargs):
+    iam_changed()
     # Clear cache for all related users
     for member in instance.members.all():
         clear_member_access_policies_cache(member)
@@ -46,6 +56,55 @@ def clear_role_cache(sender, instance, **kwargs):
 @receiver(post_save, sender=Group)
 @receiver(post_delete, sender=Group)
 def clear_group_cache(sender, instance, **kwargs):
+    iam_changed()
     # Clear cache for all related users
     for member in instance.members.all():
         clear_member_access_policies_cache(member)
+
+
+@receiver(post_save, sender=ResourceGroup)
+@receiver(post_delete, sender=ResourceGroup)
+@receiver(post_save, sender=ResourceGroupAssignment)
+@receiver(post_delete, sender=ResourceGroupAssignment)
+def clear_resource_group_cache(sender, instance, **kwargs):
+    iam_changed()
+
+
+@receiver(m2m_changed, sender=AccessPolicy.members.through)
+@receiver(m2m_changed, sender=Role.members.through)
+@receiver(m2m_changed, sender=Role.access_policies.through)
+@receiver(m2m_changed, sender=Group.members.through)
+@receiver(m2m_changed, sender=Group.roles.through)
+@receiver(m2m_changed, sender=Group.access_policies.through)
+def clear_relations_cache(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        iam_changed()
+
+
+def remember_user_code(sender, instance, **kwargs):
+    # deferred user_code is not loaded to be remembered
+    instance._iam_user_code = instance.__dict__.get("user_code")
+
+
+def connect_user_code_tracking():
+    """Remember user_code of loaded objects to find out if save changes it"""
+    for model in apps.get_models():
+        if has_user_code(model):
+            post_init.connect(remember_user_code, sender=model)
+
+
+@receiver(post_save)
+def clear_allowed_objects_cache_on_save(sender, instance, created, **kwargs):
+    if not has_user_code(sender):
+        return
+
+    user_code = instance.__dict__.get("user_code")
+    if created or user_code != getattr(instance, "_iam_user_code", user_code):
+        allowed_objects_changed(sender)
+    instance._iam_user_code = user_code
+
+
+@receiver(post_delete)
+def clear_allowed_objects_cache_on_delete(sender, instance, **kwargs):
+    if has_user_code(sender):
+        allowed_objects_changed(sender)
@@ -0,0 +1,107 @@
+from unittest import mock
+
+from django.db import transaction
+
+from poms.common.common_base_test import BaseTestCase
+from poms.iam import allowed_objects
+from poms.iam.models import AccessPolicy, ResourceGroup
+from poms.iam.utils import get_allowed_queryset
+from poms.portfolios.models import Portfolio
+
+
+class AllowedObjectsTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.member.is_admin = False
+        self.member.save()
+        self.portfolio = Portfolio.objects.first()
+
+    def create_policy(self, resources: list) -> AccessPolicy:
+        user_code = self.random_string()
+        policy = AccessPolicy.objects.create(
+            name=user_code,
+            user_code=user_code,
+            configuration_code=user_code,
+            owner=self.member,
+            policy={
+                "Version": "2023-01-01",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": ["finmars:portfolio:list"],
+                        "Resource": resources,
+                    }
+                ],
+            },
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            policy.members.add(self.member)
+
+        return policy
+
+    def get_allowed_ids(self) -> set:
+        return set(
+            get_allowed_queryset(self.member, Portfolio.objects.all()).values_list(
+                "id", flat=True
+            )
+        )
+
+    def test_nothing_allowed_without_policies(self):
+        self.assertEqual(self.get_allowed_ids(), set())
+
+    def test_user_code(self):
+        self.create_policy(
+            [f"frn:finmars:portfolios:portfolio:{self.portfolio.user_code}"]
+        )
+
+        self.assertIn(self.portfolio.id, self.get_allowed_ids())
+
+    def test_all(self):
+        self.create_policy(["*"])
+
+        self.assertEqual(
+            self.get_allowed_ids(), set(Portfolio.objects.values_list("id", flat=True))
+        )
+
+    def test_resource_group(self):
+        # statements are lowercased
+        user_code = self.random_string().lower()
+        resource_group = ResourceGroup.objects.create(
+            name=user_code,
+            user_code=user_code,
+            configuration_code=user_code,
+            owner=self.member,
+        )
+        self.create_policy([f"frn:finmars:iam:resourcegroup:{user_code}"])
+        self.assertEqual(self.get_allowed_ids(), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resource_group.create_assignment(self.portfolio)
+
+        self.assertEqual(self.get_allowed_ids(), {self.portfolio.id})
+
+    def test_user_code_change(self):
+        user_code = self.random_string()
+        self.create_policy([f"frn:finmars:portfolios:portfolio:{user_code}"])
+        self.assertNotIn(self.portfolio.id, self.get_allowed_ids())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.portfolio.user_code = user_code
+            self.portfolio.save()
+
+        self.assertIn(self.portfolio.id, self.get_allowed_ids())
+
+    def test_objects_version_is_bumped_once_per_transaction(self):
+        with mock.patch.object(
+            allowed_objects, "_bump_objects_versions"
+        ) as bump, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for _ in range(3):
+                    self.portfolio.user_code = self.random_string()
+                    self.portfolio.save()
+
+        bump.assert_called_once()
+        self.assertIn(Portfolio, bump.call_args.args[0])
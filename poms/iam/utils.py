@@ -3,6 +3,7 @@ import logging
 from django.conf import settings
 from django.core.cache import cache
 from django.db.models import QuerySet
+from poms.iam.allowed_objects import filter_allowed_queryset
 from poms.iam.models import AccessPolicy, ResourceGroup
 from poms.users.models import Member
 
@@ -147,114 +148,9 @@ def filter_queryset_with_access_policies(member, queryset, view):
     if member.is_admin:
         return queryset
 
-    statements = get_statements(member)
-
-    """
-    Important clause:
-    We will not grant access to objects if Access Policy is not configured.
-    """
-    if not len(statements):
-        return queryset.none()
-
-    _l.debug("filter_queryset_with_access_policies.statements %s" % len(statements))
-
-    app_label = queryset.model._meta.app_label
-    model_name = queryset.model._meta.model_name
-    content_type_key = f"{app_label}.{model_name}"
-
-    q = Q()
-    view_related_statements = []
     viewset_name = view.__class__.__name__.replace("ViewSet", "").lower()
 
-    # Filter statements related to the current view
-    for statement in statements:
-        if any(
-            viewset_name == action_statement_into_object(act)["viewset"]
-            for act in statement["action"]
-        ):
-            view_related_statements.append(statement)
-
-    _l.debug(
-        "filter_queryset_with_access_policies.view_related_statements %s"
-        % len(view_related_statements)
-    )
-
-    for statement in view_related_statements:
-        if statement["effect"] == "allow":
-            resources = statement.get("resource", [])
-
-            # Handle '*' resource (no restrictions)
-            if "*" in resources:
-                q |= Q(id__isnull=False)
-                continue
-
-            # Parse and expand resources if there are ResourceGroups
-            expanded_resources = set()
-            for resource in resources:
-                if resource.startswith("frn:finmars:iam:resourcegroup:"):
-                    # Handle ResourceGroup resource
-                    resource_group_code = resource.split(":")[-1]
-                    try:
-                        resource_group = ResourceGroup.objects.get(
-                            user_code=resource_group_code
-                        )
-                        assignments = resource_group.assignments.all()
-
-                        # Add each assigned object's user_code as a resource
-                        expanded_resources.update(
-                            f"frn:finmars:{assignment.content_type.app_label}:{assignment.content_type.model}:{assignment.object_user_code}"
-                            for assignment in assignments
-                            if assignment.object_user_code
-                        )
-                    except ResourceGroup.DoesNotExist:
-                        _l.warning(
-                            f"ResourceGroup with user_code {resource_group_code} does not exist."
-                        )
-                        continue
-                else:
-                    expanded_resources.add(resource)
-
-            # Apply the filters for expanded resources
-            for resource in expanded_resources:
-                parsed_resource = parse_resource_into_object(resource)
-                _l.info(
-                    "filter_queryset_with_access_policies.parsed_resource %s"
-                    % parsed_resource
-                )
-
-                # Match the content type and apply filters
-                if (
-                    f"{parsed_resource['app_label']}.{parsed_resource['model']}"
-                    == content_type_key
-                ):
-                    user_code_val = parsed_resource["user_code"]
-                    if "*" in user_code_val:
-                        # Apply wildcard match
-                        base_code = user_code_val.split("*")[0]
-                        q |= Q(user_code__icontains=base_code)
-                    else:
-                        # TODO szhitenev
-                        # in future release enforce user_code to asci lowercase only
-                        q |= Q(user_code__icontains=user_code_val)
-
-    _l.debug("filter_queryset_with_access_policies.q %s" % len(q))
-
-    """
-    Important clause:
-    If Access Statements do not grant access, we deny access to objects.
-    """
-    if not q:
-        return queryset.none()
-
-    _l.debug(
-        "ObjectPermissionBackend.filter_queryset before access filter: %s"
-        % queryset.count()
-    )
-
-    result = queryset.filter(q)
-    _l.info("ObjectPermissionBackend.filter_queryset q %s" % q)
-
-    return result
+    return filter_allowed_queryset(member, queryset, viewset_name)
 
 
 """
@@ -305,27 +201,9 @@ def get_allowed_queryset(member, queryset):
     if member.is_admin:
         return queryset
 
-    # Get allowed resources for the member and model
-    allowed_resources = get_allowed_resources(member, queryset.model, queryset)
-    allowed_user_codes = []
-
-    _l.debug("get_allowed_queryset.allowed_resources %s" % allowed_resources)
-
-    # Extract user codes from allowed resources
-    for resource in allowed_resources:
-        parsed_resource = parse_resource_into_object(resource)
-        allowed_user_codes.append(parsed_resource["user_code"])
-
-    _l.debug("get_allowed_queryset.allowed_user_codes %s" % allowed_user_codes)
-
-    # Filter queryset based on allowed user codes
-    # Build a Q object for filtering using icontains for each user_code
-    q_filter = Q()
-    for user_code in allowed_user_codes:
-        q_filter |= Q(user_code__icontains=user_code)
-
-    # Apply the Q filter to the queryset
-    return queryset.filter(q_filter)
+    return filter_allowed_queryset(
+        member, queryset, queryset.model.__name__.lower()
+    )
 
 
 def get_allowed_resources(member, model, queryset):
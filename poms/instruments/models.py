@@ -1,11 +1,12 @@
 import json
 import logging
 import traceback
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
 from datetime import date, datetime, timedelta
 from math import isnan
-from typing import Optional
+from typing import List, Optional
 
+import numpy as np
 import QuantLib as ql
 from dateutil import relativedelta, rrule
 
@@ -23,7 +24,9 @@ from poms.common.constants import SYSTEM_VALUE_TYPES, SystemValueType
 from poms.common.fields import ResourceGroupsField
 from poms.common.formula_accruals import (
     calculate_accrual_event_factor,
+    calculate_accrual_event_factors,
     calculate_accrual_schedule_factor,
+    calculate_accrual_schedule_factors,
     get_coupon,
 )
 from poms.common.models import (
@@ -40,10 +43,12 @@ from poms.currencies.models import CurrencyHistory
 from poms.expressions_engine import formula
 from poms.instruments.finmars_quantlib import Actual365A, Actual365L
 from poms.obj_attrs.models import GenericAttribute, GenericAttributeType
+from poms.reports.result_cache import report_data_changed
 from poms.users.models import EcosystemDefault, MasterUser
 
 _l = logging.getLogger("poms.instruments")
 DATE_FORMAT = "%Y-%m-%d"
+PRICES_BATCH_SIZE = 1000
 
 
 class InstrumentClass(AbstractClassModel):
@@ -2288,45 +2293,135 @@ class Instrument(NamedModel, FakeDeletableModel, TimeStampedModel, ObjectStateMo
 
         return accrual_size
 
+    def _get_related_objects(self, name: str, *select_related) -> list:
+        """Objects of the reverse relation, prefetched ones if they are"""
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        if name in prefetched:
+            return list(prefetched[name])
+
+        return list(getattr(self, name).select_related(*select_related))
+
+    def get_accrued_prices(self, dates: List[date]) -> np.ndarray:
+        """
+        Same as get_accrued_price for every date (sorted), accrual events and
+        schedules are loaded once and factors are calculated per event/schedule
+        """
+        result = np.zeros(len(dates))
+
+        events = sorted(
+            self._get_related_objects("accrual_events", "accrual_calculation_model"),
+            key=lambda x: x.end_date,
+        )
+        end_dates = [event.end_date for event in events]
+
+        schedules = sorted(
+            self._get_related_objects(
+                "accrual_calculation_schedules",
+                "accrual_calculation_model",
+                "periodicity",
+            ),
+            key=lambda x: x.accrual_start_date,
+        )
+        start_dates = [
+            datetime.strptime(schedule.accrual_start_date, DATE_FORMAT).date()
+            for schedule in schedules
+        ]
+
+        # indexes of dates by the event or schedule used for them
+        events_days = {}
+        schedules_days = {}
+
+        for i, day in enumerate(dates):
+            if not self._price_date_is_valid(day=day):
+                continue
+
+            if events and day >= events[0].start_date:
+                pos = bisect_left(end_dates, day)
+                if pos < len(events):
+                    events_days.setdefault(pos, []).append(i)
+                    continue
+
+            pos = bisect_right(start_dates, day) - 1
+            if pos >= 0:
+                schedules_days.setdefault(pos, []).append(i)
+
+        for pos, days in events_days.items():
+            event = events[pos]
+            factors = calculate_accrual_event_factors(event, [dates[i] for i in days])
+            result[days] = event.accrual_size * np.array(factors)
+
+        for pos, days in schedules_days.items():
+            schedule = schedules[pos]
+            factors = calculate_accrual_schedule_factors(
+                schedule,
+                start_dates[pos],
+                [dates[i] for i in days],
+                datetime.strptime(schedule.first_payment_date, DATE_FORMAT).date(),
+                maturity_date=self.maturity_date,
+            )
+            result[days] = float(schedule.accrual_size) * factors
+
+        return result
+
     def calculate_prices_accrued_price(self, begin_date=None, end_date=None) -> None:
         existed_prices = PriceHistory.objects.filter(
             instrument=self, date__range=(begin_date, end_date)
         )
 
         if begin_date is None and end_date is None:
-            for price in existed_prices:
-                if price.date >= self.maturity_date:
-                    continue
-                accrued_price = self.get_accrued_price(price.date)
-                if accrued_price is None:
-                    accrued_price = 0
-                price.accrued_price = accrued_price
-                price.save(update_fields=["accrued_price"])
+            prices = [
+                price for price in existed_prices if price.date < self.maturity_date
+            ]
+            dates = sorted({price.date for price in prices})
+            accrued_prices = dict(zip(dates, self.get_accrued_prices(dates).tolist()))
+            for price in prices:
+                price.accrued_price = accrued_prices[price.date]
+
+            PriceHistory.objects.bulk_update(
+                prices, ["accrued_price"], batch_size=PRICES_BATCH_SIZE
+            )
 
         else:
+            dates = [
+                dt.date()
+                for dt in rrule.rrule(rrule.DAILY, dtstart=begin_date, until=end_date)
+                if dt.date() < self.maturity_date
+            ]
+            # accrued price doesn't depend on pricing policy
+            accrued_prices = self.get_accrued_prices(dates).tolist()
+
             existed_prices = {(p.pricing_policy_id, p.date): p for p in existed_prices}
+            updated_prices = []
+            new_prices = []
             for pp in PricingPolicy.objects.filter(master_user=self.master_user):
-                for dt in rrule.rrule(rrule.DAILY, dtstart=begin_date, until=end_date):
-                    day = dt.date()
-                    if day >= self.maturity_date:
-                        continue
-
-                    accrued_price = self.get_accrued_price(day)
-
+                for day, accrued_price in zip(dates, accrued_prices):
                     price = existed_prices.get((pp.id, day))
                     if price is None:
-                        if accrued_price is not None:
-                            price = PriceHistory()
-                            price.instrument = self
-                            price.pricing_policy = pp
-                            price.date = day
-                            price.accrued_price = accrued_price
-                            price.save()
+                        price = PriceHistory(
+                            instrument=self,
+                            pricing_policy=pp,
+                            date=day,
+                            accrued_price=accrued_price,
+                        )
+                        # same as in PriceHistory.save()
+                        price.run_auto_calculation()
+                        new_prices.append(price)
                     else:
-                        if accrued_price is None:
-                            accrued_price = 0
                         price.accrued_price = accrued_price
-                        price.save(update_fields=["accrued_price"])
+                        updated_prices.append(price)
+
+            PriceHistory.objects.bulk_update(
+                updated_prices, ["accrued_price"], batch_size=PRICES_BATCH_SIZE
+            )
+            PriceHistory.objects.bulk_create(new_prices, batch_size=PRICES_BATCH_SIZE)
+
+        report_data_changed()
+
+        from poms.widgets.snapshots import outdate_balance_snapshots
+
+        outdate_balance_snapshots(
+            begin_date or date.min, end_date, instrument_ids=[self.id]
+        )
 
     def get_accrual_schedule_factor(self, price_date: date):
         from poms.common.formula_accruals import calculate_accrual_schedule_factor
@@ -2493,6 +2588,18 @@ class Instrument(NamedModel, FakeDeletableModel, TimeStampedModel, ObjectStateMo
 
         return res.factor_value if res else 1
 
+    def get_factors_by_dates(self, dates: List[date]) -> List[float]:
+        """Same as get_factor for every date, factor schedules are loaded once"""
+        factors = self.get_factors()
+        effective_dates = [f.effective_date for f in factors]
+
+        result = []
+        for day in dates:
+            pos = bisect_left(effective_dates, day) if day else 0
+            result.append(factors[pos - 1].factor_value if pos else 1)
+
+        return result
+
     def generate_instrument_system_attributes(self):
         # from django.contrib.contenttypes.models import ContentType
 
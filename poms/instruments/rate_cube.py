@@ -0,0 +1,250 @@
+"""
+FX rates and prices of the range of dates.
+
+Calculations like Performance Report or portfolio register prices need
+rates of many days, getting them by CurrencyHistory.objects.get() /
+PriceHistory.objects.get() makes one query per day. RateCube loads histories
+of the whole range by one query per pricing policy into numpy arrays indexed
+by date offset, create it once per report or task and share between steps.
+"""
+
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from poms.currencies.models import CurrencyHistory
+from poms.instruments.models import PriceHistory
+
+PRICE_FIELDS = ("principal_price", "accrued_price", "factor", "nav", "cash_flow")
+
+
+def fill_forward(values: np.ndarray, previous: Optional[float] = None) -> np.ndarray:
+    """Replace NaN with the last known value, previous is the value before the array"""
+    values = values.copy()
+    if previous is not None and len(values) and np.isnan(values[0]):
+        values[0] = previous
+
+    index = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+
+    return values[index]
+
+
+class RateCube:
+    """
+    FX rates and prices of date_from..date_to.
+
+    Missing rates are None (NaN in arrays) or the last known value
+    if fill_forward is set. FX rate of default currency is always 1.
+    Lookups outside the range are made by a single query each.
+    """
+
+    def __init__(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        default_currency_id: Optional[int] = None,
+        fill_forward: bool = False,
+    ):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.days = (date_to - date_from).days + 1 if date_from and date_to else 0
+        self.default_currency_id = default_currency_id
+        self.fill_forward = fill_forward
+
+        # (pricing_policy_id, currency_id) -> array of fx rates
+        self._fx_rates: Dict[Tuple[int, int], np.ndarray] = {}
+        # (pricing_policy_id, instrument_id) -> {field: array of values}
+        self._prices: Dict[Tuple[int, int], Dict[str, np.ndarray]] = {}
+        # lookups outside the range
+        self._outside: Dict[tuple, Optional[float]] = {}
+
+    def get_date_index(self, day: date) -> Optional[int]:
+        if not self.days or day < self.date_from or day > self.date_to:
+            return None
+        return (day - self.date_from).days
+
+    def _load(self, model, key_field, ids, pricing_policy_id, fields):
+        """{id: {field: array}} of history values of the range"""
+        result = {
+            pk: {field: np.full(self.days, np.nan) for field in fields} for pk in ids
+        }
+
+        rows = model.objects.filter(
+            **{f"{key_field}__in": ids},
+            pricing_policy_id=pricing_policy_id,
+            date__gte=self.date_from,
+            date__lte=self.date_to,
+        ).values_list(key_field, "date", *fields)
+
+        for pk, day, *values in rows:
+            i = (day - self.date_from).days
+            for field, value in zip(fields, values):
+                if value is not None:
+                    result[pk][field][i] = value
+
+        if self.fill_forward:
+            previous = {
+                row[0]: row[2:]
+                for row in model.objects.filter(
+                    **{f"{key_field}__in": ids},
+                    pricing_policy_id=pricing_policy_id,
+                    date__lt=self.date_from,
+                )
+                .order_by(key_field, "-date")
+                .distinct(key_field)
+                .values_list(key_field, "date", *fields)
+            }
+            for pk, arrays in result.items():
+                previous_values = previous.get(pk) or [None] * len(fields)
+                for field, previous_value in zip(fields, previous_values):
+                    arrays[field] = fill_forward(arrays[field], previous_value)
+
+        return result
+
+    def _get_outside(self, model, key_field, pk, pricing_policy_id, day, field):
+        key = (model.__name__, pk, pricing_policy_id, day, field)
+        if key not in self._outside:
+            queryset = model.objects.filter(
+                **{key_field: pk}, pricing_policy_id=pricing_policy_id
+            )
+            if self.fill_forward:
+                queryset = queryset.filter(date__lte=day).order_by("-date")
+            else:
+                queryset = queryset.filter(date=day)
+
+            self._outside[key] = queryset.values_list(field, flat=True).first()
+
+        return self._outside[key]
+
+    def load_fx_rates(self, currency_ids: Iterable[int], pricing_policy_id: int):
+        ids = {
+            pk
+            for pk in currency_ids
+            if pk is not None and (pricing_policy_id, pk) not in self._fx_rates
+        }
+        if not ids or not self.days:
+            return
+
+        if self.default_currency_id in ids:
+            ids.discard(self.default_currency_id)
+            self._fx_rates[(pricing_policy_id, self.default_currency_id)] = np.ones(
+                self.days
+            )
+
+        if ids:
+            loaded = self._load(
+                CurrencyHistory, "currency_id", ids, pricing_policy_id, ("fx_rate",)
+            )
+            for pk, arrays in loaded.items():
+                self._fx_rates[(pricing_policy_id, pk)] = arrays["fx_rate"]
+
+    def load_prices(self, instrument_ids: Iterable[int], pricing_policy_id: int):
+        ids = {
+            pk
+            for pk in instrument_ids
+            if pk is not None and (pricing_policy_id, pk) not in self._prices
+        }
+        if not ids or not self.days:
+            return
+
+        loaded = self._load(
+            PriceHistory, "instrument_id", ids, pricing_policy_id, PRICE_FIELDS
+        )
+        for pk, arrays in loaded.items():
+            self._prices[(pricing_policy_id, pk)] = arrays
+
+    def get_fx_rate(
+        self, currency_id: int, pricing_policy_id: int, day: date
+    ) -> Optional[float]:
+        if currency_id == self.default_currency_id:
+            return 1
+
+        i = self.get_date_index(day)
+        if i is None:
+            return self._get_outside(
+                CurrencyHistory,
+                "currency_id",
+                currency_id,
+                pricing_policy_id,
+                day,
+                "fx_rate",
+            )
+
+        self.load_fx_rates([currency_id], pricing_policy_id)
+        value = self._fx_rates[(pricing_policy_id, currency_id)][i]
+
+        return None if np.isnan(value) else float(value)
+
+    def get_price(
+        self,
+        instrument_id: int,
+        pricing_policy_id: int,
+        day: date,
+        field: str = "principal_price",
+    ) -> Optional[float]:
+        i = self.get_date_index(day)
+        if i is None:
+            return self._get_outside(
+                PriceHistory, "instrument_id", instrument_id, pricing_policy_id, day, field
+            )
+
+        self.load_prices([instrument_id], pricing_policy_id)
+        value = self._prices[(pricing_policy_id, instrument_id)][field][i]
+
+        return None if np.isnan(value) else float(value)
+
+    def get_fx_rates(
+        self, currency_ids: List[int], pricing_policy_id: int, dates: List[date]
+    ) -> np.ndarray:
+        """FX rates array of shape (dates, currencies)"""
+        self.load_fx_rates(currency_ids, pricing_policy_id)
+
+        return self._get_series(
+            currency_ids,
+            dates,
+            lambda pk: self._fx_rates.get((pricing_policy_id, pk)),
+            lambda pk, day: self.get_fx_rate(pk, pricing_policy_id, day),
+        )
+
+    def get_prices(
+        self,
+        instrument_ids: List[int],
+        pricing_policy_id: int,
+        dates: List[date],
+        field: str = "principal_price",
+    ) -> np.ndarray:
+        """Prices array of shape (dates, instruments)"""
+        self.load_prices(instrument_ids, pricing_policy_id)
+
+        def get_array(pk):
+            arrays = self._prices.get((pricing_policy_id, pk))
+            return arrays[field] if arrays else None
+
+        return self._get_series(
+            instrument_ids,
+            dates,
+            get_array,
+            lambda pk, day: self.get_price(pk, pricing_policy_id, day, field),
+        )
+
+    def _get_series(self, ids, dates, get_array, get_value):
+        result = np.full((len(dates), len(ids)), np.nan)
+        index = [self.get_date_index(day) for day in dates]
+
+        if None not in index:
+            for j, pk in enumerate(ids):
+                array = get_array(pk)
+                if array is not None:
+                    result[:, j] = array[index]
+            return result
+
+        for i, day in enumerate(dates):
+            for j, pk in enumerate(ids):
+                value = get_value(pk, day) if pk is not None else None
+                if value is not None:
+                    result[i, j] = value
+
+        return result
+
@@ -0,0 +1,113 @@
+from datetime import date, timedelta
+
+from poms.common.common_base_test import BaseTestCase
+from poms.common.factories import AccrualEventFactory
+from poms.configuration.utils import get_default_configuration_code
+from poms.instruments.models import (
+    AccrualCalculationModel,
+    AccrualCalculationSchedule,
+    Instrument,
+    Periodicity,
+    PriceHistory,
+    PricingPolicy,
+)
+
+START = date(2020, 1, 15)
+DATES = [START + timedelta(days=i) for i in range(0, 5 * 365, 7)]
+
+
+class GetAccruedPricesTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.instrument = Instrument.objects.first()
+        self.instrument.maturity_date = date(2024, 7, 15)
+        self.instrument.save()
+
+    def create_schedule(self, accrual_start_date, model_id, periodicity_id, size=5):
+        return AccrualCalculationSchedule.objects.create(
+            instrument=self.instrument,
+            accrual_calculation_model_id=model_id,
+            periodicity_id=periodicity_id,
+            accrual_start_date=accrual_start_date,
+            first_payment_date=accrual_start_date + timedelta(days=181),
+            accrual_size=size,
+        )
+
+    def assert_same_as_get_accrued_price(self):
+        expected = [self.instrument.get_accrued_price(day) for day in DATES]
+
+        prices = self.instrument.get_accrued_prices(DATES)
+
+        for day, price, expected_price in zip(DATES, prices, expected):
+            self.assertAlmostEqual(price, expected_price, places=12, msg=str(day))
+
+    @BaseTestCase.cases(
+        ("act_360", AccrualCalculationModel.DAY_COUNT_ACT_360),
+        ("act_act_icma", AccrualCalculationModel.DAY_COUNT_ACT_ACT_ICMA),
+        ("act_365a", AccrualCalculationModel.DAY_COUNT_ACT_365A),
+        ("30_360_us", AccrualCalculationModel.DAY_COUNT_30_360_US),
+        ("nl_365", AccrualCalculationModel.DAY_COUNT_NL_365),
+    )
+    def test_schedules(self, model_id):
+        self.create_schedule(START, model_id, Periodicity.SEMI_ANNUALLY)
+        self.create_schedule(date(2022, 3, 1), model_id, Periodicity.QUARTERLY, 4)
+
+        self.assert_same_as_get_accrued_price()
+
+    def test_events_and_schedule(self):
+        self.create_schedule(
+            START,
+            AccrualCalculationModel.DAY_COUNT_ACT_365,
+            Periodicity.ANNUALLY,
+        )
+        for year in (2021, 2022):
+            AccrualEventFactory(
+                instrument=self.instrument,
+                start_date=date(year, 1, 1),
+                end_date=date(year, 12, 31),
+                accrual_calculation_model_id=AccrualCalculationModel.DAY_COUNT_ACT_360,
+            )
+
+        self.assert_same_as_get_accrued_price()
+
+    def test_calculate_prices_accrued_price(self):
+        self.create_schedule(
+            START, AccrualCalculationModel.DAY_COUNT_ACT_360, Periodicity.SEMI_ANNUALLY
+        )
+        pricing_policy = PricingPolicy.objects.create(
+            master_user=self.instrument.master_user,
+            owner=self.member,
+            user_code=self.random_string(),
+            configuration_code=get_default_configuration_code(),
+        )
+        PriceHistory.objects.create(
+            instrument=self.instrument,
+            pricing_policy=pricing_policy,
+            date=date(2021, 2, 1),
+            principal_price=100,
+            accrued_price=0,
+        )
+
+        self.instrument.calculate_prices_accrued_price(
+            date(2021, 1, 30), date(2021, 2, 2)
+        )
+
+        prices = PriceHistory.objects.filter(
+            instrument=self.instrument, pricing_policy=pricing_policy
+        ).order_by("date")
+        self.assertEqual(
+            [(price.date, price.accrued_price) for price in prices],
+            [
+                (day, self.instrument.get_accrued_price(day))
+                for day in (
+                    date(2021, 1, 30),
+                    date(2021, 1, 31),
+                    date(2021, 2, 1),
+                    date(2021, 2, 2),
+                )
+            ],
+        )
+        self.assertEqual(prices.get(date=date(2021, 2, 1)).principal_price, 100)
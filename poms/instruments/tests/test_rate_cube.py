@@ -0,0 +1,102 @@
+from datetime import date
+
+from poms.common.common_base_test import BaseTestCase
+from poms.configuration.utils import get_default_configuration_code
+from poms.currencies.models import CurrencyHistory
+from poms.instruments.models import PriceHistory, PricingPolicy
+from poms.instruments.rate_cube import RateCube
+
+
+class RateCubeTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.currency = self.eur
+        self.instrument = self.db_data.instruments["Apple"]
+        self.pricing_policy = PricingPolicy.objects.create(
+            master_user=self.master_user,
+            owner=self.member,
+            user_code=self.random_string(),
+            configuration_code=get_default_configuration_code(),
+        )
+        for day, fx_rate in ((1, 1.1), (3, 1.3), (10, 2.0)):
+            CurrencyHistory.objects.create(
+                currency=self.currency,
+                pricing_policy=self.pricing_policy,
+                date=date(2024, 1, day),
+                fx_rate=fx_rate,
+            )
+        for day, price in ((2, 20), (3, 30)):
+            PriceHistory.objects.create(
+                instrument=self.instrument,
+                pricing_policy=self.pricing_policy,
+                date=date(2024, 1, day),
+                principal_price=price,
+                nav=price * 10,
+            )
+
+    def create_cube(self, **kwargs):
+        return RateCube(
+            date(2024, 1, 2),
+            date(2024, 1, 5),
+            default_currency_id=self.usd.id,
+            **kwargs,
+        )
+
+    def test_rates_are_loaded_once(self):
+        cube = self.create_cube()
+
+        with self.assertNumQueries(1):
+            fx_rates = [
+                cube.get_fx_rate(self.currency.id, self.pricing_policy.id, date(2024, 1, day))
+                for day in range(2, 6)
+            ]
+
+        self.assertEqual(fx_rates, [None, 1.3, None, None])
+
+        with self.assertNumQueries(1):
+            navs = [
+                cube.get_price(self.instrument.id, self.pricing_policy.id, date(2024, 1, day), "nav")
+                for day in range(2, 6)
+            ]
+
+        self.assertEqual(navs, [200, 300, None, None])
+
+    def test_default_currency(self):
+        cube = self.create_cube()
+
+        with self.assertNumQueries(0):
+            fx_rate = cube.get_fx_rate(self.usd.id, self.pricing_policy.id, date(2024, 1, 2))
+
+        self.assertEqual(fx_rate, 1)
+
+    def test_fill_forward(self):
+        cube = self.create_cube(fill_forward=True)
+
+        fx_rates = cube.get_fx_rates(
+            [self.currency.id, self.usd.id],
+            self.pricing_policy.id,
+            [date(2024, 1, day) for day in range(2, 6)],
+        )
+
+        self.assertEqual(fx_rates[:, 0].tolist(), [1.1, 1.3, 1.3, 1.3])
+        self.assertEqual(fx_rates[:, 1].tolist(), [1, 1, 1, 1])
+
+    def test_outside_of_range(self):
+        cube = self.create_cube()
+
+        self.assertEqual(
+            cube.get_fx_rate(self.currency.id, self.pricing_policy.id, date(2024, 1, 10)),
+            2.0,
+        )
+        self.assertIsNone(
+            cube.get_fx_rate(self.currency.id, self.pricing_policy.id, date(2024, 1, 11))
+        )
+        self.assertEqual(
+            self.create_cube(fill_forward=True).get_fx_rate(
+                self.currency.id, self.pricing_policy.id, date(2024, 1, 11)
+            ),
+            2.0,
+        )
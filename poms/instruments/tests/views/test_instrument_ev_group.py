@@ -39,3 +39,35 @@ class InstrumentViewSetTest(BaseTestCase):
         self.assertEqual(len(response_json["results"]), 3)
         names = {group["group_name"] for group in response_json["results"]}
         self.assertEqual(names, self.expected_names)
+
+    def test__post_ev_group_items_count(self):
+        post_data = {
+            "groups_values": [],
+            "page": 1,
+            "page_size": 60,
+            "is_enabled": "any",
+            "groups_types": ["country"],
+            "ev_options": {"entity_filters": ["disabled", "inactive", "active"]},
+            "filter_settings": [],
+            "global_table_search": "",
+        }
+        response = self.client.post(self.url, data=post_data, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+
+        counts = {
+            group["group_name"]: group["items_count"]
+            for group in response.json()["results"]
+        }
+        for name in self.expected_names:
+            expected = Instrument.objects.filter(
+                master_user=self.master_user,
+                is_deleted=False,
+                country__short_name=name,
+            )
+            if name is None:
+                expected = Instrument.objects.filter(
+                    master_user=self.master_user,
+                    is_deleted=False,
+                    country__isnull=True,
+                )
+            self.assertEqual(counts[name], expected.count())
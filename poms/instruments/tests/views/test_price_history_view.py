@@ -1,4 +1,5 @@
 from copy import deepcopy
+from datetime import date
 
 from poms.common.common_base_test import BaseTestCase
 from poms.instruments.models import Instrument, PriceHistory, PricingPolicy
@@ -377,3 +378,35 @@ class PriceHistoryViewSetTest(BaseTestCase):
 
         price_history = PriceHistory.objects.get(pk=response_json["id"])
         self.assertEqual(price_history.accrued_price, 0.0)
+
+    def test__ev_item_cursor_pagination(self):
+        for day in (3, 1, 2, 2, 5):
+            price = self.create_pricing_history()
+            price.date = date(2024, 1, day)
+            price.save()
+
+        expected = list(
+            PriceHistory.objects.order_by("-date", "id").values_list("id", flat=True)
+        )
+
+        ids = []
+        data = {
+            "pagination_mode": "cursor",
+            "ordering": "-date",
+            "page_size": 2,
+            "count_mode": "exact",
+        }
+        while True:
+            response = self.client.post(
+                path=f"{self.url}ev-item/", format="json", data=data
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+
+            response_json = response.json()
+            self.assertEqual(response_json["count"], len(expected))
+            ids.extend(item["id"] for item in response_json["results"])
+            if not response_json["next_cursor"]:
+                break
+            data["cursor"] = response_json["next_cursor"]
+
+        self.assertEqual(ids, expected)
@@ -119,6 +119,7 @@ from poms.instruments.tasks import (
 from poms.obj_attrs.models import GenericAttributeType
 from poms.obj_attrs.utils import get_attributes_prefetch
 from poms.obj_attrs.views import GenericAttributeTypeViewSet, GenericClassifierViewSet
+from poms.reports.result_cache import report_data_changed
 from poms.reports.sql_builders.helpers import dictfetchall
 from poms.strategies.models import Strategy3
 from poms.transactions.models import NotificationClass, Transaction
@@ -126,6 +127,7 @@ from poms.transactions.serializers import TransactionTypeProcessSerializer
 from poms.users.filters import OwnerByMasterUserFilter
 from poms.users.models import EcosystemDefault, MasterUser
 from poms.users.permissions import SuperUserOrReadOnly
+from poms.widgets.snapshots import history_changed
 from poms_app import settings
 
 _l = logging.getLogger("poms.instruments")
@@ -1688,6 +1690,10 @@ class PriceHistoryViewSet(AbstractModelViewSet):
             unique_fields=["instrument", "pricing_policy", "date"],
             update_fields=["principal_price", "accrued_price"],
         )
+        report_data_changed()
+        history_changed(
+            PriceHistory, [(price.instrument_id, price.date) for price in valid_data]
+        )
 
         if errors:
             _l.info(f"PriceHistoryViewSet.bulk_create.errors {errors}")
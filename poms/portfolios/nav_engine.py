@@ -0,0 +1,391 @@
+"""
+NAV of portfolio register for the range of dates.
+
+Result is the same as the sum of market values of Balance Report built for
+every day (see calculate_simple_balance_report), but transactions, prices and
+fx rates are loaded once: position sizes and cash of every day are cumulative
+sums of transaction deltas, market values are calculated by numpy for all
+days at once.
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from django.db import connection
+
+import numpy as np
+
+from poms.instruments.models import Instrument
+from poms.instruments.rate_cube import RateCube
+from poms.portfolios.models import PortfolioRegister, PortfolioRegisterRecord
+from poms.transactions.models import Transaction, TransactionClass
+from poms.users.models import EcosystemDefault
+
+_l = logging.getLogger("poms.portfolios")
+
+# Balance Report counts positions of these classes only
+POSITION_CLASSES = {
+    TransactionClass.BUY,
+    TransactionClass.SELL,
+    TransactionClass.INITIAL_POSITION,
+}
+# Balance Report counts these classes on their own date only
+INITIAL_CLASSES = {
+    TransactionClass.INITIAL_POSITION,
+    TransactionClass.INITIAL_CASH,
+}
+CASH_FLOW_CLASSES = [
+    TransactionClass.CASH_INFLOW,
+    TransactionClass.DISTRIBUTION,
+    TransactionClass.INJECTION,
+    TransactionClass.CASH_OUTFLOW,
+]
+# market value of such instruments depends on PL cost price
+NOT_SUPPORTED_INSTRUMENT_CLASSES = {5}
+
+# same sources as in the Balance Report query
+# language=PostgreSQL
+TRANSACTIONS_QUERY = """
+    select transaction_class_id, instrument_id, settlement_currency_id,
+           accounting_date, cash_date, position_size_with_sign, cash_consideration
+    from pl_transactions_with_ttype
+    where master_user_id = %(master_user_id)s and portfolio_id = %(portfolio_id)s
+
+    union all
+
+    select transaction_class_id, instrument_id, settlement_currency_id,
+           accounting_date, cash_date, (0) as position_size_with_sign, cash_consideration
+    from pl_cash_fx_trades_transactions_with_ttype
+    where master_user_id = %(master_user_id)s and portfolio_id = %(portfolio_id)s
+
+    union all
+
+    select transaction_class_id, instrument_id, settlement_currency_id,
+           accounting_date, cash_date, position_size_with_sign, cash_consideration
+    from pl_cash_fx_variations_transactions_with_ttype
+    where master_user_id = %(master_user_id)s and portfolio_id = %(portfolio_id)s
+
+    union all
+
+    select transaction_class_id, instrument_id, settlement_currency_id,
+           accounting_date, cash_date, position_size_with_sign, cash_consideration
+    from pl_cash_transaction_pl_transactions_with_ttype
+    where master_user_id = %(master_user_id)s and portfolio_id = %(portfolio_id)s
+"""
+
+
+def get_portfolio_transactions(master_user_id: int, portfolio_id: int) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TRANSACTIONS_QUERY,
+            {"master_user_id": master_user_id, "portfolio_id": portfolio_id},
+        )
+        return cursor.fetchall()
+
+
+def get_balance_transactions(portfolio_register: PortfolioRegister) -> list:
+    return get_portfolio_transactions(
+        portfolio_register.master_user_id, portfolio_register.portfolio_id
+    )
+
+
+def get_transaction_deltas(transaction_class_id, accounting_date, cash_date):
+    """
+    Changes of (position, cash) made by transaction as list of
+    (date, position multiplier, cash multiplier).
+
+    Balance Report on date D puts transaction to interim account:
+    - accounting_date <= D < cash_date: position and cash
+    - cash_date <= D < accounting_date: no position and negative cash
+    otherwise position and cash are counted from min(accounting, cash) date.
+    Initial positions and cash are counted on their date only.
+    """
+    if accounting_date <= cash_date:
+        deltas = [(accounting_date, 1, 1)]
+    else:
+        deltas = [(cash_date, 0, -1), (accounting_date, 1, 2)]
+
+    if transaction_class_id in INITIAL_CLASSES:
+        day = min(accounting_date, cash_date)
+        position, cash = deltas[0][1:]
+        deltas = [(day, position, cash), (day + timedelta(days=1), -position, -cash)]
+
+    return deltas
+
+
+def get_balance_series(transactions: list, dates: List[date]):
+    """
+    Position size by instrument and cash by settlement currency of every day,
+    dates must be sorted
+
+    Returns (instruments ids, positions, currencies ids, cash), where positions
+    and cash are arrays of shape (days, instruments) and (days, currencies)
+    """
+    days = len(dates)
+
+    instrument_ids = sorted(
+        {
+            t[1]
+            for t in transactions
+            if t[0] in POSITION_CLASSES and t[1] is not None and t[5]
+        }
+    )
+    currency_ids = sorted({t[2] for t in transactions if t[2] is not None})
+    instrument_index = {pk: i for i, pk in enumerate(instrument_ids)}
+    currency_index = {pk: i for i, pk in enumerate(currency_ids)}
+
+    positions = np.zeros((days, len(instrument_ids)))
+    cash = np.zeros((days, len(currency_ids)))
+
+    for (
+        transaction_class_id,
+        instrument_id,
+        settlement_currency_id,
+        accounting_date,
+        cash_date,
+        position_size,
+        cash_consideration,
+    ) in transactions:
+        if accounting_date is None or cash_date is None:
+            continue
+
+        instrument = instrument_index.get(instrument_id)
+        if transaction_class_id not in POSITION_CLASSES:
+            instrument = None
+        currency = currency_index.get(settlement_currency_id)
+
+        for day, position_k, cash_k in get_transaction_deltas(
+            transaction_class_id, accounting_date, cash_date
+        ):
+            # first of the dates affected by the change, changes before
+            # the range are the opening balance of the first date
+            i = bisect_left(dates, day)
+            if i >= days:
+                continue
+            if instrument is not None and position_size:
+                positions[i, instrument] += position_k * position_size
+            if currency is not None and cash_consideration:
+                cash[i, currency] += cash_k * cash_consideration
+
+    return (
+        instrument_ids,
+        np.cumsum(positions, axis=0),
+        currency_ids,
+        np.cumsum(cash, axis=0),
+    )
+
+
+def get_default_rate_cube(master_user_id: int, dates: List[date]) -> RateCube:
+    return RateCube(
+        dates[0],
+        dates[-1],
+        default_currency_id=EcosystemDefault.cache.get_cache(
+            master_user_pk=master_user_id
+        ).currency_id,
+    )
+
+
+def get_rate_cube(portfolio_register: PortfolioRegister, dates: List[date]) -> RateCube:
+    return get_default_rate_cube(portfolio_register.master_user_id, dates)
+
+
+class MarketValues(NamedTuple):
+    """
+    Positions and cash of every day with their market values in report
+    currency, arrays of shape (days, instruments) and (days, currencies).
+    Market value is NaN if price or fx rate is missing.
+    """
+
+    instrument_ids: List[int]
+    positions: np.ndarray
+    positions_value: np.ndarray
+    currency_ids: List[int]
+    cash: np.ndarray
+    cash_value: np.ndarray
+    # Balance Report fails with division by zero on such days
+    failed_days: np.ndarray
+
+
+def calculate_market_values(
+    transactions: list,
+    dates: List[date],
+    report_currency_id: int,
+    pricing_policy_id: int,
+    rate_cube: RateCube,
+) -> Optional[MarketValues]:
+    """
+    Market values of positions and cash of every day, same as market values
+    of Balance Report items. Returns None if there are positions which can't
+    be valued without PL calculation.
+    """
+    instrument_ids, positions, currency_ids, cash = get_balance_series(
+        transactions, dates
+    )
+
+    instruments = {
+        item[0]: item
+        for item in Instrument.objects.filter(id__in=instrument_ids).values_list(
+            "id",
+            "instrument_type__instrument_class_id",
+            "price_multiplier",
+            "accrued_multiplier",
+            "pricing_currency_id",
+            "accrued_currency_id",
+        )
+    }
+    if len(instruments) != len(instrument_ids):
+        return None
+    instruments = [instruments[pk] for pk in instrument_ids]
+    if any(item[1] in NOT_SUPPORTED_INSTRUMENT_CLASSES for item in instruments):
+        return None
+
+    def get_fx_rates(ids):
+        return rate_cube.get_fx_rates(ids, pricing_policy_id, dates)
+
+    report_fx_rate = get_fx_rates([report_currency_id])
+    failed_days = report_fx_rate[:, 0] == 0
+    report_fx_rate[failed_days] = np.nan
+
+    principal = rate_cube.get_prices(
+        instrument_ids, pricing_policy_id, dates, "principal_price"
+    )
+    accrued = rate_cube.get_prices(
+        instrument_ids, pricing_policy_id, dates, "accrued_price"
+    )
+    price_multiplier = np.array([item[2] for item in instruments], dtype=float)
+    accrued_multiplier = np.array([item[3] for item in instruments], dtype=float)
+    pricing_fx_rate = get_fx_rates([item[4] for item in instruments])
+    accrued_fx_rate = get_fx_rates([item[5] for item in instruments])
+
+    positions_value = (
+        positions * principal * price_multiplier * pricing_fx_rate
+        + positions * accrued * accrued_fx_rate * accrued_multiplier
+    ) / report_fx_rate
+    # Balance Report has no items for closed positions
+    positions_value[positions == 0] = 0
+
+    cash_value = cash * get_fx_rates(currency_ids) / report_fx_rate
+
+    return MarketValues(
+        instrument_ids,
+        positions,
+        positions_value,
+        currency_ids,
+        cash,
+        cash_value,
+        failed_days,
+    )
+
+
+def calculate_navs(
+    portfolio_register: PortfolioRegister,
+    dates: List[date],
+    rate_cube: Optional[RateCube] = None,
+) -> Optional[List[Optional[float]]]:
+    """
+    NAV of portfolio register in the currency of linked instrument for
+    every day, None for the day if NAV can't be calculated.
+    Returns None if portfolio has positions which can't be valued without
+    PL calculation, the Balance Report has to be used in that case.
+    """
+    values = calculate_market_values(
+        get_balance_transactions(portfolio_register),
+        dates,
+        portfolio_register.linked_instrument.pricing_currency_id,
+        portfolio_register.valuation_pricing_policy_id,
+        rate_cube or get_rate_cube(portfolio_register, dates),
+    )
+    if values is None:
+        return None
+
+    # items without market value are skipped in NAV
+    navs = np.nansum(values.positions_value, axis=1) + np.nansum(
+        values.cash_value, axis=1
+    )
+
+    return [
+        None if failed else float(nav)
+        for nav, failed in zip(navs, values.failed_days)
+    ]
+
+
+def calculate_cash_flows(
+    portfolio_register: PortfolioRegister,
+    dates: List[date],
+    rate_cube: Optional[RateCube] = None,
+) -> Dict[date, float]:
+    """
+    Cash flow of portfolio register in the currency of linked instrument,
+    same as calculate_cash_flow for every day.
+    Days with missing fx rates are absent in result.
+    """
+    rate_cube = rate_cube or get_rate_cube(portfolio_register, dates)
+    pricing_policy_id = portfolio_register.valuation_pricing_policy_id
+    pricing_currency_id = portfolio_register.linked_instrument.pricing_currency_id
+
+    transactions = Transaction.objects.filter(
+        master_user_id=portfolio_register.master_user_id,
+        portfolio_id=portfolio_register.portfolio_id,
+        accounting_date__gte=dates[0],
+        accounting_date__lte=dates[-1],
+        transaction_class_id__in=CASH_FLOW_CLASSES,
+    ).values_list(
+        "accounting_date",
+        "transaction_currency_id",
+        "cash_consideration",
+        "reference_fx_rate",
+    )
+
+    cash_flows = {day: 0 for day in dates}
+
+    for day, currency_id, cash_consideration, reference_fx_rate in transactions:
+        if day not in cash_flows:
+            continue
+
+        if currency_id == pricing_currency_id:
+            fx_rate = 1
+        else:
+            try:
+                fx_rate = rate_cube.get_fx_rate(
+                    currency_id, pricing_policy_id, day
+                ) / rate_cube.get_fx_rate(pricing_currency_id, pricing_policy_id, day)
+            except (TypeError, ZeroDivisionError):
+                _l.error(
+                    f"calculate_cash_flows {portfolio_register} day {day} "
+                    f"no fx_rate for currency {currency_id}"
+                )
+                del cash_flows[day]
+                continue
+
+        cash_flows[day] = cash_flows[day] + (
+            cash_consideration * reference_fx_rate * fx_rate
+        )
+
+    return cash_flows
+
+
+def get_rolling_shares(
+    portfolio_register: PortfolioRegister, dates: List[date]
+) -> List[Optional[float]]:
+    """
+    Rolling shares of the latest register record for every day,
+    None if there is no record yet
+    """
+    records = list(
+        PortfolioRegisterRecord.objects.filter(
+            instrument_id=portfolio_register.linked_instrument_id,
+            transaction_date__lte=dates[-1],
+        )
+        .order_by("transaction_date", "transaction_code")
+        .values_list("transaction_date", "rolling_shares_of_the_day")
+    )
+    records_dates = [record[0] for record in records]
+
+    result = []
+    for day in dates:
+        i = bisect_right(records_dates, day)
+        result.append(records[i - 1][1] if i else None)
+
+    return result
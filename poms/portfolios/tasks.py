@@ -1,6 +1,7 @@
 import logging
 import traceback
 from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 
 from django.conf import settings
 from django.views.generic.dates import timezone_today
@@ -11,6 +12,7 @@ from poms.celery_tasks import finmars_task
 from poms.celery_tasks.models import CeleryTask
 from poms.common.exceptions import FinmarsBaseException
 from poms.common.utils import (
+    date_now,
     get_last_bdays_of_months_between_two_dates,
     get_last_business_day,
     get_last_business_day_in_previous_quarter,
@@ -21,6 +23,7 @@ from poms.common.utils import (
 )
 from poms.currencies.models import Currency, CurrencyHistory
 from poms.instruments.models import CostMethod, PricingPolicy
+from poms.instruments.rate_cube import RateCube
 from poms.portfolios.models import (
     Portfolio,
     PortfolioHistory,
@@ -29,12 +32,19 @@ from poms.portfolios.models import (
     PortfolioRegister,
     PortfolioRegisterRecord,
 )
+from poms.portfolios.nav_engine import (
+    calculate_cash_flows,
+    calculate_navs,
+    get_rolling_shares,
+)
 from poms.portfolios.utils import get_price_calculation_type, update_price_histories
 from poms.reports.common import Report
+from poms.reports.result_cache import report_data_changed
 from poms.reports.sql_builders.balance import BalanceReportBuilderSql
 from poms.system_messages.handlers import send_system_message
 from poms.transactions.models import Transaction, TransactionClass
 from poms.users.models import EcosystemDefault, Member
+from poms.widgets.snapshots import history_changed
 
 _l = logging.getLogger("poms.portfolios")
 celery_logger = get_task_logger(__name__)
@@ -140,6 +150,88 @@ def calculate_cash_flow(master_user, date, pricing_policy, portfolio_register):
     return cash_flow
 
 
+def calculate_register_price_history_range(
+    portfolio_register: PortfolioRegister,
+    dates: list,
+    rate_cube: Optional[RateCube] = None,
+) -> Optional[int]:
+    """
+    Calculate NAV, cash flow and principal price of the register linked instrument
+    for all dates at once and save them in Price History.
+    Returns number of calculated days or None if register has to be calculated
+    day by day with Balance Report
+    """
+    from poms.instruments.models import PriceHistory
+
+    log = "calculate_register_price_history_range"
+
+    navs = calculate_navs(portfolio_register, dates, rate_cube)
+    if navs is None:
+        return None
+
+    cash_flows = calculate_cash_flows(portfolio_register, dates, rate_cube)
+    rolling_shares = get_rolling_shares(portfolio_register, dates)
+
+    count = 0
+    price_histories = []
+    for day, nav, shares in zip(dates, navs, rolling_shares):
+        if shares is None:
+            # no register record yet
+            continue
+
+        price_history = PriceHistory(
+            instrument=portfolio_register.linked_instrument,
+            date=day,
+            pricing_policy=portfolio_register.valuation_pricing_policy,
+            procedure_modified_datetime=date_now(),
+        )
+        price_histories.append(price_history)
+
+        if nav is None:
+            price_history.error_message = (
+                f"{log} {portfolio_register} day {day} nav calculation "
+                f"ended in error: report currency fx_rate is 0"
+            )
+        elif day not in cash_flows:
+            price_history.error_message = (
+                f"{log} {portfolio_register} day {day} cash flow calculation "
+                f"ended in error: no fx_rate in currency history"
+            )
+        elif not shares:
+            price_history.error_message = (
+                f"{log} {portfolio_register} day {day} principal price calculation "
+                f"ended in error: no rolling shares of the day"
+            )
+        else:
+            price_history.nav = nav
+            price_history.cash_flow = cash_flows[day]
+            price_history.principal_price = nav / shares
+            count = count + 1
+
+        if price_history.error_message:
+            _l.error(price_history.error_message)
+
+    PriceHistory.objects.bulk_create(
+        price_histories,
+        update_conflicts=True,
+        unique_fields=["instrument", "pricing_policy", "date"],
+        update_fields=[
+            "nav",
+            "cash_flow",
+            "principal_price",
+            "error_message",
+            "procedure_modified_datetime",
+            "modified_at",
+        ],
+    )
+    report_data_changed()
+    history_changed(
+        PriceHistory, [(price.instrument_id, price.date) for price in price_histories]
+    )
+
+    return count
+
+
 @finmars_task(name="portfolios.calculate_portfolio_register_record", bind=True)
 def calculate_portfolio_register_record(self, task_id, *args, **kwargs):
     """
@@ -659,6 +751,18 @@ def calculate_portfolio_register_price_history(self, task_id: int, *args, **kwar
 
         total = sum(len(item["dates"]) for item in result.values())
 
+        # fx rates and prices of all registers are loaded once
+        all_dates = [day for item in result.values() for day in item["dates"]]
+        rate_cube = None
+        if all_dates:
+            rate_cube = RateCube(
+                min(all_dates),
+                max(all_dates),
+                default_currency_id=EcosystemDefault.cache.get_cache(
+                    master_user_pk=master_user.pk
+                ).currency_id,
+            )
+
         for item in result.values():
             portfolio_register = portfolio_register_map[
                 item["portfolio_register_object"]["user_code"]
@@ -675,6 +779,27 @@ def calculate_portfolio_register_price_history(self, task_id: int, *args, **kwar
                 pricing_policy=portfolio_register.valuation_pricing_policy,
             ).delete()
 
+            if settings.PORTFOLIO_REGISTER_NAV_ENGINE and item["dates"]:
+                calculated = calculate_register_price_history_range(
+                    portfolio_register, item["dates"], rate_cube
+                )
+                if calculated is not None:
+                    count = count + calculated
+                    task.update_progress(
+                        {
+                            "current": count,
+                            "percent": round(count / (total / 100)),
+                            "total": total,
+                            "description": f"Calculated {portfolio_register}",
+                        }
+                    )
+                    continue
+
+                _l.info(
+                    f"{log} {portfolio_register} can't be calculated for all dates "
+                    f"at once, calculate day by day"
+                )
+
             for day in item["dates"]:
                 pr_record = (
                     PortfolioRegisterRecord.objects.filter(
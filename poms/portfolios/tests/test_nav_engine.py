@@ -0,0 +1,150 @@
+from datetime import date, timedelta
+
+from django.test import SimpleTestCase
+
+from poms.common.common_base_test import BIG, BaseTestCase
+from poms.configuration.utils import get_default_configuration_code
+from poms.instruments.models import PriceHistory, PricingPolicy
+from poms.portfolios.models import PortfolioRegister
+from poms.portfolios.nav_engine import calculate_navs, get_balance_series
+from poms.portfolios.tasks import calculate_simple_balance_report
+from poms.transactions.models import TransactionClass
+
+DATES = [date(2024, 1, day) for day in range(1, 8)]
+INSTRUMENT = 10
+USD = 1
+EUR = 2
+
+
+def transaction(
+    transaction_class_id, accounting_date, cash_date, position_size, cash, currency=USD
+):
+    return (
+        transaction_class_id,
+        INSTRUMENT,
+        currency,
+        accounting_date,
+        cash_date,
+        position_size,
+        cash,
+    )
+
+
+class GetBalanceSeriesTest(SimpleTestCase):
+    def test_positions_and_cash(self):
+        transactions = [
+            # before the range
+            transaction(TransactionClass.BUY, date(2023, 12, 1), date(2023, 12, 1), 5, -50),
+            transaction(TransactionClass.BUY, date(2024, 1, 3), date(2024, 1, 3), 10, -100),
+            transaction(TransactionClass.SELL, date(2024, 1, 5), date(2024, 1, 5), -15, 160),
+            transaction(TransactionClass.CASH_INFLOW, date(2024, 1, 2), date(2024, 1, 2), 0, 30, EUR),
+            # after the range
+            transaction(TransactionClass.BUY, date(2024, 2, 1), date(2024, 2, 1), 1, -1),
+        ]
+
+        instrument_ids, positions, currency_ids, cash = get_balance_series(
+            transactions, DATES
+        )
+
+        self.assertEqual(instrument_ids, [INSTRUMENT])
+        self.assertEqual(currency_ids, [USD, EUR])
+        self.assertEqual(positions[:, 0].tolist(), [5, 5, 15, 15, 0, 0, 0])
+        self.assertEqual(cash[:, 0].tolist(), [-50, -50, -150, -150, 10, 10, 10])
+        self.assertEqual(cash[:, 1].tolist(), [0, 30, 30, 30, 30, 30, 30])
+
+    def test_interim_account(self):
+        transactions = [
+            # position is booked before cash settlement
+            transaction(TransactionClass.BUY, date(2024, 1, 2), date(2024, 1, 4), 10, -100),
+            # cash is paid before the position is booked
+            transaction(TransactionClass.BUY, date(2024, 1, 6), date(2024, 1, 5), 1, -10),
+        ]
+
+        _, positions, _, cash = get_balance_series(transactions, DATES)
+
+        self.assertEqual(positions[:, 0].tolist(), [0, 10, 10, 10, 10, 11, 11])
+        self.assertEqual(cash[:, 0].tolist(), [0, -100, -100, -100, -90, -110, -110])
+
+    def test_initial_position_counts_on_its_date_only(self):
+        transactions = [
+            transaction(
+                TransactionClass.INITIAL_POSITION, date(2024, 1, 3), date(2024, 1, 3), 7, 0
+            ),
+            transaction(
+                TransactionClass.INITIAL_CASH, date(2024, 1, 7), date(2024, 1, 7), 0, 40
+            ),
+        ]
+
+        _, positions, _, cash = get_balance_series(transactions, DATES)
+
+        self.assertEqual(positions[:, 0].tolist(), [0, 0, 7, 0, 0, 0, 0])
+        self.assertEqual(cash[:, 0].tolist(), [0, 0, 0, 0, 0, 0, 40])
+
+    def test_only_trades_make_positions(self):
+        transactions = [
+            transaction(TransactionClass.FX_TRADE, date(2024, 1, 1), date(2024, 1, 1), 3, 0),
+        ]
+
+        instrument_ids, positions, _, _ = get_balance_series(transactions, DATES)
+
+        self.assertEqual(instrument_ids, [])
+        self.assertEqual(positions.shape, (len(DATES), 0))
+
+
+class CalculateNavsTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.portfolio = self.db_data.portfolios[BIG]
+        self.instrument = self.db_data.instruments["Apple"]
+        self.pricing_policy = PricingPolicy.objects.create(
+            master_user=self.master_user,
+            owner=self.member,
+            user_code=self.random_string(),
+            configuration_code=get_default_configuration_code(),
+        )
+        self.portfolio_register = PortfolioRegister.objects.create(
+            master_user=self.master_user,
+            owner=self.member,
+            portfolio=self.portfolio,
+            linked_instrument=self.db_data.instruments["Tesla B."],
+            valuation_pricing_policy=self.pricing_policy,
+            valuation_currency=self.db_data.usd,
+        )
+        self.dates = [date(2024, 1, 1) + timedelta(days=i) for i in range(5)]
+
+    def buy(self, day, position_size, cash_consideration, cash_date=None):
+        _, transaction = self.db_data.cash_in_transaction(self.portfolio, day=day)
+        transaction.cash_date = cash_date or day
+        transaction.transaction_class_id = TransactionClass.BUY
+        transaction.instrument = self.instrument
+        transaction.position_size_with_sign = position_size
+        transaction.cash_consideration = cash_consideration
+        transaction.save()
+
+    def test_same_nav_as_balance_report(self):
+        self.db_data.cash_in_transaction(self.portfolio, amount=1000, day=self.dates[0])
+        self.buy(self.dates[1], 10, -300)
+        self.buy(self.dates[3], -4, 150)
+        self.buy(self.dates[2], 1, -40, cash_date=self.dates[4])
+        self.buy(self.dates[3], 2, -70, cash_date=self.dates[1])
+        for i, day in enumerate(self.dates[1:]):
+            PriceHistory.objects.create(
+                instrument=self.instrument,
+                pricing_policy=self.pricing_policy,
+                date=day,
+                principal_price=30 + i,
+            )
+
+        navs = calculate_navs(self.portfolio_register, self.dates)
+
+        for day, nav in zip(self.dates, navs):
+            report = calculate_simple_balance_report(
+                day, self.portfolio_register, self.member
+            )
+            expected = sum(
+                item["market_value"] for item in report.items if item["market_value"]
+            )
+            self.assertAlmostEqual(nav, expected, msg=str(day))
@@ -2,6 +2,8 @@ from typing import List
 
 from poms.instruments.models import PriceHistory
 from poms.portfolios.models import PortfolioRegisterRecord
+from poms.reports.result_cache import report_data_changed
+from poms.widgets.snapshots import history_changed
 
 
 def get_price_calculation_type(transaction_class, transaction) -> str:
@@ -28,3 +30,5 @@ def update_price_histories(prices: List[PriceHistory], **kwargs):
     Update PriceHistory objects with given data
     """
     PriceHistory.objects.filter(id__in=[price.id for price in prices]).update(**kwargs)
+    report_data_changed()
+    history_changed(PriceHistory, [(price.instrument_id, price.date) for price in prices])
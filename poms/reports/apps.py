@@ -15,6 +15,8 @@ class ReportsConfig(AppConfig):
     verbose_name = gettext_lazy("Reports")
 
     def ready(self):
+        from poms.reports import signals  # noqa: F401
+
         post_migrate.connect(self.create_views_for_sql_reports, sender=self)
 
     def create_views_for_sql_reports(
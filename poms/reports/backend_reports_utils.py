@@ -1,13 +1,52 @@
 import itertools
 import logging
+from typing import Any, Callable, Dict
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 
+import numpy as np
+
 from poms.obj_attrs.models import GenericAttributeType
+from poms.reports.report_frame import MISSING, ReportFrame, is_number
 
 _l = logging.getLogger("poms.reports")
 
+# flatten_and_convert_item sets instrument fields of not instrument items
+ITEM_TYPE_INSTRUMENT = 1
+ITEM_TYPE_CASH = 2
+CASH_ITEM_NAME = "Cash & Equivalents"
+ITEM_TYPE_NAMES = {3: "FX Variations", 4: "FX Trades", 5: "Other", 6: "Mismatch"}
+ITEM_TYPE_NAME_ROOTS = {
+    "instrument.country",
+    "instrument.instrument_type",
+    "currency.country",
+}
+ITEM_TYPE_NAME_FIELDS = {"name", "user_code", "short_name"}
+
+NUMERIC_FILTER_TYPES = {
+    "greater": np.greater,
+    "greater_equal": np.greater_equal,
+    "less": np.less,
+    "less_equal": np.less_equal,
+    "from_to": None,
+    "out_of_range": None,
+}
+
+# weight keys of the subtotal formulas
+SUBTOTAL_WEIGHTED_KEYS = {
+    2: "market_value",
+    3: "market_value_percent",
+    4: "exposure",
+    5: "exposure_percent",
+}
+SUBTOTAL_WEIGHTED_AVERAGE_KEYS = {
+    6: "market_value",
+    7: "market_value_percent",
+    8: "exposure",
+    9: "exposure_percent",
+}
+
 
 def almost_equal_floats(
     a: float, b: float, round_digits=settings.ROUND_NDIGITS
@@ -69,55 +108,52 @@ class BackendReportHelperService:
         return result_group
 
     def get_unique_groups(self, items, group_type, columns):
-        seen_group_identifiers = set()
-        result_groups = []
+        return self.get_frame_unique_groups(ReportFrame(items), group_type, columns)
 
-        for item in items:
-            result_group = self.get_result_group(item, group_type)
-            identifier = result_group["___group_identifier"]
+    def get_frame_unique_groups(self, frame: ReportFrame, group_type, columns):
+        identifier_key = self.convert_name_key_to_user_code_key(group_type["key"])
+        identifier_column = frame.column(identifier_key)
+        codes = frame.codes(identifier_key)
 
-            if identifier not in seen_group_identifiers:
-                seen_group_identifiers.add(identifier)
-                result_groups.append(result_group)
+        # distinct values in order of the first item with them
+        unique_codes, first_positions = np.unique(codes, return_index=True)
+        order = np.argsort(first_positions)
 
-        # _l.debug('result_groups %s' % result_groups)
-        # _l.debug('items %s' % items)
+        # group items are the ones with value equal to the group identifier,
+        # which is str of the value or None
+        codes_by_identifier = {}
+        for code in unique_codes:
+            value = identifier_column.get_unique(code)
+            if value is None or isinstance(value, str):
+                codes_by_identifier.setdefault(value, []).append(code)
 
-        identifier_key = self.convert_name_key_to_user_code_key(group_type["key"])
+        seen_group_identifiers = set()
+        result_groups = []
 
-        for result_group in result_groups:
-            group_items = [
-                item
-                for item in items
-                if item.get(identifier_key) == result_group["___group_identifier"]
-            ]
+        for position in first_positions[order]:
+            result_group = self.get_result_group(frame.item(position), group_type)
+            identifier = result_group["___group_identifier"]
+
+            if identifier in seen_group_identifiers:
+                continue
+            seen_group_identifiers.add(identifier)
 
-            # _l.debug('group_items %s' % group_items)
+            group_codes = codes_by_identifier.get(identifier, [])
+            group_frame = frame.take(np.isin(codes, group_codes))
 
-            result_group["subtotal"] = BackendReportSubtotalService.calculate(
-                group_items, columns
+            result_group["subtotal"] = BackendReportSubtotalService.calculate_frame(
+                group_frame, columns
             )
 
-            if result_group["subtotal"].get("market_value"):
-                try:
-                    total_value = (
-                        sum(map(lambda item: item["market_value_percent"], group_items))
-                        or None
-                    )
-                    # None is to raise an exception if sum is 0
-                    result_group["subtotal"]["market_value_percent"] = total_value
-                except Exception as e:
-                    result_group["subtotal"]["market_value_percent"] = "No Data"
-
-            if result_group["subtotal"].get("exposure"):
-                try:
-                    total_value = (
-                        sum(map(lambda item: item["exposure_percent"], group_items))
-                        or None
+            for key in ("market_value", "exposure"):
+                if result_group["subtotal"].get(key):
+                    result_group["subtotal"][f"{key}_percent"] = (
+                        BackendReportSubtotalService.get_percent_total(
+                            group_frame, f"{key}_percent"
+                        )
                     )
-                    result_group["subtotal"]["exposure_percent"] = total_value
-                except Exception as e:
-                    result_group["subtotal"]["exposure_percent"] = "No Data"
+
+            result_groups.append(result_group)
 
         return result_groups
 
@@ -362,14 +398,7 @@ class BackendReportHelperService:
 
         return flattened_item
 
-    def convert_report_items_to_full_items(self, data):
-        original_items = []  # probably we're missing user attributes
-
-        # to_representation_st = time.perf_counter()
-        # def log_with_time(message):
-        #     elapsed_time = time.perf_counter() - to_representation_st
-        #     _l.debug(f"{message} | Elapsed time: {elapsed_time:.3f} seconds")
-
+    def get_helper_dicts(self, data) -> dict:
         helper_dicts = {
             "accrued_currency": self.convert_helper_dict(data["item_currencies"]),
             "pricing_currency": self.convert_helper_dict(data["item_currencies"]),
@@ -399,8 +428,6 @@ class BackendReportHelperService:
             "strategy3_cash": self.convert_helper_dict(data["item_strategies3"]),
         }
 
-        # log_with_time("helper dicts are created")
-
         if "item_countries" in data:
             helper_dicts["country"] = self.convert_helper_dict(data["item_countries"])
 
@@ -419,45 +446,273 @@ class BackendReportHelperService:
                 data["item_transaction_classes"]
             )
 
+        return helper_dicts
+
+    def get_instrument_attribute_types(self) -> list:
         content_type = ContentType.objects.get(
             app_label="instruments", model="instrument"
         )
-        instrument_attribute_types = GenericAttributeType.objects.filter(
-            content_type=content_type
-        )
+        return list(GenericAttributeType.objects.filter(content_type=content_type))
 
-        # log_with_time("data prepared to be flattened")
+    def get_full_item_converter(self, data) -> Callable[[dict], dict]:
+        """Function flattening report item of the data with all its paths"""
+        helper_dicts = self.get_helper_dicts(data)
+        instrument_attribute_types = self.get_instrument_attribute_types()
 
-        # _l.debug('data helper_dicts %s' %  helper_dicts)
-        # _l.debug('data items %s' % data['items'][0])
-        for item in data["items"]:
+        def convert(item):
             original_item = self.flatten_and_convert_item(
                 item, helper_dicts, instrument_attribute_types
             )
 
             if "custom_fields" in item:
                 for custom_field in item["custom_fields"]:
-                    original_item["custom_fields." + custom_field["user_code"]] = (
-                        custom_field["value"]
+                    # values calculated by report serializer are kept
+                    original_item.setdefault(
+                        "custom_fields." + custom_field["user_code"],
+                        custom_field["value"],
+                    )
+
+            return original_item
+
+        return convert
+
+    def convert_report_items_to_full_items(self, data):
+        convert = self.get_full_item_converter(data)
+
+        return [convert(item) for item in data["items"]]
+
+    def keep_custom_fields(self, report_items, full_items, custom_fields):
+        """Put values of custom fields calculated on full items to report items"""
+        for report_item, full_item in zip(report_items, full_items):
+            for custom_field in custom_fields:
+                key = f"custom_fields.{custom_field['user_code']}"
+                if key in full_item:
+                    report_item[key] = full_item[key]
+
+    def _compile_related_path(self, path, helper_dicts) -> Callable[[dict], Any]:
+        root_key, _, rest = path.partition(".")
+
+        if root_key == "custom_fields" and rest:
+
+            def get_custom_field_value(item):
+                value = item.get(path, MISSING)
+                if value is MISSING:
+                    for custom_field in item.get("custom_fields") or []:
+                        if custom_field["user_code"] == rest:
+                            value = custom_field["value"]
+
+                return value
+
+            return get_custom_field_value
+
+        if path in helper_dicts:
+            related_objects = helper_dicts[path]
+
+            # id is left only if there is no related object to flatten
+            def get_id_value(item):
+                value = item.get(path, MISSING)
+                if value is MISSING or related_objects.get(value):
+                    return MISSING
+
+                return value
+
+            return get_id_value
+
+        if not rest or root_key not in helper_dicts:
+            return lambda item: item.get(path, MISSING)
+
+        related_objects = helper_dicts[root_key]
+        first_key, _, second_key = rest.partition(".")
+        second_objects = helper_dicts.get(first_key)
+
+        def get_related_value(item):
+            if root_key not in item:
+                return MISSING
+
+            related_object = related_objects.get(item[root_key])
+            if not related_object or first_key not in related_object:
+                return MISSING
+
+            related_value = related_object[first_key]
+
+            if first_key == "attributes" and isinstance(related_value, list):
+                value = MISSING
+                for attribute in related_value:
+                    user_code = attribute.get("attribute_type_object", {}).get(
+                        "user_code"
                     )
+                    if user_code and user_code == second_key:
+                        value = self._get_attribute_value(attribute)
+
+                return value
+
+            if second_objects is not None:
+                second_object = second_objects.get(related_value)
+                if second_object:
+                    return second_object.get(second_key, MISSING)
+
+            return MISSING if second_key else related_value
+
+        return get_related_value
+
+    def _get_item_type_overrides(
+        self, path, helper_dicts, instrument_attribute_paths
+    ) -> Dict[int, Callable[[dict], Any]]:
+        """
+        Values of the path set by flatten_and_convert_item for not instrument
+        items by item_type, MISSING if value isn't changed for the item
+        """
+        overrides = {}
+        root, _, field = path.rpartition(".")
+
+        def set_constant(item_type, value):
+            overrides[item_type] = lambda item: value
+
+        if path in instrument_attribute_paths or (
+            root == "instrument.instrument_type" and field in ITEM_TYPE_NAME_FIELDS
+        ):
+            set_constant(ITEM_TYPE_CASH, CASH_ITEM_NAME)
+
+        if root == "instrument.country" and field in ITEM_TYPE_NAME_FIELDS:
+            overrides[ITEM_TYPE_CASH] = self._get_copied_value(
+                "currency.country", field, helper_dicts
+            )
+
+        if root == "currency.country" and field in ITEM_TYPE_NAME_FIELDS:
+            overrides[ITEM_TYPE_INSTRUMENT] = self._get_copied_value(
+                "instrument.country", field, helper_dicts
+            )
+
+        if path in instrument_attribute_paths or (
+            root in ITEM_TYPE_NAME_ROOTS and field in ITEM_TYPE_NAME_FIELDS
+        ):
+            for item_type, name in ITEM_TYPE_NAMES.items():
+                set_constant(item_type, name)
+
+        return overrides
+
+    def _get_copied_value(self, root, field, helper_dicts) -> Callable[[dict], Any]:
+        # country of cash is the country of its currency and vice versa
+        get_name = self._compile_related_path(f"{root}.name", helper_dicts)
+        get_field = self._compile_related_path(f"{root}.{field}", helper_dicts)
+
+        def get_value(item):
+            if get_name(item) is MISSING:
+                return MISSING
+
+            return get_field(item)
+
+        return get_value
+
+    def compile_item_path(
+        self, path, helper_dicts, instrument_attribute_paths
+    ) -> Callable[[dict], Any]:
+        """
+        Function of report item returning value of the path in the item
+        flattened by flatten_and_convert_item, MISSING if there is no such key
+        """
+        get_related_value = self._compile_related_path(path, helper_dicts)
+        overrides = self._get_item_type_overrides(
+            path, helper_dicts, instrument_attribute_paths
+        )
+        if not overrides:
+            return get_related_value
+
+        def get_value(item):
+            override = overrides.get(item.get("item_type"))
+            if override is not None:
+                value = override(item)
+                if value is not MISSING:
+                    return value
+
+            return get_related_value(item)
+
+        return get_value
+
+    def get_referenced_paths(self, options, calculation_group=None):
+        """
+        Paths of flattened items used by backend report request,
+        None if all of them are used
+        """
+        if options.get("globalTableSearch"):
+            return None
+
+        paths = {"id", "market_value", "exposure"}
+
+        if calculation_group and calculation_group != "no_grouping":
+            paths.add(calculation_group)
+
+        for column in options.get("columns", []):
+            paths.add(column["key"])
+
+        for filter_ in self.get_regular_filters(options):
+            if isinstance(filter_, dict) and "key" in filter_:
+                paths.add(filter_["key"])
+
+        for group_type in options.get("groups_types", []):
+            paths.add(group_type["key"])
+            paths.add(self.convert_name_key_to_user_code_key(group_type["key"]))
 
-            original_items.append(original_item)
+        if options.get("ordering"):
+            paths.add(options["ordering"].lstrip("-"))
 
-        # log_with_time("data flattening")
+        return sorted(paths)
 
-        return original_items
+    def convert_report_items_to_path_items(self, data, paths):
+        """
+        Report items flattened only with values of the paths, all paths if
+        paths are None. Accessor of each path is compiled once for all items.
+        """
+        if paths is None:
+            return self.convert_report_items_to_full_items(data)
+
+        helper_dicts = self.get_helper_dicts(data)
+        instrument_attribute_paths = {
+            f"instrument.attributes.{attribute_type.user_code}"
+            for attribute_type in self.get_instrument_attribute_types()
+        }
+        accessors = [
+            (
+                path,
+                self.compile_item_path(
+                    path, helper_dicts, instrument_attribute_paths
+                ),
+            )
+            for path in paths
+        ]
+
+        path_items = []
+        for item in data["items"]:
+            path_item = {}
+            for path, get_value in accessors:
+                value = get_value(item)
+                if value is not MISSING:
+                    path_item[path] = value
+
+            path_items.append(path_item)
+
+        return path_items
+
+    def get_full_items_by_rows(self, data, path_items, rows):
+        """
+        Fully flattened report items of the rows (page of the report)
+        with values calculated for path items, like percents
+        """
+        convert = self.get_full_item_converter(data)
+
+        return [
+            {**convert(data["items"][row]), **path_items[row]} for row in rows
+        ]
 
     def get_filter_match(self, item, key, value):
-        item_value = item.get(key)
+        return self.get_group_value_match(item.get(key), value)
 
+    def get_group_value_match(self, item_value, value):
         result_value = value
 
         if isinstance(result_value, str):
             result_value = result_value.lower()
 
-        # _l.debug('get_filter_match.item_value %s' % item_value)
-        # _l.debug('get_filter_match.result_value %s' % result_value)
-
         # Refactor someday this shitty logic
         if item_value is None:
             if result_value not in ("-", None):
@@ -572,69 +827,116 @@ class BackendReportHelperService:
 
         return result
 
-    def filter_table_rows(self, items, options):
+    def match_regular_filter(self, value, filter_):
+        value_type = filter_["value_type"]
+        filter_type = filter_["filter_type"]
+        filter_value = filter_["value"]
+        filter_value_not_empty = self.check_for_empty_regular_filter(
+            filter_value, filter_type
+        )
+
+        if value or value == 0:
+            if filter_type == "empty":
+                return False
+
+            if filter_value_not_empty:
+                value_from_table = value
+                filter_argument = filter_value
+
+                if value_type in (10, 30) and filter_type != "multiselector":
+                    value_from_table = value_from_table.lower()
+                    filter_argument = filter_argument[0].lower()
+
+                elif value_type == 20:
+                    if filter_type not in ("from_to", "out_of_range"):
+                        filter_argument = filter_argument[0]
+
+                elif value_type == 40:
+                    if filter_type not in {"from_to", "out_of_range", "date_tree"}:
+                        filter_argument = filter_argument[0]
+
+                if not self.filter_value_from_table(
+                    value_from_table, filter_argument, filter_type
+                ):
+                    return False
+
+        elif filter_type != "empty" and filter_value_not_empty:
+            return False
+
+        return True
+
+    def match_numeric_filter(self, frame: ReportFrame, filter_):
+        """
+        Vectorized match of the number filter of the column of only numbers
+        and empty values, None if the filter can't be matched this way
+        """
+        key = filter_["key"]
+        filter_type = filter_["filter_type"]
+        filter_value = filter_["value"]
+
+        if (
+            filter_["value_type"] != 20
+            or filter_type not in NUMERIC_FILTER_TYPES
+            or not frame.column(key).is_numeric
+            or not self.check_for_empty_regular_filter(filter_value, filter_type)
+        ):
+            return None
+
+        if filter_type in ("from_to", "out_of_range"):
+            min_value = filter_value["min_value"]
+            max_value = filter_value["max_value"]
+            if not is_number(min_value) or not is_number(max_value):
+                return None
+        elif not is_number(filter_value[0]):
+            return None
+
+        numbers = frame.numbers(key)
+        is_present = frame.is_number(key)
+
+        # nan of empty values doesn't match any comparison
+        with np.errstate(invalid="ignore"):
+            if filter_type == "from_to":
+                return is_present & (min_value <= numbers) & (numbers <= max_value)
+
+            if filter_type == "out_of_range":
+                return is_present & ((numbers <= min_value) | (numbers >= max_value))
+
+            return is_present & NUMERIC_FILTER_TYPES[filter_type](
+                numbers, filter_value[0]
+            )
+
+    def filter_frame_table_rows(self, frame: ReportFrame, options) -> ReportFrame:
         regular_filters = self.get_regular_filters(options)
 
-        def match_item(item):
-            for filter_ in regular_filters:
-                key_property = filter_["key"]
-                value_type = filter_["value_type"]
-                filter_type = filter_["filter_type"]
-                filter_value = filter_["value"]
-                filter_value_not_empty = self.check_for_empty_regular_filter(
-                    filter_value, filter_type
+        for filter_ in regular_filters:
+            if filter_["key"] == "ordering":
+                continue
+
+            mask = self.match_numeric_filter(frame, filter_)
+            if mask is None:
+                mask = frame.map(
+                    filter_["key"],
+                    lambda value: self.match_regular_filter(value, filter_),
                 )
 
-                if key_property != "ordering":
-                    if item.get(key_property) or item.get(key_property) == 0:
-                        if filter_type == "empty":
-                            return False
-
-                        if filter_value_not_empty:
-                            value_from_table = item[key_property]
-                            filter_argument = filter_value
-
-                            if (
-                                value_type in (10, 30)
-                                and filter_type != "multiselector"
-                            ):
-                                value_from_table = value_from_table.lower()
-                                filter_argument = filter_argument[0].lower()
-
-                            elif value_type == 20:
-                                if filter_type not in ("from_to", "out_of_range"):
-                                    filter_argument = filter_argument[0]
-
-                            elif value_type == 40:
-                                if filter_type not in {
-                                    "from_to",
-                                    "out_of_range",
-                                    "date_tree",
-                                }:
-                                    filter_argument = filter_argument[0]
-
-                            if not self.filter_value_from_table(
-                                value_from_table, filter_argument, filter_type
-                            ):
-                                return False
-
-                    elif filter_type != "empty" and filter_value_not_empty:
-                        return False
-            return True
-
-        return [item for item in items if match_item(item)]
+            # next filters are matched only with the rows left
+            frame = frame.take(mask)
+
+        return frame
+
+    def filter_table_rows(self, items, options):
+        return self.filter_frame_table_rows(ReportFrame(items), options).items()
 
     # Methods for filter_table_rows
 
-    def filter_by_groups_filters(self, items, options):
+    def filter_frame_by_groups_filters(self, frame: ReportFrame, options):
         # Retrieve the group types and values from the options dictionary
         groups_types = options.get("groups_types", [])
         groups_values = options.get("groups_values", [])
 
-        # Early exit: If there are no group types or values, return the original list without filtering
+        # Early exit: If there are no group types or values, return the original frame
         if not groups_types or not groups_values:
-            # _l.debug(f"filter_by_groups_filters after len {len(items)}")
-            return items
+            return frame
 
         # Validate that both lists have the same length
         if len(groups_types) != len(groups_values):
@@ -644,68 +946,62 @@ class BackendReportHelperService:
             groups_types = groups_types[:min_length]
             groups_values = groups_values[:min_length]
 
-        # Filter the items based on group types and values
-        # We use a list comprehension for efficiency and readability
-        filtered_items = [
-            item  # Include item in the filtered list if it matches all criteria
-            for item in items
-            if all(  # `all` checks that every condition in the inner loop is True
-                self.get_filter_match(
-                    item,
-                    self.convert_name_key_to_user_code_key(groups_types[i]["key"]),
-                    groups_values[i],
-                )
-                for i in range(
-                    len(groups_types)
-                )  # Iterate over each index in group types
+        # Item is left if it matches all the group values
+        for group_type, group_value in zip(groups_types, groups_values):
+            mask = frame.map(
+                self.convert_name_key_to_user_code_key(group_type["key"]),
+                lambda value: self.get_group_value_match(value, group_value),
             )
-        ]
+            frame = frame.take(mask)
 
-        # Log the final count of filtered items
-        # _l.debug(f"filter_by_groups_filters after len {len(filtered_items)}")
+        return frame
 
-        # Return the filtered list
-        return filtered_items
+    def filter_by_groups_filters(self, items, options):
+        if not options.get("groups_types") or not options.get("groups_values"):
+            return items
 
-    def filter_by_global_table_search(self, items, options):
+        return self.filter_frame_by_groups_filters(ReportFrame(items), options).items()
+
+    def filter_frame_by_global_table_search(self, frame: ReportFrame, options):
         query = options.get("globalTableSearch", "")
 
         if not query:
-            return items
+            return frame
 
         pieces = {piece.lower() for piece in query.split()}
 
-        def item_matches(item):
-            for value in item.values():
-                if value is not None:
-                    # Let's only convert to str if it's not already a str
-                    value_str = value if isinstance(value, str) else str(value)
-                    value_str = value_str.lower()
-
-                    # Check if any piece is in value_str
-                    if any(piece in value_str for piece in pieces):
-                        return True
-
-            return False
+        def value_matches(value):
+            if value is None:
+                return False
 
-        return list(filter(item_matches, items))
+            # Let's only convert to str if it's not already a str
+            value_str = value if isinstance(value, str) else str(value)
+            value_str = value_str.lower()
 
-    def filter(self, items, options):
-        # _l.debug(f"Before filter {len(items)}")
+            # Check if any piece is in value_str
+            return any(piece in value_str for piece in pieces)
 
-        items = self.filter_by_global_table_search(items, options)
+        mask = np.zeros(len(frame), dtype=bool)
+        for key in frame.keys():
+            mask |= frame.map(key, value_matches)
 
-        # _l.debug(f"After filter_by_global_table_search {len(items)}")
+        return frame.take(mask)
 
-        items = self.filter_table_rows(items, options)
+    def filter_by_global_table_search(self, items, options):
+        if not options.get("globalTableSearch", ""):
+            return items
 
-        # _l.debug(f"After filter_table_rows {len(items)}")
+        return self.filter_frame_by_global_table_search(
+            ReportFrame(items), options
+        ).items()
 
-        # items = self.filter_by_groups_filters(items, options)
+    def filter_frame(self, frame: ReportFrame, options) -> ReportFrame:
+        frame = self.filter_frame_by_global_table_search(frame, options)
 
-        # _l.debug(f"After filter_by_groups_filters {len(items)}")
+        return self.filter_frame_table_rows(frame, options)
 
-        return items
+    def filter(self, items, options):
+        return self.filter_frame(ReportFrame(items), options).items()
 
     def reduce_columns(self, items, options):
         columns = options["columns"]
@@ -743,7 +1039,7 @@ class BackendReportHelperService:
 
         return comparator
 
-    def sort_items_by_property(self, items, property):
+    def sort_frame_by_property(self, frame: ReportFrame, property) -> ReportFrame:
         # Determine sort direction
         if property.startswith("-"):
             reverse = True
@@ -751,11 +1047,11 @@ class BackendReportHelperService:
         else:
             reverse = False
 
-        # Adjusted sort key to handle None values
-        sort_key = lambda x: (x.get(property) is None, x.get(property))
+        # None values are last, as (is None, value) key of sorted()
+        return frame.take(frame.argsort(property, reverse=reverse))
 
-        # Use sorted() to sort items
-        return sorted(items, key=sort_key, reverse=reverse)
+    def sort_items_by_property(self, items, property):
+        return self.sort_frame_by_property(ReportFrame(items), property).items()
 
     def sort_groups(self, items, options):
         if "groups_order" in options:
@@ -768,16 +1064,19 @@ class BackendReportHelperService:
 
         return items
 
-    def sort_items(self, items, options):
+    def sort_frame_items(self, frame: ReportFrame, options) -> ReportFrame:
         if "ordering" in options and "items_order" in options:
             property = options["ordering"]
 
             if options["items_order"] == "desc":
                 property = f"-{property}"
 
-            return self.sort_items_by_property(items, property)
+            return self.sort_frame_by_property(frame, property)
 
-        return items
+        return frame
+
+    def sort_items(self, items, options):
+        return self.sort_frame_items(ReportFrame(items), options).items()
 
     def calculate_value_percent(self, items, group_field, data_field):
         if not items:
@@ -870,6 +1169,98 @@ class BackendReportSubtotalService:
             result = "No Data"
         return result
 
+    @staticmethod
+    def sum_frame(frame: ReportFrame, column):
+        key = column["key"]
+        # missing values are 0, any other not a number is no data
+        if np.any(~frame.is_number(key) & ~frame.is_missing(key)):
+            return "No Data"
+
+        return float(np.sum(frame.numbers(key), where=frame.is_number(key)))
+
+    @staticmethod
+    def get_frame_weighted_value(frame: ReportFrame, column_key, weighted_key):
+        if not (
+            frame.column(column_key).is_numeric
+            and frame.column(weighted_key).is_numeric
+        ):
+            return BackendReportSubtotalService.get_weighted_value(
+                frame.items(), column_key, weighted_key
+            )
+
+        values = frame.numbers(column_key)
+        weights = frame.numbers(weighted_key)
+        # only items with both value and weight not 0 or empty
+        mask = (
+            frame.is_number(column_key)
+            & frame.is_number(weighted_key)
+            & (values != 0)
+            & (weights != 0)
+        )
+
+        return float(np.sum(values[mask] * weights[mask]))
+
+    @staticmethod
+    def get_frame_weighted_average_value(
+        frame: ReportFrame, column_key, weighted_average_key
+    ):
+        if not frame.column(weighted_average_key).is_numeric:
+            return BackendReportSubtotalService.get_weighted_average_value(
+                frame.items(), column_key, weighted_average_key
+            )
+
+        weights = frame.numbers(weighted_average_key)
+        is_weight = frame.is_number(weighted_average_key)
+        total = float(np.sum(weights, where=is_weight))
+
+        if not total:
+            print(f"{weighted_average_key} totals is", total, column_key)
+            return "No Data"
+
+        if np.any(~frame.is_number(column_key) & ~frame.is_missing(column_key)):
+            return "No Data"
+
+        values = frame.numbers(column_key)
+        mask = frame.is_number(column_key) & is_weight
+
+        return float(np.sum(values[mask] * (weights[mask] / total)))
+
+    @staticmethod
+    def get_percent_total(frame: ReportFrame, key):
+        # None is to raise an exception if sum is 0
+        if not np.all(frame.is_number(key)):
+            return "No Data"
+
+        return float(np.sum(frame.numbers(key))) or None
+
+    @staticmethod
+    def resolve_frame_subtotal_function(frame: ReportFrame, column):
+        if (
+            "report_settings" in column
+            and "subtotal_formula_id" in column["report_settings"]
+        ):
+            formula_id = column["report_settings"]["subtotal_formula_id"]
+            if formula_id == 1:
+                return BackendReportSubtotalService.sum_frame(frame, column)
+            elif formula_id in SUBTOTAL_WEIGHTED_KEYS:
+                return BackendReportSubtotalService.get_frame_weighted_value(
+                    frame, column["key"], SUBTOTAL_WEIGHTED_KEYS[formula_id]
+                )
+            elif formula_id in SUBTOTAL_WEIGHTED_AVERAGE_KEYS:
+                return BackendReportSubtotalService.get_frame_weighted_average_value(
+                    frame, column["key"], SUBTOTAL_WEIGHTED_AVERAGE_KEYS[formula_id]
+                )
+
+    @staticmethod
+    def calculate_frame(frame: ReportFrame, columns):
+        return {
+            column["key"]: BackendReportSubtotalService.resolve_frame_subtotal_function(
+                frame, column
+            )
+            for column in columns
+            if column["value_type"] == 20
+        }
+
     @staticmethod
     def resolve_subtotal_function(items, column):
         # szhitenev 2023-12-21
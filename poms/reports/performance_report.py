@@ -24,6 +24,7 @@ from poms.common.utils import (
 )
 from poms.currencies.models import Currency, CurrencyHistory
 from poms.instruments.models import Instrument, InstrumentType, PriceHistory
+from poms.instruments.rate_cube import RateCube
 from poms.portfolios.models import Portfolio, PortfolioRegister, PortfolioRegisterRecord
 from poms.reports.common import Report
 from poms.reports.models import BalanceReportCustomField
@@ -46,6 +47,9 @@ class PerformanceReportBuilder:
             master_user_pk=self.instance.master_user.pk
         )
 
+        # replaced by the cube of report dates in build_report
+        self.rate_cube = RateCube(default_currency_id=self.ecosystem_defaults.currency_id)
+
         _l.debug("self.instance master_user %s" % self.instance.master_user)
         _l.debug("self.instance period_type %s" % self.instance.period_type)
         _l.debug("self.instance begin_date %s" % self.instance.begin_date)
@@ -197,6 +201,13 @@ class PerformanceReportBuilder:
         if self.end_date < begin_date:
             self.end_date = begin_date
 
+        # fx rates and prices of all periods are loaded once
+        self.rate_cube = RateCube(
+            self.instance.first_transaction_date - timedelta(days=1),
+            self.end_date,
+            default_currency_id=self.ecosystem_defaults.currency_id,
+        )
+
         if self.instance.adjustment_type == "annualized":
             self.check_can_calculate_annualized_report()
 
@@ -555,7 +566,7 @@ class PerformanceReportBuilder:
                 TransactionClass.INJECTION,
                 TransactionClass.DISTRIBUTION,
             ],
-        ).order_by("transaction_date")
+        ).select_related("portfolio_register__linked_instrument").order_by("transaction_date")
 
         # create empty structure start
 
@@ -660,65 +671,10 @@ class PerformanceReportBuilder:
                 item = item_date["portfolios"][_key]
 
                 try:
-                    price_history = PriceHistory.objects.get(
-                        date=item["transaction_date"],
-                        instrument=item["portfolio_register"].linked_instrument,
-                        pricing_policy=item[
-                            "portfolio_register"
-                        ].valuation_pricing_policy,
+                    nav = self.get_register_nav(
+                        item["portfolio_register"], item["transaction_date"]
                     )
 
-                    if (
-                        self.instance.report_currency.id
-                        == item[
-                            "portfolio_register"
-                        ].linked_instrument.pricing_currency.id
-                    ):
-                        fx_rate = 1
-                    else:
-                        if (
-                            self.instance.report_currency.id
-                            == self.ecosystem_defaults.currency.id
-                        ):
-                            report_currency_fx_rate = 1
-                        else:
-                            report_currency_fx_rate = CurrencyHistory.objects.get(
-                                date=item["transaction_date"],
-                                currency=self.instance.report_currency,
-                                pricing_policy=item[
-                                    "portfolio_register"
-                                ].valuation_pricing_policy,
-                            ).fx_rate
-
-                        if (
-                            item[
-                                "portfolio_register"
-                            ].linked_instrument.pricing_currency.id
-                            == self.ecosystem_defaults.currency.id
-                        ):
-                            instrument_pricing_currency_fx_rate = 1
-                        else:
-                            instrument_pricing_currency_fx_rate = (
-                                CurrencyHistory.objects.get(
-                                    date=item["transaction_date"],
-                                    currency=item[
-                                        "portfolio_register"
-                                    ].linked_instrument.pricing_currency,
-                                    pricing_policy=item[
-                                        "portfolio_register"
-                                    ].valuation_pricing_policy,
-                                ).fx_rate
-                            )
-
-                        fx_rate = (
-                            instrument_pricing_currency_fx_rate
-                            / report_currency_fx_rate
-                        )
-
-                    nav = price_history.nav * fx_rate
-
-                    # report currency / linked_instrument.pricing currency
-
                 except Exception as e:
                     _l.error("Could not calculate nav %s " % e)
                     nav = 0
@@ -736,49 +692,7 @@ class PerformanceReportBuilder:
                 cash_outflow = 0
 
                 for record in item["records"]:
-                    try:
-                        if (
-                            self.instance.report_currency.id
-                            == record.valuation_currency.id
-                        ):
-                            fx_rate = 1
-                        else:
-                            if (
-                                self.instance.report_currency.id
-                                == self.ecosystem_defaults.currency.id
-                            ):
-                                report_currency_fx_rate = 1
-                            else:
-                                report_currency_fx_rate = CurrencyHistory.objects.get(
-                                    date=record.transaction_date,
-                                    pricing_policy=record.portfolio_register.valuation_pricing_policy,
-                                    currency=self.instance.report_currency,
-                                ).fx_rate
-
-                            if (
-                                record.valuation_currency.id
-                                == self.ecosystem_defaults.currency.id
-                            ):
-                                record_valuation_currency_fx_rate = 1
-                            else:
-                                record_valuation_currency_fx_rate = CurrencyHistory.objects.get(
-                                    date=record.transaction_date,
-                                    pricing_policy=record.portfolio_register.valuation_pricing_policy,
-                                    currency=record.valuation_currency,
-                                ).fx_rate
-
-                            fx_rate = (
-                                record_valuation_currency_fx_rate
-                                / report_currency_fx_rate
-                            )
-
-                    except Exception as e:
-                        _l.error("Could not calculate fx_rate e %s" % e)
-                        _l.error(
-                            "Could not calculate fx_rate traceback %s"
-                            % traceback.format_exc()
-                        )
-                        fx_rate = 1
+                    fx_rate = self.get_record_fx_rate(record)
 
                     # report / valuation
 
@@ -936,58 +850,75 @@ class PerformanceReportBuilder:
             )
 
     def get_modified_dietz_nav_for_record(self, register_record):
+        portfolio_register = register_record.portfolio_register
+        linked_instrument = portfolio_register.linked_instrument
+
+        nav = self.rate_cube.get_price(
+            linked_instrument.id,
+            portfolio_register.valuation_pricing_policy_id,
+            register_record.transaction_date,
+            "nav",
+        )
+        if nav is None:
+            return 0
+
         try:
-            price_history = PriceHistory.objects.get(
-                date=register_record.transaction_date,
-                instrument=register_record.portfolio_register.linked_instrument,
-                pricing_policy=register_record.portfolio_register.valuation_pricing_policy,
+            fx_rate = self.get_fx_rate_to_report_currency(
+                linked_instrument.pricing_currency_id,
+                portfolio_register.valuation_pricing_policy_id,
+                register_record.transaction_date,
+            )
+        except Exception as e:
+            _l.error("fx_rate e %s" % e)
+            fx_rate = 1
+
+        return nav * fx_rate
+
+    def get_fx_rate_to_report_currency(self, currency_id, pricing_policy_id, day):
+        """
+        FX rate from the currency to report currency,
+        raises CurrencyHistory.DoesNotExist if there is no rate
+        """
+        if self.instance.report_currency.id == currency_id:
+            return 1
+
+        fx_rates = []
+        for fx_currency_id in (currency_id, self.instance.report_currency.id):
+            fx_rate = self.rate_cube.get_fx_rate(fx_currency_id, pricing_policy_id, day)
+            if fx_rate is None:
+                raise CurrencyHistory.DoesNotExist(
+                    f"no fx_rate for currency {fx_currency_id} date {day} "
+                    f"policy {pricing_policy_id} was found in currency history"
+                )
+            fx_rates.append(fx_rate)
+
+        return fx_rates[0] / fx_rates[1]
+
+    def get_register_nav(self, portfolio_register, day):
+        """
+        NAV of portfolio register in report currency,
+        raises DoesNotExist if there is no price or fx rate
+        """
+        linked_instrument = portfolio_register.linked_instrument
+
+        nav = self.rate_cube.get_price(
+            linked_instrument.id,
+            portfolio_register.valuation_pricing_policy_id,
+            day,
+            "nav",
+        )
+        if nav is None:
+            raise PriceHistory.DoesNotExist(
+                f"no price for instrument {linked_instrument.id} date {day} "
+                f"policy {portfolio_register.valuation_pricing_policy_id}"
             )
 
-            try:
-                if (
-                    self.instance.report_currency.id
-                    == register_record.portfolio_register.linked_instrument.pricing_currency.id
-                ):
-                    fx_rate = 1
-                else:
-                    if (
-                        self.instance.report_currency.id
-                        == self.ecosystem_defaults.currency.id
-                    ):
-                        report_currency_fx_rate = 1
-                    else:
-                        report_currency_fx_rate = CurrencyHistory.objects.get(
-                            date=register_record,
-                            currency=self.instance.report_currency,
-                            pricing_policy=register_record.portfolio_register.valuation_pricing_policy,
-                        ).fx_rate
-
-                    if (
-                        register_record.portfolio_register.linked_instrument.pricing_currency.id
-                        == self.ecosystem_defaults.currency.id
-                    ):
-                        instrument_pricing_currency_fx_rate = 1
-                    else:
-                        instrument_pricing_currency_fx_rate = CurrencyHistory.objects.get(
-                            date=register_record.transaction_date,
-                            currency=register_record.portfolio_register.linked_instrument.pricing_currency,
-                            pricing_policy=register_record.portfolio_register.valuation_pricing_policy,
-                        ).fx_rate
-
-                    fx_rate = (
-                        instrument_pricing_currency_fx_rate / report_currency_fx_rate
-                    )
-
-            except Exception as e:
-                _l.error("fx_rate e %s" % e)
-                fx_rate = 1
-
-            nav = price_history.nav * fx_rate
-
-        except Exception:
-            nav = 0
-
-        return nav
+        # report currency / linked_instrument.pricing currency
+        return nav * self.get_fx_rate_to_report_currency(
+            linked_instrument.pricing_currency_id,
+            portfolio_register.valuation_pricing_policy_id,
+            day,
+        )
 
     def get_inception_date_cash_flow(self, portfolios, date, pricing_policy):
         portfolio_registers = self.get_portfolio_registers()
@@ -1001,7 +932,7 @@ class PerformanceReportBuilder:
                 TransactionClass.INJECTION,
                 TransactionClass.DISTRIBUTION,
             ],
-        ).order_by("transaction_date")
+        ).select_related("portfolio_register__linked_instrument").order_by("transaction_date")
 
         cash_flow = 0
 
@@ -1038,34 +969,12 @@ class PerformanceReportBuilder:
         return nav
 
     def get_record_fx_rate(self, record):
-        fx_rate = 1
-
         try:
-            if self.instance.report_currency.id == record.valuation_currency.id:
-                fx_rate = 1
-            else:
-                if (
-                    self.instance.report_currency.id
-                    == self.ecosystem_defaults.currency.id
-                ):
-                    report_currency_fx_rate = 1
-                else:
-                    report_currency_fx_rate = CurrencyHistory.objects.get(
-                        date=record.transaction_date,
-                        pricing_policy=record.portfolio_register.valuation_pricing_policy,
-                        currency=self.instance.report_currency,
-                    ).fx_rate
-
-                if record.valuation_currency.id == self.ecosystem_defaults.currency.id:
-                    record_valuation_currency_fx_rate = 1
-                else:
-                    record_valuation_currency_fx_rate = CurrencyHistory.objects.get(
-                        pricing_policy=record.portfolio_register.valuation_pricing_policy,
-                        date=record.transaction_date,
-                        currency=record.valuation_currency,
-                    ).fx_rate
-
-                fx_rate = record_valuation_currency_fx_rate / report_currency_fx_rate
+            fx_rate = self.get_fx_rate_to_report_currency(
+                record.valuation_currency_id,
+                record.portfolio_register.valuation_pricing_policy_id,
+                record.transaction_date,
+            )
 
         except Exception as e:
             _l.error("fx_rate e %s" % e)
@@ -1140,7 +1049,7 @@ class PerformanceReportBuilder:
                         TransactionClass.INJECTION,
                         TransactionClass.DISTRIBUTION,
                     ],
-                ).order_by("transaction_date")
+                ).select_related("portfolio_register__linked_instrument").order_by("transaction_date")
 
                 if not portfolio_records:
                     no_register_records.append(portfolio.user_code)
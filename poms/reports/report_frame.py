@@ -0,0 +1,172 @@
+"""
+Columnar frame of flattened report items.
+
+Backend report endpoints filter, group, sort and subtotal the same list of
+items many times. ReportFrame builds a column once per report and key:
+values are dictionary encoded (code of every row + distinct values) and
+numbers are kept in a float array. Filters are evaluated once per distinct
+value and broadcast to rows by codes, sorts, group-bys and subtotals are
+numpy operations over row indexes. Items themselves are not copied, frames
+made by filters share columns and select rows of the same items.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# value of the row without the key
+MISSING = object()
+
+
+def _get_value_key(value, row: int):
+    # 1, 1.0 and True are equal dict keys, but are different values here
+    try:
+        hash(value)
+    except TypeError:
+        return list, row
+
+    return type(value), value
+
+
+def is_number(value) -> bool:
+    return value is not MISSING and isinstance(value, (int, float))
+
+
+class Column:
+    """Values of the key of all items"""
+
+    def __init__(self, values: list):
+        codes_by_value = {}
+        self.uniques = []
+        self.codes = np.empty(len(values), dtype=np.int64)
+
+        for row, value in enumerate(values):
+            value_key = _get_value_key(value, row)
+            code = codes_by_value.get(value_key)
+            if code is None:
+                code = codes_by_value[value_key] = len(self.uniques)
+                self.uniques.append(value)
+            self.codes[row] = code
+
+        unique_is_number = np.array(
+            [is_number(value) for value in self.uniques], dtype=bool
+        )
+        unique_numbers = np.array(
+            [float(value) if is_number(value) else np.nan for value in self.uniques],
+            dtype=float,
+        )
+        self.is_number = unique_is_number[self.codes]
+        self.numbers = unique_numbers[self.codes]
+        self.is_missing = np.array(
+            [value is MISSING for value in self.uniques], dtype=bool
+        )[self.codes]
+        # only numbers, None and missing values
+        self.is_numeric = all(
+            value is None or value is MISSING or is_number(value)
+            for value in self.uniques
+        )
+
+    def get_unique(self, code: int, default=None):
+        value = self.uniques[code]
+        return default if value is MISSING else value
+
+    def map(self, func: Callable, codes: np.ndarray, default=None) -> np.ndarray:
+        """Boolean result of func for value of every code, func is called once
+        per distinct value, missing values are passed as default"""
+        distinct_codes, inverse = np.unique(codes, return_inverse=True)
+        results = np.array(
+            [bool(func(self.get_unique(code, default))) for code in distinct_codes],
+            dtype=bool,
+        )
+        return results[inverse]
+
+    def get_ranks(self, codes: np.ndarray) -> np.ndarray:
+        """Sort rank of value of every code, equal values have equal rank,
+        None and missing values are after all the others"""
+        distinct_codes, inverse = np.unique(codes, return_inverse=True)
+        present = [
+            i
+            for i, code in enumerate(distinct_codes)
+            if self.uniques[code] is not MISSING and self.uniques[code] is not None
+        ]
+        present.sort(key=lambda i: self.uniques[distinct_codes[i]])
+
+        ranks = np.full(len(distinct_codes), len(present), dtype=np.int64)
+        rank = -1
+        previous = MISSING
+        for i in present:
+            value = self.uniques[distinct_codes[i]]
+            if previous is MISSING or previous < value:
+                rank += 1
+            ranks[i] = rank
+            previous = value
+
+        return ranks[inverse]
+
+
+class ReportFrame:
+    """Selected rows of the report items with columns built on demand"""
+
+    def __init__(
+        self,
+        items: List[dict],
+        rows: Optional[np.ndarray] = None,
+        columns: Optional[Dict[str, Column]] = None,
+    ):
+        self._items = items
+        self.rows = np.arange(len(items)) if rows is None else rows
+        # shared by all frames of the items
+        self._columns = {} if columns is None else columns
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def column(self, key: str) -> Column:
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = Column(
+                [item.get(key, MISSING) for item in self._items]
+            )
+
+        return column
+
+    def keys(self) -> List[str]:
+        """Keys of the selected items"""
+        keys = {}
+        for row in self.rows:
+            keys.update(dict.fromkeys(self._items[row]))
+
+        return list(keys)
+
+    def codes(self, key: str) -> np.ndarray:
+        return self.column(key).codes[self.rows]
+
+    def numbers(self, key: str) -> np.ndarray:
+        """Float values of the key of selected rows, nan if not a number"""
+        return self.column(key).numbers[self.rows]
+
+    def is_number(self, key: str) -> np.ndarray:
+        return self.column(key).is_number[self.rows]
+
+    def is_missing(self, key: str) -> np.ndarray:
+        return self.column(key).is_missing[self.rows]
+
+    def map(self, key: str, func: Callable, default=None) -> np.ndarray:
+        """Boolean result of func for value of the key of selected rows"""
+        return self.column(key).map(func, self.codes(key), default)
+
+    def argsort(self, key: str, reverse: bool = False) -> np.ndarray:
+        """Positions of the selected rows in stable order of values of the key,
+        None and missing values are last (first if reversed) as in sorted()"""
+        ranks = self.column(key).get_ranks(self.codes(key))
+        return np.argsort(-ranks if reverse else ranks, kind="stable")
+
+    def take(self, selection: np.ndarray) -> "ReportFrame":
+        """Frame of the rows selected by boolean mask or positions"""
+        return ReportFrame(self._items, self.rows[selection], self._columns)
+
+    def item(self, position: int) -> dict:
+        return self._items[self.rows[position]]
+
+    def items(self) -> List[dict]:
+        return [self._items[row] for row in self.rows]
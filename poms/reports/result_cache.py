@@ -0,0 +1,220 @@
+"""
+Cache of built reports.
+
+Frontend asks for one report many times: one `groups` request and one `items`
+request per expanded group, all with the same report settings. Serialized
+report is stored in cache under the key made of report settings and data
+version of the schema, so the report is built once per screen. Data version
+is changed when transactions, prices or fx rates are changed, that makes
+all cached reports of the schema unreachable.
+"""
+
+import hashlib
+import json
+import logging
+import pickle
+import time
+import uuid
+import zlib
+from collections.abc import Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Model
+
+from poms.common.utils import collect_on_commit, get_current_schema
+
+_l = logging.getLogger("poms.reports")
+
+# changed when format of cached report data is changed,
+# 2 - report items are not flattened
+REPORT_CACHE_FORMAT = 2
+
+# attributes of report which don't change result of the report builder
+NOT_CACHED_ATTRIBUTES = {
+    "id",
+    "task_id",
+    "task_status",
+    "context",
+    "ecosystem_default",
+    "report_instance_name",
+    "report_instance_id",
+    "save_report",
+    "ignore_cache",
+    "frontend_request_options",
+    "page",
+    "page_size",
+    "count",
+    "items",
+    "transactions",
+    "has_errors",
+    "auth_time",
+    "report_cache_key",
+    "cached_report_data",
+}
+
+
+def get_report_cache():
+    return caches[settings.REPORT_CACHE_ALIAS]
+
+
+def _get_data_version_key(schema):
+    return f"{schema}_report_data_version"
+
+
+def get_report_data_version(schema):
+    return get_report_cache().get_or_set(
+        _get_data_version_key(schema), uuid.uuid4().hex, None
+    )
+
+
+def bump_report_data_version(schema):
+    """Make all cached reports of the schema outdated"""
+    try:
+        get_report_cache().set(_get_data_version_key(schema), uuid.uuid4().hex, None)
+    except Exception as e:
+        _l.error(f"bump_report_data_version {schema} error {repr(e)}")
+
+
+def report_data_changed():
+    """
+    Bump data version of the current schema when the db transaction is committed,
+    so report built concurrently from not committed data is not cached as fresh.
+    Version is bumped once per db transaction however many rows are changed.
+    """
+    collect_on_commit(
+        "report_data_changed",
+        (),
+        lambda _: bump_report_data_version(get_current_schema()),
+    )
+
+
+def _normalize(value):
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, Iterable) and not isinstance(value, (str, bytes)):
+        values = [_normalize(v) for v in value]
+        # portfolios, accounts etc. are sets, their order doesn't matter
+        if all(isinstance(v, int) for v in values):
+            values.sort()
+        return values
+    return value
+
+
+def get_report_cache_key(instance, report_type):
+    """
+    Key of the report in cache, None if report must not be cached
+    """
+    if getattr(instance, "ignore_cache", False):
+        return None
+
+    schema = get_current_schema()
+
+    report_data = {
+        name: _normalize(value)
+        for name, value in vars(instance).items()
+        if name not in NOT_CACHED_ATTRIBUTES and not name.startswith("item_")
+    }
+    report_data["report_type"] = report_type
+    report_data["master_user"] = _normalize(instance.master_user)
+    report_data["member"] = _normalize(instance.member)
+    report_data["data_version"] = get_report_data_version(schema)
+    report_data["cache_format"] = REPORT_CACHE_FORMAT
+
+    report_settings = json.dumps(report_data, sort_keys=True, default=str)
+    unique_key = hashlib.md5(report_settings.encode()).hexdigest()
+
+    return f"{schema}_report_{report_type}_{unique_key}"
+
+
+def get_cached_report_data(cache_key):
+    if not cache_key:
+        return None
+
+    try:
+        value = get_report_cache().get(cache_key)
+        if value is None:
+            return None
+        return pickle.loads(zlib.decompress(value))
+    except Exception as e:
+        _l.error(f"get_cached_report_data {cache_key} error {repr(e)}")
+        return None
+
+
+def _add_to_index(report_cache, schema, cache_key, size):
+    """
+    Keep list of cached reports of the schema and remove the oldest ones
+    when total size of reports is bigger than REPORT_CACHE_MAX_TOTAL_SIZE
+    """
+    index_key = f"{schema}_report_cache_index"
+    now = time.time()
+
+    index = [
+        entry
+        for entry in report_cache.get(index_key) or []
+        if entry[2] > now and entry[0] != cache_key
+    ]
+    index.append((cache_key, size, now + settings.REPORT_CACHE_TTL))
+
+    total_size = sum(entry[1] for entry in index)
+    evicted = []
+    while total_size > settings.REPORT_CACHE_MAX_TOTAL_SIZE and len(index) > 1:
+        entry = index.pop(0)
+        evicted.append(entry[0])
+        total_size -= entry[1]
+
+    if evicted:
+        report_cache.delete_many(evicted)
+
+    report_cache.set(index_key, index, settings.REPORT_CACHE_TTL)
+
+
+def set_cached_report_data(instance, data):
+    cache_key = getattr(instance, "report_cache_key", None)
+    if not cache_key:
+        return
+
+    try:
+        value = zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+        if len(value) > settings.REPORT_CACHE_MAX_SIZE:
+            _l.info(f"set_cached_report_data {cache_key} too big {len(value)}")
+            return
+
+        report_cache = get_report_cache()
+        report_cache.set(cache_key, value, settings.REPORT_CACHE_TTL)
+
+        _add_to_index(report_cache, get_current_schema(), cache_key, len(value))
+    except Exception as e:
+        _l.error(f"set_cached_report_data {cache_key} error {repr(e)}")
+
+
+def load_cached_report_data(instance, report_type):
+    """
+    Put cache key and cached report data to the report instance,
+    returns False if report has to be built
+    """
+    try:
+        instance.report_cache_key = get_report_cache_key(instance, report_type)
+    except Exception as e:
+        _l.error(f"load_cached_report_data {report_type} error {repr(e)}")
+        instance.report_cache_key = None
+
+    instance.cached_report_data = get_cached_report_data(instance.report_cache_key)
+
+    return instance.cached_report_data is not None
+
+
+def get_report_data(instance, serialize):
+    """
+    Cached report data or result of serialize(instance) which is put to cache
+    """
+    data = getattr(instance, "cached_report_data", None)
+    if data is not None:
+        return data
+
+    data = serialize(instance)
+    set_cached_report_data(instance, data)
+    return data
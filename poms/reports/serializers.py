@@ -1,12 +1,10 @@
 import contextlib
-import json
 import logging
 import time
 import traceback
 import uuid
 from datetime import date, timedelta
 
-from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import ForeignKey
 from django.utils.translation import gettext_lazy
 from rest_framework import serializers
@@ -24,7 +22,7 @@ from poms.common.serializers import (
 from poms.common.utils import date_now, date_yesterday
 from poms.currencies.fields import CurrencyField, SystemCurrencyDefault
 from poms.currencies.serializers import CurrencyViewSerializer
-from poms.expressions_engine import formula
+from poms.expressions_engine import batch, formula
 from poms.instruments.fields import (
     BundleField,
     PricingPolicyField,
@@ -69,14 +67,15 @@ from poms.reports.models import (
     TransactionReportCustomField,
 )
 from poms.reports.serializers_helpers import (
-    serialize_balance_report_item,
-    serialize_pl_report_item,
+    serialize_balance_report_items,
+    serialize_pl_report_items,
     serialize_price_checker_item,
     serialize_price_checker_item_instrument,
     serialize_report_item_instrument,
     serialize_transaction_report_item,
 )
-from poms.reports.utils import generate_unique_key
+from poms.reports.report_frame import ReportFrame
+from poms.reports.result_cache import get_report_data
 from poms.strategies.fields import Strategy1Field, Strategy2Field, Strategy3Field
 from poms.strategies.serializers import (
     Strategy1ViewSerializer,
@@ -92,6 +91,9 @@ from poms_app import settings
 
 _l = logging.getLogger("poms.reports")
 
+# rows which names are kept in memory while custom fields are evaluated
+CUSTOM_FIELDS_BATCH_SIZE = 5000
+
 _cf_list = [
     "id",
     "master_user",
@@ -193,6 +195,9 @@ class ReportSerializerWithLogs(serializers.Serializer):
 
 
 class ReportSerializer(ReportSerializerWithLogs):
+    # backend report serializers flatten items only with paths they use
+    flatten_items = True
+
     # task_id = serializers.CharField(
     #     allow_null=True, allow_blank=True, required=False
     # )  # something depreacted
@@ -535,14 +540,16 @@ class ReportSerializer(ReportSerializerWithLogs):
                 with contextlib.suppress(KeyError):
                     names[f"{pk_attr}_object"] = objs[pk]
 
-    def evaluate_expression(self, expr, names, context):
+    def evaluate_expression(self, expr, names, context, evaluator=None):
         try:
+            if evaluator is not None:
+                return evaluator.eval(expr, names=names)
             return formula.safe_eval(expr, names=names, context=context)
         except formula.InvalidExpression as e:
             _l.debug(f"evaluate_expression {e} trace {traceback.format_exc()}")
             return gettext_lazy("Invalid expression")
 
-    def process_custom_field(self, cf, value):
+    def process_custom_field(self, cf, value, evaluator=None):
         if cf["expr"] and value:
             if cf["value_type"] == 10:
                 return str(value)
@@ -558,6 +565,7 @@ class ReportSerializer(ReportSerializerWithLogs):
                     "parse_date(item, '%d/%m/%Y')",
                     names={"item": value},
                     context=self.context,
+                    evaluator=evaluator,
                 )
 
         return None
@@ -571,7 +579,11 @@ class ReportSerializer(ReportSerializerWithLogs):
 
         helper_service = BackendReportHelperService()
 
-        full_items = helper_service.convert_report_items_to_full_items(data)
+        if self.flatten_items:
+            full_items = helper_service.convert_report_items_to_full_items(data)
+        else:
+            full_items = data["items"]
+            convert_item = helper_service.get_full_item_converter(data)
 
         _l.info(
             "Initial serialization complete: %s seconds",
@@ -611,52 +623,55 @@ class ReportSerializer(ReportSerializerWithLogs):
         custom_fields = data.get("custom_fields_object", [])
         custom_fields_to_calculate = data.get("custom_fields_to_calculate", [])
 
-        # index = 0
         if custom_fields_to_calculate and custom_fields:
             calc_st = time.perf_counter()
-            for item in full_items:
-                item_st = time.perf_counter()
-                names = self._extract_names(item, data)
-
-                for name, item_dict in item_dicts.items():
-                    self._set_object(names, name, item_dict)
-
-                # if index == 0:
-                #     _l.info('names %s' % names)
-
-                # index = index + 1
-
-                names = formula.value_prepare(names)
-                custom_fields_names = {}
-
-                for _ in range(data["expression_iterations_count"]):
-                    for cf in custom_fields:
-                        if cf["name"] in custom_fields_to_calculate:
-                            expr = cf.get("expr")
-                            value = (
-                                self.evaluate_expression(
-                                    expr, names, context=self.context
-                                )
-                                if expr
-                                else None
-                            )
-                            if cf["user_code"] not in custom_fields_names:
-                                custom_fields_names[cf["user_code"]] = value
-
-                # Processing custom fields
-                cfv = []
-                for key, value in custom_fields_names.items():
-                    for cf in custom_fields:
-                        if cf["user_code"] == key:
-                            value = self.process_custom_field(cf, value)
-
-                            item[f"custom_fields.{cf['user_code']}"] = value
-                            # cfv.append(
-                            #     {"custom_field": cf["id"], "user_code": cf["user_code"], "value": value}
-                            # )
-                # item["custom_fields"] = cfv
-
-                _l.debug("Processed item in: %s seconds", time.perf_counter() - item_st)
+            # one evaluator for all rows, only row names are bound per evaluation
+            evaluator = formula.SimpleEval2(allow_assign=True, context=self.context)
+            fields = [cf for cf in custom_fields if cf["name"] in custom_fields_to_calculate]
+
+            # names of every row don't change between expression iterations,
+            # so each custom field is evaluated once over a chunk of rows
+            for offset in range(0, len(full_items), CUSTOM_FIELDS_BATCH_SIZE):
+                chunk_st = time.perf_counter()
+                report_items = full_items[offset : offset + CUSTOM_FIELDS_BATCH_SIZE]
+                items = report_items
+                if not self.flatten_items:
+                    # names of expressions are all values of flattened item
+                    items = [convert_item(item) for item in report_items]
+                rows = []
+                for item in items:
+                    names = self._extract_names(item, data)
+
+                    for name, item_dict in item_dicts.items():
+                        self._set_object(names, name, item_dict)
+
+                    rows.append(formula.value_prepare(names))
+
+                for cf in fields:
+                    expr = cf.get("expr")
+                    if expr:
+                        values = batch.safe_eval_batch(
+                            expr,
+                            rows,
+                            evaluator=evaluator,
+                            error_value=gettext_lazy("Invalid expression"),
+                        )
+                    else:
+                        values = [None] * len(items)
+
+                    for item, value in zip(items, values):
+                        item[f"custom_fields.{cf['user_code']}"] = self.process_custom_field(
+                            cf, value, evaluator=evaluator
+                        )
+
+                if not self.flatten_items:
+                    helper_service.keep_custom_fields(report_items, items, fields)
+
+                _l.debug(
+                    "Processed %s items in: %s seconds",
+                    len(items),
+                    time.perf_counter() - chunk_st,
+                )
 
             _l.info(
                 "Custom field calculation completed in: %s seconds",
@@ -775,7 +790,7 @@ class BalanceReportLightSerializer(ReportSerializerWithLogs):
         return Report(**validated_data)
 
     def get_items(self, obj):
-        return [serialize_balance_report_item(item) for item in obj.items]
+        return serialize_balance_report_items(obj.items)
 
     def to_representation(self, instance):
         # No need for now, but do not delete
@@ -797,7 +812,7 @@ class BalanceReportSerializer(ReportSerializer):
     # item_instruments = serializers.SerializerMethodField()
 
     def get_items(self, obj):
-        return [serialize_balance_report_item(item) for item in obj.items]
+        return serialize_balance_report_items(obj.items)
 
     # to slow, because sql querys are not bulk fetcthed
     # def get_item_instruments(self, obj):
@@ -867,7 +882,7 @@ class PLReportSerializer(ReportSerializer):
     )
 
     def get_items(self, obj):
-        return [serialize_pl_report_item(item) for item in obj.items]
+        return serialize_pl_report_items(obj.items)
 
     def get_item_instruments(self, obj):
         _l.debug("get item instruments here")
@@ -876,6 +891,9 @@ class PLReportSerializer(ReportSerializer):
 
 
 class TransactionReportSerializer(ReportSerializerWithLogs):
+    # backend report serializers flatten items only with paths they use
+    flatten_items = True
+
     report_instance_id = serializers.CharField(
         allow_null=True,
         allow_blank=True,
@@ -1140,7 +1158,11 @@ class TransactionReportSerializer(ReportSerializerWithLogs):
 
         helper_service = BackendReportHelperService()
 
-        full_items = helper_service.convert_report_items_to_full_items(data)
+        if self.flatten_items:
+            full_items = helper_service.convert_report_items_to_full_items(data)
+        else:
+            full_items = data["items"]
+            convert_item = helper_service.get_full_item_converter(data)
         custom_fields = data["custom_fields_object"]
 
         # _l.debug('custom_fields_to_calculate %s' % data["custom_fields_to_calculate"])
@@ -1170,51 +1192,68 @@ class TransactionReportSerializer(ReportSerializerWithLogs):
                         names[f"{pk_attr}_object"] = objs[pk]
                         # names[pk_attr] = objs[pk]
 
-            for item in full_items:
-                names = {}
-
-                for key, value in item.items():
-                    names[key] = value
-
-                _set_object(names, "complex_transaction", item_complex_transactions)
-                _set_object(names, "transaction_class", item_transaction_classes)
-                _set_object(names, "instrument", item_instruments)
-                _set_object(names, "transaction_currency", item_currencies)
-                _set_object(names, "settlement_currency", item_currencies)
-                _set_object(names, "portfolio", item_portfolios)
-                _set_object(names, "account_cash", item_accounts)
-                _set_object(names, "account_position", item_accounts)
-                _set_object(names, "account_interim", item_accounts)
-                _set_object(names, "strategy1_position", item_strategies1)
-                _set_object(names, "strategy1_cash", item_strategies1)
-                _set_object(names, "strategy2_position", item_strategies2)
-                _set_object(names, "strategy2_cash", item_strategies2)
-                _set_object(names, "strategy3_position", item_strategies3)
-                _set_object(names, "strategy3_cash", item_strategies3)
-                _set_object(names, "responsible", item_responsibles)
-                _set_object(names, "counterparty", item_counterparties)
-                _set_object(names, "linked_instrument", item_instruments)
-                _set_object(names, "allocation_balance", item_instruments)
-                _set_object(names, "allocation_pl", item_instruments)
-
-                names = formula.value_prepare(names)
-                custom_fields_names = {}
-
+            # one evaluator for all rows, only row names are bound per evaluation
+            evaluator = formula.SimpleEval2(allow_assign=True, context=self.context)
+
+            fields = [cf for cf in custom_fields if cf["name"] in data["custom_fields_to_calculate"]]
+            invalid_expression = gettext_lazy("Invalid expression")
+
+            for offset in range(0, len(full_items), CUSTOM_FIELDS_BATCH_SIZE):
+                report_items = full_items[offset : offset + CUSTOM_FIELDS_BATCH_SIZE]
+                items = report_items
+                if not self.flatten_items:
+                    # names of expressions are all values of flattened item
+                    items = [convert_item(item) for item in report_items]
+                rows = []
+
+                for item in items:
+                    names = {}
+
+                    for key, value in item.items():
+                        names[key] = value
+
+                    _set_object(names, "complex_transaction", item_complex_transactions)
+                    _set_object(names, "transaction_class", item_transaction_classes)
+                    _set_object(names, "instrument", item_instruments)
+                    _set_object(names, "transaction_currency", item_currencies)
+                    _set_object(names, "settlement_currency", item_currencies)
+                    _set_object(names, "portfolio", item_portfolios)
+                    _set_object(names, "account_cash", item_accounts)
+                    _set_object(names, "account_position", item_accounts)
+                    _set_object(names, "account_interim", item_accounts)
+                    _set_object(names, "strategy1_position", item_strategies1)
+                    _set_object(names, "strategy1_cash", item_strategies1)
+                    _set_object(names, "strategy2_position", item_strategies2)
+                    _set_object(names, "strategy2_cash", item_strategies2)
+                    _set_object(names, "strategy3_position", item_strategies3)
+                    _set_object(names, "strategy3_cash", item_strategies3)
+                    _set_object(names, "responsible", item_responsibles)
+                    _set_object(names, "counterparty", item_counterparties)
+                    _set_object(names, "linked_instrument", item_instruments)
+                    _set_object(names, "allocation_balance", item_instruments)
+                    _set_object(names, "allocation_pl", item_instruments)
+
+                    rows.append(formula.value_prepare(names))
+
+                rows_custom_fields_names = [{} for _ in items]
+
+                # custom fields may refer to each other, every iteration
+                # evaluates each custom field over the whole chunk
                 for i in range(data["expression_iterations_count"]):
-                    for cf in custom_fields:
-                        if cf["name"] in data["custom_fields_to_calculate"]:
-                            expr = cf["expr"]
-
-                            if expr:
-                                try:
-                                    value = formula.safe_eval(
-                                        expr, names=names, context=self.context
-                                    )
-                                except formula.InvalidExpression:
-                                    value = gettext_lazy("Invalid expression")
-                            else:
-                                value = None
+                    for cf in fields:
+                        expr = cf["expr"]
+
+                        if expr:
+                            values = batch.safe_eval_batch(
+                                expr,
+                                rows,
+                                evaluator=evaluator,
+                                error_value=invalid_expression,
+                            )
+                        else:
+                            values = [None] * len(items)
 
+                        for custom_fields_names, value in zip(rows_custom_fields_names, values):
                             if cf["user_code"] not in custom_fields_names:
                                 custom_fields_names[cf["user_code"]] = value
                             else:
@@ -1222,55 +1261,54 @@ class TransactionReportSerializer(ReportSerializerWithLogs):
                                     cf["user_code"]
                                 ] is None or custom_fields_names[
                                     cf["user_code"]
-                                ] == gettext_lazy("Invalid expression"):
+                                ] == invalid_expression:
                                     custom_fields_names[cf["user_code"]] = value
 
-                    names["custom_fields"] = custom_fields_names
-
-                for key, value in custom_fields_names.items():
-                    for cf in custom_fields:
-                        if cf["user_code"] == key:
-                            expr = cf["expr"]
-
-                            if cf["value_type"] == 10:
-                                if expr:
-                                    try:
-                                        value = formula.safe_eval(
-                                            "str(item)",
-                                            names={"item": value},
-                                            context=self.context,
-                                        )
-                                    except formula.InvalidExpression:
-                                        value = gettext_lazy("Invalid expression")
-                                else:
-                                    value = None
-
-                            elif cf["value_type"] == 20:
-                                if expr:
-                                    try:
-                                        value = formula.safe_eval(
-                                            "float(item)",
-                                            names={"item": value},
-                                            context=self.context,
-                                        )
-                                    except formula.InvalidExpression:
-                                        value = gettext_lazy("Invalid expression")
-                                else:
-                                    value = None
-                            elif cf["value_type"] == 40:
-                                if expr:
-                                    try:
-                                        value = formula.safe_eval(
-                                            "parse_date(item, '%d/%m/%Y')",
-                                            names={"item": value},
-                                            context=self.context,
-                                        )
-                                    except formula.InvalidExpression:
-                                        value = gettext_lazy("Invalid expression")
-                                else:
-                                    value = None
-
-                            item[f"custom_fields.{cf['user_code']}"] = value
+                    for names, custom_fields_names in zip(rows, rows_custom_fields_names):
+                        names["custom_fields"] = custom_fields_names
+
+                for item, custom_fields_names in zip(items, rows_custom_fields_names):
+                    for key, value in custom_fields_names.items():
+                        for cf in custom_fields:
+                            if cf["user_code"] == key:
+                                expr = cf["expr"]
+
+                                if cf["value_type"] == 10:
+                                    if expr:
+                                        try:
+                                            value = evaluator.eval(
+                                                "str(item)", names={"item": value}
+                                            )
+                                        except formula.InvalidExpression:
+                                            value = gettext_lazy("Invalid expression")
+                                    else:
+                                        value = None
+
+                                elif cf["value_type"] == 20:
+                                    if expr:
+                                        try:
+                                            value = evaluator.eval(
+                                                "float(item)", names={"item": value}
+                                            )
+                                        except formula.InvalidExpression:
+                                            value = gettext_lazy("Invalid expression")
+                                    else:
+                                        value = None
+                                elif cf["value_type"] == 40:
+                                    if expr:
+                                        try:
+                                            value = evaluator.eval(
+                                                "parse_date(item, '%d/%m/%Y')", names={"item": value}
+                                            )
+                                        except formula.InvalidExpression:
+                                            value = gettext_lazy("Invalid expression")
+                                    else:
+                                        value = None
+
+                                item[f"custom_fields.{cf['user_code']}"] = value
+
+                if not self.flatten_items:
+                    helper_service.keep_custom_fields(report_items, items, fields)
 
         data["items"] = full_items
         data["serialization_time"] = float(
@@ -1556,6 +1594,8 @@ class PriceHistoryCheckSerializer(ReportSerializerWithLogs):
 
 
 class BackendBalanceReportGroupsSerializer(BalanceReportSerializer):
+    flatten_items = False
+
     def to_representation(self, instance):
         if not instance.frontend_request_options:
             raise serializers.ValidationError("frontend_request_options is required")
@@ -1570,87 +1610,14 @@ class BackendBalanceReportGroupsSerializer(BalanceReportSerializer):
 
         _l.debug("BackendBalanceReportGroupsSerializer.to_representation")
 
-        # settings, unique_key = generate_unique_key(instance, "balance")
-
-        data = super().to_representation(instance)
+        data = get_report_data(instance, super().to_representation)
         log_with_time("Report items are received from parent class")
 
-        log_with_time("Report items converted to full items")
-
-        # if instance.ignore_cache:
-        #
-        #     data = super(BackendBalanceReportGroupsSerializer, self).to_representation(
-        #         instance
-        #     )
-        #
-        #     full_items = helper_service.convert_report_items_to_full_items(data)
-        #
-        # else:
-        #
-        #     try:
-        #
-        #         report_instance = BalanceReportInstance.objects.get(unique_key=unique_key)
-        #
-        #         data = report_instance.data
-        #
-        #         full_items = report_instance.data["items"]
-        #
-        #         data["execution_time"] = float(
-        #             "{:3.3f}".format(time.perf_counter() - to_representation_st)
-        #         )
-        #
-        #     except ObjectDoesNotExist:
-        #
-        #         data = super(BackendBalanceReportGroupsSerializer, self).to_representation(
-        #             instance
-        #         )
-        #
-        #         report_uuid = str(uuid.uuid4())
-        #
-        #         report_instance_name = ""
-        #         if self.instance.report_instance_name:
-        #             report_instance_name = self.instance.report_instance_name
-        #         else:
-        #             report_instance_name = report_uuid
-        #
-        #         report_instance = BalanceReportInstance(
-        #             unique_key=unique_key,
-        #             settings=settings,
-        #             master_user=instance.master_user,
-        #             member=instance.member,
-        #             owner=instance.member,
-        #             user_code=report_instance_name,
-        #             name=report_instance_name,
-        #             short_name=report_instance_name,
-        #             report_date=instance.report_date,
-        #             report_currency=instance.report_currency,
-        #             pricing_policy=instance.pricing_policy,
-        #             cost_method=instance.cost_method,
-        #         )
-        #
-        #         report_instance.report_date = instance.report_date
-        #         report_instance.report_currency = instance.report_currency
-        #         report_instance.pricing_policy = instance.pricing_policy
-        #         report_instance.cost_method = instance.cost_method
-        #
-        #         report_instance.report_uuid = report_uuid
-        #
-        #         data["report_uuid"] = report_uuid
-        #
-        #         full_items = helper_service.convert_report_items_to_full_items(data)
-        #
-        #         data["items"] = full_items
-        #
-        #         report_instance.data = json.loads(json.dumps(data, default=str))
-        #
-        #         if report_instance.data:
-        #             report_instance.save()
-        #
-        #         data["execution_time"] = float(
-        #             "{:3.3f}".format(time.perf_counter() - to_representation_st)
-        #         )
-
-        full_items = data["items"]
+        # only paths used by the request are flattened
+        paths = helper_service.get_referenced_paths(
+            instance.frontend_request_options, instance.calculation_group
+        )
+        full_items = helper_service.convert_report_items_to_path_items(data, paths)
 
         full_items = helper_service.calculate_value_percent(
             full_items, instance.calculation_group, "market_value"
@@ -1663,18 +1630,18 @@ class BackendBalanceReportGroupsSerializer(BalanceReportSerializer):
         log_with_time("calculate_value_percent_exposure")
 
         # filter by previous groups
-        full_items = helper_service.filter(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame(
+            ReportFrame(full_items), instance.frontend_request_options
         )
         log_with_time("helper_service.filter")
 
-        full_items = helper_service.filter_by_groups_filters(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame_by_groups_filters(
+            frame, instance.frontend_request_options
         )
         log_with_time("helper_service.filter_by_groups_filters")
 
-        full_items = helper_service.sort_items(
-            full_items, instance.frontend_request_options
+        frame = helper_service.sort_frame_items(
+            frame, instance.frontend_request_options
         )
         log_with_time("helper_service.sort_items")
 
@@ -1683,8 +1650,8 @@ class BackendBalanceReportGroupsSerializer(BalanceReportSerializer):
 
         group_type = groups_types[len(groups_types) - 1]
 
-        unique_groups = helper_service.get_unique_groups(
-            full_items, group_type, columns
+        unique_groups = helper_service.get_frame_unique_groups(
+            frame, group_type, columns
         )
         log_with_time("helper_service.get_unique_groups")
         unique_groups = helper_service.sort_groups(
@@ -1705,10 +1672,6 @@ class BackendBalanceReportGroupsSerializer(BalanceReportSerializer):
         )
         log_with_time("helper_service.paginate_items")
 
-        # if not instance.ignore_cache:
-        #     data["report_instance_id"] = report_instance.id
-        #     data["created_at"] = report_instance.created_at
-
         data["items"] = groups
         data.pop("item_currencies", [])
         data.pop("item_portfolios", [])
@@ -1734,6 +1697,8 @@ class BackendBalanceReportGroupsSerializer(BalanceReportSerializer):
 
 
 class BackendBalanceReportItemsSerializer(BalanceReportSerializer):
+    flatten_items = False
+
     def to_representation(self, instance):
         if not instance.frontend_request_options:
             raise serializers.ValidationError("frontend_request_options is required")
@@ -1747,71 +1712,14 @@ class BackendBalanceReportItemsSerializer(BalanceReportSerializer):
         helper_service = BackendReportHelperService()
         log_with_time("Starting BackendBalanceReportItemsSerializer.to_representation")
 
-        settings, unique_key = generate_unique_key(instance, "balance")
-        log_with_time("Unique key generated")
+        data = get_report_data(instance, super().to_representation)
+        log_with_time("Report data retrieved")
 
-        data = super().to_representation(instance)
-        log_with_time("Data retrieved without cache")
-
-        # full_items = helper_service.convert_report_items_to_full_items(data)
-        full_items = data["items"]
-        log_with_time("Report items converted to full items without cache")
-
-        # if instance.ignore_cache:
-        #     data = super(BackendBalanceReportItemsSerializer, self).to_representation(instance)
-        #     log_with_time("Data retrieved without cache")
-        #
-        #     full_items = helper_service.convert_report_items_to_full_items(data)
-        #     log_with_time("Report items converted to full items without cache")
-        #
-        # else:
-        #     try:
-        #         report_instance = BalanceReportInstance.objects.get(unique_key=unique_key)
-        #         log_with_time("Report instance retrieved from cache")
-        #
-        #         data = report_instance.data
-        #         full_items = report_instance.data["items"]
-        #         log_with_time("Data and full items loaded from report instance")
-        #
-        #         data["execution_time"] = float("{:3.3f}".format(time.perf_counter() - to_representation_st))
-        #         log_with_time("Execution time added to data from cache")
-        #
-        #     except ObjectDoesNotExist:
-        #         log_with_time("Report instance not found in cache, generating new data")
-        #
-        #         data = super(BackendBalanceReportItemsSerializer, self).to_representation(instance)
-        #         report_uuid = str(uuid.uuid4())
-        #         report_instance_name = self.instance.report_instance_name or report_uuid
-        #
-        #         report_instance = BalanceReportInstance(
-        #             unique_key=unique_key,
-        #             settings=settings,
-        #             master_user=instance.master_user,
-        #             member=instance.member,
-        #             owner=instance.member,
-        #             user_code=report_instance_name,
-        #             name=report_instance_name,
-        #             short_name=report_instance_name,
-        #             report_date=instance.report_date,
-        #             report_currency=instance.report_currency,
-        #             pricing_policy=instance.pricing_policy,
-        #             cost_method=instance.cost_method,
-        #         )
-        #
-        #         data["report_uuid"] = report_uuid
-        #         full_items = helper_service.convert_report_items_to_full_items(data)
-        #         data["items"] = full_items
-        #         log_with_time("New report instance data and items prepared")
-        #
-        #         report_instance.data = json.loads(json.dumps(data, default=str))
-        #         log_with_time("Data serialized to JSON")
-        #
-        #         if report_instance.data:
-        #             report_instance.save()
-        #             log_with_time("Report instance saved to database")
-        #
-        #         data["execution_time"] = float("{:3.3f}".format(time.perf_counter() - to_representation_st))
-        #         log_with_time("Execution time added to newly generated data")
+        # only paths used by the request are flattened
+        paths = helper_service.get_referenced_paths(
+            instance.frontend_request_options, instance.calculation_group
+        )
+        full_items = helper_service.convert_report_items_to_path_items(data, paths)
 
         # Processing full_items with various helper_service methods
         full_items = helper_service.calculate_value_percent(
@@ -1824,22 +1732,22 @@ class BackendBalanceReportItemsSerializer(BalanceReportSerializer):
         )
         log_with_time("Exposure percent calculated")
 
-        full_items = helper_service.filter(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame(
+            ReportFrame(full_items), instance.frontend_request_options
         )
         log_with_time("Items filtered based on frontend request options")
 
-        full_items = helper_service.filter_by_groups_filters(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame_by_groups_filters(
+            frame, instance.frontend_request_options
         )
         log_with_time("Items filtered by group filters")
 
-        full_items = helper_service.sort_items(
-            full_items, instance.frontend_request_options
+        frame = helper_service.sort_frame_items(
+            frame, instance.frontend_request_options
         )
         log_with_time("Items sorted based on frontend request options")
 
-        data["count"] = len(full_items)
+        data["count"] = len(frame)
         log_with_time("Item count added to data")
 
         # if not instance.ignore_cache:
@@ -1847,9 +1755,10 @@ class BackendBalanceReportItemsSerializer(BalanceReportSerializer):
         #     data["created_at"] = report_instance.created_at
         #     log_with_time("Report instance ID and creation date added to data")
 
-        data["items"] = helper_service.paginate_items(
-            full_items, {"page_size": instance.page_size, "page": instance.page}
+        rows = helper_service.paginate_items(
+            frame.rows, {"page_size": instance.page_size, "page": instance.page}
         )
+        data["items"] = helper_service.get_full_items_by_rows(data, full_items, rows)
         log_with_time("Items paginated")
 
         for item in data["items"]:
@@ -1878,6 +1787,8 @@ class BackendBalanceReportItemsSerializer(BalanceReportSerializer):
 
 
 class BackendPLReportGroupsSerializer(PLReportSerializer):
+    flatten_items = False
+
     def to_representation(self, instance):
         if not instance.frontend_request_options:
             raise serializers.ValidationError("frontend_request_options is required")
@@ -1886,100 +1797,35 @@ class BackendPLReportGroupsSerializer(PLReportSerializer):
 
         helper_service = BackendReportHelperService()
 
-        settings, unique_key = generate_unique_key(instance, "pnl")
-
         _l.info(f"pnl.serializer {instance.pl_first_date}")
 
-        report_instance = None
-        if instance.ignore_cache:
-            data = super().to_representation(instance)
-
-            # full_items = helper_service.convert_report_items_to_full_items(data)
-            full_items = data["items"]
-
-        else:
-            try:
-                report_instance = PLReportInstance.objects.get(unique_key=unique_key)
-
-                data = report_instance.data
-
-                full_items = report_instance.data["items"]
-
-                data["execution_time"] = float(
-                    "{:3.3f}".format(time.perf_counter() - to_representation_st)
-                )
-
-            except ObjectDoesNotExist:
-                data = super().to_representation(instance)
-
-                report_uuid = str(uuid.uuid4())
-
-                if self.instance.report_instance_name:
-                    report_instance_name = self.instance.report_instance_name
-                else:
-                    report_instance_name = report_uuid
-
-                report_instance = PLReportInstance(
-                    unique_key=unique_key,
-                    settings=settings,
-                    master_user=instance.master_user,
-                    member=instance.member,
-                    owner=instance.member,
-                    user_code=report_instance_name,
-                    name=report_instance_name,
-                    short_name=report_instance_name,
-                    report_date=instance.report_date,
-                    pl_first_date=instance.pl_first_date,
-                    report_currency=instance.report_currency,
-                    pricing_policy=instance.pricing_policy,
-                    cost_method=instance.cost_method,
-                )
-
-                report_instance.report_uuid = report_uuid
-                report_instance.report_date = instance.report_date
-                report_instance.pl_first_date = instance.pl_first_date
-                report_instance.report_currency = instance.report_currency
-                report_instance.pricing_policy = instance.pricing_policy
-                report_instance.cost_method = instance.cost_method
-
-                report_instance.report_uuid = report_uuid
+        data = get_report_data(instance, super().to_representation)
 
-                data["report_uuid"] = report_uuid
+        data["report_uuid"] = str(uuid.uuid4())
 
-                # full_items = helper_service.convert_report_items_to_full_items(data)
-                full_items = data["items"]
-
-                data["execution_time"] = float(
-                    "{:3.3f}".format(time.perf_counter() - to_representation_st)
-                )
-
-                data["items"] = full_items
-
-                # TODO consider something more logical, we got here date conversion error
-                report_instance.data = json.loads(json.dumps(data, default=str))
-
-                if report_instance.data:
-                    report_instance.save()
-
-        if not instance.ignore_cache and report_instance:
-            data["report_instance_id"] = report_instance.id
-            data["created_at"] = report_instance.created_at
+        # only paths used by the request are flattened
+        paths = helper_service.get_referenced_paths(
+            instance.frontend_request_options, instance.calculation_group
+        )
+        full_items = helper_service.convert_report_items_to_path_items(data, paths)
 
         _l.debug("BackendBalanceReportGroupsSerializer.to_representation")
 
         # filter by previous groups
-        full_items = helper_service.filter(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame(
+            ReportFrame(full_items), instance.frontend_request_options
         )
-        full_items = helper_service.calculate_value_percent(
-            full_items, instance.calculation_group, "market_value"
+        helper_service.calculate_value_percent(
+            frame.items(), instance.calculation_group, "market_value"
         )
-        full_items = helper_service.calculate_value_percent(
-            full_items, instance.calculation_group, "exposure"
+        helper_service.calculate_value_percent(
+            frame.items(), instance.calculation_group, "exposure"
         )
+        # percents are added to the items, so columns are made after that
+        frame = ReportFrame(full_items, rows=frame.rows)
 
-        full_items = helper_service.filter_by_groups_filters(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame_by_groups_filters(
+            frame, instance.frontend_request_options
         )
 
         # _l.debug('instance.frontend_request_options %s' % instance.frontend_request_options)
@@ -1990,8 +1836,8 @@ class BackendPLReportGroupsSerializer(PLReportSerializer):
 
         group_type = groups_types[len(groups_types) - 1]
 
-        unique_groups = helper_service.get_unique_groups(
-            full_items, group_type, columns
+        unique_groups = helper_service.get_frame_unique_groups(
+            frame, group_type, columns
         )
         unique_groups = helper_service.sort_groups(
             unique_groups, instance.frontend_request_options
@@ -2030,6 +1876,8 @@ class BackendPLReportGroupsSerializer(PLReportSerializer):
 
 
 class BackendPLReportItemsSerializer(PLReportSerializer):
+    flatten_items = False
+
     def to_representation(self, instance):
         if not instance.frontend_request_options:
             raise serializers.ValidationError("frontend_request_options is required")
@@ -2038,112 +1886,50 @@ class BackendPLReportItemsSerializer(PLReportSerializer):
 
         helper_service = BackendReportHelperService()
 
-        settings, unique_key = generate_unique_key(instance, "pnl")
-
-        report_instance = None
-        if instance.ignore_cache:
-            data = super().to_representation(instance)
-
-            # full_items = helper_service.convert_report_items_to_full_items(data)
-            full_items = data["items"]
-
-        else:
-            try:
-                if instance.ignore_cache:
-                    raise ObjectDoesNotExist
-
-                report_instance = PLReportInstance.objects.get(unique_key=unique_key)
-
-                data = report_instance.data
-
-                full_items = report_instance.data["items"]
-
-            except ObjectDoesNotExist:
-                data = super().to_representation(instance)
-
-                report_uuid = str(uuid.uuid4())
+        data = get_report_data(instance, super().to_representation)
 
-                report_instance_name = ""
-                if self.instance.report_instance_name:
-                    report_instance_name = self.instance.report_instance_name
-                else:
-                    report_instance_name = report_uuid
+        data["report_uuid"] = str(uuid.uuid4())
 
-                report_instance = PLReportInstance(
-                    unique_key=unique_key,
-                    settings=settings,
-                    master_user=instance.master_user,
-                    member=instance.member,
-                    owner=instance.member,
-                    user_code=report_instance_name,
-                    name=report_instance_name,
-                    short_name=report_instance_name,
-                    report_date=instance.report_date,
-                    pl_first_date=instance.pl_first_date,
-                    report_currency=instance.report_currency,
-                    pricing_policy=instance.pricing_policy,
-                    cost_method=instance.cost_method,
-                )
-
-                report_instance.report_uuid = report_uuid
-                report_instance.report_date = instance.report_date
-                report_instance.pl_first_date = instance.pl_first_date
-                report_instance.report_currency = instance.report_currency
-                report_instance.pricing_policy = instance.pricing_policy
-                report_instance.cost_method = instance.cost_method
-
-                report_instance.report_uuid = report_uuid
-
-                data["report_uuid"] = report_uuid
-
-                full_items = data["items"]
-
-                # full_items = helper_service.convert_report_items_to_full_items(data)
-
-                # data["items"] = full_items
-
-                report_instance.data = json.loads(
-                    json.dumps(data, default=str)
-                )  # TODO consider something more logical, we got here date conversion error
-
-                if report_instance.data:
-                    report_instance.save()
-
-        if not instance.ignore_cache and report_instance:
-            data["report_instance_id"] = report_instance.id
-            data["created_at"] = report_instance.created_at
+        # only paths used by the request are flattened
+        paths = helper_service.get_referenced_paths(
+            instance.frontend_request_options, instance.calculation_group
+        )
+        full_items = helper_service.convert_report_items_to_path_items(data, paths)
 
         _l.debug("BackendBalanceReportItemsSerializer.to_representation")
 
         _l.debug(f"PL BEFORE ALL FILTERS full_items len {len(full_items)}")
-        full_items = helper_service.filter(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame(
+            ReportFrame(full_items), instance.frontend_request_options
         )
-        full_items = helper_service.calculate_value_percent(
-            full_items, instance.calculation_group, "market_value"
+        helper_service.calculate_value_percent(
+            frame.items(), instance.calculation_group, "market_value"
         )
-        full_items = helper_service.calculate_value_percent(
-            full_items, instance.calculation_group, "exposure"
+        helper_service.calculate_value_percent(
+            frame.items(), instance.calculation_group, "exposure"
         )
+        # percents are added to the items, so columns are made after that
+        frame = ReportFrame(full_items, rows=frame.rows)
 
-        _l.debug(f"PL BEFORE ALL GLOBAL FILTER full_items len {len(full_items)}")
-        full_items = helper_service.filter_by_groups_filters(
-            full_items, instance.frontend_request_options
+        _l.debug(f"PL BEFORE ALL GLOBAL FILTER full_items len {len(frame)}")
+        frame = helper_service.filter_frame_by_groups_filters(
+            frame, instance.frontend_request_options
         )
-        full_items = helper_service.sort_items(
-            full_items, instance.frontend_request_options
+        frame = helper_service.sort_frame_items(
+            frame, instance.frontend_request_options
         )
-        _l.debug(f"PL BEFORE AFTER ALL FILTERS full_items len {len(full_items)}")
+        _l.debug(f"PL BEFORE AFTER ALL FILTERS full_items len {len(frame)}")
 
-        data["count"] = len(full_items)
+        data["count"] = len(frame)
 
-        data["items"] = helper_service.paginate_items(
-            full_items,
+        rows = helper_service.paginate_items(
+            frame.rows,
             {
                 "page_size": instance.page_size,
                 "page": instance.page,
             },
         )
+        data["items"] = helper_service.get_full_items_by_rows(data, full_items, rows)
         data.pop("item_currencies", [])
         data.pop("item_portfolios", [])
         data.pop("item_instruments", [])
@@ -2163,6 +1949,8 @@ class BackendPLReportItemsSerializer(PLReportSerializer):
 
 
 class BackendTransactionReportGroupsSerializer(TransactionReportSerializer):
+    flatten_items = False
+
     def to_representation(self, instance):
         if not instance.frontend_request_options:
             raise serializers.ValidationError("frontend_request_options is required")
@@ -2171,13 +1959,15 @@ class BackendTransactionReportGroupsSerializer(TransactionReportSerializer):
 
         helper_service = BackendReportHelperService()
 
-        data = super().to_representation(instance)
+        data = get_report_data(instance, super().to_representation)
 
         report_uuid = str(uuid.uuid4())
 
         data["report_uuid"] = report_uuid
 
-        full_items = data["items"]
+        # only paths used by the request are flattened
+        paths = helper_service.get_referenced_paths(instance.frontend_request_options)
+        full_items = helper_service.convert_report_items_to_path_items(data, paths)
         # full_items = helper_service.convert_report_items_to_full_items(data)
 
         # data["items"] = full_items
@@ -2185,11 +1975,11 @@ class BackendTransactionReportGroupsSerializer(TransactionReportSerializer):
         _l.debug("BackendTransactionReportGroupsSerializer.to_representation")
 
         # filter by previous groups
-        full_items = helper_service.filter(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame(
+            ReportFrame(full_items), instance.frontend_request_options
         )
-        full_items = helper_service.filter_by_groups_filters(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame_by_groups_filters(
+            frame, instance.frontend_request_options
         )
 
         groups_types = instance.frontend_request_options["groups_types"]
@@ -2197,8 +1987,8 @@ class BackendTransactionReportGroupsSerializer(TransactionReportSerializer):
 
         group_type = groups_types[len(groups_types) - 1]
 
-        unique_groups = helper_service.get_unique_groups(
-            full_items, group_type, columns
+        unique_groups = helper_service.get_frame_unique_groups(
+            frame, group_type, columns
         )
         unique_groups = helper_service.sort_groups(
             unique_groups, instance.frontend_request_options
@@ -2242,6 +2032,8 @@ class BackendTransactionReportGroupsSerializer(TransactionReportSerializer):
 
 
 class BackendTransactionReportItemsSerializer(TransactionReportSerializer):
+    flatten_items = False
+
     def to_representation(self, instance):
         _l.debug("BackendTransactionReportItemsSerializer.to_representation")
 
@@ -2252,35 +2044,38 @@ class BackendTransactionReportItemsSerializer(TransactionReportSerializer):
 
         helper_service = BackendReportHelperService()
 
-        data = super().to_representation(instance)
+        data = get_report_data(instance, super().to_representation)
         report_uuid = str(uuid.uuid4())
 
         data["report_uuid"] = report_uuid
-        full_items = data["items"]
+        # only paths used by the request are flattened
+        paths = helper_service.get_referenced_paths(instance.frontend_request_options)
+        full_items = helper_service.convert_report_items_to_path_items(data, paths)
         # full_items = helper_service.convert_report_items_to_full_items(data)
         # data["items"] = full_items
 
-        full_items = helper_service.filter(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame(
+            ReportFrame(full_items), instance.frontend_request_options
         )
-        full_items = helper_service.filter_by_groups_filters(
-            full_items, instance.frontend_request_options
+        frame = helper_service.filter_frame_by_groups_filters(
+            frame, instance.frontend_request_options
         )
-        full_items = helper_service.sort_items(
-            full_items, instance.frontend_request_options
+        frame = helper_service.sort_frame_items(
+            frame, instance.frontend_request_options
         )
 
-        _l.debug(f"full items?? {len(full_items)}")
+        _l.debug(f"full items?? {len(frame)}")
 
-        data["count"] = len(full_items)
+        data["count"] = len(frame)
 
-        data["items"] = helper_service.paginate_items(
-            full_items,
+        rows = helper_service.paginate_items(
+            frame.rows,
             {
                 "page_size": instance.page_size,
                 "page": instance.page,
             },
         )
+        data["items"] = helper_service.get_full_items_by_rows(data, full_items, rows)
 
         data.pop("item_currencies", [])
         data.pop("item_portfolios", [])
@@ -339,327 +339,297 @@ def serialize_transaction_report_item(item):
     return result
 
 
-def serialize_balance_report_item(item):
-    result = {
-        # "id": ','.join(str(x) for x in item['pk']),
-        "id": "-",
-        "name": item["name"],
-        "short_name": item["short_name"],
-        "user_code": item["user_code"],
-        "portfolio": item["portfolio_id"],
-        "item_type": item["item_type"],
-        "item_type_name": item["item_type_name"],
-    }
-
-    if item["instrument_id"] == -1:
-        result["instrument"] = None
-    else:
-        result["instrument"] = item["instrument_id"]
-
-    if item["currency_id"] == -1:
-        result["currency"] = None
-    else:
-        result["currency"] = item["currency_id"]
-
-    if item["pricing_currency_id"] == -1:
-        result["pricing_currency"] = None
-    else:
-        result["pricing_currency"] = item["pricing_currency_id"]
+# serialized key and key of the report item
+BALANCE_REPORT_ITEM_FIELDS = (
+    ("name", "name"),
+    ("short_name", "short_name"),
+    ("user_code", "user_code"),
+    ("portfolio", "portfolio_id"),
+    ("item_type", "item_type"),
+    ("item_type_name", "item_type_name"),
+    ("instrument", "instrument_id"),
+    ("currency", "currency_id"),
+    ("pricing_currency", "pricing_currency_id"),
+    ("exposure_currency", "exposure_currency_id"),
+    ("allocation", "allocation_pl_id"),
+    ("instrument_pricing_currency_fx_rate", "instrument_pricing_currency_fx_rate"),
+    ("instrument_accrued_currency_fx_rate", "instrument_accrued_currency_fx_rate"),
+    ("instrument_principal_price", "instrument_principal_price"),
+    ("instrument_accrued_price", "instrument_accrued_price"),
+    ("instrument_factor", "instrument_factor"),
+    ("instrument_ytm", "instrument_ytm"),
+    ("daily_price_change", "daily_price_change"),
+    ("account", "account_position_id"),
+    ("strategy1", "strategy1_position_id"),
+    ("strategy2", "strategy2_position_id"),
+    ("strategy3", "strategy3_position_id"),
+    ("fx_rate", "fx_rate"),
+    ("position_size", "position_size"),
+    ("nominal_position_size", "nominal_position_size"),
+    ("market_value", "market_value"),
+    ("market_value_loc", "market_value_loc"),
+    ("exposure", "exposure"),
+    ("exposure_loc", "exposure_loc"),
+    ("ytm", "ytm"),
+    ("ytm_at_cost", "ytm_at_cost"),
+    ("modified_duration", "modified_duration"),
+    ("return_annually", "return_annually"),
+    ("return_annually_fixed", "return_annually_fixed"),
+    ("position_return", "position_return"),
+    ("position_return_loc", "position_return_loc"),
+    ("net_position_return", "net_position_return"),
+    ("net_position_return_loc", "net_position_return_loc"),
+    ("position_return_fixed", "position_return_fixed"),
+    ("position_return_fixed_loc", "position_return_fixed_loc"),
+    ("net_position_return_fixed", "net_position_return_fixed"),
+    ("net_position_return_fixed_loc", "net_position_return_fixed_loc"),
+    ("net_cost_price", "net_cost_price"),
+    ("net_cost_price_loc", "net_cost_price_loc"),
+    ("gross_cost_price", "gross_cost_price"),
+    ("gross_cost_price_loc", "gross_cost_price_loc"),
+    ("principal_invested", "principal_invested"),
+    ("principal_invested_loc", "principal_invested_loc"),
+    ("amount_invested", "amount_invested"),
+    ("amount_invested_loc", "amount_invested_loc"),
+    ("principal_invested_fixed", "principal_invested_fixed"),
+    ("principal_invested_fixed_loc", "principal_invested_fixed_loc"),
+    ("amount_invested_fixed", "amount_invested_fixed"),
+    ("amount_invested_fixed_loc", "amount_invested_fixed_loc"),
+    ("time_invested", "time_invested"),
+    ("principal", "principal"),
+    ("carry", "carry"),
+    ("overheads", "overheads"),
+    ("total", "total"),
+    ("principal_fx", "principal_fx"),
+    ("carry_fx", "carry_fx"),
+    ("overheads_fx", "overheads_fx"),
+    ("total_fx", "total_fx"),
+    ("principal_fixed", "principal_fixed"),
+    ("carry_fixed", "carry_fixed"),
+    ("overheads_fixed", "overheads_fixed"),
+    ("total_fixed", "total_fixed"),
+    ("principal_loc", "principal_loc"),
+    ("carry_loc", "carry_loc"),
+    ("overheads_loc", "overheads_loc"),
+    ("total_loc", "total_loc"),
+    ("principal_fx_loc", "principal_fx_loc"),
+    ("carry_fx_loc", "carry_fx_loc"),
+    ("overheads_fx_loc", "overheads_fx_loc"),
+    ("total_fx_loc", "total_fx_loc"),
+    ("principal_fixed_loc", "principal_fixed_loc"),
+    ("carry_fixed_loc", "carry_fixed_loc"),
+    ("overheads_fixed_loc", "overheads_fixed_loc"),
+    ("total_fixed_loc", "total_fixed_loc"),
+)
+PL_REPORT_ITEM_FIELDS = (
+    ("name", "name"),
+    ("short_name", "short_name"),
+    ("user_code", "user_code"),
+    ("portfolio", "portfolio_id"),
+    ("item_type", "item_type"),
+    ("item_type_name", "item_type_name"),
+    ("item_group", "item_group"),
+    ("item_group_code", "item_group_code"),
+    ("item_group_name", "item_group_name"),
+    ("instrument", "instrument_id"),
+    ("pricing_currency", "pricing_currency_id"),
+    ("exposure_currency", "exposure_currency_id"),
+    ("allocation", "allocation_pl_id"),
+    ("account", "account_position_id"),
+    ("strategy1", "strategy1_position_id"),
+    ("strategy2", "strategy2_position_id"),
+    ("strategy3", "strategy3_position_id"),
+    ("instrument_pricing_currency_fx_rate", "instrument_pricing_currency_fx_rate"),
+    ("instrument_accrued_currency_fx_rate", "instrument_accrued_currency_fx_rate"),
+    ("instrument_principal_price", "instrument_principal_price"),
+    ("instrument_accrued_price", "instrument_accrued_price"),
+    ("instrument_factor", "instrument_factor"),
+    ("instrument_ytm", "instrument_ytm"),
+    ("daily_price_change", "daily_price_change"),
+    ("position_size", "position_size"),
+    ("nominal_position_size", "nominal_position_size"),
+    ("period_start_position_size", "period_start_position_size"),
+    ("period_start_nominal_position_size", "period_start_nominal_position_size"),
+    ("position_return", "position_return"),
+    ("position_return_loc", "position_return_loc"),
+    ("net_position_return", "net_position_return"),
+    ("net_position_return_loc", "net_position_return_loc"),
+    ("position_return_fixed", "position_return_fixed"),
+    ("position_return_fixed_loc", "position_return_fixed_loc"),
+    ("net_position_return_fixed", "net_position_return_fixed"),
+    ("net_position_return_fixed_loc", "net_position_return_fixed_loc"),
+    ("net_cost_price", "net_cost_price"),
+    ("net_cost_price_loc", "net_cost_price_loc"),
+    ("gross_cost_price", "gross_cost_price"),
+    ("gross_cost_price_loc", "gross_cost_price_loc"),
+    ("principal_invested_fixed", "principal_invested_fixed"),
+    ("principal_invested_fixed_loc", "principal_invested_fixed_loc"),
+    ("amount_invested_fixed", "amount_invested_fixed"),
+    ("amount_invested_fixed_loc", "amount_invested_fixed_loc"),
+    ("time_invested", "time_invested"),
+    ("mismatch", "mismatch"),
+    ("ytm", "ytm"),
+    ("ytm_at_cost", "ytm_at_cost"),
+    ("market_value", "market_value"),
+    ("market_value_loc", "market_value_loc"),
+    ("exposure", "exposure"),
+    ("exposure_loc", "exposure_loc"),
+    ("principal", "principal"),
+    ("carry", "carry"),
+    ("overheads", "overheads"),
+    ("total", "total"),
+    ("principal_fx", "principal_fx"),
+    ("carry_fx", "carry_fx"),
+    ("overheads_fx", "overheads_fx"),
+    ("total_fx", "total_fx"),
+    ("principal_fixed", "principal_fixed"),
+    ("carry_fixed", "carry_fixed"),
+    ("overheads_fixed", "overheads_fixed"),
+    ("total_fixed", "total_fixed"),
+    ("principal_loc", "principal_loc"),
+    ("carry_loc", "carry_loc"),
+    ("overheads_loc", "overheads_loc"),
+    ("total_loc", "total_loc"),
+    ("principal_fx_loc", "principal_fx_loc"),
+    ("carry_fx_loc", "carry_fx_loc"),
+    ("overheads_fx_loc", "overheads_fx_loc"),
+    ("total_fx_loc", "total_fx_loc"),
+    ("principal_fixed_loc", "principal_fixed_loc"),
+    ("carry_fixed_loc", "carry_fixed_loc"),
+    ("overheads_fixed_loc", "overheads_fixed_loc"),
+    ("total_fixed_loc", "total_fixed_loc"),
+)
+# relations with -1 id are serialized as None
+REPORT_ITEM_RELATIONS = {
+    "instrument",
+    "currency",
+    "pricing_currency",
+    "exposure_currency",
+    "allocation",
+}
+
+
+def _serialize_report_item_columns(items, fields):
+    """Serialized values of items by keys, one column at a time"""
+    columns = {}
+
+    for key, item_key in fields:
+        if key in REPORT_ITEM_RELATIONS:
+            columns[key] = [
+                None if item[item_key] == -1 else item[item_key] for item in items
+            ]
+        else:
+            columns[key] = [item[item_key] for item in items]
+
+    return columns
+
+
+def _join_report_items(ids, columns):
+    keys = ("id", *columns)
+    return [dict(zip(keys, row)) for row in zip(ids, *columns.values())]
+
+
+def _get_balance_report_item_id(
+    item_type, instrument, currency, portfolio, account, strategy1, strategy2, strategy3
+):
+    ids = [str(item_type)]
+
+    if item_type == 1:  # instrument
+        ids.append(str(instrument))
+
+    if item_type == 2:  # currency
+        ids.append(str(currency))
+
+    ids.extend(
+        [str(portfolio), str(account), str(strategy1), str(strategy2), str(strategy3)]
+    )
 
-    if item["exposure_currency_id"] == -1:
-        result["exposure_currency"] = None
-    else:
-        result["exposure_currency"] = item["exposure_currency_id"]
+    return ",".join(ids)
 
-    if item["allocation_pl_id"] == -1:
-        result["allocation"] = None
-    else:
-        result["allocation"] = item["allocation_pl_id"]
 
-    # Check if logic is right
-    result["instrument_pricing_currency_fx_rate"] = item[
-        "instrument_pricing_currency_fx_rate"
-    ]
-    result["instrument_accrued_currency_fx_rate"] = item[
-        "instrument_accrued_currency_fx_rate"
+def serialize_balance_report_items(items):
+    columns = _serialize_report_item_columns(items, BALANCE_REPORT_ITEM_FIELDS)
+    ids = [
+        _get_balance_report_item_id(*values)
+        for values in zip(
+            columns["item_type"],
+            columns["instrument"],
+            columns["currency"],
+            columns["portfolio"],
+            columns["account"],
+            columns["strategy1"],
+            columns["strategy2"],
+            columns["strategy3"],
+        )
     ]
-    result["instrument_principal_price"] = item["instrument_principal_price"]
-    result["instrument_accrued_price"] = item["instrument_accrued_price"]
-    result["instrument_factor"] = item["instrument_factor"]
-    result["instrument_ytm"] = item["instrument_ytm"]
-    result["daily_price_change"] = item["daily_price_change"]
-
-    result["account"] = item["account_position_id"]
-
-    result["strategy1"] = item["strategy1_position_id"]
-    result["strategy2"] = item["strategy2_position_id"]
-    result["strategy3"] = item["strategy3_position_id"]
-
-    ids = []
-    ids.append(str(result["item_type"]))  # if of item type
-
-    if item["item_type"] == 1:
-        ids.append(str(result["instrument"]))  # id of instrument
-
-    if item["item_type"] == 2:
-        ids.append(str(result["currency"]))  # id of currency
-
-    ids.append(str(result["portfolio"]))
-    ids.append(str(result["account"]))
-    ids.append(str(result["strategy1"]))
-    ids.append(str(result["strategy2"]))
-    ids.append(str(result["strategy3"]))
-
-    result["id"] = ",".join(ids)
-
-    # result["pricing_currency"] = item["pricing_currency_id"]
-    # result["currency"] = None
-
-    result["fx_rate"] = item["fx_rate"]
-
-    result["position_size"] = item["position_size"]
-    result["nominal_position_size"] = item["nominal_position_size"]
-
-    result["market_value"] = item["market_value"]
-    result["market_value_loc"] = item["market_value_loc"]
-    result["exposure"] = item["exposure"]
-    result["exposure_loc"] = item["exposure_loc"]
-
-    result["ytm"] = item["ytm"]
-    result["ytm_at_cost"] = item["ytm_at_cost"]
-    result["modified_duration"] = item["modified_duration"]
-    result["return_annually"] = item["return_annually"]
-    result["return_annually_fixed"] = item["return_annually_fixed"]
 
-    result["position_return"] = item["position_return"]
-    result["position_return_loc"] = item["position_return_loc"]
-    result["net_position_return"] = item["net_position_return"]
-    result["net_position_return_loc"] = item["net_position_return_loc"]
+    return _join_report_items(ids, columns)
 
-    result["position_return_fixed"] = item["position_return_fixed"]
-    result["position_return_fixed_loc"] = item["position_return_fixed_loc"]
-    result["net_position_return_fixed"] = item["net_position_return_fixed"]
-    result["net_position_return_fixed_loc"] = item["net_position_return_fixed_loc"]
 
-    result["net_cost_price"] = item["net_cost_price"]
-    result["net_cost_price_loc"] = item["net_cost_price_loc"]
-    result["gross_cost_price"] = item["gross_cost_price"]
-    result["gross_cost_price_loc"] = item["gross_cost_price_loc"]
-
-    result["principal_invested"] = item["principal_invested"]
-    result["principal_invested_loc"] = item["principal_invested_loc"]
-
-    result["amount_invested"] = item["amount_invested"]
-    result["amount_invested_loc"] = item["amount_invested_loc"]
-
-    result["principal_invested_fixed"] = item["principal_invested_fixed"]
-    result["principal_invested_fixed_loc"] = item["principal_invested_fixed_loc"]
-
-    result["amount_invested_fixed"] = item["amount_invested_fixed"]
-    result["amount_invested_fixed_loc"] = item["amount_invested_fixed_loc"]
-
-    result["time_invested"] = item["time_invested"]
-    result["return_annually"] = item["return_annually"]
-    result["return_annually_fixed"] = item["return_annually_fixed"]
-
-    # performance
-
-    result["principal"] = item["principal"]
-    result["carry"] = item["carry"]
-    result["overheads"] = item["overheads"]
-    result["total"] = item["total"]
-
-    result["principal_fx"] = item["principal_fx"]
-    result["carry_fx"] = item["carry_fx"]
-    result["overheads_fx"] = item["overheads_fx"]
-    result["total_fx"] = item["total_fx"]
-
-    result["principal_fixed"] = item["principal_fixed"]
-    result["carry_fixed"] = item["carry_fixed"]
-    result["overheads_fixed"] = item["overheads_fixed"]
-    result["total_fixed"] = item["total_fixed"]
-
-    # loc started
-
-    result["principal_loc"] = item["principal_loc"]
-    result["carry_loc"] = item["carry_loc"]
-    result["overheads_loc"] = item["overheads_loc"]
-    result["total_loc"] = item["total_loc"]
-
-    result["principal_fx_loc"] = item["principal_fx_loc"]
-    result["carry_fx_loc"] = item["carry_fx_loc"]
-    result["overheads_fx_loc"] = item["overheads_fx_loc"]
-    result["total_fx_loc"] = item["total_fx_loc"]
-
-    result["principal_fixed_loc"] = item["principal_fixed_loc"]
-    result["carry_fixed_loc"] = item["carry_fixed_loc"]
-    result["overheads_fixed_loc"] = item["overheads_fixed_loc"]
-    result["total_fixed_loc"] = item["total_fixed_loc"]
-
-    return result
-
-
-def serialize_pl_report_item(item):
-    result = {
-        # "id": ','.join(str(x) for x in item['pk']),
-        "id": "-",
-        "name": item["name"],
-        "short_name": item["short_name"],
-        "user_code": item["user_code"],
-        "portfolio": item["portfolio_id"],
-        "item_type": item["item_type"],
-        "item_type_name": item["item_type_name"],
-        "item_group": item["item_group"],
-        "item_group_code": item["item_group_code"],
-        "item_group_name": item["item_group_name"],
-    }
-
-    # if item["item_type"] == 1:  # instrument
-    if item["instrument_id"] == -1:
-        result["instrument"] = None
-    else:
-        result["instrument"] = item["instrument_id"]
-
-    if item["pricing_currency_id"] == -1:
-        result["pricing_currency"] = None
-    else:
-        result["pricing_currency"] = item["pricing_currency_id"]
-
-    if item["exposure_currency_id"] == -1:
-        result["exposure_currency"] = None
-    else:
-        result["exposure_currency"] = item["exposure_currency_id"]
-
-    if item["allocation_pl_id"] == -1:
-        result["allocation"] = None
-    else:
-        result["allocation"] = item["allocation_pl_id"]
-
-    result["account"] = item["account_position_id"]
-
-    result["strategy1"] = item["strategy1_position_id"]
-    result["strategy2"] = item["strategy2_position_id"]
-    result["strategy3"] = item["strategy3_position_id"]
-
-    # result["pricing_currency"] = item["pricing_currency_id"]
-    # result["currency"] = None
-
-    ids = []
-
-    ids.append(str(item["item_type"]))
-    ids.append(str(item["item_group"]))
-
-    if item["item_type"] == 1:  # instrument
-        ids.append(str(result["instrument"]))
-
-    if item["item_type"] == 3:  # FX Variations
-        ids.append(str(result["name"]))
-
-    if item["item_type"] == 4:  # FX Trades
-        ids.append(str(result["name"]))
-
-    if item["item_type"] == 5:
-        ids.append(str(result["name"]))
-
-    if item["item_type"] == 6:  # mismatch
-        ids.append(str(result["instrument"]))
-
-    ids.append(str(result["portfolio"]))
-    ids.append(str(result["account"]))
-    ids.append(str(result["strategy1"]))
-    ids.append(str(result["strategy2"]))
-    ids.append(str(result["strategy3"]))
-    ids.append(str(result["allocation"]))
-
-    result["id"] = ",".join(ids)
+def serialize_balance_report_item(item):
+    return serialize_balance_report_items([item])[0]
+
+
+def _get_pl_report_item_id(
+    item_type,
+    item_group,
+    instrument,
+    name,
+    portfolio,
+    account,
+    strategy1,
+    strategy2,
+    strategy3,
+    allocation,
+):
+    ids = [str(item_type), str(item_group)]
+
+    if item_type == 1:  # instrument
+        ids.append(str(instrument))
+
+    if item_type in (3, 4, 5):  # FX Variations, FX Trades, Transaction PL
+        ids.append(str(name))
+
+    if item_type == 6:  # mismatch
+        ids.append(str(instrument))
+
+    ids.extend(
+        [
+            str(portfolio),
+            str(account),
+            str(strategy1),
+            str(strategy2),
+            str(strategy3),
+            str(allocation),
+        ]
+    )
 
-    result["instrument_pricing_currency_fx_rate"] = item[
-        "instrument_pricing_currency_fx_rate"
-    ]
-    result["instrument_accrued_currency_fx_rate"] = item[
-        "instrument_accrued_currency_fx_rate"
-    ]
-    result["instrument_principal_price"] = item["instrument_principal_price"]
-    result["instrument_accrued_price"] = item["instrument_accrued_price"]
-    result["instrument_factor"] = item["instrument_factor"]
-    result["instrument_ytm"] = item["instrument_ytm"]
-    result["daily_price_change"] = item["daily_price_change"]
+    return ",".join(ids)
 
-    #
-    result["position_size"] = item["position_size"]
-    result["nominal_position_size"] = item["nominal_position_size"]
 
-    result["period_start_position_size"] = item["period_start_position_size"]
-    result["period_start_nominal_position_size"] = item[
-        "period_start_nominal_position_size"
+def serialize_pl_report_items(items):
+    columns = _serialize_report_item_columns(items, PL_REPORT_ITEM_FIELDS)
+    ids = [
+        _get_pl_report_item_id(*values)
+        for values in zip(
+            columns["item_type"],
+            columns["item_group"],
+            columns["instrument"],
+            columns["name"],
+            columns["portfolio"],
+            columns["account"],
+            columns["strategy1"],
+            columns["strategy2"],
+            columns["strategy3"],
+            columns["allocation"],
+        )
     ]
 
-    result["position_return"] = item["position_return"]
-    result["position_return_loc"] = item["position_return_loc"]
-    result["net_position_return"] = item["net_position_return"]
-    result["net_position_return_loc"] = item["net_position_return_loc"]
-
-    result["position_return_fixed"] = item["position_return_fixed"]
-    result["position_return_fixed_loc"] = item["position_return_fixed_loc"]
-    result["net_position_return_fixed"] = item["net_position_return_fixed"]
-    result["net_position_return_fixed_loc"] = item["net_position_return_fixed_loc"]
-
-    result["net_cost_price"] = item["net_cost_price"]
-    result["net_cost_price_loc"] = item["net_cost_price_loc"]
-    result["gross_cost_price"] = item["gross_cost_price"]
-    result["gross_cost_price_loc"] = item["gross_cost_price_loc"]
-
-    result["principal_invested_fixed"] = item["principal_invested_fixed"]
-    result["principal_invested_fixed_loc"] = item["principal_invested_fixed_loc"]
-
-    result["amount_invested_fixed"] = item["amount_invested_fixed"]
-    result["amount_invested_fixed_loc"] = item["amount_invested_fixed_loc"]
-
-    result["time_invested"] = item["time_invested"]
-
-    result["mismatch"] = item["mismatch"]
-
-    result["ytm"] = item["ytm"]
-    result["ytm_at_cost"] = item["ytm_at_cost"]
+    return _join_report_items(ids, columns)
 
-    result["market_value"] = item["market_value"]
-    result["market_value_loc"] = item["market_value_loc"]
-    result["exposure"] = item["exposure"]
-    result["exposure_loc"] = item["exposure_loc"]
 
-    result["principal"] = item["principal"]
-    result["carry"] = item["carry"]
-    result["overheads"] = item["overheads"]
-    result["total"] = item["total"]
-
-    result["principal_fx"] = item["principal_fx"]
-    result["carry_fx"] = item["carry_fx"]
-    result["overheads_fx"] = item["overheads_fx"]
-    result["total_fx"] = item["total_fx"]
-
-    result["principal_fixed"] = item["principal_fixed"]
-    result["carry_fixed"] = item["carry_fixed"]
-    result["overheads_fixed"] = item["overheads_fixed"]
-    result["total_fixed"] = item["total_fixed"]
-
-    # loc started
-
-    result["principal_loc"] = item["principal_loc"]
-    result["carry_loc"] = item["carry_loc"]
-    result["overheads_loc"] = item["overheads_loc"]
-    result["total_loc"] = item["total_loc"]
-
-    result["principal_fx_loc"] = item["principal_fx_loc"]
-    result["carry_fx_loc"] = item["carry_fx_loc"]
-    result["overheads_fx_loc"] = item["overheads_fx_loc"]
-    result["total_fx_loc"] = item["total_fx_loc"]
-
-    result["principal_fixed_loc"] = item["principal_fixed_loc"]
-    result["carry_fixed_loc"] = item["carry_fixed_loc"]
-    result["overheads_fixed_loc"] = item["overheads_fixed_loc"]
-    result["total_fixed_loc"] = item["total_fixed_loc"]
-
-    return result
+def serialize_pl_report_item(item):
+    return serialize_pl_report_items([item])[0]
 
 
 def serialize_report_item_instrument(item):
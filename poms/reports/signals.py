@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from poms.currencies.models import CurrencyHistory
+from poms.instruments.models import Instrument, PriceHistory
+from poms.reports.models import (
+    BalanceReportCustomField,
+    PLReportCustomField,
+    TransactionReportCustomField,
+)
+from poms.reports.result_cache import report_data_changed
+from poms.transactions.models import ComplexTransaction, Transaction
+
+"""
+Cached reports are built from transactions, prices and fx rates,
+code below makes them outdated when such data is changed
+"""
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=ComplexTransaction)
+@receiver(post_delete, sender=ComplexTransaction)
+@receiver(post_save, sender=PriceHistory)
+@receiver(post_delete, sender=PriceHistory)
+@receiver(post_save, sender=CurrencyHistory)
+@receiver(post_delete, sender=CurrencyHistory)
+@receiver(post_save, sender=Instrument)
+@receiver(post_delete, sender=Instrument)
+@receiver(post_save, sender=BalanceReportCustomField)
+@receiver(post_delete, sender=BalanceReportCustomField)
+@receiver(post_save, sender=PLReportCustomField)
+@receiver(post_delete, sender=PLReportCustomField)
+@receiver(post_save, sender=TransactionReportCustomField)
+@receiver(post_delete, sender=TransactionReportCustomField)
+def clear_report_cache(sender, instance, **kwargs):
+    report_data_changed()
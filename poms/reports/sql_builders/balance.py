@@ -6,11 +6,10 @@ from datetime import timedelta
 from django.conf import settings
 from django.db import connection
 
-from celery import group
-
 from poms.accounts.models import Account, AccountType
 from poms.celery_tasks import finmars_task
 from poms.celery_tasks.models import CeleryTask
+from poms.common.exceptions import FinmarsBaseException
 from poms.common.utils import get_last_business_day
 from poms.currencies.models import Currency
 from poms.iam.utils import get_allowed_queryset
@@ -38,8 +37,22 @@ from poms.reports.sql_builders.helpers import (
     get_where_expression_for_position_consolidation,
     get_balance_query_with_pl,
     get_balance_query,
+    get_report_query_parameters,
+    fetch_columns,
+)
+from poms.reports.sql_builders.balance_items import get_balance_items
+from poms.reports.sql_builders.parallel import (
+    build_in_parallel,
+    get_portfolio_shards,
+    is_parallel_build_allowed,
 )
 from poms.reports.sql_builders.pl import PLReportBuilderSql
+from poms.reports.sql_builders.report_query import (
+    ReportQuery,
+    get_cached_template,
+    get_template_key,
+    parameterize_template,
+)
 from poms.strategies.models import Strategy1, Strategy2, Strategy3
 from poms.users.models import EcosystemDefault
 
@@ -114,8 +127,7 @@ class BalanceReportBuilderSql:
 
         self.instance.items = []
 
-        # self.parallel_build()
-        self.serial_build()
+        self.build_items()
 
         self.instance.execution_time = float("{:3.3f}".format(time.perf_counter() - st))
 
@@ -134,11 +146,87 @@ class BalanceReportBuilderSql:
 
         return self.instance
 
+    @staticmethod
+    def get_query_template(instance):
+        """Balance query of the report with parameters instead of values"""
+        transaction_filter_sql_string = get_transaction_filter_sql_string(
+            instance, parameterized=True
+        )
+        transaction_date_filter_for_initial_position_sql_string = (
+            get_transaction_date_filter_for_initial_position_sql_string(
+                None,
+                has_where=bool(len(transaction_filter_sql_string)),
+                parameterized=True,
+            )
+        )
+        transactions_all_with_multipliers_where_expression = (
+            get_where_expression_for_position_consolidation(
+                instance, prefix="tt_w_m.", prefix_second="t_o."
+            )
+        )
+        consolidation_columns = get_position_consolidation_for_select(instance)
+        tt_consolidation_columns = get_position_consolidation_for_select(
+            instance, prefix="tt."
+        )
+        tt_in1_consolidation_columns = get_position_consolidation_for_select(
+            instance, prefix="tt_in1."
+        )
+        balance_q_consolidated_select_columns = get_position_consolidation_for_select(
+            instance, prefix="balance_q."
+        )
+        pl_left_join_consolidation = get_pl_left_join_consolidation(instance)
+        fx_trades_and_fx_variations_filter_sql_string = (
+            get_fx_trades_and_fx_variations_transaction_filter_sql_string(
+                instance, parameterized=True
+            )
+        )
+
+        pl_query = parameterize_template(
+            PLReportBuilderSql.get_source_query(cost_method=instance.cost_method.id)
+        )
+        pl_query = pl_query.format(
+            transaction_filter_sql_string=transaction_filter_sql_string,
+            transaction_date_filter_for_initial_position_sql_string=transaction_date_filter_for_initial_position_sql_string,
+            fx_trades_and_fx_variations_filter_sql_string=fx_trades_and_fx_variations_filter_sql_string,
+            consolidation_columns=consolidation_columns,
+            balance_q_consolidated_select_columns=balance_q_consolidated_select_columns,
+            tt_consolidation_columns=tt_consolidation_columns,
+            tt_in1_consolidation_columns=tt_in1_consolidation_columns,
+            transactions_all_with_multipliers_where_expression=transactions_all_with_multipliers_where_expression,
+            filter_query_for_balance_in_multipliers_table="",
+        )
+        # filter_query_for_balance_in_multipliers_table=' where multiplier = 1')
+        # TODO ask for right where expression
+
+        if instance.calculate_pl:
+            query = get_balance_query_with_pl()
+        else:
+            query = get_balance_query()
+
+        query = parameterize_template(query)
+
+        return query.format(
+            consolidated_cash_columns=get_cash_consolidation_for_select(instance),
+            consolidated_position_columns=consolidation_columns,
+            consolidated_cash_as_position_columns=get_cash_as_position_consolidation_for_select(
+                instance
+            ),
+            balance_q_consolidated_select_columns=balance_q_consolidated_select_columns,
+            transaction_filter_sql_string=transaction_filter_sql_string,
+            transaction_date_filter_for_initial_position_sql_string=transaction_date_filter_for_initial_position_sql_string,
+            pl_query=pl_query,
+            pl_left_join_consolidation=pl_left_join_consolidation,
+            fx_trades_and_fx_variations_filter_sql_string=fx_trades_and_fx_variations_filter_sql_string,
+        )
+
     def build_sync(self, task_id):
         celery_task = CeleryTask.objects.filter(id=task_id).first()
         if not celery_task:
             _l.error(f"Invalid celery task_id={task_id}")
-            return
+            raise FinmarsBaseException(
+                error_key="invalid_celery_task",
+                message=f"Invalid celery task_id={task_id}",
+            )
 
         try:
             report_settings = celery_task.options_object
@@ -156,109 +244,23 @@ class BalanceReportBuilderSql:
                     master_user_pk=celery_task.master_user.pk
                 )
 
-                pl_query = PLReportBuilderSql.get_source_query(
-                    cost_method=instance.cost_method.id
-                )
-
-                transaction_filter_sql_string = get_transaction_filter_sql_string(
-                    instance
-                )
-                transaction_date_filter_for_initial_position_sql_string = (
-                    get_transaction_date_filter_for_initial_position_sql_string(
-                        instance.report_date,
-                        has_where=bool(len(transaction_filter_sql_string)),
-                    )
-                )
-                report_fx_rate = get_report_fx_rate(instance, instance.report_date)
-                # fx_trades_and_fx_variations_filter_sql_string = get_fx_trades_and_fx_variations_transaction_filter_sql_string(
-                #     report_settings)
-                transactions_all_with_multipliers_where_expression = (
-                    get_where_expression_for_position_consolidation(
-                        instance, prefix="tt_w_m.", prefix_second="t_o."
-                    )
-                )
-                consolidation_columns = get_position_consolidation_for_select(instance)
-                tt_consolidation_columns = get_position_consolidation_for_select(
-                    instance, prefix="tt."
-                )
-                tt_in1_consolidation_columns = get_position_consolidation_for_select(
-                    instance, prefix="tt_in1."
-                )
-                balance_q_consolidated_select_columns = (
-                    get_position_consolidation_for_select(instance, prefix="balance_q.")
-                )
-                pl_left_join_consolidation = get_pl_left_join_consolidation(instance)
-                fx_trades_and_fx_variations_filter_sql_string = (
-                    get_fx_trades_and_fx_variations_transaction_filter_sql_string(
-                        instance
-                    )
-                )
-
                 self.bday_yesterday_of_report_date = get_last_business_day(
                     instance.report_date - timedelta(days=1), to_string=True
                 )
 
-                pl_query = pl_query.format(
-                    report_date=instance.report_date,
-                    master_user_id=celery_task.master_user.id,
-                    default_currency_id=ecosystem_defaults.currency_id,
-                    report_currency_id=instance.report_currency.id,
-                    pricing_policy_id=instance.pricing_policy.id,
-                    report_fx_rate=report_fx_rate,
-                    transaction_filter_sql_string=transaction_filter_sql_string,
-                    transaction_date_filter_for_initial_position_sql_string=transaction_date_filter_for_initial_position_sql_string,
-                    fx_trades_and_fx_variations_filter_sql_string=fx_trades_and_fx_variations_filter_sql_string,
-                    consolidation_columns=consolidation_columns,
-                    balance_q_consolidated_select_columns=balance_q_consolidated_select_columns,
-                    tt_consolidation_columns=tt_consolidation_columns,
-                    tt_in1_consolidation_columns=tt_in1_consolidation_columns,
-                    transactions_all_with_multipliers_where_expression=transactions_all_with_multipliers_where_expression,
-                    filter_query_for_balance_in_multipliers_table="",
-                    bday_yesterday_of_report_date=self.bday_yesterday_of_report_date,
+                query = get_cached_template(
+                    ("balance", instance.calculate_pl, *get_template_key(instance)),
+                    lambda: self.get_query_template(instance),
                 )
-                # filter_query_for_balance_in_multipliers_table=' where multiplier = 1')
-                # TODO ask for right where expression
-
-                ######################################
-
-                if instance.calculate_pl:
-                    query = get_balance_query_with_pl()
-                else:
-                    query = get_balance_query()
-
-                consolidated_cash_columns = get_cash_consolidation_for_select(instance)
-                consolidated_position_columns = get_position_consolidation_for_select(
-                    instance
-                )
-                consolidated_cash_as_position_columns = (
-                    get_cash_as_position_consolidation_for_select(instance)
-                )
-
-                _l.debug("consolidated_cash_columns %s" % consolidated_cash_columns)
-                _l.debug(
-                    "consolidated_position_columns %s" % consolidated_position_columns
-                )
-                _l.debug(
-                    "consolidated_cash_as_position_columns %s"
-                    % consolidated_cash_as_position_columns
-                )
-
-                query = query.format(
-                    report_date=instance.report_date,
-                    master_user_id=celery_task.master_user.id,
-                    default_currency_id=ecosystem_defaults.currency_id,
-                    report_currency_id=instance.report_currency.id,
-                    pricing_policy_id=instance.pricing_policy.id,
-                    consolidated_cash_columns=consolidated_cash_columns,
-                    consolidated_position_columns=consolidated_position_columns,
-                    consolidated_cash_as_position_columns=consolidated_cash_as_position_columns,
-                    balance_q_consolidated_select_columns=balance_q_consolidated_select_columns,
-                    transaction_filter_sql_string=transaction_filter_sql_string,
-                    transaction_date_filter_for_initial_position_sql_string=transaction_date_filter_for_initial_position_sql_string,
-                    pl_query=pl_query,
-                    pl_left_join_consolidation=pl_left_join_consolidation,
-                    fx_trades_and_fx_variations_filter_sql_string=fx_trades_and_fx_variations_filter_sql_string,
-                    bday_yesterday_of_report_date=self.bday_yesterday_of_report_date,
+                report_query = ReportQuery(
+                    "Balance",
+                    query,
+                    get_report_query_parameters(
+                        instance,
+                        instance.report_date,
+                        self.bday_yesterday_of_report_date,
+                        ecosystem_defaults.currency_id,
+                    ),
                 )
 
                 if settings.DEBUG:
@@ -271,447 +273,22 @@ class BalanceReportBuilderSql:
                     ) as the_file:
                         the_file.write(query)
 
-                cursor.execute(query)
+                report_query.execute(cursor)
 
                 _l.debug(
                     "Balance report query execute done: %s",
                     "{:3.3f}".format(time.perf_counter() - st),
                 )
 
-                query_str = str(cursor.query, "utf-8")
-
                 if settings.SERVER_TYPE == "local":
                     with open("/tmp/query_result.txt", "w") as the_file:
-                        the_file.write(query_str)
-
-                result = dictfetchall(cursor)
-
-                ITEM_TYPE_INSTRUMENT = 1
-                ITEM_TYPE_FX_VARIATIONS = 3
-                ITEM_TYPE_FX_TRADES = 4
-                ITEM_TYPE_TRANSACTION_PL = 5
-                ITEM_TYPE_MISMATCH = 6
-                ITEM_TYPE_EXPOSURE_COPY = 7
-
-                updated_result = []
-
-                for item in result:
-                    result_item = {}
-
-                    # item["currency_id"] = item["settlement_currency_id"]
-
-                    result_item["name"] = item["name"]
-                    result_item["short_name"] = item["short_name"]
-                    result_item["user_code"] = item["user_code"]
-                    result_item["item_type"] = item["item_type"]
-                    result_item["item_type_name"] = item["item_type_name"]
-
-                    result_item["market_value"] = item["market_value"]
-                    result_item["exposure"] = item["exposure"]
-
-                    result_item["market_value_loc"] = item["market_value_loc"]
-                    result_item["exposure_loc"] = item["exposure_loc"]
-
-                    if "portfolio_id" not in item:
-                        result_item["portfolio_id"] = ecosystem_defaults.portfolio_id
-                    else:
-                        result_item["portfolio_id"] = item["portfolio_id"]
-
-                    if "account_cash_id" not in item:
-                        result_item["account_cash_id"] = ecosystem_defaults.account_id
-                    else:
-                        result_item["account_cash_id"] = item["account_cash_id"]
-
-                    if "strategy1_cash_id" not in item:
-                        result_item["strategy1_cash_id"] = (
-                            ecosystem_defaults.strategy1_id
-                        )
-                    else:
-                        result_item["strategy1_cash_id"] = item["strategy1_cash_id"]
-
-                    if "strategy2_cash_id" not in item:
-                        result_item["strategy2_cash_id"] = (
-                            ecosystem_defaults.strategy2_id
-                        )
-                    else:
-                        result_item["strategy2_cash_id"] = item["strategy2_cash_id"]
-
-                    if "strategy3_cash_id" not in item:
-                        result_item["strategy3_cash_id"] = (
-                            ecosystem_defaults.strategy3_id
-                        )
-                    else:
-                        result_item["strategy3_cash_id"] = item["strategy3_cash_id"]
-
-                    if "account_position_id" not in item:
-                        result_item["account_position_id"] = (
-                            ecosystem_defaults.account_id
-                        )
-                    else:
-                        result_item["account_position_id"] = item["account_position_id"]
-
-                    if "strategy1_position_id" not in item:
-                        result_item["strategy1_position_id"] = (
-                            ecosystem_defaults.strategy1_id
-                        )
-                    else:
-                        result_item["strategy1_position_id"] = item[
-                            "strategy1_position_id"
-                        ]
-
-                    if "strategy2_position_id" not in item:
-                        result_item["strategy2_position_id"] = (
-                            ecosystem_defaults.strategy2_id
-                        )
-                    else:
-                        result_item["strategy2_position_id"] = item[
-                            "strategy2_position_id"
-                        ]
-
-                    if "strategy3_position_id" not in item:
-                        result_item["strategy3_position_id"] = (
-                            ecosystem_defaults.strategy3_id
-                        )
-                    else:
-                        result_item["strategy3_position_id"] = item[
-                            "strategy3_position_id"
-                        ]
-
-                    if "allocation_pl_id" not in item:
-                        result_item["allocation_pl_id"] = None
-                    else:
-                        result_item["allocation_pl_id"] = item["allocation_pl_id"]
-
-                    result_item["exposure_currency_id"] = item[
-                        "co_directional_exposure_currency_id"
-                    ]
-                    result_item["instrument_id"] = item["instrument_id"]
-                    result_item["currency_id"] = item["currency_id"]
-                    result_item["pricing_currency_id"] = item["pricing_currency_id"]
-                    result_item["instrument_pricing_currency_fx_rate"] = item[
-                        "instrument_pricing_currency_fx_rate"
-                    ]
-                    result_item["instrument_accrued_currency_fx_rate"] = item[
-                        "instrument_accrued_currency_fx_rate"
-                    ]
-                    result_item["instrument_principal_price"] = item[
-                        "instrument_principal_price"
-                    ]
-                    result_item["instrument_accrued_price"] = item[
-                        "instrument_accrued_price"
-                    ]
-                    result_item["instrument_factor"] = item["instrument_factor"]
-                    result_item["instrument_ytm"] = item["instrument_ytm"]
-                    result_item["daily_price_change"] = item["daily_price_change"]
-
-                    result_item["fx_rate"] = item["fx_rate"]
-
-                    # _l.debug('item %s' % item)
-                    result_item["position_size"] = round(
-                        item["position_size"], settings.ROUND_NDIGITS
-                    )
-                    # _l.debug('item["nominal_position_size"] %s' % item["nominal_position_size"])
-                    if item["nominal_position_size"] is not None:
-                        result_item["nominal_position_size"] = round(
-                            item["nominal_position_size"], settings.ROUND_NDIGITS
-                        )
-                    else:
-                        result_item["nominal_position_size"] = None
-
-                    result_item["ytm"] = item["ytm"]
-                    result_item["ytm_at_cost"] = item["ytm_at_cost"]
-                    result_item["modified_duration"] = item["modified_duration"]
-                    result_item["return_annually"] = item["return_annually"]
-                    result_item["return_annually_fixed"] = item["return_annually_fixed"]
-
-                    result_item["position_return"] = item["position_return"]
-                    result_item["position_return_loc"] = item["position_return_loc"]
-                    result_item["net_position_return"] = item["net_position_return"]
-                    result_item["net_position_return_loc"] = item[
-                        "net_position_return_loc"
-                    ]
-
-                    result_item["position_return_fixed"] = item["position_return_fixed"]
-                    result_item["position_return_fixed_loc"] = item[
-                        "position_return_fixed_loc"
-                    ]
-                    result_item["net_position_return_fixed"] = item[
-                        "net_position_return_fixed"
-                    ]
-                    result_item["net_position_return_fixed_loc"] = item[
-                        "net_position_return_fixed_loc"
-                    ]
-
-                    result_item["net_cost_price"] = item["net_cost_price"]
-                    result_item["net_cost_price_loc"] = item["net_cost_price_loc"]
-                    result_item["gross_cost_price"] = item["gross_cost_price"]
-                    result_item["gross_cost_price_loc"] = item["gross_cost_price_loc"]
-
-                    result_item["principal_invested"] = item["principal_invested"]
-                    result_item["principal_invested_loc"] = item[
-                        "principal_invested_loc"
-                    ]
-
-                    result_item["amount_invested"] = item["amount_invested"]
-                    result_item["amount_invested_loc"] = item["amount_invested_loc"]
-
-                    result_item["principal_invested_fixed"] = item[
-                        "principal_invested_fixed"
-                    ]
-                    result_item["principal_invested_fixed_loc"] = item[
-                        "principal_invested_fixed_loc"
-                    ]
-
-                    result_item["amount_invested_fixed"] = item["amount_invested_fixed"]
-                    result_item["amount_invested_fixed_loc"] = item[
-                        "amount_invested_fixed_loc"
-                    ]
-
-                    result_item["time_invested"] = item["time_invested"]
-                    result_item["return_annually"] = item["return_annually"]
-                    result_item["return_annually_fixed"] = item["return_annually_fixed"]
-
-                    # performance
-
-                    result_item["principal"] = item["principal_opened"]
-                    result_item["carry"] = item["carry_opened"]
-                    result_item["overheads"] = item["overheads_opened"]
-                    result_item["total"] = item["total_opened"]
-
-                    result_item["principal_fx"] = item["principal_fx_opened"]
-                    result_item["carry_fx"] = item["carry_fx_opened"]
-                    result_item["overheads_fx"] = item["overheads_fx_opened"]
-                    result_item["total_fx"] = item["total_fx_opened"]
-
-                    result_item["principal_fixed"] = item["principal_fixed_opened"]
-                    result_item["carry_fixed"] = item["carry_fixed_opened"]
-                    result_item["overheads_fixed"] = item["overheads_fixed_opened"]
-                    result_item["total_fixed"] = item["total_fixed_opened"]
-
-                    # loc started
-
-                    result_item["principal_loc"] = item["principal_opened_loc"]
-                    result_item["carry_loc"] = item["carry_opened_loc"]
-                    result_item["overheads_loc"] = item["overheads_opened_loc"]
-                    result_item["total_loc"] = item["total_opened_loc"]
-
-                    result_item["principal_fx_loc"] = item["principal_fx_opened_loc"]
-                    result_item["carry_fx_loc"] = item["carry_fx_opened_loc"]
-                    result_item["overheads_fx_loc"] = item["overheads_fx_opened_loc"]
-                    result_item["total_fx_loc"] = item["total_fx_opened_loc"]
-
-                    result_item["principal_fixed_loc"] = item[
-                        "principal_fixed_opened_loc"
-                    ]
-                    result_item["carry_fixed_loc"] = item["carry_fixed_opened_loc"]
-                    result_item["overheads_fixed_loc"] = item[
-                        "overheads_fixed_opened_loc"
-                    ]
-                    result_item["total_fixed_loc"] = item["total_fixed_opened_loc"]
-
-                    # Position * ( Long Underlying Exposure - Short Underlying Exposure)
-                    # "Underlying Long/Short Exposure - Split":
-                    # Position * Long Underlying Exposure
-                    # -Position * Short Underlying Exposure
-
-                    long = 0
-                    short = 0
-
-                    if (
-                        item["long_underlying_exposure_id"]
-                        == LongUnderlyingExposure.ZERO
-                    ):
-                        long = item["exposure_long_underlying_zero"]
-                    if (
-                        item["long_underlying_exposure_id"]
-                        == LongUnderlyingExposure.LONG_UNDERLYING_INSTRUMENT_PRICE_EXPOSURE
-                    ):
-                        long = item["exposure_short_underlying_price"]
-                    if (
-                        item["long_underlying_exposure_id"]
-                        == LongUnderlyingExposure.LONG_UNDERLYING_INSTRUMENT_PRICE_DELTA
-                    ):
-                        long = item["exposure_long_underlying_price_delta"]
-                    if (
-                        item["long_underlying_exposure_id"]
-                        == LongUnderlyingExposure.LONG_UNDERLYING_CURRENCY_FX_RATE_EXPOSURE
-                    ):
-                        long = item["exposure_long_underlying_fx_rate"]
-                    if (
-                        item["long_underlying_exposure_id"]
-                        == LongUnderlyingExposure.LONG_UNDERLYING_CURRENCY_FX_RATE_DELTA_ADJUSTED_EXPOSURE
-                    ):
-                        long = item["exposure_long_underlying_fx_rate_delta"]
-
-                    if (
-                        item["short_underlying_exposure_id"]
-                        == ShortUnderlyingExposure.ZERO
-                    ):
-                        short = item["exposure_short_underlying_zero"]
-                    if (
-                        item["short_underlying_exposure_id"]
-                        == ShortUnderlyingExposure.SHORT_UNDERLYING_INSTRUMENT_PRICE_EXPOSURE
-                    ):
-                        short = item["exposure_short_underlying_price"]
-                    if (
-                        item["short_underlying_exposure_id"]
-                        == ShortUnderlyingExposure.SHORT_UNDERLYING_INSTRUMENT_PRICE_DELTA
-                    ):
-                        short = item["exposure_short_underlying_price_delta"]
-                    if (
-                        item["short_underlying_exposure_id"]
-                        == ShortUnderlyingExposure.SHORT_UNDERLYING_CURRENCY_FX_RATE_EXPOSURE
-                    ):
-                        short = item["exposure_short_underlying_fx_rate"]
-                    if (
-                        item["short_underlying_exposure_id"]
-                        == ShortUnderlyingExposure.SHORT_UNDERLYING_CURRENCY_FX_RATE_DELTA_ADJUSTED_EXPOSURE
-                    ):
-                        short = item["exposure_short_underlying_fx_rate_delta"]
-
-                    if (
-                        item["exposure_calculation_model_id"]
-                        == ExposureCalculationModel.UNDERLYING_LONG_SHORT_EXPOSURE_NET
-                    ):
-                        result_item["exposure"] = result_item["position_size"] * (
-                            long - short
-                        )
-
-                    # (i )   Position * Long Underlying Exposure
-                    # (ii)  -Position * Short Underlying Exposure
-
-                    if long is None:
-                        long = 0
-
-                    if (
-                        item["exposure_calculation_model_id"]
-                        == ExposureCalculationModel.UNDERLYING_LONG_SHORT_EXPOSURE_SPLIT
-                    ):
-                        result_item["exposure"] = result_item["position_size"] * long
-
-                    if round(item["position_size"], settings.ROUND_NDIGITS):
-                        updated_result.append(result_item)
-
-                        if ITEM_TYPE_INSTRUMENT == 1 and (
-                            item["has_second_exposure_currency"]
-                            and instance.show_balance_exposure_details
-                        ):
-                            new_exposure_item = {
-                                "name": item["name"],
-                                "user_code": item["user_code"],
-                                "short_name": item["short_name"],
-                                "pricing_currency_id": item["pricing_currency_id"],
-                                "currency_id": item["currency_id"],
-                                "instrument_id": item["instrument_id"],
-                                "portfolio_id": item["portfolio_id"],
-                                "account_cash_id": item["account_cash_id"],
-                                "strategy1_cash_id": item["strategy1_cash_id"],
-                                "strategy2_cash_id": item["strategy2_cash_id"],
-                                "strategy3_cash_id": item["strategy3_cash_id"],
-                                "account_position_id": item["account_position_id"],
-                                "strategy1_position_id": item["strategy1_position_id"],
-                                "strategy2_position_id": item["strategy2_position_id"],
-                                "strategy3_position_id": item["strategy3_position_id"],
-                                "instrument_pricing_currency_fx_rate": None,
-                                "instrument_accrued_currency_fx_rate": None,
-                                "instrument_principal_price": None,
-                                "instrument_accrued_price": None,
-                                "instrument_factor": None,
-                                "instrument_ytm": None,
-                                "daily_price_change": None,
-                                "market_value": None,
-                                "market_value_loc": None,
-                                "item_type": 7,
-                                "item_type_name": "Exposure",
-                                "exposure": item["exposure_2"],
-                                "exposure_loc": item["exposure_2_loc"],
-                                "exposure_currency_id": item[
-                                    "counter_directional_exposure_currency_id"
-                                ],
-                            }
-
-                            if (
-                                item["exposure_calculation_model_id"]
-                                == ExposureCalculationModel.UNDERLYING_LONG_SHORT_EXPOSURE_SPLIT
-                            ):
-                                new_exposure_item["exposure"] = (
-                                    -item["position_size"] * short
-                                )
-
-                            new_exposure_item["position_size"] = None
-                            new_exposure_item["nominal_position_size"] = None
-                            new_exposure_item["ytm"] = None
-                            new_exposure_item["ytm_at_cost"] = None
-                            new_exposure_item["modified_duration"] = None
-                            new_exposure_item["return_annually"] = None
-                            new_exposure_item["return_annually_fixed"] = None
-
-                            new_exposure_item["position_return"] = None
-                            new_exposure_item["position_return_loc"] = None
-                            new_exposure_item["net_position_return"] = None
-                            new_exposure_item["net_position_return_loc"] = None
-
-                            new_exposure_item["position_return_fixed"] = None
-                            new_exposure_item["position_return_fixed_loc"] = None
-                            new_exposure_item["net_position_return_fixed"] = None
-                            new_exposure_item["net_position_return_fixed_loc"] = None
-
-                            new_exposure_item["net_cost_price"] = None
-                            new_exposure_item["net_cost_price_loc"] = None
-                            new_exposure_item["gross_cost_price"] = None
-                            new_exposure_item["gross_cost_price_loc"] = None
-
-                            new_exposure_item["principal_invested"] = None
-                            new_exposure_item["principal_invested_loc"] = None
-
-                            new_exposure_item["amount_invested"] = None
-                            new_exposure_item["amount_invested_loc"] = None
-
-                            new_exposure_item["principal_invested_fixed"] = None
-                            new_exposure_item["principal_invested_fixed_loc"] = None
-
-                            new_exposure_item["amount_invested_fixed"] = None
-                            new_exposure_item["amount_invested_fixed_loc"] = None
-
-                            new_exposure_item["time_invested"] = None
-                            new_exposure_item["return_annually"] = None
-                            new_exposure_item["return_annually_fixed"] = None
-
-                            # performance
-
-                            new_exposure_item["principal"] = None
-                            new_exposure_item["carry"] = None
-                            new_exposure_item["overheads"] = None
-                            new_exposure_item["total"] = None
-
-                            new_exposure_item["principal_fx"] = None
-                            new_exposure_item["carry_fx"] = None
-                            new_exposure_item["overheads_fx"] = None
-                            new_exposure_item["total_fx"] = None
-
-                            new_exposure_item["principal_fixed"] = None
-                            new_exposure_item["carry_fixed"] = None
-                            new_exposure_item["overheads_fixed"] = None
-                            new_exposure_item["total_fixed"] = None
-
-                            # loc started
+                        the_file.write(report_query.mogrify(cursor))
 
-                            new_exposure_item["principal_loc"] = None
-                            new_exposure_item["carry_loc"] = None
-                            new_exposure_item["overheads_loc"] = None
-                            new_exposure_item["total_loc"] = None
-
-                            new_exposure_item["principal_fx_loc"] = None
-                            new_exposure_item["carry_fx_loc"] = None
-                            new_exposure_item["overheads_fx_loc"] = None
-                            new_exposure_item["total_fx_loc"] = None
-
-                            new_exposure_item["principal_fixed_loc"] = None
-                            new_exposure_item["carry_fixed_loc"] = None
-                            new_exposure_item["overheads_fixed_loc"] = None
-                            new_exposure_item["total_fixed_loc"] = None
-
-                            updated_result.append(new_exposure_item)
+                updated_result = get_balance_items(
+                    fetch_columns(cursor),
+                    ecosystem_defaults,
+                    instance.show_balance_exposure_details,
+                )
 
                 # _l.debug("build balance result %s " % len(result))
 
@@ -727,160 +304,74 @@ class BalanceReportBuilderSql:
             celery_task.save()
             raise e
 
-    def parallel_build(self):
-        st = time.perf_counter()
+    def get_task_options(self, portfolios_ids):
+        return {
+            "report_date": self.instance.report_date,
+            "portfolios_ids": portfolios_ids,
+            "accounts_ids": [instance.id for instance in self.instance.accounts],
+            "strategies1_ids": [instance.id for instance in self.instance.strategies1],
+            "strategies2_ids": [instance.id for instance in self.instance.strategies2],
+            "strategies3_ids": [instance.id for instance in self.instance.strategies3],
+            "report_currency_id": self.instance.report_currency.id,
+            "pricing_policy_id": self.instance.pricing_policy.id,
+            "cost_method_id": self.instance.cost_method.id,
+            "show_balance_exposure_details": self.instance.show_balance_exposure_details,
+            "portfolio_mode": self.instance.portfolio_mode,
+            "account_mode": self.instance.account_mode,
+            "strategy1_mode": self.instance.strategy1_mode,
+            "strategy2_mode": self.instance.strategy2_mode,
+            "strategy3_mode": self.instance.strategy3_mode,
+            "allocation_mode": self.instance.allocation_mode,
+            "calculate_pl": self.instance.calculate_pl,
+        }
+
+    def create_task(self, portfolios_ids):
+        return CeleryTask.objects.create(
+            master_user=self.instance.master_user,
+            member=self.instance.member,
+            verbose_name="Balance Report",
+            type="calculate_balance_report",
+            options_object=self.get_task_options(portfolios_ids),
+        )
 
-        tasks = []
-
-        if self.instance.portfolio_mode == Report.MODE_INDEPENDENT:
-            for portfolio in self.instance.portfolios:
-                task = CeleryTask.objects.create(
-                    master_user=self.instance.master_user,
-                    member=self.instance.member,
-                    verbose_name="Balance Report",
-                    type="calculate_balance_report",
-                    options_object={
-                        "report_date": self.instance.report_date,
-                        "portfolios_ids": [portfolio.id],
-                        "accounts_ids": [
-                            instance.id for instance in self.instance.accounts
-                        ],
-                        "strategies1_ids": [
-                            instance.id for instance in self.instance.strategies1
-                        ],
-                        "strategies2_ids": [
-                            instance.id for instance in self.instance.strategies2
-                        ],
-                        "strategies3_ids": [
-                            instance.id for instance in self.instance.strategies3
-                        ],
-                        "report_currency_id": self.instance.report_currency.id,
-                        "pricing_policy_id": self.instance.pricing_policy.id,
-                        "cost_method_id": self.instance.cost_method.id,
-                        "show_balance_exposure_details": self.instance.show_balance_exposure_details,
-                        "portfolio_mode": self.instance.portfolio_mode,
-                        "account_mode": self.instance.account_mode,
-                        "strategy1_mode": self.instance.strategy1_mode,
-                        "strategy2_mode": self.instance.strategy2_mode,
-                        "strategy3_mode": self.instance.strategy3_mode,
-                        "allocation_mode": self.instance.allocation_mode,
-                        "calculate_pl": self.instance.calculate_pl,
-                    },
-                )
+    def build_items(self):
+        if is_parallel_build_allowed(self.instance):
+            self.parallel_build()
+        else:
+            self.serial_build()
 
-                tasks.append(task)
+    def parallel_build(self):
+        """
+        Portfolios are independent, so report is built by portfolio shards
+        in threads, each shard in its own db connection
+        """
+        st = time.perf_counter()
 
-        else:
-            task = CeleryTask.objects.create(
-                master_user=self.instance.master_user,
-                member=self.instance.member,
-                verbose_name="Balance Report",
-                type="calculate_balance_report",
-                options_object={
-                    "report_date": self.instance.report_date,
-                    "portfolios_ids": [
-                        instance.id for instance in self.instance.portfolios
-                    ],
-                    "accounts_ids": [
-                        instance.id for instance in self.instance.accounts
-                    ],
-                    "strategies1_ids": [
-                        instance.id for instance in self.instance.strategies1
-                    ],
-                    "strategies2_ids": [
-                        instance.id for instance in self.instance.strategies2
-                    ],
-                    "strategies3_ids": [
-                        instance.id for instance in self.instance.strategies3
-                    ],
-                    "report_currency_id": self.instance.report_currency.id,
-                    "pricing_policy_id": self.instance.pricing_policy.id,
-                    "cost_method_id": self.instance.cost_method.id,
-                    "show_balance_exposure_details": self.instance.show_balance_exposure_details,
-                    "portfolio_mode": self.instance.portfolio_mode,
-                    "account_mode": self.instance.account_mode,
-                    "strategy1_mode": self.instance.strategy1_mode,
-                    "strategy2_mode": self.instance.strategy2_mode,
-                    "strategy3_mode": self.instance.strategy3_mode,
-                    "allocation_mode": self.instance.allocation_mode,
-                    "calculate_pl": self.instance.calculate_pl,
-                },
+        tasks = [
+            self.create_task(portfolios_ids)
+            for portfolios_ids in get_portfolio_shards(
+                self.instance.portfolios, settings.REPORT_PARALLEL_SHARDS
             )
-
-            tasks.append(task)
+        ]
 
         _l.debug("Going to run %s tasks" % len(tasks))
 
-        # Run the group of tasks
-        job = group(
-            build.s(
-                task_id=task.id,
-                context={
-                    "realm_code": self.instance.master_user.realm_code,
-                    "space_code": self.instance.master_user.space_code,
-                },
+        try:
+            self.instance.items = build_in_parallel(
+                self.build_sync, [task.id for task in tasks]
             )
-            for task in tasks
-        )
-
-        group_result = job.apply_async()
-        # Wait for all tasks to finish and get their results
-        group_result.join()
-
-        # Retrieve results
-        all_dicts = []
-        # TODO probably we can do some optimization here
-        for result in group_result.results:
-            # Each result is an AsyncResult instance.
-            # You can get the result of the task with its .result property.
-            all_dicts.extend(result.result)
-
-        for task in tasks:
-            # refresh the task instance to get the latest status from the database
-            task.refresh_from_db()
-
-            task.delete()
-
-        # 'all_dicts' is now a list of all dicts returned by the tasks
-        self.instance.items = all_dicts
+        finally:
+            CeleryTask.objects.filter(
+                id__in=[task.id for task in tasks],
+            ).exclude(status=CeleryTask.STATUS_ERROR).delete()
 
         _l.debug("parallel_build done: %s", "{:3.3f}".format(time.perf_counter() - st))
 
     def serial_build(self):
         st = time.perf_counter()
 
-        task = CeleryTask.objects.create(
-            master_user=self.instance.master_user,
-            member=self.instance.member,
-            verbose_name="Balance Report",
-            type="calculate_balance_report",
-            options_object={
-                "report_date": self.instance.report_date,
-                "portfolios_ids": [
-                    instance.id for instance in self.instance.portfolios
-                ],
-                "accounts_ids": [instance.id for instance in self.instance.accounts],
-                "strategies1_ids": [
-                    instance.id for instance in self.instance.strategies1
-                ],
-                "strategies2_ids": [
-                    instance.id for instance in self.instance.strategies2
-                ],
-                "strategies3_ids": [
-                    instance.id for instance in self.instance.strategies3
-                ],
-                "report_currency_id": self.instance.report_currency.id,
-                "pricing_policy_id": self.instance.pricing_policy.id,
-                "cost_method_id": self.instance.cost_method.id,
-                "show_balance_exposure_details": self.instance.show_balance_exposure_details,
-                "portfolio_mode": self.instance.portfolio_mode,
-                "account_mode": self.instance.account_mode,
-                "strategy1_mode": self.instance.strategy1_mode,
-                "strategy2_mode": self.instance.strategy2_mode,
-                "strategy3_mode": self.instance.strategy3_mode,
-                "allocation_mode": self.instance.allocation_mode,
-                "calculate_pl": self.instance.calculate_pl,
-            },
+        task = self.create_task(
+            [instance.id for instance in self.instance.portfolios]
         )
 
         result = self.build_sync(task.id)
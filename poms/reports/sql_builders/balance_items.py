@@ -0,0 +1,318 @@
+"""
+Balance report items made from columns of the balance query result.
+
+Rows of the query were fetched as dicts, and every row was copied into an
+item dict key by key, exposure items were made by setting dozens of keys to
+None one by one. Here the result is kept as column lists: rounding,
+exposures and selection of non-zero positions are done per column with
+numpy, and only items of the report are created, each one by a single
+dict(zip(...)) call.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+from django.conf import settings
+
+from poms.instruments.models import (
+    ExposureCalculationModel,
+    LongUnderlyingExposure,
+    ShortUnderlyingExposure,
+)
+
+ITEM_TYPE_EXPOSURE_COPY = 7
+
+# consolidation columns of the query and attributes of ecosystem defaults
+# used when the column is not selected in the mode of the report
+CONSOLIDATION_COLUMNS = (
+    ("portfolio_id", "portfolio_id"),
+    ("account_cash_id", "account_id"),
+    ("strategy1_cash_id", "strategy1_id"),
+    ("strategy2_cash_id", "strategy2_id"),
+    ("strategy3_cash_id", "strategy3_id"),
+    ("account_position_id", "account_id"),
+    ("strategy1_position_id", "strategy1_id"),
+    ("strategy2_position_id", "strategy2_id"),
+    ("strategy3_position_id", "strategy3_id"),
+    ("allocation_pl_id", None),
+)
+
+# item key and query column
+HEAD_COLUMNS = (
+    ("name", "name"),
+    ("short_name", "short_name"),
+    ("user_code", "user_code"),
+    ("item_type", "item_type"),
+    ("item_type_name", "item_type_name"),
+    ("market_value", "market_value"),
+    ("exposure", "exposure"),
+    ("market_value_loc", "market_value_loc"),
+    ("exposure_loc", "exposure_loc"),
+)
+INSTRUMENT_COLUMNS = (
+    ("exposure_currency_id", "co_directional_exposure_currency_id"),
+    ("instrument_id", "instrument_id"),
+    ("currency_id", "currency_id"),
+    ("pricing_currency_id", "pricing_currency_id"),
+    ("instrument_pricing_currency_fx_rate", "instrument_pricing_currency_fx_rate"),
+    ("instrument_accrued_currency_fx_rate", "instrument_accrued_currency_fx_rate"),
+    ("instrument_principal_price", "instrument_principal_price"),
+    ("instrument_accrued_price", "instrument_accrued_price"),
+    ("instrument_factor", "instrument_factor"),
+    ("instrument_ytm", "instrument_ytm"),
+    ("daily_price_change", "daily_price_change"),
+    ("fx_rate", "fx_rate"),
+)
+# values of the position, they are empty in exposure items
+POSITION_COLUMNS = (
+    ("position_size", "position_size"),
+    ("nominal_position_size", "nominal_position_size"),
+    ("ytm", "ytm"),
+    ("ytm_at_cost", "ytm_at_cost"),
+    ("modified_duration", "modified_duration"),
+    ("return_annually", "return_annually"),
+    ("return_annually_fixed", "return_annually_fixed"),
+    ("position_return", "position_return"),
+    ("position_return_loc", "position_return_loc"),
+    ("net_position_return", "net_position_return"),
+    ("net_position_return_loc", "net_position_return_loc"),
+    ("position_return_fixed", "position_return_fixed"),
+    ("position_return_fixed_loc", "position_return_fixed_loc"),
+    ("net_position_return_fixed", "net_position_return_fixed"),
+    ("net_position_return_fixed_loc", "net_position_return_fixed_loc"),
+    ("net_cost_price", "net_cost_price"),
+    ("net_cost_price_loc", "net_cost_price_loc"),
+    ("gross_cost_price", "gross_cost_price"),
+    ("gross_cost_price_loc", "gross_cost_price_loc"),
+    ("principal_invested", "principal_invested"),
+    ("principal_invested_loc", "principal_invested_loc"),
+    ("amount_invested", "amount_invested"),
+    ("amount_invested_loc", "amount_invested_loc"),
+    ("principal_invested_fixed", "principal_invested_fixed"),
+    ("principal_invested_fixed_loc", "principal_invested_fixed_loc"),
+    ("amount_invested_fixed", "amount_invested_fixed"),
+    ("amount_invested_fixed_loc", "amount_invested_fixed_loc"),
+    ("time_invested", "time_invested"),
+    # performance
+    ("principal", "principal_opened"),
+    ("carry", "carry_opened"),
+    ("overheads", "overheads_opened"),
+    ("total", "total_opened"),
+    ("principal_fx", "principal_fx_opened"),
+    ("carry_fx", "carry_fx_opened"),
+    ("overheads_fx", "overheads_fx_opened"),
+    ("total_fx", "total_fx_opened"),
+    ("principal_fixed", "principal_fixed_opened"),
+    ("carry_fixed", "carry_fixed_opened"),
+    ("overheads_fixed", "overheads_fixed_opened"),
+    ("total_fixed", "total_fixed_opened"),
+    # loc
+    ("principal_loc", "principal_opened_loc"),
+    ("carry_loc", "carry_opened_loc"),
+    ("overheads_loc", "overheads_opened_loc"),
+    ("total_loc", "total_opened_loc"),
+    ("principal_fx_loc", "principal_fx_opened_loc"),
+    ("carry_fx_loc", "carry_fx_opened_loc"),
+    ("overheads_fx_loc", "overheads_fx_opened_loc"),
+    ("total_fx_loc", "total_fx_opened_loc"),
+    ("principal_fixed_loc", "principal_fixed_opened_loc"),
+    ("carry_fixed_loc", "carry_fixed_opened_loc"),
+    ("overheads_fixed_loc", "overheads_fixed_opened_loc"),
+    ("total_fixed_loc", "total_fixed_opened_loc"),
+)
+
+# underlying exposure id and column with the exposure value
+LONG_UNDERLYING_EXPOSURE_COLUMNS = (
+    (LongUnderlyingExposure.ZERO, "exposure_long_underlying_zero"),
+    (
+        LongUnderlyingExposure.LONG_UNDERLYING_INSTRUMENT_PRICE_EXPOSURE,
+        "exposure_short_underlying_price",
+    ),
+    (
+        LongUnderlyingExposure.LONG_UNDERLYING_INSTRUMENT_PRICE_DELTA,
+        "exposure_long_underlying_price_delta",
+    ),
+    (
+        LongUnderlyingExposure.LONG_UNDERLYING_CURRENCY_FX_RATE_EXPOSURE,
+        "exposure_long_underlying_fx_rate",
+    ),
+    (
+        LongUnderlyingExposure.LONG_UNDERLYING_CURRENCY_FX_RATE_DELTA_ADJUSTED_EXPOSURE,
+        "exposure_long_underlying_fx_rate_delta",
+    ),
+)
+SHORT_UNDERLYING_EXPOSURE_COLUMNS = (
+    (ShortUnderlyingExposure.ZERO, "exposure_short_underlying_zero"),
+    (
+        ShortUnderlyingExposure.SHORT_UNDERLYING_INSTRUMENT_PRICE_EXPOSURE,
+        "exposure_short_underlying_price",
+    ),
+    (
+        ShortUnderlyingExposure.SHORT_UNDERLYING_INSTRUMENT_PRICE_DELTA,
+        "exposure_short_underlying_price_delta",
+    ),
+    (
+        ShortUnderlyingExposure.SHORT_UNDERLYING_CURRENCY_FX_RATE_EXPOSURE,
+        "exposure_short_underlying_fx_rate",
+    ),
+    (
+        ShortUnderlyingExposure.SHORT_UNDERLYING_CURRENCY_FX_RATE_DELTA_ADJUSTED_EXPOSURE,
+        "exposure_short_underlying_fx_rate_delta",
+    ),
+)
+
+ITEM_KEYS = (
+    [key for key, _ in HEAD_COLUMNS]
+    + [column for column, _ in CONSOLIDATION_COLUMNS]
+    + [key for key, _ in INSTRUMENT_COLUMNS]
+    + [key for key, _ in POSITION_COLUMNS]
+)
+EXPOSURE_ITEM_KEYS = [
+    "name",
+    "user_code",
+    "short_name",
+    "pricing_currency_id",
+    "currency_id",
+    "instrument_id",
+] + [column for column, _ in CONSOLIDATION_COLUMNS]
+EXPOSURE_ITEM_TEMPLATE = {
+    **dict.fromkeys(EXPOSURE_ITEM_KEYS),
+    "instrument_pricing_currency_fx_rate": None,
+    "instrument_accrued_currency_fx_rate": None,
+    "instrument_principal_price": None,
+    "instrument_accrued_price": None,
+    "instrument_factor": None,
+    "instrument_ytm": None,
+    "daily_price_change": None,
+    "fx_rate": None,
+    "market_value": None,
+    "market_value_loc": None,
+    "item_type": ITEM_TYPE_EXPOSURE_COPY,
+    "item_type_name": "Exposure",
+    "exposure": None,
+    "exposure_loc": None,
+    "exposure_currency_id": None,
+    **dict.fromkeys(key for key, _ in POSITION_COLUMNS),
+}
+
+
+def _to_objects(values: list) -> np.ndarray:
+    # object arrays keep python values and arithmetic of them
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _select_underlying(columns: Dict[str, list], key: str, choices) -> np.ndarray:
+    """Exposure of the underlying chosen by the id column, 0 for unknown ids"""
+    ids = _to_objects(columns[key])
+    values = _to_objects([0] * len(ids))
+    for exposure_id, column in choices:
+        selected = ids == exposure_id
+        if selected.any():
+            values[selected] = _to_objects(columns[column])[selected]
+
+    return values
+
+
+def get_balance_items(
+    columns: Dict[str, list], ecosystem_defaults, show_balance_exposure_details: bool
+) -> List[dict]:
+    """Items of the balance report from columns of the balance query"""
+    count = len(columns["name"])
+    ndigits = settings.ROUND_NDIGITS
+
+    values = {key: columns[column] for key, column in HEAD_COLUMNS}
+    for column, default_attribute in CONSOLIDATION_COLUMNS:
+        if column in columns:
+            values[column] = columns[column]
+        else:
+            default = (
+                getattr(ecosystem_defaults, default_attribute)
+                if default_attribute
+                else None
+            )
+            values[column] = [default] * count
+    values.update((key, columns[column]) for key, column in INSTRUMENT_COLUMNS)
+    values.update((key, columns[column]) for key, column in POSITION_COLUMNS)
+
+    raw_position_size = _to_objects(columns["position_size"])
+    position_size = _to_objects([round(value, ndigits) for value in raw_position_size])
+    values["position_size"] = position_size
+    values["nominal_position_size"] = [
+        None if value is None else round(value, ndigits)
+        for value in columns["nominal_position_size"]
+    ]
+
+    # Position * ( Long Underlying Exposure - Short Underlying Exposure)
+    # "Underlying Long/Short Exposure - Split":
+    # Position * Long Underlying Exposure
+    # -Position * Short Underlying Exposure
+    long = _select_underlying(
+        columns, "long_underlying_exposure_id", LONG_UNDERLYING_EXPOSURE_COLUMNS
+    )
+    short = _select_underlying(
+        columns, "short_underlying_exposure_id", SHORT_UNDERLYING_EXPOSURE_COLUMNS
+    )
+    model = _to_objects(columns["exposure_calculation_model_id"])
+    exposure = _to_objects(columns["exposure"])
+
+    net = np.flatnonzero(
+        model == ExposureCalculationModel.UNDERLYING_LONG_SHORT_EXPOSURE_NET
+    )
+    exposure[net] = position_size[net] * (long[net] - short[net])
+
+    long[np.array([value is None for value in long], dtype=bool)] = 0
+
+    split = model == ExposureCalculationModel.UNDERLYING_LONG_SHORT_EXPOSURE_SPLIT
+    split_rows = np.flatnonzero(split)
+    exposure[split_rows] = position_size[split_rows] * long[split_rows]
+    values["exposure"] = exposure
+
+    positions = np.flatnonzero(
+        np.array([bool(value) for value in position_size], dtype=bool)
+    )
+    item_values = [_to_objects(values[key])[positions] for key in ITEM_KEYS]
+    items = [dict(zip(ITEM_KEYS, row)) for row in zip(*item_values)]
+
+    if not show_balance_exposure_details:
+        return items
+
+    has_exposure = np.array(
+        [bool(value) for value in columns["has_second_exposure_currency"]],
+        dtype=bool,
+    )[positions]
+    exposure_rows = positions[has_exposure]
+    exposure_2 = _to_objects(columns["exposure_2"])[exposure_rows]
+    split_exposure = split[exposure_rows]
+    exposure_2[split_exposure] = (
+        -raw_position_size[exposure_rows][split_exposure]
+        * short[exposure_rows][split_exposure]
+    )
+    exposure_values = zip(
+        zip(*[_to_objects(values[key])[exposure_rows] for key in EXPOSURE_ITEM_KEYS]),
+        exposure_2,
+        _to_objects(columns["exposure_2_loc"])[exposure_rows],
+        _to_objects(columns["counter_directional_exposure_currency_id"])[
+            exposure_rows
+        ],
+    )
+    exposure_items = iter(
+        {
+            **EXPOSURE_ITEM_TEMPLATE,
+            **dict(zip(EXPOSURE_ITEM_KEYS, row)),
+            "exposure": exposure_value,
+            "exposure_loc": exposure_loc,
+            "exposure_currency_id": exposure_currency_id,
+        }
+        for row, exposure_value, exposure_loc, exposure_currency_id in exposure_values
+    )
+
+    # exposure item follows its position item
+    result = []
+    for item, item_has_exposure in zip(items, has_exposure):
+        result.append(item)
+        if item_has_exposure:
+            result.append(next(exposure_items))
+
+    return result
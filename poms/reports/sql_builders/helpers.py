@@ -1,5 +1,15 @@
 from poms.currencies.models import CurrencyHistory
 from poms.reports.common import Report
+from poms.reports.sql_builders.report_query import get_parameter_sql
+
+# filters of transactions by ids: attribute of report, column, query parameter
+TRANSACTION_FILTERS = (
+    ("portfolios", "portfolio_id", "portfolio_ids"),
+    ("accounts", "account_position_id", "account_ids"),
+    ("strategies1", "strategy1_position_id", "strategy1_ids"),
+    ("strategies2", "strategy2_position_id", "strategy2_ids"),
+    ("strategies3", "strategy3_position_id", "strategy3_ids"),
+)
 
 
 def dictfetchall(cursor):
@@ -8,7 +18,25 @@ def dictfetchall(cursor):
     return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
-def get_transaction_date_filter_for_initial_position_sql_string(date, has_where):
+def fetch_columns(cursor, itersize=2000):
+    "Return all rows from a cursor as a dict of column lists"
+    names = [col[0] for col in cursor.description]
+    columns = [[] for _ in names]
+
+    while True:
+        rows = cursor.fetchmany(itersize)
+        if not rows:
+            break
+
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+
+    return dict(zip(names, columns))
+
+
+def get_transaction_date_filter_for_initial_position_sql_string(
+    date, has_where, parameterized=False
+):
     result_string = ""
 
     if has_where:
@@ -16,18 +44,64 @@ def get_transaction_date_filter_for_initial_position_sql_string(date, has_where)
     else:
         result_string = "where "
 
+    if parameterized:
+        date_sql = get_parameter_sql("initial_position_date")
+    else:
+        date_sql = "'%s'" % date
+
     result_string = (
         result_string
-        + "((transaction_class_id IN (14,15) and min_date = '%s') or (transaction_class_id NOT IN (14,15)))"
-        % date
+        + "((transaction_class_id IN (14,15) and min_date = %s) or (transaction_class_id NOT IN (14,15)))"
+        % date_sql
     )
 
     return result_string
 
 
-def get_transaction_filter_sql_string(instance):
+def get_parameterized_transaction_filter_sql_list(instance):
+    return [
+        f"{column} = ANY({get_parameter_sql(parameter)})"
+        for attribute, column, parameter in TRANSACTION_FILTERS
+        if len(getattr(instance, attribute))
+    ]
+
+
+def get_transaction_filter_parameters(instance):
+    return {
+        parameter: [item.id for item in getattr(instance, attribute)]
+        for attribute, _, parameter in TRANSACTION_FILTERS
+        if len(getattr(instance, attribute))
+    }
+
+
+def get_report_query_parameters(
+    instance, report_date, bday_yesterday_of_report_date, default_currency_id, prefix=""
+):
+    """Values of parameters of the report query template made with prefix"""
+    parameters = {
+        prefix + "report_date": report_date,
+        prefix + "bday_yesterday_of_report_date": bday_yesterday_of_report_date,
+        prefix + "master_user_id": instance.master_user.id,
+        prefix + "default_currency_id": default_currency_id,
+        prefix + "report_currency_id": instance.report_currency.id,
+        prefix + "pricing_policy_id": instance.pricing_policy.id,
+        "initial_position_date": instance.report_date,
+    }
+    parameters.update(get_transaction_filter_parameters(instance))
+
+    return parameters
+
+
+def get_transaction_filter_sql_string(instance, parameterized=False):
     result_string = ""
 
+    if parameterized:
+        filter_sql_list = get_parameterized_transaction_filter_sql_list(instance)
+        if len(filter_sql_list):
+            result_string = "where " + " and ".join(filter_sql_list)
+
+        return result_string
+
     filter_sql_list = []
 
     portfolios_ids = []
@@ -99,9 +173,18 @@ def get_report_fx_rate(instance, date):
     return report_fx_rate
 
 
-def get_fx_trades_and_fx_variations_transaction_filter_sql_string(instance):
+def get_fx_trades_and_fx_variations_transaction_filter_sql_string(
+    instance, parameterized=False
+):
     result_string = ""
 
+    if parameterized:
+        filter_sql_list = get_parameterized_transaction_filter_sql_list(instance)
+        if len(filter_sql_list):
+            result_string = " and " + " and ".join(filter_sql_list)
+
+        return result_string
+
     filter_sql_list = []
 
     portfolios_ids = []
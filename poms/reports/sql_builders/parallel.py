@@ -0,0 +1,75 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection, connections
+
+from poms.common.utils import get_current_schema, set_schema
+from poms.reports.common import Report
+
+_l = logging.getLogger("poms.reports")
+
+
+def is_parallel_build_allowed(instance):
+    """
+    Only report with independent portfolios could be split by portfolios,
+    in other modes positions of different portfolios are consolidated.
+    Shards read tasks and data by their own connections, which don't see
+    uncommitted changes of the transaction of the caller.
+    """
+    return (
+        settings.REPORT_PARALLEL_BUILD
+        and not connection.in_atomic_block
+        and instance.portfolio_mode == Report.MODE_INDEPENDENT
+        and len(instance.portfolios) >= settings.REPORT_PARALLEL_MIN_PORTFOLIOS
+    )
+
+
+def get_portfolio_shards(portfolios, shards_count):
+    """Split portfolios ids to shards_count lists of nearly equal size"""
+    ids = sorted(portfolio.id for portfolio in portfolios)
+    shards_count = max(1, min(shards_count, len(ids)))
+
+    return [ids[index::shards_count] for index in range(shards_count)]
+
+
+def _build_shard(build, schema, task_id):
+    # every thread has its own db connection, it starts in public schema
+    try:
+        set_schema(schema)
+        return build(task_id)
+    finally:
+        connections.close_all()
+
+
+def build_in_parallel(build, task_ids):
+    """
+    Run build(task_id) for every task in the thread pool and merge
+    resulting items in order of completion
+    """
+    st = time.perf_counter()
+
+    schema = get_current_schema()
+    items = []
+
+    with ThreadPoolExecutor(max_workers=settings.REPORT_PARALLEL_WORKERS) as executor:
+        futures = [
+            executor.submit(_build_shard, build, schema, task_id)
+            for task_id in task_ids
+        ]
+
+        try:
+            for future in as_completed(futures):
+                items.extend(future.result())
+
+                _l.debug(
+                    "build_in_parallel shard done: %s",
+                    "{:3.3f}".format(time.perf_counter() - st),
+                )
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return items
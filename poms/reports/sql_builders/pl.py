@@ -3,13 +3,13 @@ import os
 import time
 from datetime import date, timedelta
 
-from celery import group
 from django.conf import settings
 from django.db import connection
 
 from poms.accounts.models import Account, AccountType
 from poms.celery_tasks import finmars_task
 from poms.celery_tasks.models import CeleryTask
+from poms.common.exceptions import FinmarsBaseException
 from poms.common.utils import (
     get_closest_bday_of_yesterday,
     get_last_business_day,
@@ -25,12 +25,23 @@ from poms.reports.common import Report
 from poms.reports.models import PLReportCustomField, ReportInstanceModel
 from poms.reports.sql_builders.helpers import (
     get_transaction_filter_sql_string,
-    get_report_fx_rate,
     get_fx_trades_and_fx_variations_transaction_filter_sql_string,
     get_where_expression_for_position_consolidation,
     get_position_consolidation_for_select,
     dictfetchall,
     get_transaction_date_filter_for_initial_position_sql_string,
+    get_report_query_parameters,
+)
+from poms.reports.sql_builders.parallel import (
+    build_in_parallel,
+    get_portfolio_shards,
+    is_parallel_build_allowed,
+)
+from poms.reports.sql_builders.report_query import (
+    ReportQuery,
+    get_cached_template,
+    get_template_key,
+    parameterize_template,
 )
 from poms.strategies.models import Strategy1, Strategy2, Strategy3
 from poms.transactions.models import Transaction
@@ -38,6 +49,9 @@ from poms.users.models import EcosystemDefault
 
 _l = logging.getLogger("poms.reports")
 
+# prefix of parameters of the query for PL first date
+PL_FIRST_DATE_PREFIX = "first_"
+
 
 class PLReportBuilderSql:
     def __init__(self, instance=None):
@@ -160,8 +174,7 @@ class PLReportBuilderSql:
         _l.debug("self.instance.report_date %s" % self.instance.report_date)
         _l.debug("self.instance.pl_first_date %s" % self.instance.pl_first_date)
 
-        # self.parallel_build()
-        self.serial_build()
+        self.build_items()
 
         self.instance.execution_time = float("{:3.3f}".format(time.perf_counter() - st))
 
@@ -3264,23 +3277,25 @@ class PLReportBuilderSql:
         return query
 
     @staticmethod
-    def get_query_for_first_date(instance):
-        ecosystem_defaults = EcosystemDefault.cache.get_cache(
-            master_user_pk=instance.master_user.pk
+    def get_date_query_template(instance, prefix=""):
+        """
+        Source query of the report with parameters instead of values,
+        values of the query for PL first date are passed with prefix
+        """
+        transaction_filter_sql_string = get_transaction_filter_sql_string(
+            instance, parameterized=True
         )
-
-        report_fx_rate = get_report_fx_rate(instance, instance.pl_first_date)
-
-        _l.debug("report_fx_rate %s" % report_fx_rate)
-
-        transaction_filter_sql_string = get_transaction_filter_sql_string(instance)
         transaction_date_filter_for_initial_position_sql_string = (
             get_transaction_date_filter_for_initial_position_sql_string(
-                instance.report_date, has_where=bool(len(transaction_filter_sql_string))
+                None,
+                has_where=bool(len(transaction_filter_sql_string)),
+                parameterized=True,
             )
         )
         fx_trades_and_fx_variations_filter_sql_string = (
-            get_fx_trades_and_fx_variations_transaction_filter_sql_string(instance)
+            get_fx_trades_and_fx_variations_transaction_filter_sql_string(
+                instance, parameterized=True
+            )
         )
         transactions_all_with_multipliers_where_expression = (
             get_where_expression_for_position_consolidation(
@@ -3295,15 +3310,12 @@ class PLReportBuilderSql:
             instance, prefix="tt_in1."
         )
 
-        query = PLReportBuilderSql.get_source_query(cost_method=instance.cost_method.id)
+        query = parameterize_template(
+            PLReportBuilderSql.get_source_query(cost_method=instance.cost_method.id),
+            prefix,
+        )
 
-        query = query.format(
-            report_date=instance.pl_first_date,
-            master_user_id=instance.master_user.id,
-            default_currency_id=ecosystem_defaults.currency_id,
-            report_currency_id=instance.report_currency.id,
-            pricing_policy_id=instance.pricing_policy.id,
-            report_fx_rate=report_fx_rate,
+        return query.format(
             transaction_filter_sql_string=transaction_filter_sql_string,
             transaction_date_filter_for_initial_position_sql_string=transaction_date_filter_for_initial_position_sql_string,
             fx_trades_and_fx_variations_filter_sql_string=fx_trades_and_fx_variations_filter_sql_string,
@@ -3312,92 +3324,39 @@ class PLReportBuilderSql:
             tt_in1_consolidation_columns=tt_in1_consolidation_columns,
             transactions_all_with_multipliers_where_expression=transactions_all_with_multipliers_where_expression,
             filter_query_for_balance_in_multipliers_table="",
-            bday_yesterday_of_report_date=instance.bday_yesterday_of_report_date,
         )
 
-        return query
-
     @staticmethod
-    def get_query_for_second_date(instance):
-        report_fx_rate = get_report_fx_rate(instance, instance.report_date)
+    def get_query_parameters(instance):
         ecosystem_defaults = EcosystemDefault.cache.get_cache(
             master_user_pk=instance.master_user.pk
         )
 
-        _l.debug("report_fx_rate %s" % report_fx_rate)
-
-        transaction_filter_sql_string = get_transaction_filter_sql_string(instance)
-        transaction_date_filter_for_initial_position_sql_string = (
-            get_transaction_date_filter_for_initial_position_sql_string(
-                instance.report_date, has_where=bool(len(transaction_filter_sql_string))
-            )
-        )
-        fx_trades_and_fx_variations_filter_sql_string = (
-            get_fx_trades_and_fx_variations_transaction_filter_sql_string(instance)
+        parameters = get_report_query_parameters(
+            instance,
+            instance.report_date,
+            instance.bday_yesterday_of_report_date,
+            ecosystem_defaults.currency_id,
         )
-        transactions_all_with_multipliers_where_expression = (
-            get_where_expression_for_position_consolidation(
-                instance, prefix="tt_w_m.", prefix_second="t_o."
+        parameters.update(
+            get_report_query_parameters(
+                instance,
+                instance.pl_first_date,
+                instance.bday_yesterday_of_report_date,
+                ecosystem_defaults.currency_id,
+                prefix=PL_FIRST_DATE_PREFIX,
             )
         )
-        consolidation_columns = get_position_consolidation_for_select(instance)
-        tt_consolidation_columns = get_position_consolidation_for_select(
-            instance, prefix="tt."
-        )
-
-        tt_in1_consolidation_columns = get_position_consolidation_for_select(
-            instance, prefix="tt_in1."
-        )
 
-        query = PLReportBuilderSql.get_source_query(cost_method=instance.cost_method.id)
+        return parameters
 
-        query = query.format(
-            report_date=instance.report_date,
-            master_user_id=instance.master_user.id,
-            default_currency_id=ecosystem_defaults.currency_id,
-            report_currency_id=instance.report_currency.id,
-            pricing_policy_id=instance.pricing_policy.id,
-            report_fx_rate=report_fx_rate,
-            transaction_filter_sql_string=transaction_filter_sql_string,
-            transaction_date_filter_for_initial_position_sql_string=transaction_date_filter_for_initial_position_sql_string,
-            fx_trades_and_fx_variations_filter_sql_string=fx_trades_and_fx_variations_filter_sql_string,
-            consolidation_columns=consolidation_columns,
-            tt_consolidation_columns=tt_consolidation_columns,
-            tt_in1_consolidation_columns=tt_in1_consolidation_columns,
-            transactions_all_with_multipliers_where_expression=transactions_all_with_multipliers_where_expression,
-            filter_query_for_balance_in_multipliers_table="",
-            bday_yesterday_of_report_date=instance.bday_yesterday_of_report_date,
-        )
-
-        return query
-
-    @finmars_task(name="reports.build_pl_report", bind=True)
-    def build(self, task_id, *args, **kwargs):
-        try:
-            st = time.perf_counter()
-
-            celery_task = CeleryTask.objects.get(id=task_id)
-
-            report_settings = celery_task.options_object
-
-            instance = ReportInstanceModel(
-                **report_settings, master_user=celery_task.master_user
-            )
-
-            with connection.cursor() as cursor:
-                query_1 = PLReportBuilderSql.get_query_for_first_date(instance)
-                query_2 = PLReportBuilderSql.get_query_for_second_date(instance)
-
-                ecosystem_defaults = EcosystemDefault.objects.get(
-                    master_user=celery_task.master_user
-                )
-
-                st = time.perf_counter()
-
-                # q1 - pl first date
-                # q2 - report date
-                # language=PostgreSQL
-                query = """select 
+    @staticmethod
+    def get_query_template(instance):
+        """PL query of the report with parameters instead of values"""
+        # q1 - pl first date
+        # q2 - report date
+        # language=PostgreSQL
+        query = """select 
                                 
                                 (q2.name) as name,
                                 (q2.short_name) as short_name,
@@ -3727,15 +3686,45 @@ class PLReportBuilderSql:
                            from ({query_report_date}) as q2 
                            left join ({query_first_date}) as q1 on q1.name = q2.name and q1.item_type = q2.item_type and q1.instrument_id = q2.instrument_id {final_consolidation_where_filters}"""
 
-                query = query.format(
-                    query_first_date=query_1,
-                    query_report_date=query_2,
-                    final_consolidation_columns=PLReportBuilderSql.get_final_consolidation_columns(
-                        instance
-                    ),
-                    final_consolidation_where_filters=PLReportBuilderSql.get_final_consolidation_where_filters_columns(
-                        instance
-                    ),
+        return query.format(
+            query_first_date=PLReportBuilderSql.get_date_query_template(
+                instance, prefix=PL_FIRST_DATE_PREFIX
+            ),
+            query_report_date=PLReportBuilderSql.get_date_query_template(instance),
+            final_consolidation_columns=PLReportBuilderSql.get_final_consolidation_columns(
+                instance
+            ),
+            final_consolidation_where_filters=PLReportBuilderSql.get_final_consolidation_where_filters_columns(
+                instance
+            ),
+        )
+
+    @finmars_task(name="reports.build_pl_report", bind=True)
+    def build(self, task_id, *args, **kwargs):
+        try:
+            st = time.perf_counter()
+
+            celery_task = CeleryTask.objects.get(id=task_id)
+
+            report_settings = celery_task.options_object
+
+            instance = ReportInstanceModel(
+                **report_settings, master_user=celery_task.master_user
+            )
+
+            with connection.cursor() as cursor:
+                ecosystem_defaults = EcosystemDefault.objects.get(
+                    master_user=celery_task.master_user
+                )
+
+                st = time.perf_counter()
+
+                query = get_cached_template(
+                    ("pl", *get_template_key(instance)),
+                    lambda: PLReportBuilderSql.get_query_template(instance),
+                )
+                report_query = ReportQuery(
+                    "PL", query, PLReportBuilderSql.get_query_parameters(instance)
                 )
 
                 if settings.SERVER_TYPE == "local":
@@ -3747,20 +3736,18 @@ class PLReportBuilderSql:
                     ) as the_file:
                         the_file.write(query)
 
-                cursor.execute(query)
+                report_query.execute(cursor)
 
                 _l.debug(
                     "PL report query execute done: %s",
                     "{:3.3f}".format(time.perf_counter() - st),
                 )
 
-                query_str = str(cursor.query, "utf-8")
-
                 if settings.SERVER_TYPE == "local":
                     with open(
                         os.path.join(settings.BASE_DIR, "/tmp/query_result_pl.txt"), "w"
                     ) as the_file:
-                        the_file.write(query_str)
+                        the_file.write(report_query.mogrify(cursor))
 
                 result_tmp_raw = dictfetchall(cursor)
                 result_tmp = []
@@ -4808,7 +4795,10 @@ class PLReportBuilderSql:
         celery_task = CeleryTask.objects.filter(id=task_id).first()
         if not celery_task:
             _l.error(f"Invalid celery task_id={task_id}")
-            return
+            raise FinmarsBaseException(
+                error_key="invalid_celery_task",
+                message=f"Invalid celery task_id={task_id}",
+            )
 
         try:
             return self.build(task_id)
@@ -4818,124 +4808,71 @@ class PLReportBuilderSql:
             celery_task.save()
             raise e
 
-    def parallel_build(self):
-        st = time.perf_counter()
+    def get_task_options(self, portfolios_ids):
+        return {
+            "report_date": self.instance.report_date,
+            "pl_first_date": self.instance.pl_first_date,
+            "bday_yesterday_of_report_date": self.instance.bday_yesterday_of_report_date,
+            "portfolios_ids": portfolios_ids,
+            "accounts_ids": [instance.id for instance in self.instance.accounts],
+            "strategies1_ids": [instance.id for instance in self.instance.strategies1],
+            "strategies2_ids": [instance.id for instance in self.instance.strategies2],
+            "strategies3_ids": [instance.id for instance in self.instance.strategies3],
+            "report_currency_id": self.instance.report_currency.id,
+            "pricing_policy_id": self.instance.pricing_policy.id,
+            "cost_method_id": self.instance.cost_method.id,
+            "show_balance_exposure_details": self.instance.show_balance_exposure_details,
+            "portfolio_mode": self.instance.portfolio_mode,
+            "account_mode": self.instance.account_mode,
+            "strategy1_mode": self.instance.strategy1_mode,
+            "strategy2_mode": self.instance.strategy2_mode,
+            "strategy3_mode": self.instance.strategy3_mode,
+            "allocation_mode": self.instance.allocation_mode,
+        }
+
+    def create_task(self, portfolios_ids):
+        return CeleryTask.objects.create(
+            master_user=self.instance.master_user,
+            member=self.instance.member,
+            verbose_name="PL Report",
+            type="calculate_pl_report",
+            options_object=self.get_task_options(portfolios_ids),
+        )
 
-        tasks = []
+    def build_items(self):
+        if is_parallel_build_allowed(self.instance):
+            self.parallel_build()
+        else:
+            self.serial_build()
 
-        if self.instance.portfolio_mode == Report.MODE_INDEPENDENT:
-            for portfolio in self.instance.portfolios:
-                task = CeleryTask.objects.create(
-                    master_user=self.instance.master_user,
-                    member=self.instance.member,
-                    verbose_name="PL Report",
-                    type="calculate_pl_report",
-                    options_object={
-                        "report_date": self.instance.report_date,
-                        "pl_first_date": self.instance.pl_first_date,
-                        "bday_yesterday_of_report_date": self.bday_yesterday_of_report_date,
-                        "portfolios_ids": [portfolio.id],
-                        "accounts_ids": [
-                            instance.id for instance in self.instance.accounts
-                        ],
-                        "strategies1_ids": [
-                            instance.id for instance in self.instance.strategies1
-                        ],
-                        "strategies2_ids": [
-                            instance.id for instance in self.instance.strategies2
-                        ],
-                        "strategies3_ids": [
-                            instance.id for instance in self.instance.strategies3
-                        ],
-                        "report_currency_id": self.instance.report_currency.id,
-                        "pricing_policy_id": self.instance.pricing_policy.id,
-                        "cost_method_id": self.instance.cost_method.id,
-                        "show_balance_exposure_details": self.instance.show_balance_exposure_details,
-                        "portfolio_mode": self.instance.portfolio_mode,
-                        "account_mode": self.instance.account_mode,
-                        "strategy1_mode": self.instance.strategy1_mode,
-                        "strategy2_mode": self.instance.strategy2_mode,
-                        "strategy3_mode": self.instance.strategy3_mode,
-                        "allocation_mode": self.instance.allocation_mode,
-                    },
-                )
+    def parallel_build(self):
+        """
+        Portfolios are independent, so report is built by portfolio shards
+        in threads, each shard in its own db connection
+        """
+        st = time.perf_counter()
 
-                tasks.append(task)
+        self.instance.bday_yesterday_of_report_date = get_last_business_day(
+            self.instance.report_date - timedelta(days=1), to_string=True
+        )
 
-        else:
-            task = CeleryTask.objects.create(
-                master_user=self.instance.master_user,
-                member=self.instance.member,
-                verbose_name="PL Report",
-                type="calculate_pl_report",
-                options_object={
-                    "report_date": self.instance.report_date,
-                    "pl_first_date": self.instance.pl_first_date,
-                    "bday_yesterday_of_report_date": self.bday_yesterday_of_report_date,
-                    "portfolios_ids": [
-                        instance.id for instance in self.instance.portfolios
-                    ],
-                    "accounts_ids": [
-                        instance.id for instance in self.instance.accounts
-                    ],
-                    "strategies1_ids": [
-                        instance.id for instance in self.instance.strategies1
-                    ],
-                    "strategies2_ids": [
-                        instance.id for instance in self.instance.strategies2
-                    ],
-                    "strategies3_ids": [
-                        instance.id for instance in self.instance.strategies3
-                    ],
-                    "report_currency_id": self.instance.report_currency.id,
-                    "pricing_policy_id": self.instance.pricing_policy.id,
-                    "cost_method_id": self.instance.cost_method.id,
-                    "show_balance_exposure_details": self.instance.show_balance_exposure_details,
-                    "portfolio_mode": self.instance.portfolio_mode,
-                    "account_mode": self.instance.account_mode,
-                    "strategy1_mode": self.instance.strategy1_mode,
-                    "strategy2_mode": self.instance.strategy2_mode,
-                    "strategy3_mode": self.instance.strategy3_mode,
-                    "allocation_mode": self.instance.allocation_mode,
-                },
+        tasks = [
+            self.create_task(portfolios_ids)
+            for portfolios_ids in get_portfolio_shards(
+                self.instance.portfolios, settings.REPORT_PARALLEL_SHARDS
             )
-
-            tasks.append(task)
+        ]
 
         _l.debug("Going to run %s tasks" % len(tasks))
 
-        # Run the group of tasks
-        job = group(
-            self.build.s(
-                task_id=task.id,
-                context={
-                    "realm_code": self.instance.master_user.realm_code,
-                    "space_code": self.instance.master_user.space_code,
-                },
+        try:
+            self.instance.items = build_in_parallel(
+                self.build_sync, [task.id for task in tasks]
             )
-            for task in tasks
-        )
-
-        group_result = job.apply_async()
-        # Wait for all tasks to finish and get their results
-        group_result.join()
-
-        # Retrieve results
-        all_dicts = []
-        for result in group_result.results:
-            # Each result is an AsyncResult instance.
-            # You can get the result of the task with its .result property.
-            all_dicts.extend(result.result)
-
-        for task in tasks:
-            # refresh the task instance to get the latest status from the database
-            task.refresh_from_db()
-
-            if task.status != CeleryTask.STATUS_ERROR:
-                task.delete()
-
-        # 'all_dicts' is now a list of all dicts returned by the tasks
-        self.instance.items = all_dicts
+        finally:
+            CeleryTask.objects.filter(
+                id__in=[task.id for task in tasks],
+            ).exclude(status=CeleryTask.STATUS_ERROR).delete()
 
         _l.debug("parallel_build done: %s", "{:3.3f}".format(time.perf_counter() - st))
 
@@ -4970,39 +4907,8 @@ class PLReportBuilderSql:
             self.instance.report_date - timedelta(days=1), to_string=True
         )
 
-        task = CeleryTask.objects.create(
-            master_user=self.instance.master_user,
-            member=self.instance.member,
-            verbose_name="PL Report",
-            type="calculate_pl_report",
-            options_object={
-                "report_date": self.instance.report_date,
-                "pl_first_date": self.instance.pl_first_date,
-                "bday_yesterday_of_report_date": self.instance.bday_yesterday_of_report_date,
-                "portfolios_ids": [
-                    instance.id for instance in self.instance.portfolios
-                ],
-                "accounts_ids": [instance.id for instance in self.instance.accounts],
-                "strategies1_ids": [
-                    instance.id for instance in self.instance.strategies1
-                ],
-                "strategies2_ids": [
-                    instance.id for instance in self.instance.strategies2
-                ],
-                "strategies3_ids": [
-                    instance.id for instance in self.instance.strategies3
-                ],
-                "report_currency_id": self.instance.report_currency.id,
-                "pricing_policy_id": self.instance.pricing_policy.id,
-                "cost_method_id": self.instance.cost_method.id,
-                "show_balance_exposure_details": self.instance.show_balance_exposure_details,
-                "portfolio_mode": self.instance.portfolio_mode,
-                "account_mode": self.instance.account_mode,
-                "strategy1_mode": self.instance.strategy1_mode,
-                "strategy2_mode": self.instance.strategy2_mode,
-                "strategy3_mode": self.instance.strategy3_mode,
-                "allocation_mode": self.instance.allocation_mode,
-            },
+        task = self.create_task(
+            [instance.id for instance in self.instance.portfolios]
         )
 
         result = self.build_sync(task.id)
@@ -5010,7 +4916,7 @@ class PLReportBuilderSql:
         # 'all_dicts' is now a list of all dicts returned by the tasks
         self.instance.items = result
 
-        _l.debug("parallel_build done: %s", "{:3.3f}".format(time.perf_counter() - st))
+        _l.debug("serial_build done: %s", "{:3.3f}".format(time.perf_counter() - st))
 
     def get_cash_consolidation_for_select(self):
         result = []
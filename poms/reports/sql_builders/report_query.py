@@ -0,0 +1,245 @@
+"""
+Parameterized report queries.
+
+Balance and PL report queries are thousands of lines assembled by str.format.
+Report date, ids of master user, currencies, pricing policy and ids of the
+filtered portfolios, accounts and strategies were inlined into the text, so
+every report was a new SQL text parsed and planned by Postgres from scratch.
+Here values are bind parameters (lists of ids are arrays compared by
+"= ANY"), and the text of a query depends only on the cost method,
+consolidation modes and set filters of the report. Templates are assembled
+once per such combination and cached in the process. Queries are executed as
+prepared statements of the db session, so Postgres parses them once per
+connection and schema and could reuse their plans.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from poms.common.utils import get_current_schema
+
+_l = logging.getLogger("poms.reports")
+
+# values formatted into report query templates as '{name}' or {name}
+TEMPLATE_PARAMETERS = (
+    "report_date",
+    "bday_yesterday_of_report_date",
+    "master_user_id",
+    "default_currency_id",
+    "report_currency_id",
+    "pricing_policy_id",
+)
+TEMPLATES_CACHE_SIZE = 128
+PREPARED_STATEMENTS_MAX_COUNT = 32
+# invalid_sql_statement_name, e.g. statements were discarded by connection pooler
+INVALID_SQL_STATEMENT_NAME = "26000"
+
+_PARAMETER_RE = re.compile(r"%%|%\((\w+)\)s")
+
+_templates = OrderedDict()
+_templates_lock = Lock()
+
+
+def get_parameter_type(name: str) -> str:
+    """Postgres type of the parameter by suffix of its name"""
+    if name.endswith("_ids"):
+        return "integer[]"
+    if name.endswith("_date"):
+        return "date"
+    if name.endswith("_id"):
+        return "integer"
+
+    raise ValueError(f"Unknown type of report query parameter {name}")
+
+
+def get_parameter_sql(name: str) -> str:
+    return f"CAST(%({name})s AS {get_parameter_type(name)})"
+
+
+def parameterize_template(template: str, prefix: str = "") -> str:
+    """
+    Replace values of TEMPLATE_PARAMETERS in the template by placeholders of
+    parameters with the prefix, other fields are left for str.format
+    """
+    for name in TEMPLATE_PARAMETERS:
+        parameter_sql = get_parameter_sql(prefix + name)
+        template = template.replace("'{%s}'" % name, parameter_sql)
+        template = template.replace("{%s}" % name, parameter_sql)
+
+    return template
+
+
+def get_template_key(instance) -> tuple:
+    """Attributes of the report which change text of its query templates"""
+    return (
+        instance.cost_method.id,
+        instance.portfolio_mode,
+        instance.account_mode,
+        instance.strategy1_mode,
+        instance.strategy2_mode,
+        instance.strategy3_mode,
+        instance.allocation_mode,
+        bool(len(instance.portfolios)),
+        bool(len(instance.accounts)),
+        bool(len(instance.strategies1)),
+        bool(len(instance.strategies2)),
+        bool(len(instance.strategies3)),
+    )
+
+
+def get_cached_template(key: Hashable, build: Callable[[], str]) -> str:
+    """Template made by build() once per key, least recently used are dropped"""
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            return template
+
+    template = build()
+
+    with _templates_lock:
+        _templates[key] = template
+        while len(_templates) > TEMPLATES_CACHE_SIZE:
+            _templates.popitem(last=False)
+
+    return template
+
+
+def get_positional_sql(sql: str) -> Tuple[str, List[str]]:
+    """Text of the query with $n placeholders and names of parameters by n"""
+    positions = {}
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            return "%"
+        if name not in positions:
+            positions[name] = len(positions) + 1
+        return f"${positions[name]}"
+
+    return _PARAMETER_RE.sub(replace, sql), list(positions)
+
+
+def _get_prepared_statements(db) -> OrderedDict:
+    """Names of statements prepared in the current session of the db connection"""
+    session = getattr(db, "report_prepared_statements", None)
+    if session is None or session[0] is not db.connection:
+        session = db.report_prepared_statements = (db.connection, OrderedDict())
+
+    return session[1]
+
+
+class ReportQuery:
+    """Report query with named parameters executed as a prepared statement"""
+
+    def __init__(self, name: str, sql: str, params: dict):
+        self.name = name
+        self.sql = sql
+        self.params = params
+        self.timings = {}
+
+    def get_statement_name(self, positional_sql: str) -> str:
+        # plans of the same text differ by schema of the tenant
+        key = f"{get_current_schema()}\n{positional_sql}"
+        return f"report_{hashlib.md5(key.encode()).hexdigest()}"
+
+    def prepare(self, cursor) -> Tuple[str, list]:
+        """Name of the statement prepared in the session and its values"""
+        sql, names = get_positional_sql(self.sql)
+        values = [self.params[name] for name in names]
+        statement = self.get_statement_name(sql)
+
+        statements = _get_prepared_statements(cursor.db)
+        if statement in statements:
+            statements.move_to_end(statement)
+            return statement, values
+
+        st = time.perf_counter()
+
+        types = ", ".join(get_parameter_type(name) for name in names)
+        cursor.execute(
+            f"PREPARE {statement} ({types}) AS {sql}"
+            if types
+            else f"PREPARE {statement} AS {sql}"
+        )
+        statements[statement] = True
+
+        while len(statements) > PREPARED_STATEMENTS_MAX_COUNT:
+            old_statement, _ = statements.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {old_statement}")
+
+        self.timings["prepare_time"] = time.perf_counter() - st
+
+        return statement, values
+
+    def get_sql_and_values(self, cursor) -> Tuple[str, Optional[object]]:
+        if not settings.REPORT_SQL_PREPARED_STATEMENTS:
+            return self.sql, self.params
+
+        statement, values = self.prepare(cursor)
+        if not values:
+            return f"EXECUTE {statement}", None
+
+        placeholders = ", ".join(["%s"] * len(values))
+        return f"EXECUTE {statement}({placeholders})", values
+
+    def is_statement_lost(self, cursor, error: DatabaseError) -> bool:
+        return (
+            settings.REPORT_SQL_PREPARED_STATEMENTS
+            and getattr(error.__cause__, "pgcode", None) == INVALID_SQL_STATEMENT_NAME
+            and not cursor.db.in_atomic_block
+        )
+
+    def explain(self, cursor, sql: str, values):
+        """Planning and execution time of the query measured by Postgres"""
+        cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", values)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        self.timings["planning_time"] = plan[0]["Planning Time"] / 1000
+        self.timings["server_execution_time"] = plan[0]["Execution Time"] / 1000
+
+    def execute(self, cursor):
+        """Execute the query, rows are left in the cursor"""
+        sql, values = self.get_sql_and_values(cursor)
+
+        if settings.REPORT_SQL_PROFILING:
+            # query is executed twice, only for profiling
+            self.explain(cursor, sql, values)
+
+        st = time.perf_counter()
+
+        try:
+            cursor.execute(sql, values)
+        except DatabaseError as e:
+            if not self.is_statement_lost(cursor, e):
+                raise
+
+            _get_prepared_statements(cursor.db).clear()
+            sql, values = self.get_sql_and_values(cursor)
+            cursor.execute(sql, values)
+
+        self.timings["execution_time"] = time.perf_counter() - st
+
+        _l.log(
+            logging.INFO if settings.REPORT_SQL_PROFILING else logging.DEBUG,
+            "%s report query timings: %s",
+            self.name,
+            ", ".join(
+                f"{key} {value:3.3f}" for key, value in self.timings.items()
+            ),
+        )
+
+    def mogrify(self, cursor) -> str:
+        """Text of the query with values, for debugging"""
+        return str(cursor.mogrify(self.sql, self.params), "utf-8")
@@ -1,6 +1,5 @@
 import logging
 import time
-import traceback
 from datetime import timedelta
 
 from django.db import connection
@@ -24,6 +23,9 @@ from poms.reports.sql_builders.helpers import (
     get_transaction_report_date_filter_sql_string,
     get_transaction_report_filter_sql_string,
 )
+from poms.reports.sql_builders.transaction_filters import (
+    get_transaction_user_filters_sql,
+)
 from poms.strategies.models import Strategy1, Strategy2, Strategy3
 from poms.transactions.models import (
     ComplexTransaction,
@@ -132,144 +134,11 @@ class TransactionReportBuilderSql:
         return self.instance
 
     def add_user_filters(self):
+        """Conditions of user filters for the query and their parameters"""
         if not self.instance.filters:
-            return ""
-
-        portfolios = list(
-            Portfolio.objects.all().values(
-                "id", "user_code", "short_name", "name", "public_name"
-            )
-        )
-        instruments = list(
-            Instrument.objects.all().values(
-                "id", "user_code", "short_name", "name", "public_name"
-            )
-        )
-        currencies = list(
-            Currency.objects.all().values(
-                "id", "user_code", "short_name", "name", "public_name"
-            )
-        )
+            return "", {}
 
-        _l.debug(f"add_user_filters.instruments count {len(instruments)}")
-
-        result = ""
-        try:
-            for filter in self.instance.filters:
-                if filter["options"]["enabled"] and filter["options"]["filter_values"]:
-                    if filter["key"] in [
-                        "portfolio.user_code",
-                        "portfolio.name",
-                        "portfolio.short_name",
-                        "portfolio.public_name",
-                    ]:
-                        field_key = filter["key"].split(".")[1]
-
-                        portfolio_ids = []
-
-                        for portfolio in portfolios:
-                            portfolio_ids.extend(
-                                str(portfolio["id"])
-                                for value in filter["options"]["filter_values"]
-                                if value == portfolio[field_key]
-                            )
-                        _l.debug(f"portfolio_ids {portfolio_ids}")
-
-                        if portfolio_ids:
-                            res = "'" + "','".join(portfolio_ids)
-                            res = f"{res}'"
-
-                            result = f"{result}and t.portfolio_id IN ({res})"
-
-                    if filter["key"] in {
-                        "instrument.user_code",
-                        "instrument.name",
-                        "instrument.short_name",
-                        "instrument.public_name",
-                    }:
-                        field_key = filter["key"].split(".")[1]
-
-                        instrument_ids = []
-
-                        for instrument in instruments:
-                            instrument_ids.extend(
-                                str(instrument["id"])
-                                for value in filter["options"]["filter_values"]
-                                if value == instrument[field_key]
-                            )
-
-                        if instrument_ids:
-                            res = "'" + "','".join(instrument_ids)
-                            res = f"{res}'"
-                            result = f"{result}and t.instrument_id IN ({res})"
-
-                    if filter["key"] in ["entry_item_user_code"]:
-                        instrument_ids = []
-
-                        for instrument in instruments:
-                            instrument_ids.extend(
-                                str(instrument["id"])
-                                for value in filter["options"]["filter_values"]
-                                if value == instrument["user_code"]
-                            )
-                        _l.debug(f"instrument_ids {instrument_ids}")
-
-                        instrument_expression = ""
-
-                        if instrument_ids:
-                            res = "'" + "','".join(instrument_ids)
-                            res = f"{res}'"
-
-                            instrument_expression = f"t.instrument_id IN ({res})"
-
-                        currencies_ids = []
-
-                        for currency in currencies:
-                            currencies_ids.extend(
-                                str(currency["id"])
-                                for value in filter["options"]["filter_values"]
-                                if value == currency["user_code"]
-                            )
-                        _l.debug(f"currencies_ids {currencies_ids}")
-
-                        settlement_currency_expression = ""
-                        transaction_currency_expression = ""
-
-                        if currencies_ids:
-                            res = "'" + "','".join(currencies_ids)
-                            res = f"{res}'"
-
-                            settlement_currency_expression = (
-                                f"t.settlement_currency_id IN ({res})"
-                            )
-                            res = "'" + "','".join(currencies_ids)
-                            res = f"{res}'"
-
-                            transaction_currency_expression = (
-                                f"t.transaction_currency_id IN ({res})"
-                            )
-                        # _l.debug('result %s' % result)
-
-                        if instrument_expression and (
-                            settlement_currency_expression
-                            and transaction_currency_expression
-                        ):
-                            result = f"{result}and ({instrument_expression} or {settlement_currency_expression} or {transaction_currency_expression})"
-
-                        elif instrument_expression:
-                            result = f"{result}and {instrument_expression}"
-
-                        elif (
-                            settlement_currency_expression
-                            and transaction_currency_expression
-                        ):
-                            result = f"{result}and ({settlement_currency_expression} or {transaction_currency_expression})"
-
-        except Exception as e:
-            _l.error(f"User filters layout error {e}")
-            _l.error(f"User filters layout traceback {traceback.format_exc()}")
-
-        return result
+        return get_transaction_user_filters_sql(self.instance.filters)
 
     def build_complex_transaction_level_items(self):
         _l.debug("build_complex_transaction_level_items")
@@ -429,7 +298,7 @@ class TransactionReportBuilderSql:
                 self.instance
             )
 
-            user_filters = self.add_user_filters()
+            user_filters, user_filters_params = self.add_user_filters()
 
             query = """
                     SELECT
@@ -564,7 +433,7 @@ class TransactionReportBuilderSql:
             )
 
             # cursor.execute(query, [self.instance.begin_date, self.instance.end_date, self.instance.master_user.id, statuses, filter_sql_string])
-            cursor.execute(query)
+            cursor.execute(query, user_filters_params or None)
 
             result = dictfetchall(cursor)
 
@@ -591,7 +460,7 @@ class TransactionReportBuilderSql:
             date_filter_sql_string = get_transaction_report_date_filter_sql_string(
                 self.instance
             )
-            user_filters = self.add_user_filters()
+            user_filters, user_filters_params = self.add_user_filters()
 
             query = """
                     SELECT
@@ -731,7 +600,7 @@ class TransactionReportBuilderSql:
             )
 
             # cursor.execute(query, [self.instance.begin_date, self.instance.end_date, self.instance.master_user.id, statuses, filter_sql_string])
-            cursor.execute(query)
+            cursor.execute(query, user_filters_params or None)
 
             raw_results = dictfetchall(cursor)
             results = []
@@ -0,0 +1,273 @@
+"""
+User filters of the transaction report as predicates of its query.
+
+Filters were matched in Python against all portfolios, instruments and
+currencies of the space loaded for every report, and ids of matched objects
+were inlined into the query. Here each filter is a predicate on a column of
+the transaction, its complex transaction or transaction type, or an EXISTS
+subquery on the related table, with values passed as query parameters, so
+the database matches filters by its indexes.
+
+Keys of filters are keys of report items: own fields ("notes",
+"transaction_date", "complex_transaction_user_text_1"), fields of relations
+("portfolio.user_code", "settlement_currency.name") and "entry_item_*"
+fields of the instrument or currencies of the transaction.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+
+from poms.common.filtering_handlers import FilterType
+from poms.transactions.models import ComplexTransaction, Transaction, TransactionType
+
+_l = logging.getLogger("poms.reports")
+
+# prefixes of item keys of columns selected from joined tables of the query
+JOINED_TABLES = (
+    ("complex_transaction_", "tc", ComplexTransaction),
+    ("transaction_type_", "tt", TransactionType),
+)
+# instrument or currencies of entries of the transaction
+ENTRY_ITEM_PREFIX = "entry_item_"
+ENTRY_ITEM_RELATIONS = ("instrument", "settlement_currency", "transaction_currency")
+
+TEXT_FIELDS = (models.CharField, models.TextField)
+NUMBER_FIELDS = (models.IntegerField, models.FloatField, models.DecimalField)
+DATE_FIELDS = (models.DateField,)
+
+COMPARISONS = {
+    FilterType.GREATER: ">",
+    FilterType.GREATER_EQUAL: ">=",
+    FilterType.LESS: "<",
+    FilterType.LESS_EQUAL: "<=",
+}
+RANGE_FILTER_TYPES = (FilterType.FROM_TO, FilterType.OUT_OF_RANGE)
+
+
+def get_value_field(model, name: str) -> Optional[models.Field]:
+    """Concrete field of the model holding values, not a relation"""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+    if not field.concrete or field.is_relation:
+        return None
+
+    return field
+
+
+def get_relation_field(name: str) -> Optional[models.ForeignKey]:
+    try:
+        field = Transaction._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+    return field if field.many_to_one else None
+
+
+class TransactionUserFilters:
+    """SQL predicates of report filters and values of their parameters"""
+
+    def __init__(self, prefix: str = "user_filter_"):
+        self.prefix = prefix
+        self.params = {}
+
+    def add_param(self, value) -> str:
+        name = f"{self.prefix}{len(self.params)}"
+        self.params[name] = value
+        return f"%({name})s"
+
+    def convert_value(self, field: models.Field, value):
+        if isinstance(field, DATE_FIELDS):
+            return datetime.strptime(value, settings.API_DATE_FORMAT).date()
+        if isinstance(field, NUMBER_FIELDS):
+            return float(value)
+        if isinstance(field, models.BooleanField):
+            return value in (True, "true", "True", 1)
+        return str(value)
+
+    def get_text_match_sql(self, column: str, value: str) -> str:
+        """All words of value are in the column, or the whole value in quotes"""
+        words = [value.strip('"')] if '"' in value else value.split()
+        return " and ".join(
+            f"strpos(lower({column}), lower({self.add_param(word)})) > 0"
+            for word in words
+        )
+
+    def get_predicate(
+        self, column: str, field: models.Field, filter_type: str, values
+    ) -> Optional[str]:
+        """Predicate of the column, None if the filter has no values"""
+        is_text = isinstance(field, TEXT_FIELDS)
+
+        if filter_type == FilterType.EMPTY:
+            if is_text:
+                return f"({column} is null or {column} = '')"
+            return f"{column} is null"
+
+        if filter_type in RANGE_FILTER_TYPES:
+            if not isinstance(values, dict):
+                return None
+            min_value = values.get("min_value")
+            max_value = values.get("max_value")
+            if min_value in (None, "") or max_value in (None, ""):
+                return None
+
+            min_param = self.add_param(self.convert_value(field, min_value))
+            max_param = self.add_param(self.convert_value(field, max_value))
+            if filter_type == FilterType.FROM_TO:
+                return f"{column} between {min_param} and {max_param}"
+            # boundaries are out of range too, as in filters of report items
+            return f"({column} <= {min_param} or {column} >= {max_param})"
+
+        if not isinstance(values, list):
+            values = [values]
+        values = [value for value in values if value is not None and value != ""]
+        if not values:
+            return None
+
+        if filter_type in (FilterType.MULTISELECTOR, FilterType.DATE_TREE):
+            values = [self.convert_value(field, value) for value in values]
+            return f"{column} = ANY({self.add_param(values)})"
+
+        value = self.convert_value(field, values[0])
+
+        if filter_type in (FilterType.CONTAINS, FilterType.HAS_SUBSTRING):
+            if not is_text:
+                return None
+            if filter_type == FilterType.HAS_SUBSTRING:
+                value = f'"{value}"'
+            return self.get_text_match_sql(column, value)
+
+        if filter_type == FilterType.DOES_NOT_CONTAINS:
+            if not is_text:
+                return None
+            return (
+                f"({column} is null or strpos({column}, {self.add_param(value)}) = 0)"
+            )
+
+        if filter_type == FilterType.SELECTOR:
+            return f"{column} = {self.add_param(value)}"
+
+        if filter_type in (FilterType.EQUAL, FilterType.NOT_EQUAL):
+            if is_text:
+                predicate = f"lower({column}) = lower({self.add_param(value)})"
+            elif isinstance(field, models.FloatField):
+                # floats are equal with the precision of almost_equal_floats
+                epsilon = 10**-settings.ROUND_NDIGITS
+                predicate = (
+                    f"abs({column} - {self.add_param(value)}) "
+                    f"< {self.add_param(epsilon)}"
+                )
+            else:
+                predicate = f"{column} = {self.add_param(value)}"
+
+            if filter_type == FilterType.NOT_EQUAL:
+                return f"not ({predicate})"
+            return predicate
+
+        if filter_type in COMPARISONS:
+            return f"{column} {COMPARISONS[filter_type]} {self.add_param(value)}"
+
+        return None
+
+    def get_related_predicate(
+        self, relation: models.ForeignKey, name: str, filter_type: str, values
+    ) -> Optional[str]:
+        """EXISTS subquery on the related table of the transaction"""
+        field = get_value_field(relation.related_model, name)
+        if field is None:
+            return None
+
+        alias = f"uf{len(self.params)}"
+        predicate = self.get_predicate(
+            f"{alias}.{field.column}", field, filter_type, values
+        )
+        if predicate is None:
+            return None
+
+        table = relation.related_model._meta.db_table
+        if filter_type == FilterType.EMPTY:
+            # transactions without the related object are empty too
+            return (
+                f"NOT EXISTS (SELECT 1 FROM {table} {alias} "
+                f"WHERE {alias}.id = t.{relation.column} AND NOT {predicate})"
+            )
+
+        return (
+            f"EXISTS (SELECT 1 FROM {table} {alias} "
+            f"WHERE {alias}.id = t.{relation.column} AND {predicate})"
+        )
+
+    def get_filter_sql(self, key: str, filter_type: str, values) -> Optional[str]:
+        """Predicate of the filter of the item key, None if it is not supported"""
+        if "." in key:
+            relation_name, name = key.split(".", 1)
+            relation = get_relation_field(relation_name)
+            if relation is None:
+                return None
+            return self.get_related_predicate(relation, name, filter_type, values)
+
+        if key.startswith(ENTRY_ITEM_PREFIX):
+            name = key[len(ENTRY_ITEM_PREFIX) :]
+            predicates = []
+            for relation_name in ENTRY_ITEM_RELATIONS:
+                predicate = self.get_related_predicate(
+                    get_relation_field(relation_name), name, filter_type, values
+                )
+                if predicate is None:
+                    return None
+                predicates.append(predicate)
+            return f"({' or '.join(predicates)})"
+
+        field = get_value_field(Transaction, key)
+        if field is not None:
+            return self.get_predicate(f"t.{field.column}", field, filter_type, values)
+
+        for prefix, alias, model in JOINED_TABLES:
+            if key.startswith(prefix):
+                field = get_value_field(model, key[len(prefix) :])
+                if field is not None:
+                    return self.get_predicate(
+                        f"{alias}.{field.column}", field, filter_type, values
+                    )
+
+        return None
+
+
+def get_transaction_user_filters_sql(filters: List[dict]) -> Tuple[str, Dict]:
+    """
+    Conditions of the report query ("and ..." for each enabled filter)
+    and values of their parameters
+    """
+    user_filters = TransactionUserFilters()
+    result = ""
+
+    for filter_ in filters or []:
+        options = filter_.get("options") or {}
+        if not options.get("enabled"):
+            continue
+
+        key = filter_.get("key", "")
+        filter_type = options.get("filter_type") or FilterType.MULTISELECTOR
+        try:
+            predicate = user_filters.get_filter_sql(
+                key, filter_type, options.get("filter_values")
+            )
+        except (TypeError, ValueError) as e:
+            _l.error(f"User filter {key} has invalid values: {e}")
+            continue
+
+        if predicate is None:
+            _l.debug(f"User filter {key} {filter_type} is skipped")
+            continue
+
+        result = f"{result} and {predicate}"
+
+    return result, user_filters.params
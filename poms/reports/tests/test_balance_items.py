@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from poms.instruments.models import (
+    ExposureCalculationModel,
+    LongUnderlyingExposure,
+    ShortUnderlyingExposure,
+)
+from poms.reports.serializers_helpers import serialize_balance_report_items
+from poms.reports.sql_builders.balance_items import (
+    INSTRUMENT_COLUMNS,
+    POSITION_COLUMNS,
+    get_balance_items,
+)
+
+ECOSYSTEM_DEFAULTS = SimpleNamespace(
+    portfolio_id=101,
+    account_id=102,
+    strategy1_id=103,
+    strategy2_id=104,
+    strategy3_id=105,
+)
+
+
+def get_columns(rows):
+    """Columns of the balance query, only portfolios are independent"""
+    columns = {}
+    for _, column in INSTRUMENT_COLUMNS + POSITION_COLUMNS:
+        columns[column] = [None] * len(rows)
+
+    for name in {name for row in rows for name in row}:
+        columns[name] = [row.get(name) for row in rows]
+
+    return columns
+
+
+ROW = {
+    "name": "Apple",
+    "short_name": "AAPL",
+    "user_code": "AAPL",
+    "item_type": 1,
+    "item_type_name": "Instrument",
+    "portfolio_id": 1,
+    "instrument_id": 10,
+    "currency_id": -1,
+    "pricing_currency_id": 20,
+    "co_directional_exposure_currency_id": 20,
+    "counter_directional_exposure_currency_id": 21,
+    "market_value": 300.0,
+    "market_value_loc": 300.0,
+    "exposure": 300.0,
+    "exposure_loc": 300.0,
+    "exposure_2": -300.0,
+    "exposure_2_loc": -300.0,
+    "position_size": 10.0000000001,
+    "nominal_position_size": None,
+    "long_underlying_exposure_id": LongUnderlyingExposure.ZERO,
+    "exposure_long_underlying_zero": 0,
+    "short_underlying_exposure_id": ShortUnderlyingExposure.ZERO,
+    "exposure_short_underlying_zero": 0,
+    "exposure_calculation_model_id": ExposureCalculationModel.MARKET_VALUE,
+    "has_second_exposure_currency": True,
+}
+
+
+class BalanceItemsTest(SimpleTestCase):
+    def test_items(self):
+        rows = [
+            ROW,
+            {**ROW, "name": "Closed", "position_size": 0.0000000001},
+            {
+                **ROW,
+                "name": "Option",
+                "position_size": 2.0,
+                "exposure_calculation_model_id": (
+                    ExposureCalculationModel.UNDERLYING_LONG_SHORT_EXPOSURE_SPLIT
+                ),
+                "long_underlying_exposure_id": (
+                    LongUnderlyingExposure.LONG_UNDERLYING_INSTRUMENT_PRICE_DELTA
+                ),
+                "exposure_long_underlying_price_delta": 5.0,
+                "short_underlying_exposure_id": (
+                    ShortUnderlyingExposure.SHORT_UNDERLYING_INSTRUMENT_PRICE_DELTA
+                ),
+                "exposure_short_underlying_price_delta": 3.0,
+                "has_second_exposure_currency": False,
+            },
+        ]
+
+        items = get_balance_items(get_columns(rows), ECOSYSTEM_DEFAULTS, True)
+
+        self.assertEqual(
+            [(item["name"], item["item_type"]) for item in items],
+            [("Apple", 1), ("Apple", 7), ("Option", 1)],
+        )
+        apple, apple_exposure, option = items
+        self.assertEqual(apple["position_size"], 10.0)
+        self.assertEqual(apple["account_position_id"], 102)
+        self.assertIsNone(apple["allocation_pl_id"])
+        self.assertEqual(apple["exposure_currency_id"], 20)
+        self.assertEqual(apple_exposure["exposure"], -300.0)
+        self.assertEqual(apple_exposure["exposure_currency_id"], 21)
+        self.assertEqual(apple_exposure["strategy1_position_id"], 103)
+        self.assertIsNone(apple_exposure["position_size"])
+        self.assertEqual(option["exposure"], 10.0)
+
+        serialized = serialize_balance_report_items(items)
+        self.assertEqual(serialized[0]["id"], "1,10,1,102,103,104,105")
+        self.assertIsNone(serialized[0]["currency"])
+
+    def test_no_exposure_details(self):
+        items = get_balance_items(get_columns([ROW]), ECOSYSTEM_DEFAULTS, False)
+
+        self.assertEqual([item["item_type"] for item in items], [1])
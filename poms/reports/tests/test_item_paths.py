@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from poms.reports.backend_reports_utils import BackendReportHelperService
+from poms.reports.report_frame import MISSING
+
+
+def get_attribute(user_code, value):
+    return {
+        "attribute_type_object": {"user_code": user_code, "value_type": 10},
+        "value_string": value,
+    }
+
+
+COUNTRIES = {
+    1: {"id": 1, "name": "United States", "user_code": "US", "short_name": "US"},
+    2: {"id": 2, "name": "Germany", "user_code": "DE", "short_name": "DE"},
+}
+INSTRUMENTS = {
+    1: {
+        "id": 1,
+        "name": "Apple",
+        "country": 1,
+        "instrument_type": 1,
+        "attributes": [get_attribute("asset_type", "Equity")],
+    },
+    2: {"id": 2, "name": "Bund", "country": 2, "instrument_type": 5},
+}
+CURRENCIES = {
+    1: {"id": 1, "name": "USD", "country": 1},
+    2: {"id": 2, "name": "EUR", "country": 2},
+}
+HELPER_DICTS = {
+    "instrument": INSTRUMENTS,
+    "currency": CURRENCIES,
+    "country": COUNTRIES,
+    "instrument_type": {1: {"id": 1, "name": "Stocks", "user_code": "stocks"}},
+}
+ITEMS = [
+    {"id": 1, "item_type": 1, "instrument": 1, "currency": 1, "market_value": 10},
+    {"id": 2, "item_type": 1, "instrument": 2, "currency": 3, "market_value": 20},
+    {"id": 3, "item_type": 2, "instrument": None, "currency": 2},
+    {"id": 4, "item_type": 3, "instrument": None, "currency": 1},
+    {"id": 5, "instrument": 7, "custom_fields.total": 1.5},
+]
+INSTRUMENT_ATTRIBUTE_TYPES = [
+    SimpleNamespace(user_code="asset_type"),
+    SimpleNamespace(user_code="sector"),
+]
+
+
+class TestCompileItemPath(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = BackendReportHelperService()
+
+    def test_values_of_full_items(self):
+        full_items = [
+            self.service.flatten_and_convert_item(
+                item, HELPER_DICTS, INSTRUMENT_ATTRIBUTE_TYPES
+            )
+            for item in ITEMS
+        ]
+        paths = {path for item in full_items for path in item}
+        paths.update(["instrument.country", "instrument.attributes.missing", "nope"])
+        instrument_attribute_paths = {
+            f"instrument.attributes.{attribute_type.user_code}"
+            for attribute_type in INSTRUMENT_ATTRIBUTE_TYPES
+        }
+
+        for path in paths:
+            get_value = self.service.compile_item_path(
+                path, HELPER_DICTS, instrument_attribute_paths
+            )
+            for item, full_item in zip(ITEMS, full_items):
+                with self.subTest(path=path, id=item["id"]):
+                    self.assertEqual(get_value(item), full_item.get(path, MISSING))
+
+    def test_referenced_paths(self):
+        options = {
+            "columns": [{"key": "instrument.name"}],
+            "filter_settings": [{"key": "currency.country.name"}],
+            "groups_types": [{"key": "instrument.country.name"}],
+            "ordering": "-market_value",
+        }
+
+        self.assertEqual(
+            self.service.get_referenced_paths(options, "portfolio.id"),
+            [
+                "currency.country.name",
+                "exposure",
+                "id",
+                "instrument.country.name",
+                "instrument.country.user_code",
+                "instrument.name",
+                "market_value",
+                "portfolio.id",
+            ],
+        )
+        self.assertIsNone(
+            self.service.get_referenced_paths({"globalTableSearch": "apple"})
+        )
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import override_settings
+
+from poms.common.common_base_test import BaseTestCase
+from poms.common.exceptions import FinmarsBaseException
+from poms.reports.common import Report
+from poms.reports.sql_builders import parallel
+from poms.reports.sql_builders.balance import BalanceReportBuilderSql
+from poms.reports.sql_builders.parallel import (
+    build_in_parallel,
+    get_portfolio_shards,
+    is_parallel_build_allowed,
+)
+
+
+class ParallelBuildTest(BaseTestCase):
+    databases = "__all__"
+
+    @staticmethod
+    def create_portfolios(count):
+        return [SimpleNamespace(id=i) for i in range(count, 0, -1)]
+
+    def test_portfolio_shards(self):
+        shards = get_portfolio_shards(self.create_portfolios(10), 4)
+
+        self.assertEqual(shards, [[1, 5, 9], [2, 6, 10], [3, 7], [4, 8]])
+        self.assertEqual(get_portfolio_shards(self.create_portfolios(2), 4), [[1], [2]])
+
+    @override_settings(REPORT_PARALLEL_BUILD=True, REPORT_PARALLEL_MIN_PORTFOLIOS=3)
+    @mock.patch.object(parallel, "connection", SimpleNamespace(in_atomic_block=False))
+    def test_parallel_build_allowed(self):
+        instance = SimpleNamespace(
+            portfolio_mode=Report.MODE_INDEPENDENT,
+            portfolios=self.create_portfolios(3),
+        )
+        self.assertTrue(is_parallel_build_allowed(instance))
+
+        parallel.connection.in_atomic_block = True
+        self.assertFalse(is_parallel_build_allowed(instance))
+        parallel.connection.in_atomic_block = False
+
+        instance.portfolio_mode = Report.MODE_INTERDEPENDENT
+        self.assertFalse(is_parallel_build_allowed(instance))
+
+        instance.portfolio_mode = Report.MODE_INDEPENDENT
+        instance.portfolios = self.create_portfolios(2)
+        self.assertFalse(is_parallel_build_allowed(instance))
+
+    def test_shard_items_are_merged(self):
+        items = build_in_parallel(lambda task_id: [task_id, task_id * 10], [1, 2, 3])
+
+        self.assertEqual(sorted(items), [1, 2, 3, 10, 20, 30])
+
+    def test_shard_error_is_raised(self):
+        def build(task_id):
+            if task_id == 2:
+                raise ValueError("shard failed")
+            return [task_id]
+
+        with self.assertRaises(ValueError):
+            build_in_parallel(build, [1, 2, 3])
+
+    def test_shard_of_missing_task_fails(self):
+        with self.assertRaises(FinmarsBaseException):
+            build_in_parallel(
+                lambda task_id: BalanceReportBuilderSql.build_sync(
+                    mock.Mock(), task_id
+                ),
+                [0],
+            )
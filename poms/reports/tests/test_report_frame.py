@@ -0,0 +1,153 @@
+from django.test import SimpleTestCase
+
+from poms.reports.backend_reports_utils import (
+    BackendReportHelperService,
+    BackendReportSubtotalService,
+)
+from poms.reports.report_frame import ReportFrame
+
+ITEMS = [
+    {"id": 1, "name": "Apple", "type": "Equity", "market_value": 300, "exposure": 2},
+    {"id": 2, "name": "Bond", "type": "Bonds", "market_value": 100.5, "exposure": 0},
+    {"id": 3, "name": "Cash", "type": "Equity", "market_value": None},
+    {"id": 4, "name": "Tesla", "type": None, "market_value": -50, "exposure": 4},
+    {"id": 5, "name": "apple", "type": "Equity", "market_value": 300, "exposure": 1},
+]
+
+
+def get_ids(items):
+    return [item["id"] for item in items]
+
+
+class TestReportFrame(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = BackendReportHelperService()
+        self.frame = ReportFrame(ITEMS)
+
+    def test_columns_are_shared_by_selected_frames(self):
+        column = self.frame.column("type")
+        frame = self.frame.take(self.frame.is_number("market_value"))
+
+        self.assertIs(frame.column("type"), column)
+        self.assertEqual(column.uniques, ["Equity", "Bonds", None])
+        self.assertEqual(get_ids(frame.items()), [1, 2, 4, 5])
+
+    def test_filter_number_column(self):
+        options = {
+            "filter_settings": [
+                {
+                    "key": "market_value",
+                    "value_type": 20,
+                    "filter_type": "greater_equal",
+                    "value": [100],
+                }
+            ]
+        }
+
+        self.assertEqual(get_ids(self.service.filter(ITEMS, options)), [1, 2, 5])
+
+    def test_filter_string_column(self):
+        options = {
+            "filter_settings": [
+                {
+                    "key": "name",
+                    "value_type": 10,
+                    "filter_type": "contains",
+                    "value": ["APP"],
+                },
+                {
+                    "key": "market_value",
+                    "value_type": 20,
+                    "filter_type": "out_of_range",
+                    "value": {"min_value": 0, "max_value": 200},
+                },
+            ]
+        }
+
+        self.assertEqual(get_ids(self.service.filter(ITEMS, options)), [1, 5])
+
+    def test_global_table_search(self):
+        options = {"globalTableSearch": "bond tesla"}
+
+        self.assertEqual(get_ids(self.service.filter(ITEMS, options)), [2, 4])
+
+    def test_groups_filters(self):
+        options = {"groups_types": [{"key": "type"}], "groups_values": ["equity"]}
+
+        self.assertEqual(
+            get_ids(self.service.filter_by_groups_filters(ITEMS, options)), [1, 3, 5]
+        )
+
+    def test_sort_items(self):
+        options = {"ordering": "market_value", "items_order": "asc"}
+        self.assertEqual(
+            get_ids(self.service.sort_items(ITEMS, options)), [4, 2, 1, 5, 3]
+        )
+
+        options["items_order"] = "desc"
+        self.assertEqual(
+            get_ids(self.service.sort_items(ITEMS, options)), [3, 1, 5, 2, 4]
+        )
+
+    def test_unique_groups(self):
+        columns = [
+            {
+                "key": "market_value",
+                "value_type": 20,
+                "report_settings": {"subtotal_formula_id": 1},
+            },
+            {
+                "key": "exposure",
+                "value_type": 20,
+                "report_settings": {"subtotal_formula_id": 6},
+            },
+        ]
+
+        groups = self.service.get_unique_groups(ITEMS, {"key": "type"}, columns)
+
+        self.assertEqual(
+            [group["___group_identifier"] for group in groups],
+            ["Equity", "Bonds", None],
+        )
+        self.assertEqual(groups[0]["subtotal"]["market_value"], "No Data")
+        self.assertEqual(groups[1]["subtotal"]["market_value"], 100.5)
+        self.assertEqual(groups[2]["subtotal"]["exposure"], 4)
+
+
+class TestReportFrameSubtotals(SimpleTestCase):
+    def assert_same_subtotals(self, items, column):
+        frame = ReportFrame(items)
+
+        self.assertEqual(
+            BackendReportSubtotalService.resolve_frame_subtotal_function(frame, column),
+            BackendReportSubtotalService.resolve_subtotal_function(items, column),
+        )
+
+    def test_formulas(self):
+        items = [
+            {"value": 2, "market_value": 10, "exposure": 0},
+            {"value": 3, "market_value": 30, "exposure": None},
+            {"value": 0, "market_value": 60},
+        ]
+
+        for formula_id in range(1, 10):
+            column = {
+                "key": "value",
+                "value_type": 20,
+                "report_settings": {"subtotal_formula_id": formula_id},
+            }
+            with self.subTest(formula_id=formula_id):
+                self.assert_same_subtotals(items, column)
+
+    def test_not_number_values(self):
+        items = [{"value": "1.5", "market_value": 10}, {"value": 2, "market_value": 5}]
+
+        for formula_id in (1, 2, 6):
+            column = {
+                "key": "value",
+                "value_type": 20,
+                "report_settings": {"subtotal_formula_id": formula_id},
+            }
+            with self.subTest(formula_id=formula_id):
+                self.assert_same_subtotals(items, column)
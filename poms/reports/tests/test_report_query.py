@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from poms.reports.common import Report
+from poms.reports.sql_builders.helpers import (
+    get_fx_trades_and_fx_variations_transaction_filter_sql_string,
+    get_transaction_filter_parameters,
+    get_transaction_filter_sql_string,
+)
+from poms.reports.sql_builders.report_query import (
+    ReportQuery,
+    get_cached_template,
+    get_positional_sql,
+    parameterize_template,
+)
+
+
+class FakeCursor:
+    def __init__(self):
+        self.db = SimpleNamespace(connection=object(), in_atomic_block=False)
+        self.queries = []
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, params))
+
+
+class ReportQueryTest(SimpleTestCase):
+    def test_parameterize_template(self):
+        template = (
+            "select * from t where date = '{report_date}' "
+            "and pricing_policy_id = {pricing_policy_id} {transaction_filter}"
+        )
+
+        self.assertEqual(
+            parameterize_template(template, prefix="first_"),
+            "select * from t where date = CAST(%(first_report_date)s AS date) "
+            "and pricing_policy_id = CAST(%(first_pricing_policy_id)s AS integer) "
+            "{transaction_filter}",
+        )
+
+    def test_positional_sql(self):
+        sql, names = get_positional_sql(
+            "select %(a_id)s, %(b_date)s, %(a_id)s where name like 'x%%'"
+        )
+
+        self.assertEqual(sql, "select $1, $2, $1 where name like 'x%'")
+        self.assertEqual(names, ["a_id", "b_date"])
+
+    def test_transaction_filter(self):
+        instance = SimpleNamespace(
+            portfolios=[SimpleNamespace(id=1), SimpleNamespace(id=2)],
+            accounts=[],
+            strategies1=[SimpleNamespace(id=3)],
+            strategies2=[],
+            strategies3=[],
+        )
+
+        self.assertEqual(
+            get_transaction_filter_sql_string(instance, parameterized=True),
+            "where portfolio_id = ANY(CAST(%(portfolio_ids)s AS integer[])) "
+            "and strategy1_position_id = ANY(CAST(%(strategy1_ids)s AS integer[]))",
+        )
+        self.assertEqual(
+            get_fx_trades_and_fx_variations_transaction_filter_sql_string(instance),
+            " and portfolio_id in (1, 2) and strategy1_position_id in (3)",
+        )
+        self.assertEqual(
+            get_transaction_filter_parameters(instance),
+            {"portfolio_ids": [1, 2], "strategy1_ids": [3]},
+        )
+
+    def test_cached_template(self):
+        key = ("test", Report.MODE_INDEPENDENT)
+
+        self.assertEqual(get_cached_template(key, lambda: "select 1"), "select 1")
+        self.assertEqual(get_cached_template(key, lambda: "select 2"), "select 1")
+
+    @override_settings(REPORT_SQL_PREPARED_STATEMENTS=True, REPORT_SQL_PROFILING=False)
+    @mock.patch(
+        "poms.reports.sql_builders.report_query.get_current_schema",
+        return_value="space00000",
+    )
+    def test_statement_is_prepared_once_per_session(self, _):
+        cursor = FakeCursor()
+        query = "select * from t where id = %(master_user_id)s"
+
+        ReportQuery("Test", query, {"master_user_id": 1}).execute(cursor)
+        ReportQuery("Test", query, {"master_user_id": 2}).execute(cursor)
+
+        prepare, execute_1, execute_2 = cursor.queries
+        statement = prepare[0].split()[1]
+        self.assertEqual(
+            prepare,
+            (f"PREPARE {statement} (integer) AS select * from t where id = $1", None),
+        )
+        self.assertEqual(execute_1, (f"EXECUTE {statement}(%s)", [1]))
+        self.assertEqual(execute_2, (f"EXECUTE {statement}(%s)", [2]))
+
+        cursor.db.connection = object()
+        ReportQuery("Test", query, {"master_user_id": 3}).execute(cursor)
+
+        self.assertEqual(cursor.queries[3], prepare)
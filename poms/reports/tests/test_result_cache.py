@@ -0,0 +1,137 @@
+import pickle
+import zlib
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.db import transaction
+from django.test import override_settings
+
+from poms.common.common_base_test import BaseTestCase
+from poms.reports import result_cache
+from poms.users.models import MasterUser, Member
+
+REPORTS_CACHES = {
+    **settings.CACHES,
+    "reports": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+@override_settings(CACHES=REPORTS_CACHES)
+class ReportResultCacheTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        result_cache.get_report_cache().clear()
+
+    @staticmethod
+    def create_report(**kwargs):
+        options = {
+            "master_user": MasterUser(id=1),
+            "member": Member(id=2),
+            "report_date": date(2024, 1, 31),
+            "portfolios": [],
+            "ignore_cache": False,
+            "frontend_request_options": {"groups_types": []},
+            "page": 1,
+            "page_size": 40,
+        }
+        options.update(kwargs)
+        return SimpleNamespace(**options)
+
+    def test_key_does_not_depend_on_frontend_options(self):
+        key = result_cache.get_report_cache_key(self.create_report(), "balance")
+        other_key = result_cache.get_report_cache_key(
+            self.create_report(
+                frontend_request_options={"groups_types": [{"key": "name"}]},
+                page=3,
+            ),
+            "balance",
+        )
+
+        self.assertEqual(key, other_key)
+
+    def test_key_depends_on_report_settings(self):
+        key = result_cache.get_report_cache_key(self.create_report(), "balance")
+
+        self.assertNotEqual(
+            key,
+            result_cache.get_report_cache_key(
+                self.create_report(report_date=date(2024, 2, 1)), "balance"
+            ),
+        )
+        self.assertNotEqual(
+            key, result_cache.get_report_cache_key(self.create_report(), "pnl")
+        )
+        self.assertIsNone(
+            result_cache.get_report_cache_key(
+                self.create_report(ignore_cache=True), "balance"
+            )
+        )
+
+    def test_report_is_serialized_once(self):
+        calls = []
+
+        def serialize(instance):
+            calls.append(instance)
+            return {"items": [{"market_value": 1.5}]}
+
+        for _ in range(3):
+            instance = self.create_report()
+            if not result_cache.load_cached_report_data(instance, "balance"):
+                self.assertEqual(calls, [])
+
+            data = result_cache.get_report_data(instance, serialize)
+
+            self.assertEqual(data, {"items": [{"market_value": 1.5}]})
+
+        self.assertEqual(len(calls), 1)
+
+    def test_data_change_makes_cache_outdated(self):
+        instance = self.create_report()
+        result_cache.load_cached_report_data(instance, "balance")
+        result_cache.set_cached_report_data(instance, {"items": []})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result_cache.report_data_changed()
+
+        self.assertFalse(
+            result_cache.load_cached_report_data(self.create_report(), "balance")
+        )
+
+    def test_data_version_is_bumped_once_per_transaction(self):
+        with mock.patch.object(
+            result_cache, "bump_report_data_version"
+        ) as bump, self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for _ in range(3):
+                    result_cache.report_data_changed()
+
+        self.assertEqual(len(callbacks), 1)
+        bump.assert_called_once()
+
+    @override_settings(REPORT_CACHE_MAX_SIZE=10)
+    def test_big_report_is_not_cached(self):
+        instance = self.create_report()
+        result_cache.load_cached_report_data(instance, "balance")
+        result_cache.set_cached_report_data(instance, {"items": list(range(1000))})
+
+        self.assertIsNone(result_cache.get_cached_report_data(instance.report_cache_key))
+
+    def test_oldest_reports_are_evicted(self):
+        data = {"items": [1, 2, 3]}
+        size = len(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+        instances = [
+            self.create_report(report_date=date(2024, 1, day)) for day in (1, 2, 3)
+        ]
+
+        with self.settings(REPORT_CACHE_MAX_TOTAL_SIZE=size * 2):
+            for instance in instances:
+                result_cache.load_cached_report_data(instance, "balance")
+                result_cache.set_cached_report_data(instance, data)
+
+        cached = [
+            result_cache.get_cached_report_data(instance.report_cache_key)
+            for instance in instances
+        ]
+        self.assertEqual(cached, [None, data, data])
@@ -0,0 +1,128 @@
+from datetime import date
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from poms.reports.sql_builders.transaction_filters import (
+    get_transaction_user_filters_sql,
+)
+
+
+def get_filter(key, filter_type=None, filter_values=None, enabled=True):
+    return {
+        "key": key,
+        "options": {
+            "enabled": enabled,
+            "filter_type": filter_type,
+            "filter_values": filter_values,
+        },
+    }
+
+
+class TransactionUserFiltersTest(SimpleTestCase):
+    def test_related_field(self):
+        sql, params = get_transaction_user_filters_sql(
+            [get_filter("portfolio.user_code", filter_values=["p1", "p2"])]
+        )
+
+        self.assertEqual(
+            sql,
+            " and EXISTS (SELECT 1 FROM portfolios_portfolio uf0 "
+            "WHERE uf0.id = t.portfolio_id "
+            "AND uf0.user_code = ANY(%(user_filter_0)s))",
+        )
+        self.assertEqual(params, {"user_filter_0": ["p1", "p2"]})
+
+    def test_entry_item(self):
+        sql, params = get_transaction_user_filters_sql(
+            [get_filter("entry_item_user_code", "equal", ["USD"])]
+        )
+
+        self.assertIn("uf0.id = t.instrument_id", sql)
+        self.assertIn("uf1.id = t.settlement_currency_id", sql)
+        self.assertIn("uf2.id = t.transaction_currency_id", sql)
+        self.assertEqual(sql.count(" or EXISTS"), 2)
+        self.assertEqual(len(params), 3)
+
+    def test_own_fields(self):
+        sql, params = get_transaction_user_filters_sql(
+            [
+                get_filter(
+                    "transaction_date",
+                    "from_to",
+                    {"min_value": "2024-01-01", "max_value": "2024-12-31"},
+                ),
+                get_filter("position_size_with_sign", "greater", [0]),
+                get_filter("notes", "contains", ["big deal"]),
+                get_filter("complex_transaction_user_text_1", "empty", []),
+            ]
+        )
+
+        self.assertEqual(
+            sql,
+            " and t.transaction_date between %(user_filter_0)s and %(user_filter_1)s"
+            " and t.position_size_with_sign > %(user_filter_2)s"
+            " and strpos(lower(t.notes), lower(%(user_filter_3)s)) > 0"
+            " and strpos(lower(t.notes), lower(%(user_filter_4)s)) > 0"
+            " and (tc.user_text_1 is null or tc.user_text_1 = '')",
+        )
+        self.assertEqual(
+            params,
+            {
+                "user_filter_0": date(2024, 1, 1),
+                "user_filter_1": date(2024, 12, 31),
+                "user_filter_2": 0.0,
+                "user_filter_3": "big",
+                "user_filter_4": "deal",
+            },
+        )
+
+    def test_filters_of_report_items_semantics(self):
+        sql, params = get_transaction_user_filters_sql(
+            [
+                get_filter(
+                    "position_size_with_sign",
+                    "out_of_range",
+                    {"min_value": 1, "max_value": 10},
+                ),
+                get_filter("notes", "does_not_contains", ["Deal"]),
+                get_filter("cash_consideration", "equal", ["1.5"]),
+                get_filter("principal_with_sign", "not_equal", [2]),
+            ]
+        )
+
+        self.assertEqual(
+            sql,
+            " and (t.position_size_with_sign <= %(user_filter_0)s"
+            " or t.position_size_with_sign >= %(user_filter_1)s)"
+            " and (t.notes is null or strpos(t.notes, %(user_filter_2)s) = 0)"
+            " and abs(t.cash_consideration - %(user_filter_3)s) < %(user_filter_4)s"
+            " and not (abs(t.principal_with_sign - %(user_filter_5)s)"
+            " < %(user_filter_6)s)",
+        )
+        epsilon = 10**-settings.ROUND_NDIGITS
+        self.assertEqual(
+            params,
+            {
+                "user_filter_0": 1.0,
+                "user_filter_1": 10.0,
+                "user_filter_2": "Deal",
+                "user_filter_3": 1.5,
+                "user_filter_4": epsilon,
+                "user_filter_5": 2.0,
+                "user_filter_6": epsilon,
+            },
+        )
+
+    def test_skipped_filters(self):
+        sql, params = get_transaction_user_filters_sql(
+            [
+                get_filter("portfolio.user_code", filter_values=["p1"], enabled=False),
+                get_filter("portfolio.user_code", filter_values=[]),
+                get_filter("unknown.user_code", filter_values=["x"]),
+                get_filter("transaction_date", "greater", ["not a date"]),
+            ]
+        )
+
+        self.assertEqual(sql, "")
+        self.assertEqual(params, {})
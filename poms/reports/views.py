@@ -2,7 +2,6 @@ import logging
 import time
 from datetime import timedelta
 
-from django.core.exceptions import ObjectDoesNotExist
 from django_filters.rest_framework import FilterSet
 from rest_framework import status
 from rest_framework.decorators import action
@@ -23,6 +22,7 @@ from poms.reports.models import (
     TransactionReportCustomField,
 )
 from poms.reports.performance_report import PerformanceReportBuilder
+from poms.reports.result_cache import load_cached_report_data
 from poms.reports.serializers import (
     BackendBalanceReportGroupsSerializer,
     BackendBalanceReportItemsSerializer,
@@ -48,7 +48,6 @@ from poms.reports.sql_builders.pl import PLReportBuilderSql
 from poms.reports.sql_builders.price_checkers import PriceHistoryCheckerSql
 from poms.reports.sql_builders.transaction import TransactionReportBuilderSql
 from poms.reports.utils import (
-    generate_unique_key,
     get_pl_first_date,
     transform_to_allowed_accounts,
     transform_to_allowed_portfolios,
@@ -1126,27 +1125,9 @@ class BackendBalanceReportViewSet(AbstractViewSet):
         instance.portfolios = transform_to_allowed_portfolios(instance)
         instance.accounts = transform_to_allowed_accounts(instance)
 
-        # settings, unique_key = generate_unique_key(instance, "balance")
-
-        # _l.info("unique_key %s" % unique_key)
-
-        builder = BalanceReportBuilderSql(instance=instance)
-        instance = builder.build_balance()
-
-        # try:
-        #
-        #     if instance.ignore_cache:
-        #         raise ObjectDoesNotExist
-        #
-        #     balance_report_instance = BalanceReportInstance.objects.get(
-        #         unique_key=unique_key
-        #     )
-        #
-        # except ObjectDoesNotExist:
-        #
-        #     # Check to_representation comments to find why is that
-        #     builder = BalanceReportBuilderSql(instance=instance)
-        #     instance = builder.build_balance()
+        if not load_cached_report_data(instance, "balance"):
+            builder = BalanceReportBuilderSql(instance=instance)
+            instance = builder.build_balance()
 
         serializer = self.get_serializer(instance=instance, many=False)
 
@@ -1175,27 +1156,9 @@ class BackendBalanceReportViewSet(AbstractViewSet):
         instance.portfolios = transform_to_allowed_portfolios(instance)
         instance.accounts = transform_to_allowed_accounts(instance)
 
-        # settings, unique_key = generate_unique_key(instance, "balance")
-        #
-        # _l.info("unique_key %s" % unique_key)
-
-        builder = BalanceReportBuilderSql(instance=instance)
-        instance = builder.build_balance()
-
-        # try:
-        #
-        #     if instance.ignore_cache:
-        #         raise ObjectDoesNotExist
-        #
-        #     balance_report_instance = BalanceReportInstance.objects.get(
-        #         unique_key=unique_key
-        #     )
-        #
-        # except ObjectDoesNotExist:
-        #
-        #     # Check to_representation comments to find why is that
-        #     builder = BalanceReportBuilderSql(instance=instance)
-        #     instance = builder.build_balance()
+        if not load_cached_report_data(instance, "balance"):
+            builder = BalanceReportBuilderSql(instance=instance)
+            instance = builder.build_balance()
 
         serialize_report_st = time.perf_counter()
         serializer = self.get_serializer(instance=instance, many=False)
@@ -1227,28 +1190,12 @@ class BackendPLReportViewSet(AbstractViewSet):
         instance.portfolios = transform_to_allowed_portfolios(instance)
         instance.accounts = transform_to_allowed_accounts(instance)
 
-        settings, unique_key = generate_unique_key(instance, "pnl")
-
-        _l.info(
-            f"BackendPLReportViewSet.groups.unique_key {unique_key} & {instance.pl_first_date}"
-        )
-
-        try:
-            if instance.ignore_cache:
-                raise ObjectDoesNotExist
-
-            pnl_report_instance = PLReportInstance.objects.get(unique_key=unique_key)
-
-            _l.debug("PL report if found, take from cache")
-
-        except ObjectDoesNotExist as e:
-            _l.error(repr(e))
+        _l.info(f"BackendPLReportViewSet.groups {instance.pl_first_date}")
 
+        if not load_cached_report_data(instance, "pnl"):
             builder = PLReportBuilderSql(instance=instance)
             instance = builder.build_report()
 
-            _l.debug("PL report if not found, calculating new")
-
         serialize_report_st = time.perf_counter()
         serializer = self.get_serializer(instance=instance, many=False)
 
@@ -1277,15 +1224,7 @@ class BackendPLReportViewSet(AbstractViewSet):
         instance.portfolios = transform_to_allowed_portfolios(instance)
         instance.accounts = transform_to_allowed_accounts(instance)
 
-        settings, unique_key = generate_unique_key(instance, "pnl")
-
-        try:
-            if instance.ignore_cache:
-                raise ObjectDoesNotExist
-
-            pnl_report_instance = PLReportInstance.objects.get(unique_key=unique_key)
-
-        except ObjectDoesNotExist:
+        if not load_cached_report_data(instance, "pnl"):
             builder = PLReportBuilderSql(instance=instance)
             instance = builder.build_report()
 
@@ -1314,9 +1253,9 @@ class BackendTransactionReportViewSet(AbstractViewSet):
 
         instance.auth_time = self.auth_time
 
-        # Check to_representation comments to find why is that
-        builder = TransactionReportBuilderSql(instance=instance)
-        instance = builder.build_transaction()
+        if not load_cached_report_data(instance, "transaction"):
+            builder = TransactionReportBuilderSql(instance=instance)
+            instance = builder.build_transaction()
 
         serialize_report_st = time.perf_counter()
         serializer = self.get_serializer(instance=instance, many=False)
@@ -1341,9 +1280,9 @@ class BackendTransactionReportViewSet(AbstractViewSet):
 
         instance.auth_time = self.auth_time
 
-        # Check to_representation comments to find why is that
-        builder = TransactionReportBuilderSql(instance=instance)
-        instance = builder.build_transaction()
+        if not load_cached_report_data(instance, "transaction"):
+            builder = TransactionReportBuilderSql(instance=instance)
+            instance = builder.build_transaction()
 
         serialize_report_st = time.perf_counter()
         serializer = self.get_serializer(instance=instance, many=False)
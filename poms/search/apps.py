@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy
+
+
+class SearchConfig(AppConfig):
+    name = "poms.search"
+    verbose_name = gettext_lazy("Search")
+
+    def ready(self):
+        from poms.search import signals
+
+        signals.connect_search_names_tracking()
@@ -0,0 +1,240 @@
+"""
+Search documents of global table search.
+
+Document of an object is the lowercased text of the same values the global
+table search looks into: own char, text, date and number fields, names and
+user codes of related objects and attribute values. Documents are updated
+on save of the object, its attributes and related objects, and can be
+rebuilt by the rebuild_search_index command.
+"""
+
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import (
+    CharField,
+    DateField,
+    FloatField,
+    ForeignKey,
+    IntegerField,
+    QuerySet,
+    TextField,
+)
+
+from poms.obj_attrs.models import GenericAttribute
+from poms.search.models import SearchDocument
+
+_l = logging.getLogger("poms.search")
+
+SEARCH_BATCH_SIZE = 1000
+
+SEARCH_INDEXED_MODELS = {
+    "accounts.account",
+    "counterparties.counterparty",
+    "counterparties.responsible",
+    "currencies.currency",
+    "instruments.instrument",
+    "portfolios.portfolio",
+    "strategies.strategy1",
+    "strategies.strategy2",
+    "strategies.strategy3",
+    "transactions.complextransaction",
+    "transactions.transaction",
+    "transactions.transactiontype",
+}
+
+SEARCH_EXCLUDED_RELATIONS = {
+    "master_user",
+    "owner",
+    "procedure_instance",
+    "complex_transaction",
+    "event_schedule",
+    "member",
+    "action",
+    "previous_date_record",
+    "transaction",
+    "status",
+    "linked_import_task",
+    "content_type",
+}
+
+SEARCH_RELATION_NAMES = ("short_name", "name", "user_code")
+
+SEARCH_MODELS_WITHOUT_ATTRIBUTES = {
+    "currencyhistory",
+    "pricehistory",
+    "transaction",
+    "currencyhistoryerror",
+    "portfoliohistory",
+    "complextransactionimportscheme",
+    "csvimportscheme",
+    "pricehistoryerror",
+    "generatedevent",
+    "portfolioregisterrecord",
+    "complextransaction",
+}
+
+
+def is_search_indexed(model) -> bool:
+    return model._meta.label_lower in SEARCH_INDEXED_MODELS
+
+
+def get_search_relation_fields(model) -> list:
+    return [
+        f
+        for f in model._meta.fields
+        if isinstance(f, ForeignKey) and f.name not in SEARCH_EXCLUDED_RELATIONS
+    ]
+
+
+def get_search_value_fields(model) -> list:
+    return [
+        f
+        for f in model._meta.fields
+        if (isinstance(f, CharField) and f.name != "deleted_user_code")
+        or isinstance(f, (TextField, DateField, IntegerField, FloatField))
+    ]
+
+
+def has_field(model, name: str) -> bool:
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+
+    return True
+
+
+@lru_cache(maxsize=None)
+def get_search_lookups(model) -> tuple:
+    """Lookups of all the values of the document of the model"""
+    lookups = [f.name for f in get_search_value_fields(model)]
+    for f in get_search_relation_fields(model):
+        lookups.extend(
+            f"{f.name}__{name}"
+            for name in SEARCH_RELATION_NAMES
+            if has_field(f.related_model, name)
+        )
+
+    return tuple(lookups)
+
+
+@lru_cache(maxsize=None)
+def get_related_search_fields() -> Dict[str, list]:
+    """(indexed model, relation field name) of every model used in documents"""
+    related = {}
+    for label in SEARCH_INDEXED_MODELS:
+        model = apps.get_model(label)
+        for f in get_search_relation_fields(model):
+            related.setdefault(f.related_model._meta.label_lower, []).append(
+                (model, f.name)
+            )
+
+    return related
+
+
+def _get_attribute_values(content_type, object_ids: list) -> Dict[int, list]:
+    values = {}
+    attributes = GenericAttribute.objects.filter(
+        content_type=content_type, object_id__in=object_ids
+    ).values_list(
+        "object_id", "value_string", "value_float", "value_date", "classifier__name"
+    )
+    for object_id, *attribute_values in attributes:
+        values.setdefault(object_id, []).extend(attribute_values)
+
+    return values
+
+
+def make_document(values: Iterable) -> str:
+    return "\n".join(str(value).lower() for value in values if value is not None)
+
+
+def get_documents(queryset: QuerySet) -> Dict[int, str]:
+    """Documents of the objects of the queryset by their ids"""
+    model = queryset.model
+    content_type = ContentType.objects.get_for_model(model)
+    rows = list(queryset.order_by().values_list("pk", *get_search_lookups(model)))
+
+    attribute_values = {}
+    if content_type.model not in SEARCH_MODELS_WITHOUT_ATTRIBUTES:
+        attribute_values = _get_attribute_values(
+            content_type, [row[0] for row in rows]
+        )
+
+    return {
+        pk: make_document([*values, *attribute_values.get(pk, [])])
+        for pk, *values in rows
+    }
+
+
+def update_search_documents(queryset: QuerySet) -> int:
+    """Create or update documents of the objects of the queryset"""
+    content_type = ContentType.objects.get_for_model(queryset.model)
+    documents = get_documents(queryset)
+
+    SearchDocument.objects.bulk_create(
+        [
+            SearchDocument(
+                content_type=content_type, object_id=object_id, document=document
+            )
+            for object_id, document in documents.items()
+        ],
+        batch_size=SEARCH_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["content_type", "object_id"],
+        update_fields=["document"],
+    )
+
+    return len(documents)
+
+
+def delete_search_documents(model, object_ids: List[int]):
+    SearchDocument.objects.filter(
+        content_type=ContentType.objects.get_for_model(model),
+        object_id__in=object_ids,
+    ).delete()
+
+
+def rebuild_search_documents(model, **filters) -> int:
+    """Update documents of all (or filtered) objects of the model by batches"""
+    queryset = model._base_manager.filter(**filters)
+    if not filters:
+        content_type = ContentType.objects.get_for_model(model)
+        SearchDocument.objects.filter(content_type=content_type).exclude(
+            object_id__in=queryset.values("pk")
+        ).delete()
+
+    ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+    count = 0
+    for start in range(0, len(ids), SEARCH_BATCH_SIZE):
+        count += update_search_documents(
+            model._base_manager.filter(pk__in=ids[start : start + SEARCH_BATCH_SIZE])
+        )
+
+    _l.info(f"rebuild_search_documents: {model._meta.label_lower} {count} documents")
+
+    return count
+
+
+def rebuild_search_index(labels: Iterable[str] = None) -> int:
+    """Rebuild documents of the indexed models (all of them by default)"""
+    count = 0
+    for label in sorted(labels or SEARCH_INDEXED_MODELS):
+        count += rebuild_search_documents(apps.get_model(label))
+
+    return count
+
+
+def search_queryset(queryset: QuerySet, search: str) -> QuerySet:
+    """Objects of the queryset whose documents contain the search string"""
+    content_type = ContentType.objects.get_for_model(queryset.model)
+    object_ids = SearchDocument.objects.filter(
+        content_type=content_type, document__contains=search.lower()
+    ).values("object_id")
+
+    return queryset.filter(pk__in=object_ids)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from poms.common.db import get_all_tenant_schemas
+
+
+class Command(BaseCommand):
+    help = "Rebuild search documents of global table search"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--space-code", help="Workspace code (DB schema)")
+        parser.add_argument(
+            "--models",
+            nargs="*",
+            help="Models to rebuild as app_label.model_name, all indexed by default",
+        )
+
+    def handle(self, *args, **options):
+        from poms.search.documents import SEARCH_INDEXED_MODELS, rebuild_search_index
+
+        labels = options.get("models")
+        if labels and not set(labels) <= SEARCH_INDEXED_MODELS:
+            raise CommandError(
+                f"Not indexed models {sorted(set(labels) - SEARCH_INDEXED_MODELS)}"
+            )
+
+        schemas = (
+            [options["space_code"]]
+            if options.get("space_code")
+            else get_all_tenant_schemas()
+        )
+        for schema in schemas:
+            self.stdout.write(f"Rebuilding search index of {schema}...")
+
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET search_path TO {schema};")
+
+            count = rebuild_search_index(labels)
+
+            self.stdout.write(self.style.SUCCESS(f"{schema}: {count} documents"))
+
+        with connection.cursor() as cursor:
+            cursor.execute("SET search_path TO public;")
@@ -0,0 +1,37 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name="SearchDocument",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("object_id", models.BigIntegerField(verbose_name="object id")),
+                ("document", models.TextField(default="", verbose_name="document")),
+                ("content_type", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="contenttypes.contenttype", verbose_name="content type")),
+            ],
+            options={
+                "verbose_name": "search document",
+                "verbose_name_plural": "search documents",
+                "unique_together": {("content_type", "object_id")},
+            },
+        ),
+        migrations.AddIndex(
+            model_name="searchdocument",
+            index=GinIndex(fields=["document"], name="search_document_trgm_idx", opclasses=["public.gin_trgm_ops"]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models
+from django.utils.translation import gettext_lazy
+
+
+class SearchDocument(models.Model):
+    """
+    Lowercased text of the object (own fields, names of related objects and
+    attribute values) used by global table search, indexed by trigrams so
+    that substring search is an index lookup
+    """
+
+    content_type = models.ForeignKey(
+        ContentType,
+        verbose_name=gettext_lazy("content type"),
+        on_delete=models.CASCADE,
+    )
+    object_id = models.BigIntegerField(
+        verbose_name=gettext_lazy("object id"),
+    )
+    document = models.TextField(
+        default="",
+        verbose_name=gettext_lazy("document"),
+    )
+
+    class Meta:
+        verbose_name = gettext_lazy("search document")
+        verbose_name_plural = gettext_lazy("search documents")
+        unique_together = [["content_type", "object_id"]]
+        indexes = [
+            GinIndex(
+                name="search_document_trgm_idx",
+                fields=["document"],
+                # extension lives in public schema, shared by all the spaces
+                opclasses=["public.gin_trgm_ops"],
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type_id} {self.object_id}"
@@ -0,0 +1,110 @@
+import logging
+from functools import lru_cache
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from poms.common.utils import collect_on_commit, get_current_schema
+from poms.obj_attrs.models import GenericAttribute
+from poms.search.documents import (
+    SEARCH_RELATION_NAMES,
+    delete_search_documents,
+    get_related_search_fields,
+    has_field,
+    is_search_indexed,
+    update_search_documents,
+)
+
+_l = logging.getLogger("poms.search")
+
+
+@lru_cache(maxsize=None)
+def _get_name_fields(model) -> tuple:
+    return tuple(name for name in SEARCH_RELATION_NAMES if has_field(model, name))
+
+
+def _update_document(model, object_id):
+    collect_on_commit(
+        ("search_update", model._meta.label_lower),
+        (object_id,),
+        lambda ids: update_search_documents(model._base_manager.filter(pk__in=ids)),
+    )
+
+
+def _rebuild_related_documents(label: str, items: set):
+    from poms.search.tasks import rebuild_related_search_documents
+
+    space_code = get_current_schema()
+    for object_id, realm_code in items:
+        rebuild_related_search_documents.apply_async(
+            kwargs={
+                "label": label,
+                "object_id": object_id,
+                "context": {"space_code": space_code, "realm_code": realm_code},
+            }
+        )
+
+
+def remember_search_names(sender, instance, **kwargs):
+    # deferred names are not loaded to be remembered
+    names = _get_name_fields(sender)
+    if all(name in instance.__dict__ for name in names):
+        instance._search_names = tuple(instance.__dict__[name] for name in names)
+
+
+def connect_search_names_tracking():
+    """
+    Remember names of loaded objects used in documents of other models
+    to find out if save changes them
+    """
+    for label in get_related_search_fields():
+        model = apps.get_model(label)
+        if _get_name_fields(model):
+            post_init.connect(remember_search_names, sender=model)
+
+
+@receiver(post_save, dispatch_uid="search_post_save")
+def search_post_save(sender, instance, created, **kwargs):
+    if is_search_indexed(sender):
+        _update_document(sender, instance.pk)
+
+    old_names = getattr(instance, "_search_names", None)
+    if old_names is None:
+        return
+
+    new_names = tuple(getattr(instance, name) for name in _get_name_fields(sender))
+    instance._search_names = new_names
+    if created or old_names == new_names:
+        return
+
+    master_user = getattr(instance, "master_user", None)
+    if master_user is None:
+        _l.debug(f"no master user of {sender._meta.label_lower} {instance.pk}")
+        return
+
+    label = sender._meta.label_lower
+    collect_on_commit(
+        ("search_related", label),
+        ((instance.pk, master_user.realm_code),),
+        lambda items: _rebuild_related_documents(label, items),
+    )
+
+
+@receiver(post_delete, dispatch_uid="search_post_delete")
+def search_post_delete(sender, instance, **kwargs):
+    if is_search_indexed(sender):
+        collect_on_commit(
+            ("search_delete", sender._meta.label_lower),
+            (instance.pk,),
+            lambda ids: delete_search_documents(sender, list(ids)),
+        )
+
+
+@receiver(post_save, sender=GenericAttribute, dispatch_uid="search_attribute_save")
+@receiver(post_delete, sender=GenericAttribute, dispatch_uid="search_attribute_delete")
+def search_attribute_changed(sender, instance, **kwargs):
+    model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if model is not None and is_search_indexed(model):
+        _update_document(model, instance.object_id)
@@ -0,0 +1,20 @@
+import logging
+
+from poms.celery_tasks import finmars_task
+from poms.search.documents import get_related_search_fields, rebuild_search_documents
+
+_l = logging.getLogger("poms.search")
+
+
+@finmars_task(name="search.rebuild_related_search_documents")
+def rebuild_related_search_documents(label: str, object_id: int, **kwargs):
+    """
+    Update documents of objects related to the renamed object
+    (e.g. transactions of the portfolio)
+    """
+    count = 0
+    for model, field_name in get_related_search_fields().get(label, []):
+        count += rebuild_search_documents(model, **{field_name: object_id})
+
+    _l.info(f"rebuild_related_search_documents: {label} {object_id} {count} documents")
+
@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.test import override_settings
+
+from poms.common.common_base_test import BaseTestCase
+from poms.common.filtering_handlers import handle_global_table_search
+from poms.currencies.models import Currency
+from poms.instruments.models import Instrument
+from poms.search import signals
+from poms.search.documents import rebuild_search_documents, search_queryset
+from poms.search.models import SearchDocument
+
+
+class SearchDocumentsTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.content_type = ContentType.objects.get_for_model(Instrument)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instrument = self.create_instrument()
+
+    def search(self, text: str) -> set:
+        return set(
+            search_queryset(Instrument.objects.all(), text).values_list(
+                "id", flat=True
+            )
+        )
+
+    def test_document_is_updated_on_save(self):
+        document = SearchDocument.objects.get(
+            content_type=self.content_type, object_id=self.instrument.id
+        )
+        self.assertIn(self.instrument.name.lower(), document.document)
+        self.assertIn(self.instrument.country.name.lower(), document.document)
+
+    def test_search_substring(self):
+        name_part = self.instrument.name[2:8].lower()
+
+        self.assertEqual(self.search(name_part), {self.instrument.id})
+        self.assertEqual(self.search(self.random_string(20)), set())
+
+    def test_document_is_deleted(self):
+        instrument_id = self.instrument.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instrument.delete()
+
+        self.assertFalse(
+            SearchDocument.objects.filter(
+                content_type=self.content_type, object_id=instrument_id
+            ).exists()
+        )
+
+    def test_document_is_updated_once_per_db_transaction(self):
+        with mock.patch.object(
+            signals, "update_search_documents"
+        ) as update, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for _ in range(3):
+                    self.instrument.name = self.random_string()
+                    self.instrument.save()
+
+        calls = [
+            call for call in update.call_args_list if call.args[0].model is Instrument
+        ]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            list(calls[0].args[0].values_list("pk", flat=True)), [self.instrument.id]
+        )
+
+    def test_related_documents_are_rebuilt_on_rename(self):
+        currency = Currency.objects.get(pk=self.instrument.pricing_currency_id)
+        with mock.patch(
+            "poms.search.tasks.rebuild_related_search_documents.apply_async"
+        ) as apply_async, self.captureOnCommitCallbacks(execute=True):
+            currency.save()
+            currency.name = self.random_string()
+            currency.save()
+
+        apply_async.assert_called_once()
+        kwargs = apply_async.call_args.kwargs["kwargs"]
+        self.assertEqual(kwargs["label"], "currencies.currency")
+        self.assertEqual(kwargs["object_id"], currency.id)
+
+    def test_rebuild(self):
+        SearchDocument.objects.all().delete()
+
+        count = rebuild_search_documents(Instrument)
+
+        self.assertEqual(count, Instrument.objects.count())
+        self.assertEqual(self.search(self.instrument.user_code), {self.instrument.id})
+
+    @override_settings(GLOBAL_TABLE_SEARCH_INDEX=True)
+    def test_global_table_search(self):
+        qs = handle_global_table_search(
+            Instrument.objects.all(),
+            self.instrument.short_name,
+            Instrument,
+            self.content_type,
+        )
+
+        self.assertIn(self.instrument.id, set(qs.values_list("id", flat=True)))
@@ -1,27 +1,23 @@
 from copy import deepcopy
-import csv
 import json
 import logging
-import os
-import re
 import time
 import traceback
 from datetime import date
-from tempfile import NamedTemporaryFile
 
+from django.db.models import Prefetch
 from django.utils.timezone import now
 
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
-
 from poms.accounts.models import Account
 from poms.celery_tasks.models import CeleryTask
 from poms.common.models import ProxyRequest, ProxyUser
 from poms.common.storage import get_storage
 from poms.counterparties.models import Counterparty, Responsible
+from poms.csv_import.readers import iter_csv_rows, iter_excel_rows, iter_file_items
 from poms.currencies.models import Currency
 from poms.expressions_engine import formula
 from poms.file_reports.models import FileReport
+from poms.history.journal import journal_changes
 from poms.instruments.models import (
     AccrualCalculationModel,
     DailyPricingModel,
@@ -49,12 +45,32 @@ from poms.transaction_import.models import (
     TransactionImportResult,
 )
 from poms.transaction_import.serializers import TransactionImportResultSerializer
+from poms.transactions.first_transaction_dates import defer_first_transaction_dates
 from poms.transactions.handlers import TransactionTypeProcess
-from poms.transactions.models import TransactionType, TransactionTypeInput
+from poms.transactions.models import (
+    TransactionType,
+    TransactionTypeAction,
+    TransactionTypeInput,
+)
 from poms.users.models import EcosystemDefault
 
 storage = get_storage()
 
+# child models of TransactionTypeAction used by TransactionTypeProcess
+TRANSACTION_TYPE_ACTION_RELATIONS = (
+    "transactiontypeactioninstrument",
+    "transactiontypeactiontransaction",
+    "transactiontypeactioninstrumentfactorschedule",
+    "transactiontypeactioninstrumentmanualpricingformula",
+    "transactiontypeactioninstrumentaccrualcalculationschedules",
+    "transactiontypeactioninstrumenteventschedule",
+    "transactiontypeactioninstrumenteventscheduleaction",
+    "transactiontypeactionexecutecommand",
+)
+
+# task progress is saved once per this number of rows
+PROGRESS_UPDATE_ROWS = 100
+
 
 _l = logging.getLogger("poms.transaction_import")
 
@@ -76,6 +92,18 @@ props_map = {
 }
 
 
+def get_rule_scenarios_index(rule_scenarios) -> dict:
+    """
+    {selector value: [rule scenarios]} in the order of scheme rule scenarios,
+    scenario is repeated as many times as it has the selector value
+    """
+    index = {}
+    for rule_scenario in rule_scenarios:
+        for selector_value in rule_scenario.selector_values.all():
+            index.setdefault(selector_value.value, []).append(rule_scenario)
+    return index
+
+
 class TransactionImportProcess(object):
     def __init__(self, task_id, procedure_instance_id=None):
         self.task = CeleryTask.objects.get(pk=task_id)
@@ -123,6 +151,12 @@ class TransactionImportProcess(object):
         self.find_default_rule_scenario()
         self.find_error_rule_scenario()
 
+        self.rule_scenarios_index = get_rule_scenarios_index(
+            self.scheme.rule_scenarios.prefetch_related("fields", "selector_values")
+        )
+        self.transaction_types = {}  # user_code -> TransactionType
+        self.transaction_type_inputs = {}  # (user_code, name) -> TransactionTypeInput
+
         self.result = TransactionImportResult()
         self.result.task = self.task
         self.result.scheme = self.scheme
@@ -364,12 +398,7 @@ class TransactionImportProcess(object):
         )
 
     def get_default_relation(self, rule_scenario, field):
-        # i = field.transaction_type_input
-        # TODO PERFORMANCE_ISSUE Maybe performance issue
-        i = TransactionTypeInput.objects.get(
-            transaction_type__user_code=rule_scenario.transaction_type,
-            name=field.transaction_type_input,
-        )
+        i = self.get_transaction_type_input(rule_scenario, field)
 
         model_class = i.content_type.model_class()
 
@@ -382,6 +411,58 @@ class TransactionImportProcess(object):
 
         return v
 
+    def get_transaction_type(self, user_code):
+        """Transaction type with prefetched inputs and actions, loaded once per import"""
+        if user_code not in self.transaction_types:
+            self.transaction_types[user_code] = (
+                TransactionType.objects.select_related("master_user")
+                .prefetch_related(
+                    Prefetch(
+                        "inputs",
+                        queryset=TransactionTypeInput.objects.select_related(
+                            "content_type"
+                        ),
+                    ),
+                    Prefetch(
+                        "actions",
+                        queryset=TransactionTypeAction.objects.select_related(
+                            *TRANSACTION_TYPE_ACTION_RELATIONS
+                        ).order_by("order"),
+                    ),
+                )
+                .get(user_code=user_code)
+            )
+
+        return self.transaction_types[user_code]
+
+    def get_transaction_type_input(self, rule_scenario, field):
+        key = (rule_scenario.transaction_type, field.transaction_type_input)
+        if key not in self.transaction_type_inputs:
+            self.transaction_type_inputs[key] = TransactionTypeInput.objects.select_related(
+                "content_type"
+            ).get(
+                transaction_type__user_code=rule_scenario.transaction_type,
+                name=field.transaction_type_input,
+            )
+
+        return self.transaction_type_inputs[key]
+
+    def update_rows_progress(self, description):
+        if (
+            self.result.processed_rows % PROGRESS_UPDATE_ROWS
+            and self.result.processed_rows < len(self.items)
+        ):
+            return
+
+        self.task.update_progress(
+            {
+                "current": self.result.processed_rows,
+                "total": len(self.items),
+                "percent": round(self.result.processed_rows / (len(self.items) / 100)),
+                "description": description,
+            }
+        )
+
     def find_default_rule_scenario(self):
         rule_scenarios = self.scheme.rule_scenarios.prefetch_related("fields").all()
 
@@ -414,11 +495,7 @@ class TransactionImportProcess(object):
             return None
 
     def convert_value(self, item, rule_scenario, field, value):
-        # TODO PERFORMANCE_ISSUE Maybe performance issue
-        i = TransactionTypeInput.objects.get(
-            transaction_type__user_code=rule_scenario.transaction_type,
-            name=field.transaction_type_input,
-        )
+        i = self.get_transaction_type_input(rule_scenario, field)
 
         if i.value_type == TransactionTypeInput.STRING:
             return str(value)
@@ -531,8 +608,8 @@ class TransactionImportProcess(object):
 
             transaction_type_process_instance = TransactionTypeProcess(
                 linked_import_task=self.task,
-                transaction_type=TransactionType.objects.get(
-                    user_code=rule_scenario.transaction_type
+                transaction_type=self.get_transaction_type(
+                    rule_scenario.transaction_type
                 ),
                 default_values=fields,
                 context=self.context,
@@ -582,15 +659,8 @@ class TransactionImportProcess(object):
                         errors, default=str
                     )
 
-                    self.task.update_progress(
-                        {
-                            "current": self.result.processed_rows,
-                            "total": len(self.items),
-                            "percent": round(
-                                self.result.processed_rows / (len(self.items) / 100)
-                            ),
-                            "description": f"Going to skip {rule_scenario.transaction_type}",
-                        }
+                    self.update_rows_progress(
+                        f"Going to skip {rule_scenario.transaction_type}"
                     )
 
                     # raise BookSkipException(code=409, error_message=item.error_message)
@@ -644,16 +714,8 @@ class TransactionImportProcess(object):
                 # _l.info('TransactionImportProcess.Task %s. book SUCCESS item %s rule_scenario %s' % (
                 #     self.task, item, rule_scenario))
 
-                self.task.update_progress(
-                    {
-                        "current": self.result.processed_rows,
-                        "total": len(self.items),
-                        "percent": round(
-                            self.result.processed_rows / (len(self.items) / 100)
-                        ),
-                        "description": "Going to book %s"
-                        % (rule_scenario.transaction_type),
-                    }
+                self.update_rows_progress(
+                    "Going to book %s" % (rule_scenario.transaction_type)
                 )
 
         except Exception as e:
@@ -707,113 +769,25 @@ class TransactionImportProcess(object):
                 _l.info("ProcessType.CSV self.file_path %s" % self.file_path)
 
                 with storage.open(self.file_path, "rb") as f:
-                    with NamedTemporaryFile() as tmpf:
-                        for chunk in f.chunks():
-                            tmpf.write(chunk)
-                        tmpf.flush()
-
-                        # TODO check encoding (maybe should be taken from scheme)
-                        with open(
-                            tmpf.name, mode="rt", encoding="utf_8_sig", errors="ignore"
-                        ) as cf:
-                            # TODO check quotechar (maybe should be taken from scheme)
-                            reader = csv.reader(
-                                cf,
-                                delimiter=self.scheme.delimiter,
-                                quotechar='"',
-                                strict=False,
-                                skipinitialspace=True,
-                            )
-
-                            column_row = None
-
-                            for row_index, row in enumerate(reader):
-                                if row_index == 0:
-                                    column_row = row
-
-                                else:
-                                    file_item = {}
-
-                                    for column_index, value in enumerate(row):
-                                        key = column_row[column_index]
-                                        file_item[key] = value
-
-                                    self.file_items.append(file_item)
+                    self.file_items.extend(
+                        iter_file_items(iter_csv_rows(f, self.scheme.delimiter))
+                    )
 
-                            self.result.total_rows = len(self.file_items)
+                self.result.total_rows = len(self.file_items)
 
             if self.process_type == ProcessType.EXCEL:
                 with storage.open(self.file_path, "rb") as f:
-                    with NamedTemporaryFile() as tmpf:
-                        for chunk in f.chunks():
-                            tmpf.write(chunk)
-                        tmpf.flush()
-
-                        os.link(tmpf.name, tmpf.name + ".xlsx")
-
-                        # _l.info('self.file_path %s' % self.file_path)
-                        # _l.info('tmpf.name %s' % tmpf.name)
-
-                        wb = load_workbook(filename=tmpf.name + ".xlsx")
-
-                        if (
-                            self.scheme.spreadsheet_active_tab_name
-                            and self.scheme.spreadsheet_active_tab_name in wb.sheetnames
-                        ):
-                            ws = wb[self.scheme.spreadsheet_active_tab_name]
-                        else:
-                            ws = wb.active
-
-                        reader = []
-
-                        if self.scheme.spreadsheet_start_cell == "A1":
-                            for r in ws.rows:
-                                reader.append([cell.value for cell in r])
-
-                        else:
-                            start_cell_row_number = int(
-                                re.search(r"\d+", self.scheme.spreadsheet_start_cell)[0]
-                            )
-                            start_cell_letter = (
-                                self.scheme.spreadsheet_start_cell.split(
-                                    str(start_cell_row_number)
-                                )[0]
+                    self.file_items.extend(
+                        iter_file_items(
+                            iter_excel_rows(
+                                f,
+                                self.scheme.spreadsheet_active_tab_name,
+                                self.scheme.spreadsheet_start_cell,
                             )
+                        )
+                    )
 
-                            start_cell_column_number = column_index_from_string(
-                                start_cell_letter
-                            )
-
-                            row_number = 1
-
-                            for r in ws.rows:
-                                row_values = []
-
-                                if row_number >= start_cell_row_number:
-                                    for cell in r:
-                                        if cell.column >= start_cell_column_number:
-                                            row_values.append(cell.value)
-
-                                    reader.append(row_values)
-
-                                row_number = row_number + 1
-
-                        column_row = None
-
-                        for row_index, row in enumerate(reader):
-                            if row_index == 0:
-                                column_row = row
-
-                            else:
-                                file_item = {}
-
-                                for column_index, value in enumerate(row):
-                                    key = column_row[column_index]
-                                    file_item[key] = value
-
-                                self.file_items.append(file_item)
-
-                        self.result.total_rows = len(self.file_items)
+                self.result.total_rows = len(self.file_items)
 
             _l.info(
                 "TransactionImportProcess.Task %s. fill_with_raw_items %s DONE items %s"
@@ -1012,6 +986,8 @@ class TransactionImportProcess(object):
             "{:3.3f}".format(time.perf_counter() - st),
         )
 
+    @defer_first_transaction_dates()
+    @journal_changes()
     def process_items(self):
         _l.info(f"TransactionImportProcess.Task {self.task}. process_items INIT")
         st = time.perf_counter()
@@ -1061,61 +1037,40 @@ class TransactionImportProcess(object):
                 if rule_value:
                     found = False
 
-                    for rule_scenario in self.scheme.rule_scenarios.all():
-                        if rule_scenario.status != "skip":
-                            selector_values = rule_scenario.selector_values.all()
-
-                            for selector_value in selector_values:
-                                if selector_value.value == rule_value:
-                                    # sid = transaction.savepoint()
-                                    # _l.info("Create checkpoint for %s" % index)
-
-                                    found = True
-                                    try:
-                                        self.book(item, rule_scenario)
-
-                                        # _l.info("Savepoint commit for %s" % index)
-                                        # _l.error("Could not book error scenario %s" % e)
-                                        # transaction.savepoint_commit(sid)
-
-                                    except BookSkipException:
-                                        # _l.info("BookSkipException")
-                                        # transaction.savepoint_rollback(sid)
-                                        continue
-
-                                    except (
-                                        Exception,
-                                        BookUnhandledException,
-                                        BookException,
-                                    ) as e:
-                                        # transaction.savepoint_rollback(sid)
-
-                                        _l.error(
-                                            f"Catch BookUnhandledException trying "
-                                            f"to book error_rule_scenario {e}"
-                                        )
-
-                                        try:
-                                            self.book(
-                                                item, self.error_rule_scenario, error=e
-                                            )
-                                            # _l.info("Error Handler Savepoint commit for %s" % index)
-                                            # transaction.savepoint_commit(sid)
-
-                                        except Exception as e:
-                                            # any exception will work on error scenario
-                                            _l.error(
-                                                f"Could not book error scenario {e}"
-                                            )
-                                            # _l.info("Error Handler Savepoint rollback for %s" % index)
-                                            # transaction.savepoint_rollback(sid)
-                        else:
-                            """For case when its actually skip mode"""
-                            selector_values = rule_scenario.selector_values.all()
-
-                            for selector_value in selector_values:
-                                if selector_value.value == rule_value:
-                                    found = True
+                    try:
+                        rule_scenarios = self.rule_scenarios_index.get(rule_value, [])
+                    except TypeError:  # unhashable value can't match selector
+                        rule_scenarios = []
+
+                    for rule_scenario in rule_scenarios:
+                        found = True
+
+                        if rule_scenario.status == "skip":
+                            # scenario in skip mode only marks the row as matched
+                            continue
+
+                        try:
+                            self.book(item, rule_scenario)
+
+                        except BookSkipException:
+                            continue
+
+                        except (
+                            Exception,
+                            BookUnhandledException,
+                            BookException,
+                        ) as e:
+                            _l.error(
+                                f"Catch BookUnhandledException trying "
+                                f"to book error_rule_scenario {e}"
+                            )
+
+                            try:
+                                self.book(item, self.error_rule_scenario, error=e)
+
+                            except Exception as e:
+                                # any exception will work on error scenario
+                                _l.error(f"Could not book error scenario {e}")
 
                     if not found:
                         # sid = transaction.savepoint()
@@ -1153,16 +1108,7 @@ class TransactionImportProcess(object):
 
                 self.result.processed_rows = self.result.processed_rows + 1
 
-                self.task.update_progress(
-                    {
-                        "current": self.result.processed_rows,
-                        "total": len(self.items),
-                        "percent": round(
-                            self.result.processed_rows / (len(self.items) / 100)
-                        ),
-                        "description": f"Row {self.result.processed_rows} processed",
-                    }
-                )
+                self.update_rows_progress(f"Row {self.result.processed_rows} processed")
 
             except Exception as e:
                 item.status = "error"
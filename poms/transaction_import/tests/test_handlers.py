@@ -0,0 +1,48 @@
+from poms.common.common_base_test import BaseTestCase
+from poms.integrations.models import (
+    ComplexTransactionImportScheme,
+    ComplexTransactionImportSchemeRuleScenario,
+    ComplexTransactionImportSchemeSelectorValue,
+)
+from poms.transaction_import.handlers import get_rule_scenarios_index
+
+
+class GetRuleScenariosIndexTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.scheme = ComplexTransactionImportScheme.objects.create(
+            user_code=self.random_string(length=5),
+            master_user=self.master_user,
+            owner=self.member,
+        )
+        self.buy, self.sell = [
+            ComplexTransactionImportSchemeSelectorValue.objects.create(
+                scheme=self.scheme, value=value
+            )
+            for value in ("BUY", "SELL")
+        ]
+
+    def create_rule_scenario(self, name, *selector_values, status="active"):
+        rule_scenario = ComplexTransactionImportSchemeRuleScenario.objects.create(
+            scheme=self.scheme,
+            name=name,
+            status=status,
+            transaction_type=name,
+        )
+        rule_scenario.selector_values.set(selector_values)
+        return rule_scenario
+
+    def test_index_keeps_order_of_scenarios(self):
+        first = self.create_rule_scenario("first", self.buy)
+        second = self.create_rule_scenario("second", self.buy, self.sell)
+        skip = self.create_rule_scenario("skip", self.sell, status="skip")
+        self.create_rule_scenario("empty")
+
+        rule_scenarios = self.scheme.rule_scenarios.prefetch_related("selector_values")
+        with self.assertNumQueries(2):
+            index = get_rule_scenarios_index(rule_scenarios)
+
+        self.assertEqual(index, {"BUY": [first, second], "SELL": [second, skip]})
@@ -0,0 +1,147 @@
+"""
+Deferred recalculation of first transaction dates.
+
+Transaction.save() and Transaction.delete() save portfolio and instrument
+to recalculate their first_transaction_date, that is a few queries and a
+history record per transaction. Inside defer_first_transaction_dates()
+touched portfolios and instruments are collected instead and recalculated
+together by aggregate queries when the db transaction is committed.
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, Q
+
+from poms.instruments.models import Instrument
+from poms.portfolios.models import Portfolio
+from poms.search.documents import update_search_documents
+from poms.transactions.models import Transaction, TransactionClass
+
+_l = logging.getLogger("poms.transactions")
+
+# {"portfolios": set of ids, "instruments": set of ids} of the current block
+_touched: ContextVar[Optional[dict]] = ContextVar(
+    "first_transaction_dates_touched", default=None
+)
+
+
+@contextmanager
+def defer_first_transaction_dates():
+    """
+    Recalculate first transaction dates of touched portfolios and instruments
+    once on commit, nested blocks are collected by the outermost one
+    """
+    if _touched.get() is not None:
+        yield
+        return
+
+    touched = {"portfolios": set(), "instruments": set()}
+    token = _touched.set(touched)
+    try:
+        yield
+    finally:
+        _touched.reset(token)
+
+        if touched["portfolios"] or touched["instruments"]:
+            transaction.on_commit(
+                lambda: update_first_transaction_dates(
+                    touched["portfolios"], touched["instruments"]
+                )
+            )
+
+
+def first_transaction_dates_deferred(
+    portfolio_id: Optional[int], instrument_id: Optional[int]
+) -> bool:
+    """Collect ids for recalculation, False if recalculation is not deferred"""
+    touched = _touched.get()
+    if touched is None:
+        return False
+
+    if portfolio_id:
+        touched["portfolios"].add(portfolio_id)
+    if instrument_id:
+        touched["instruments"].add(instrument_id)
+
+    return True
+
+
+def update_first_transaction_dates(
+    portfolio_ids: Iterable[int], instrument_ids: Iterable[int]
+):
+    """Same as calculate_first_transactions_dates() of every portfolio and instrument"""
+    transactions = Transaction.objects.filter(is_deleted=False)
+
+    if portfolio_ids:
+        dates = {
+            row["portfolio_id"]: row
+            for row in transactions.filter(portfolio_id__in=portfolio_ids)
+            .values("portfolio_id")
+            .annotate(
+                first_transaction_date=Min("accounting_date"),
+                first_cash_flow_date=Min(
+                    "accounting_date",
+                    filter=Q(
+                        transaction_class_id__in=[
+                            TransactionClass.CASH_INFLOW,
+                            TransactionClass.CASH_OUTFLOW,
+                        ]
+                    ),
+                ),
+            )
+        }
+        portfolios = list(
+            Portfolio.objects.filter(id__in=portfolio_ids)
+            .select_related("master_user")
+            .only("id", "master_user__space_code")
+        )
+        for portfolio in portfolios:
+            row = dates.get(portfolio.id, {})
+            portfolio.first_transaction_date = row.get("first_transaction_date")
+            portfolio.first_cash_flow_date = row.get("first_cash_flow_date")
+
+        Portfolio.objects.bulk_update(
+            portfolios, ["first_transaction_date", "first_cash_flow_date"]
+        )
+        # search documents contain the dates, bulk_update sends no post_save
+        update_search_documents(Portfolio._base_manager.filter(id__in=portfolio_ids))
+        cache.delete_many(
+            [
+                f"{portfolio.master_user.space_code}_serialized_report_portfolio_{portfolio.id}"
+                for portfolio in portfolios
+            ]
+        )
+
+    if instrument_ids:
+        dates = dict(
+            transactions.filter(instrument_id__in=instrument_ids)
+            .values("instrument_id")
+            .annotate(first_transaction_date=Min("accounting_date"))
+            .values_list("instrument_id", "first_transaction_date")
+        )
+        instruments = list(
+            Instrument.objects.filter(id__in=instrument_ids)
+            .select_related("master_user")
+            .only("id", "master_user__space_code")
+        )
+        for instrument in instruments:
+            instrument.first_transaction_date = dates.get(instrument.id)
+
+        Instrument.objects.bulk_update(instruments, ["first_transaction_date"])
+        update_search_documents(Instrument._base_manager.filter(id__in=instrument_ids))
+        cache.delete_many(
+            [
+                f"{instrument.master_user.space_code}_serialized_report_instrument_{instrument.id}"
+                for instrument in instruments
+            ]
+        )
+
+    _l.info(
+        f"update_first_transaction_dates: portfolios={len(portfolio_ids)} "
+        f"instruments={len(instrument_ids)}"
+    )
@@ -18,6 +18,7 @@ from poms.common.utils import date_now, format_float, format_float_to_2
 from poms.counterparties.models import Counterparty, Responsible
 from poms.currencies.models import Currency
 from poms.expressions_engine import formula
+from poms.history.journal import journal_changes
 from poms.instruments.models import (
     AccrualCalculationModel,
     AccrualCalculationSchedule,
@@ -36,6 +37,7 @@ from poms.portfolios.models import Portfolio
 from poms.reconciliation.models import TransactionTypeReconField
 from poms.strategies.models import Strategy1, Strategy2, Strategy3
 from poms.system_messages.handlers import send_system_message
+from poms.transactions.first_transaction_dates import defer_first_transaction_dates
 from poms.transactions.models import (
     ComplexTransaction,
     ComplexTransactionInput,
@@ -2947,6 +2949,15 @@ class TransactionTypeProcess:
                 description=system_message_description,
             )
 
+    def get_actions(self):
+        # actions may be prefetched in order with their children (e.g. by import)
+        if "actions" in getattr(self.transaction_type, "_prefetched_objects_cache", {}):
+            return self.transaction_type.actions.all()
+
+        return self.transaction_type.actions.order_by("order").all()
+
+    @defer_first_transaction_dates()
+    @journal_changes()
     def process(self):
         if self.process_mode == self.MODE_RECALCULATE:
             return self.process_recalculate()
@@ -2959,7 +2970,7 @@ class TransactionTypeProcess:
 
         instrument_map = {}
         event_schedules_map = {}
-        actions = self.transaction_type.actions.order_by("order").all()
+        actions = self.get_actions()
 
         """
         Creating instruments
@@ -3616,6 +3616,16 @@ class Transaction(models.Model):
 
         super().save(*args, **kwargs)
 
+        self.update_first_transactions_dates()
+
+    def update_first_transactions_dates(self):
+        from poms.transactions.first_transaction_dates import (
+            first_transaction_dates_deferred,
+        )
+
+        if first_transaction_dates_deferred(self.portfolio_id, self.instrument_id):
+            return
+
         if self.portfolio:
             # force run of calculate_first_transactions_dates and update portfolio
             _l.debug(
@@ -3635,19 +3645,7 @@ class Transaction(models.Model):
 
         super().delete(*args, **kwargs)
 
-        if self.portfolio:
-            # force run of calculate_first_transactions_dates and update portfolio
-            _l.debug(
-                "Transaction.delete: recalculate first_transactions_dates in portfolio"
-            )
-            self.portfolio.save()
-
-        if self.instrument:
-            # force run of calculate_first_transactions_dates and update instrument
-            _l.debug(
-                "Transaction.save: recalculate first_transactions_dates in instrument"
-            )
-            self.instrument.save()
+        self.update_first_transactions_dates()
 
     def is_can_calc_cash_by_formulas(self):
         return (
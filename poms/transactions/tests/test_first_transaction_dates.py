@@ -0,0 +1,58 @@
+from datetime import date
+
+from poms.common.common_base_test import BIG, BaseTestCase
+from poms.instruments.models import Instrument
+from poms.portfolios.models import Portfolio
+from poms.search.models import SearchDocument
+from poms.transactions.first_transaction_dates import defer_first_transaction_dates
+from poms.transactions.models import Transaction
+
+
+class DeferFirstTransactionDatesTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.portfolio = self.db_data.portfolios[BIG]
+        self.instrument = self.db_data.default_instrument
+
+    def test_dates_are_updated_on_commit(self):
+        first_transaction_date = self.portfolio.first_transaction_date
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with defer_first_transaction_dates():
+                self.db_data.cash_in_transaction(self.portfolio, day=date(2024, 1, 5))
+                with defer_first_transaction_dates():
+                    self.db_data.cash_in_transaction(
+                        self.portfolio, day=date(2024, 1, 3)
+                    )
+
+                self.portfolio.refresh_from_db()
+                self.assertEqual(
+                    self.portfolio.first_transaction_date, first_transaction_date
+                )
+
+        portfolio = Portfolio.objects.get(id=self.portfolio.id)
+        self.assertEqual(portfolio.first_transaction_date, date(2024, 1, 3))
+        self.assertEqual(portfolio.first_cash_flow_date, date(2024, 1, 3))
+        instrument = Instrument.objects.get(id=self.instrument.id)
+        self.assertEqual(instrument.first_transaction_date, date(2024, 1, 3))
+        document = SearchDocument.objects.get(
+            content_type__model="portfolio", object_id=self.portfolio.id
+        )
+        self.assertIn("2024-01-03", document.document)
+
+    def test_same_dates_as_without_deferring(self):
+        self.db_data.cash_in_transaction(self.portfolio, day=date(2024, 1, 5))
+        expected = Portfolio.objects.get(id=self.portfolio.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with defer_first_transaction_dates():
+                Transaction.objects.filter(portfolio=self.portfolio).first().save()
+
+        portfolio = Portfolio.objects.get(id=self.portfolio.id)
+        self.assertEqual(
+            portfolio.first_transaction_date, expected.first_transaction_date
+        )
+        self.assertEqual(portfolio.first_cash_flow_date, expected.first_cash_flow_date)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class WidgetsConfig(AppConfig):
     name = "poms.widgets"
+
+    def ready(self):
+        from poms.widgets import signals  # noqa: F401
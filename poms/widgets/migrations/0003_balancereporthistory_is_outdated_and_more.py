@@ -0,0 +1,32 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currencies', '0001_initial'),
+        ('instruments', '0001_initial'),
+        ('widgets', '0002_remove_balancereporthistory_created_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balancereporthistory',
+            name='is_outdated',
+            field=models.BooleanField(default=False, help_text='Transactions or prices of the date were changed after collecting', verbose_name='is outdated'),
+        ),
+        migrations.CreateModel(
+            name='BalanceReportHistoryPosition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position_size', models.FloatField(default=0.0, verbose_name='position size')),
+                ('market_value', models.FloatField(blank=True, null=True, verbose_name='market value')),
+                ('balance_report_history', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='widgets.balancereporthistory', verbose_name='balance report history')),
+                ('currency', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='currencies.currency', verbose_name='currency')),
+                ('instrument', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='instruments.instrument', verbose_name='instrument')),
+            ],
+        ),
+    ]
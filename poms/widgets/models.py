@@ -57,6 +57,14 @@ class BalanceReportHistory(TimeStampedModel):
         default=0.0, null=True, blank=True, verbose_name=gettext_lazy("nav")
     )
 
+    is_outdated = models.BooleanField(
+        default=False,
+        verbose_name=gettext_lazy("is outdated"),
+        help_text=gettext_lazy(
+            "Transactions or prices of the date were changed after collecting"
+        ),
+    )
+
     class Meta:
         unique_together = [
             ["master_user", "date", "portfolio"],
@@ -90,6 +98,37 @@ class BalanceReportHistoryItem(models.Model):
     )
 
 
+class BalanceReportHistoryPosition(models.Model):
+    """Position or cash of the portfolio on the date of balance report history"""
+
+    balance_report_history = models.ForeignKey(
+        BalanceReportHistory,
+        related_name="positions",
+        verbose_name=gettext_lazy("balance report history"),
+        on_delete=models.CASCADE,
+    )
+    instrument = models.ForeignKey(
+        "instruments.Instrument",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        verbose_name=gettext_lazy("instrument"),
+    )
+    currency = models.ForeignKey(
+        Currency,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        verbose_name=gettext_lazy("currency"),
+    )
+    position_size = models.FloatField(
+        default=0.0, verbose_name=gettext_lazy("position size")
+    )
+    market_value = models.FloatField(
+        null=True, blank=True, verbose_name=gettext_lazy("market value")
+    )
+
+
 class PLReportHistory(TimeStampedModel):
     master_user = models.ForeignKey(
         MasterUser, verbose_name=gettext_lazy("master user"), on_delete=models.CASCADE
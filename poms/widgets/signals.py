@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from poms.common.utils import collect_on_commit
+from poms.currencies.models import CurrencyHistory
+from poms.instruments.models import PriceHistory
+from poms.transactions.models import Transaction
+from poms.widgets.snapshots import history_changed, transactions_changed
+
+"""
+Balance snapshots of widgets are calculated from transactions, prices and
+fx rates, code below marks them outdated from the date of changed data.
+Changes are collected during the db transaction and snapshots are updated
+once on commit.
+"""
+
+
+@receiver(post_init, sender=Transaction, dispatch_uid="widgets_transaction_init")
+def remember_transaction_date(sender, instance, **kwargs):
+    # deferred fields are not loaded to be remembered
+    instance._snapshots_old = (
+        instance.__dict__.get("portfolio_id"),
+        instance.__dict__.get("transaction_date"),
+    )
+
+
+@receiver(post_save, sender=Transaction, dispatch_uid="widgets_transaction_save")
+@receiver(post_delete, sender=Transaction, dispatch_uid="widgets_transaction_delete")
+def outdate_transaction_snapshots(sender, instance, **kwargs):
+    changes = [(instance.portfolio_id, instance.transaction_date)]
+
+    old = getattr(instance, "_snapshots_old", None)
+    if old is not None:
+        changes.append(old)
+    instance._snapshots_old = changes[0]
+
+    collect_on_commit("widgets_transactions", changes, transactions_changed)
+
+
+@receiver(post_save, sender=PriceHistory, dispatch_uid="widgets_price_save")
+@receiver(post_delete, sender=PriceHistory, dispatch_uid="widgets_price_delete")
+def outdate_price_snapshots(sender, instance, **kwargs):
+    collect_on_commit(
+        "widgets_prices",
+        [(instance.instrument_id, instance.date)],
+        lambda items: history_changed(PriceHistory, items),
+    )
+
+
+@receiver(post_save, sender=CurrencyHistory, dispatch_uid="widgets_fx_rate_save")
+@receiver(post_delete, sender=CurrencyHistory, dispatch_uid="widgets_fx_rate_delete")
+def outdate_fx_rate_snapshots(sender, instance, **kwargs):
+    collect_on_commit(
+        "widgets_fx_rates",
+        [(instance.currency_id, instance.date)],
+        lambda items: history_changed(CurrencyHistory, items),
+    )
@@ -0,0 +1,506 @@
+"""
+Daily balance snapshots of portfolios for widgets.
+
+Snapshot is BalanceReportHistory of (portfolio, date) with positions, cash
+and widget category aggregates (asset types, sectors, countries, regions,
+currencies). Snapshots of the whole range of dates are calculated at once
+by the NAV engine (transactions, prices and fx rates are loaded once)
+instead of building the Balance Report for every date.
+
+Snapshots are marked outdated when transactions of the portfolio, prices
+or fx rates of their dates are changed, and only missing or outdated dates
+are calculated again.
+"""
+
+import logging
+from datetime import date
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q, QuerySet
+
+import numpy as np
+
+from poms.currencies.models import Currency
+from poms.instruments.models import Instrument
+from poms.obj_attrs.models import (
+    GenericAttribute,
+    GenericAttributeType,
+    GenericClassifier,
+)
+from poms.portfolios.nav_engine import (
+    calculate_market_values,
+    get_default_rate_cube,
+    get_portfolio_transactions,
+)
+from poms.widgets.models import (
+    BalanceReportHistory,
+    BalanceReportHistoryItem,
+    BalanceReportHistoryPosition,
+)
+
+_l = logging.getLogger("poms.widgets")
+
+SNAPSHOTS_BATCH_SIZE = 1000
+
+MARKET_VALUE_KEY = "market_value"
+
+ASSET_TYPES_USER_CODES = (
+    "asset_types",
+    "com.finmars.marscapital-attribute:instruments.instrument:asset_type",
+)
+SECTOR_USER_CODES = (
+    "sector",
+    "com.finmars.marscapital-attribute:instruments.instrument:sector",
+)
+
+# category: (name of instruments without value, name of cash)
+# same as in collect_*_category of poms.widgets.utils
+CATEGORIES = {
+    "Asset Types": ("No Category", "Cash"),
+    "Sector": ("No category", "Cash"),
+    "Country": ("No category", "Cash"),
+    "Region": ("No Category", "Cash"),
+    "Currency": ("No Category", None),
+}
+
+
+def _filter_by_instruments(
+    histories: QuerySet, instrument_ids: Iterable[int]
+) -> QuerySet:
+    # snapshots without positions (saved before positions were stored)
+    # can't be matched by instruments, they are outdated by any of them
+    return histories.filter(
+        Q(positions__instrument_id__in=instrument_ids) | Q(positions__isnull=True)
+    )
+
+
+def outdate_balance_snapshots(
+    date_from: date,
+    date_to: Optional[date] = None,
+    portfolio_ids: Optional[Iterable[int]] = None,
+    instrument_ids: Optional[Iterable[int]] = None,
+) -> int:
+    """Mark snapshots of date_from..date_to as outdated"""
+    histories = BalanceReportHistory.objects.filter(
+        date__gte=date_from, is_outdated=False
+    )
+    if date_to is not None:
+        histories = histories.filter(date__lte=date_to)
+    if portfolio_ids is not None:
+        histories = histories.filter(portfolio_id__in=portfolio_ids)
+    if instrument_ids is not None:
+        histories = _filter_by_instruments(histories, instrument_ids)
+
+    return BalanceReportHistory.objects.filter(
+        id__in=histories.values("id")
+    ).update(is_outdated=True)
+
+
+def history_changed(model, items: Iterable[Tuple[int, date]]):
+    """
+    Outdate snapshots affected by prices (PriceHistory) or fx rates
+    (CurrencyHistory) changed without signals, items are (instrument or
+    currency id, date)
+    """
+    items = list(items)
+    if not items:
+        return
+
+    dates = [day for _, day in items]
+    instrument_ids = None
+    if model._meta.model_name == "pricehistory":
+        instrument_ids = {pk for pk, _ in items}
+
+    histories = BalanceReportHistory.objects.filter(
+        date__in=set(dates), is_outdated=False
+    )
+    if instrument_ids is not None:
+        histories = _filter_by_instruments(histories, instrument_ids)
+
+    BalanceReportHistory.objects.filter(id__in=histories.values("id")).update(
+        is_outdated=True
+    )
+
+
+def transactions_changed(items: Iterable[Tuple[Optional[int], Optional[date]]]):
+    """
+    Outdate snapshots of portfolios from the earliest date of their changed
+    transactions, items are (portfolio id, transaction date)
+    """
+    dates_from: Dict[int, date] = {}
+    for portfolio_id, day in items:
+        if portfolio_id is None or day is None:
+            continue
+        if portfolio_id not in dates_from or day < dates_from[portfolio_id]:
+            dates_from[portfolio_id] = day
+
+    if not dates_from:
+        return
+
+    BalanceReportHistory.objects.filter(
+        reduce(
+            or_,
+            (
+                Q(portfolio_id=portfolio_id, date__gte=day)
+                for portfolio_id, day in dates_from.items()
+            ),
+        ),
+        is_outdated=False,
+    ).update(is_outdated=True)
+
+
+def get_dates_to_update(
+    master_user,
+    portfolio_id: int,
+    dates: List[date],
+    report_currency_id: int,
+    pricing_policy_id: int,
+    cost_method_id: Optional[int] = None,
+) -> List[date]:
+    """Dates without up-to-date snapshot of the same settings, sorted"""
+    actual_dates = set(
+        BalanceReportHistory.objects.filter(
+            master_user=master_user,
+            portfolio_id=portfolio_id,
+            date__in=dates,
+            report_currency_id=report_currency_id,
+            pricing_policy_id=pricing_policy_id,
+            cost_method_id=cost_method_id,
+            is_outdated=False,
+        ).values_list("date", flat=True)
+    )
+
+    return sorted(set(dates) - actual_dates)
+
+
+def _get_attribute_type(master_user, user_codes: tuple):
+    attribute_types = {
+        attribute_type.user_code: attribute_type
+        for attribute_type in GenericAttributeType.objects.filter(
+            master_user=master_user,
+            content_type=ContentType.objects.get_for_model(Instrument),
+            user_code__in=user_codes,
+        )
+    }
+
+    return next(
+        (attribute_types[code] for code in user_codes if code in attribute_types),
+        None,
+    )
+
+
+def _get_attribute_values(attribute_type, instrument_ids: list, field: str) -> dict:
+    if attribute_type is None:
+        return {}
+
+    return dict(
+        GenericAttribute.objects.filter(
+            attribute_type=attribute_type, object_id__in=instrument_ids
+        ).values_list("object_id", field)
+    )
+
+
+def get_instrument_categories(
+    master_user, instrument_ids: list
+) -> Tuple[Dict[int, dict], Dict[str, dict]]:
+    """
+    Category names of instruments as {instrument id: {category: name}} and
+    names collected in every snapshot as {category: {name: 0}}.
+    Attribute categories are absent if the attribute type doesn't exist.
+    """
+    asset_types_attribute_type = _get_attribute_type(
+        master_user, ASSET_TYPES_USER_CODES
+    )
+    sector_attribute_type = _get_attribute_type(master_user, SECTOR_USER_CODES)
+
+    initial = {
+        category: {name: 0 for name in names if name}
+        for category, names in CATEGORIES.items()
+    }
+    if asset_types_attribute_type is None:
+        del initial["Asset Types"]
+    else:
+        for name in GenericClassifier.objects.filter(
+            attribute_type=asset_types_attribute_type
+        ).values_list("name", flat=True):
+            initial["Asset Types"][name] = 0
+    if sector_attribute_type is None:
+        del initial["Sector"]
+
+    asset_types = _get_attribute_values(
+        asset_types_attribute_type, instrument_ids, "classifier__name"
+    )
+    sectors = _get_attribute_values(
+        sector_attribute_type, instrument_ids, "value_string"
+    )
+
+    categories = {}
+    for pk, country, region, currency in Instrument.objects.filter(
+        id__in=instrument_ids
+    ).values_list(
+        "id",
+        "country__name",
+        "country__region",
+        "co_directional_exposure_currency__name",
+    ):
+        categories[pk] = {
+            "Asset Types": asset_types.get(pk) or CATEGORIES["Asset Types"][0],
+            "Sector": sectors.get(pk) or CATEGORIES["Sector"][0],
+            "Country": country or CATEGORIES["Country"][0],
+            "Region": region or CATEGORIES["Region"][0],
+            "Currency": currency or CATEGORIES["Currency"][0],
+        }
+
+    return categories, initial
+
+
+def aggregate_categories(
+    positions: List[Tuple[Optional[int], Optional[int], float, Optional[float]]],
+    instrument_categories: Dict[int, dict],
+    initial: Dict[str, dict],
+    currency_names: Dict[int, str],
+) -> Dict[str, Dict[str, float]]:
+    """
+    Market values of positions as {category: {name: value}}, cash is counted
+    in "Cash" of the category or in its currency. Positions are
+    (instrument id, currency id, position size, market value).
+    """
+    result = {category: dict(names) for category, names in initial.items()}
+
+    for instrument_id, currency_id, _, market_value in positions:
+        if market_value is None:
+            continue
+
+        if instrument_id is not None:
+            names = instrument_categories.get(instrument_id, {})
+        else:
+            names = {
+                category: cash_name
+                for category, (_, cash_name) in CATEGORIES.items()
+                if cash_name
+            }
+            names["Currency"] = currency_names.get(
+                currency_id, CATEGORIES["Currency"][0]
+            )
+
+        for category, name in names.items():
+            if category in result:
+                result[category][name] = result[category].get(name, 0) + market_value
+
+    return result
+
+
+def calculate_balance_snapshots(
+    master_user,
+    portfolio_id: int,
+    dates: List[date],
+    report_currency_id: int,
+    pricing_policy_id: int,
+) -> Optional[Dict[date, dict]]:
+    """
+    Snapshots of the sorted dates as {date: {"nav", "positions", "categories"}},
+    days when the Balance Report fails are absent.
+    Returns None if portfolio can't be valued without the Balance Report.
+    """
+    values = calculate_market_values(
+        get_portfolio_transactions(master_user.id, portfolio_id),
+        dates,
+        report_currency_id,
+        pricing_policy_id,
+        get_default_rate_cube(master_user.id, dates),
+    )
+    if values is None:
+        return None
+
+    instrument_categories, initial_categories = get_instrument_categories(
+        master_user, values.instrument_ids
+    )
+    currency_names = dict(
+        Currency.objects.filter(id__in=values.currency_ids).values_list("id", "name")
+    )
+
+    def to_value(value) -> Optional[float]:
+        return None if np.isnan(value) else float(value)
+
+    snapshots = {}
+    for i, day in enumerate(dates):
+        if values.failed_days[i]:
+            continue
+
+        positions = [
+            (pk, None, float(size), to_value(value))
+            for pk, size, value in zip(
+                values.instrument_ids, values.positions[i], values.positions_value[i]
+            )
+            if size
+        ]
+        positions.extend(
+            (None, pk, float(size), to_value(value))
+            for pk, size, value in zip(
+                values.currency_ids, values.cash[i], values.cash_value[i]
+            )
+            if size
+        )
+
+        snapshots[day] = {
+            # items without market value are skipped in NAV
+            "nav": sum(value for *_, value in positions if value is not None),
+            "positions": positions,
+            "categories": aggregate_categories(
+                positions, instrument_categories, initial_categories, currency_names
+            ),
+        }
+
+    return snapshots
+
+
+def save_balance_snapshots(
+    master_user,
+    portfolio_id: int,
+    snapshots: Dict[date, dict],
+    report_currency_id: int,
+    pricing_policy_id: int,
+    cost_method_id: Optional[int] = None,
+    report_settings_data=None,
+):
+    """Create or replace BalanceReportHistory with items and positions"""
+    if not snapshots:
+        return
+
+    with transaction.atomic():
+        BalanceReportHistory.objects.bulk_create(
+            [
+                BalanceReportHistory(
+                    master_user=master_user,
+                    date=day,
+                    portfolio_id=portfolio_id,
+                    report_currency_id=report_currency_id,
+                    pricing_policy_id=pricing_policy_id,
+                    cost_method_id=cost_method_id,
+                    report_settings_data=report_settings_data,
+                    nav=snapshot["nav"],
+                    is_outdated=False,
+                )
+                for day, snapshot in snapshots.items()
+            ],
+            batch_size=SNAPSHOTS_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["master_user", "date", "portfolio"],
+            update_fields=[
+                "report_currency",
+                "pricing_policy",
+                "cost_method",
+                "report_settings_data",
+                "nav",
+                "is_outdated",
+                "modified_at",
+            ],
+        )
+
+        history_ids = dict(
+            BalanceReportHistory.objects.filter(
+                master_user=master_user,
+                portfolio_id=portfolio_id,
+                date__in=list(snapshots),
+            ).values_list("date", "id")
+        )
+        BalanceReportHistoryItem.objects.filter(
+            balance_report_history_id__in=history_ids.values()
+        ).delete()
+        BalanceReportHistoryPosition.objects.filter(
+            balance_report_history_id__in=history_ids.values()
+        ).delete()
+
+        BalanceReportHistoryItem.objects.bulk_create(
+            [
+                BalanceReportHistoryItem(
+                    balance_report_history_id=history_ids[day],
+                    category=category,
+                    name=name,
+                    key=MARKET_VALUE_KEY,
+                    value=value,
+                )
+                for day, snapshot in snapshots.items()
+                for category, values in snapshot["categories"].items()
+                for name, value in values.items()
+            ],
+            batch_size=SNAPSHOTS_BATCH_SIZE,
+        )
+        BalanceReportHistoryPosition.objects.bulk_create(
+            [
+                BalanceReportHistoryPosition(
+                    balance_report_history_id=history_ids[day],
+                    instrument_id=instrument_id,
+                    currency_id=currency_id,
+                    position_size=position_size,
+                    market_value=market_value,
+                )
+                for day, snapshot in snapshots.items()
+                for (
+                    instrument_id,
+                    currency_id,
+                    position_size,
+                    market_value,
+                ) in snapshot["positions"]
+            ],
+            batch_size=SNAPSHOTS_BATCH_SIZE,
+        )
+
+
+def update_balance_snapshots(
+    master_user,
+    portfolio_id: int,
+    dates: List[date],
+    report_currency_id: int,
+    pricing_policy_id: int,
+    cost_method_id: Optional[int] = None,
+    report_settings_data=None,
+) -> Optional[Tuple[List[date], List[date]]]:
+    """
+    Calculate snapshots of missing and outdated dates, returns
+    (calculated dates, failed dates) or None if the Balance Report
+    has to be used for the portfolio
+    """
+    dates_to_update = get_dates_to_update(
+        master_user,
+        portfolio_id,
+        dates,
+        report_currency_id,
+        pricing_policy_id,
+        cost_method_id,
+    )
+    if not dates_to_update:
+        return [], []
+
+    snapshots = calculate_balance_snapshots(
+        master_user,
+        portfolio_id,
+        dates_to_update,
+        report_currency_id,
+        pricing_policy_id,
+    )
+    if snapshots is None:
+        return None
+
+    save_balance_snapshots(
+        master_user,
+        portfolio_id,
+        snapshots,
+        report_currency_id,
+        pricing_policy_id,
+        cost_method_id,
+        report_settings_data,
+    )
+
+    failed_dates = [day for day in dates_to_update if day not in snapshots]
+    _l.info(
+        f"update_balance_snapshots portfolio {portfolio_id} "
+        f"calculated {len(snapshots)} failed {len(failed_dates)} "
+        f"of {len(dates)} dates"
+    )
+
+    return sorted(snapshots), failed_dates
@@ -11,7 +11,7 @@ from poms.common.utils import (
 from poms.currencies.models import Currency
 from poms.instruments.models import CostMethod, PricingPolicy
 from poms.portfolios.models import Portfolio
-from poms.reports.common import Report
+from poms.reports.common import Report, ReportItem
 from poms.reports.serializers import BalanceReportSerializer, PLReportSerializer
 from poms.reports.sql_builders.balance import (
     BalanceReportBuilderSql,
@@ -23,10 +23,12 @@ from poms.widgets.handlers import StatsHandler
 from poms.widgets.models import (
     BalanceReportHistory,
     BalanceReportHistoryItem,
+    BalanceReportHistoryPosition,
     PLReportHistory,
     WidgetStats,
     PLReportHistoryItem,
 )
+from poms.widgets.snapshots import update_balance_snapshots
 from poms.widgets.utils import (
     find_next_date_to_process,
     collect_asset_type_category,
@@ -149,12 +151,36 @@ def collect_balance_report_history(self, task_id, *args, **kwargs):
             )
 
         balance_report_history.report_settings_data = task.options_object
+        balance_report_history.is_outdated = False
 
         balance_report_history.save()
 
         BalanceReportHistoryItem.objects.filter(
             balance_report_history=balance_report_history
         ).delete()
+        BalanceReportHistoryPosition.objects.filter(
+            balance_report_history=balance_report_history
+        ).delete()
+
+        # positions are used to outdate history when their prices are changed
+        BalanceReportHistoryPosition.objects.bulk_create(
+            [
+                BalanceReportHistoryPosition(
+                    balance_report_history=balance_report_history,
+                    instrument_id=item.get("instrument"),
+                    currency_id=(
+                        item.get("currency")
+                        if item["item_type"] == ReportItem.TYPE_CURRENCY
+                        else None
+                    ),
+                    position_size=item.get("position_size") or 0,
+                    market_value=item.get("market_value"),
+                )
+                for item in instance_serialized["items"]
+                if item["item_type"]
+                in (ReportItem.TYPE_INSTRUMENT, ReportItem.TYPE_CURRENCY)
+            ]
+        )
 
         # _l.info('instance_serialized %s' % instance_serialized)
         _l.info("instance_serialized len items %s" % len(instance_serialized["items"]))
@@ -287,6 +313,81 @@ def collect_balance_report_history(self, task_id, *args, **kwargs):
         start_new_balance_history_collect(task)
 
 
+@finmars_task(name="widgets.collect_balance_snapshots", bind=True)
+def collect_balance_snapshots(self, task_id, *args, **kwargs):
+    """
+    Collect Balance Report histories of all dates of the task at once
+    from balance snapshots, only missing and outdated dates are calculated.
+    Portfolios which can't be valued without the Balance Report are
+    collected by collect_balance_report_history.
+    """
+
+    _l.info("collect_balance_snapshots init task_id %s" % task_id)
+
+    task = CeleryTask.objects.get(id=task_id)
+    task_options_object = task.options_object
+    portfolio_id = task_options_object["portfolio_id"]
+    dates = [str_to_date(day) for day in task_options_object["dates_to_process"]]
+
+    try:
+        result = update_balance_snapshots(
+            task.master_user,
+            portfolio_id,
+            dates,
+            task_options_object["report_currency_id"],
+            task_options_object["pricing_policy_id"],
+            task_options_object.get("cost_method_id"),
+            task_options_object,
+        )
+
+    except Exception as e:
+        _l.error("collect_balance_snapshots. error %s" % e)
+        _l.error("collect_balance_snapshots. traceback %s" % traceback.format_exc())
+
+        task.status = CeleryTask.STATUS_ERROR
+        task.error_message = str(e)
+        task.save()
+        return
+
+    if result is None:
+        _l.info(
+            "collect_balance_snapshots. portfolio %s is collected by balance reports"
+            % portfolio_id
+        )
+        start_new_balance_history_collect(task)
+        return
+
+    _, failed_dates = result
+
+    history_ids = dict(
+        BalanceReportHistory.objects.filter(
+            master_user=task.master_user, portfolio_id=portfolio_id, date__in=dates
+        ).values_list("date", "id")
+    )
+
+    results = []
+    for day, day_str in zip(dates, task_options_object["dates_to_process"]):
+        if day in failed_dates:
+            task_options_object["error_dates"].append(day_str)
+            results.append({"date": day_str, "status": "error"})
+        else:
+            task_options_object["processed_dates"].append(day_str)
+            results.append(
+                {"date": day_str, "status": "success", "id": history_ids.get(day)}
+            )
+
+    if failed_dates:
+        task.error_message = "Report currency fx rate is 0 on %s" % ", ".join(
+            str(day) for day in failed_dates
+        )
+
+    task.options_object = task_options_object
+    task.result_object = {"results": results}
+    task.save()
+
+    start_new_balance_history_collect(task)
+
+
 def start_new_pl_history_collect(task):
     task = CeleryTask.objects.get(id=task.id)
     task_options_object = task.options_object
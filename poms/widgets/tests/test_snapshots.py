@@ -0,0 +1,186 @@
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db import transaction
+from django.test import SimpleTestCase
+
+from poms.common.common_base_test import BIG, BaseTestCase
+from poms.configuration.utils import get_default_configuration_code
+from poms.instruments.models import PriceHistory, PricingPolicy
+from poms.transactions.models import TransactionClass
+from poms.widgets import signals
+from poms.widgets.models import BalanceReportHistory
+from poms.widgets.snapshots import aggregate_categories, update_balance_snapshots
+from poms.widgets.utils import find_next_date_to_process
+
+APPLE = 10
+USD = 1
+
+
+class AggregateCategoriesTest(SimpleTestCase):
+    def test_instruments_and_cash(self):
+        positions = [
+            (APPLE, None, 10, 300.0),
+            (11, None, 5, None),  # not priced
+            (None, USD, 700, 700.0),
+        ]
+        instrument_categories = {
+            APPLE: {
+                "Asset Types": "Equity",
+                "Country": "United States",
+                "Region": "Americas",
+                "Currency": "USD",
+            },
+            11: {"Asset Types": "Bonds"},
+        }
+        initial = {
+            "Asset Types": {"Equity": 0, "Bonds": 0, "No Category": 0, "Cash": 0},
+            "Country": {"No category": 0, "Cash": 0},
+            "Region": {"No Category": 0, "Cash": 0},
+            "Currency": {"No Category": 0},
+        }
+
+        result = aggregate_categories(
+            positions, instrument_categories, initial, {USD: "USD"}
+        )
+
+        self.assertEqual(
+            result["Asset Types"],
+            {"Equity": 300, "Bonds": 0, "No Category": 0, "Cash": 700},
+        )
+        self.assertEqual(
+            result["Country"], {"United States": 300, "No category": 0, "Cash": 700}
+        )
+        self.assertEqual(result["Currency"], {"USD": 1000, "No Category": 0})
+        self.assertNotIn("Sector", result)
+
+
+class FindNextDateToProcessTest(SimpleTestCase):
+    def test_skips_processed_and_error_dates(self):
+        task = SimpleNamespace(
+            options_object={
+                "dates_to_process": ["2024-01-01", "2024-01-02", "2024-01-03"],
+                "processed_dates": ["2024-01-01"],
+                "error_dates": ["2024-01-02"],
+            }
+        )
+
+        self.assertEqual(find_next_date_to_process(task), "2024-01-03")
+
+
+class UpdateBalanceSnapshotsTest(BaseTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.init_test_case()
+        self.portfolio = self.db_data.portfolios[BIG]
+        self.instrument = self.db_data.instruments["Apple"]
+        self.pricing_policy = PricingPolicy.objects.create(
+            master_user=self.master_user,
+            owner=self.member,
+            user_code=self.random_string(),
+            configuration_code=get_default_configuration_code(),
+        )
+        self.dates = [date(2024, 1, 1) + timedelta(days=i) for i in range(4)]
+
+        self.db_data.cash_in_transaction(self.portfolio, amount=1000, day=self.dates[0])
+        _, self.buy = self.db_data.cash_in_transaction(
+            self.portfolio, day=self.dates[1]
+        )
+        self.buy.transaction_class_id = TransactionClass.BUY
+        self.buy.instrument = self.instrument
+        self.buy.position_size_with_sign = 10
+        self.buy.cash_consideration = -300
+        self.buy.save()
+
+        for day in self.dates:
+            PriceHistory.objects.create(
+                instrument=self.instrument,
+                pricing_policy=self.pricing_policy,
+                date=day,
+                principal_price=30,
+            )
+
+    def update(self):
+        return update_balance_snapshots(
+            self.master_user,
+            self.portfolio.id,
+            self.dates,
+            self.db_data.usd.id,
+            self.pricing_policy.id,
+        )
+
+    def get_history(self, day) -> BalanceReportHistory:
+        return BalanceReportHistory.objects.get(
+            master_user=self.master_user, portfolio=self.portfolio, date=day
+        )
+
+    def test_snapshots(self):
+        self.assertEqual(self.update(), (self.dates, []))
+
+        history = self.get_history(self.dates[2])
+        positions = {
+            (position.instrument_id, position.currency_id): position
+            for position in history.positions.all()
+        }
+        self.assertEqual(positions[(self.instrument.id, None)].position_size, 10)
+        self.assertEqual(positions[(None, self.db_data.usd.id)].position_size, 700)
+        self.assertAlmostEqual(
+            history.nav,
+            sum(position.market_value or 0 for position in positions.values()),
+        )
+        self.assertTrue(history.items.filter(category="Currency").exists())
+
+    def change_price(self, day):
+        price = PriceHistory.objects.get(
+            instrument=self.instrument,
+            pricing_policy=self.pricing_policy,
+            date=day,
+        )
+        price.principal_price = 40
+        with self.captureOnCommitCallbacks(execute=True):
+            price.save()
+
+    def test_only_outdated_dates_are_updated(self):
+        self.update()
+        self.assertEqual(self.update(), ([], []))
+
+        self.change_price(self.dates[2])
+
+        self.assertTrue(self.get_history(self.dates[2]).is_outdated)
+        self.assertFalse(self.get_history(self.dates[3]).is_outdated)
+        self.assertEqual(self.update(), ([self.dates[2]], []))
+        self.assertFalse(self.get_history(self.dates[2]).is_outdated)
+
+    def test_snapshot_without_positions_is_outdated_by_prices(self):
+        self.update()
+        self.get_history(self.dates[2]).positions.all().delete()
+
+        self.change_price(self.dates[2])
+
+        self.assertTrue(self.get_history(self.dates[2]).is_outdated)
+
+    def test_transaction_date_change_outdates_snapshots(self):
+        self.update()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buy.transaction_date = self.dates[3]
+            self.buy.save()
+
+        self.assertFalse(self.get_history(self.dates[0]).is_outdated)
+        self.assertTrue(self.get_history(self.dates[1]).is_outdated)
+
+    def test_transaction_changes_are_collected_per_db_transaction(self):
+        with mock.patch.object(
+            signals, "transactions_changed"
+        ) as changed, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for day in self.dates[2:]:
+                    self.buy.transaction_date = day
+                    self.buy.save()
+
+        changed.assert_called_once_with(
+            {(self.portfolio.id, day) for day in self.dates[1:]}
+        )
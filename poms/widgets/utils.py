@@ -2,6 +2,7 @@ import datetime
 import logging
 import traceback
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 
@@ -522,29 +523,17 @@ def str_to_date(date_string):
 
 
 def find_next_date_to_process(task):
-    result = None
-
+    """First date neither processed nor failed, the last date if all are done"""
     task_options_object = task.options_object
+    dates_to_process = task_options_object["dates_to_process"]
 
-    i = 0
-
-    found = False
-
-    while not found:
-        result = task_options_object["dates_to_process"][i]
-
-        found = True
-
-        i = i + 1
-
-        if i < len(task_options_object["dates_to_process"]):
-            if result in task_options_object["processed_dates"]:
-                found = False
+    done_dates = set(task_options_object["processed_dates"])
+    done_dates.update(task_options_object["error_dates"])
 
-            if result in task_options_object["error_dates"]:
-                found = False
-
-    return result
+    return next(
+        (day for day in dates_to_process[:-1] if day not in done_dates),
+        dates_to_process[-1],
+    )
 
 
 def collect_balance_history(
@@ -560,10 +549,19 @@ def collect_balance_history(
     pricing_policy_id,
     sync=False,
 ):
-    from poms.widgets.tasks import collect_balance_report_history
+    from poms.widgets.tasks import (
+        collect_balance_report_history,
+        collect_balance_snapshots,
+    )
 
     from poms.portfolios.models import Portfolio
 
+    collect_task = (
+        collect_balance_snapshots
+        if settings.WIDGETS_BALANCE_SNAPSHOTS
+        else collect_balance_report_history
+    )
+
     portfolio = Portfolio.objects.get(id=portfolio_id)
 
     task = CeleryTask.objects.create(
@@ -602,7 +600,7 @@ def collect_balance_history(
             % (options_object["date_from"], options_object["date_to"]),
         )
 
-        collect_balance_report_history.apply(
+        collect_task.apply(
             kwargs={
                 "task_id": task.id,
                 "context": {
@@ -614,7 +612,7 @@ def collect_balance_history(
 
     else:
         transaction.on_commit(
-            lambda: collect_balance_report_history.apply_async(
+            lambda: collect_task.apply_async(
                 kwargs={
                     "task_id": task.id,
                     "context": {
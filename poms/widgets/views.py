@@ -127,44 +127,40 @@ class HistoryNavViewSet(AbstractViewSet):
 
             balance_report_histories = balance_report_histories.order_by("date")
 
-            for result_date in result_dates:
-                found = False
-
-                for history_item in balance_report_histories:
-                    if str(history_item.date) == str(result_date):
-                        found = True
+            histories_by_date = {
+                str(history_item.date): history_item
+                for history_item in balance_report_histories
+            }
 
-                        result_item = {
-                            "date": str(history_item.date),
-                            "nav": history_item.nav,
-                        }
+            for result_date in result_dates:
+                history_item = histories_by_date.get(str(result_date))
 
-                        categories = []
-
-                        for item in history_item.items.all():
-                            if item.category not in categories:
-                                categories.append(item.category)
-
-                        result_item["categories"] = [
-                            {"name": category, "items": []} for category in categories
-                        ]
-                        for item in history_item.items.all():
-                            for category in result_item["categories"]:
-                                if item.category == category["name"]:
-                                    category["items"].append(
-                                        {
-                                            "name": item.name,
-                                            "key": item.key,
-                                            "value": item.value,
-                                        }
-                                    )
-
-                        items.append(result_item)
-
-                if not found:
+                if history_item is None:
                     items.append(
                         {"date": str(result_date), "nav": None, "categories": []}
                     )
+                    continue
+
+                categories = {}
+                for item in history_item.items.all():
+                    categories.setdefault(item.category, []).append(
+                        {
+                            "name": item.name,
+                            "key": item.key,
+                            "value": item.value,
+                        }
+                    )
+
+                items.append(
+                    {
+                        "date": str(history_item.date),
+                        "nav": history_item.nav,
+                        "categories": [
+                            {"name": category, "items": category_items}
+                            for category, category_items in categories.items()
+                        ],
+                    }
+                )
 
             currency_object = Currency.objects.get(id=currency)
             pricing_policy_object = PricingPolicy.objects.get(id=pricing_policy)
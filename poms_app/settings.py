@@ -61,6 +61,8 @@ SUPERSET_URL = os.environ.get("SUPERSET_URL", None)
 UNIFIED_DATA_PROVIDER_URL = os.environ.get("UNIFIED_DATA_PROVIDER_URL", None)
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10240
 ROUND_NDIGITS = ENV_INT("ROUND_NDIGITS", 4)
+EXPRESSION_CACHE_SIZE = ENV_INT("EXPRESSION_CACHE_SIZE", 2048)
+EXPRESSION_COMPILED = ENV_BOOL("EXPRESSION_COMPILED", False)
 
 API_DATE_FORMAT = "%Y-%m-%d"
 API_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
@@ -128,6 +130,7 @@ INSTALLED_APPS = [
     "poms.auth_tokens",
     "poms.widgets",
     "poms.explorer",
+    "poms.search",
     "crispy_forms",
     "rest_framework",
     "rest_framework.authtoken",
@@ -401,6 +404,7 @@ REDIS_PORT = ENV_INT("REDIS_PORT", default=6379)
 REDIS_DB_DEFAULT = ENV_INT("REDIS_DB_DEFAULT", default=1)
 REDIS_DB_SESSION = ENV_INT("REDIS_DB_SESSION", default=2)
 REDIS_DB_THROTTLING = ENV_INT("REDIS_DB_THROTTLING", default=3)
+REDIS_DB_REPORTS = ENV_INT("REDIS_DB_REPORTS", default=4)
 REDIS_BACKEND = "django_redis.cache.RedisCache"
 REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
 REDIS_CLIENT_CLASS = "django_redis.client.DefaultClient"
@@ -430,8 +434,45 @@ CACHES = {
         },
         "KEY_PREFIX": "backend.session",
     },
+    "reports": {
+        "BACKEND": REDIS_BACKEND,
+        "LOCATION": f"{REDIS_URL}/{REDIS_DB_REPORTS}",
+        "OPTIONS": {
+            "CLIENT_CLASS": REDIS_CLIENT_CLASS,
+        },
+        "KEY_PREFIX": "backend.reports",
+    },
 }
 
+# Built reports shared by groups/items requests of the same report settings
+REPORT_CACHE_ALIAS = ENV_STR("REPORT_CACHE_ALIAS", "reports")
+REPORT_CACHE_TTL = ENV_INT("REPORT_CACHE_TTL", 600)  # 10 mins
+REPORT_CACHE_MAX_SIZE = ENV_INT("REPORT_CACHE_MAX_SIZE", 64 * 1024 * 1024)
+REPORT_CACHE_MAX_TOTAL_SIZE = ENV_INT("REPORT_CACHE_MAX_TOTAL_SIZE", 512 * 1024 * 1024)
+
+# Balance/PL reports of independent portfolios are built by portfolio shards in threads
+REPORT_PARALLEL_BUILD = ENV_BOOL("REPORT_PARALLEL_BUILD", False)
+REPORT_PARALLEL_WORKERS = ENV_INT("REPORT_PARALLEL_WORKERS", 4)
+REPORT_PARALLEL_SHARDS = ENV_INT("REPORT_PARALLEL_SHARDS", 16)
+REPORT_PARALLEL_MIN_PORTFOLIOS = ENV_INT("REPORT_PARALLEL_MIN_PORTFOLIOS", 20)
+
+# Balance/PL report queries are executed as prepared statements of db session to reuse
+# query plans, disable when db connections go through a pooler in transaction mode
+REPORT_SQL_PREPARED_STATEMENTS = ENV_BOOL("REPORT_SQL_PREPARED_STATEMENTS", True)
+# Log planning and execution time of report queries, queries are run twice
+REPORT_SQL_PROFILING = ENV_BOOL("REPORT_SQL_PROFILING", False)
+
+# Portfolio register prices are calculated for the whole date range at once
+PORTFOLIO_REGISTER_NAV_ENGINE = ENV_BOOL("PORTFOLIO_REGISTER_NAV_ENGINE", True)
+
+# Global table search of indexed models looks into trigram indexed search documents,
+# enable after documents are built by "rebuild_search_index" command
+GLOBAL_TABLE_SEARCH_INDEX = ENV_BOOL("GLOBAL_TABLE_SEARCH_INDEX", False)
+
+# Balance history of widgets is collected from balance snapshots of the whole
+# date range at once, recalculating only missing and outdated dates
+WIDGETS_BALANCE_SNAPSHOTS = ENV_BOOL("WIDGETS_BALANCE_SNAPSHOTS", True)
+
 # SESSION_SERIALIZER = 'django.contrib.sessions.serializers.JSONSerializer'
 # SESSION_ENGINE = "poms.http_sessions.backends.cached_db"
 # SESSION_CACHE_ALIAS = 'http_session'
@@ -688,6 +729,8 @@ AWS_S3_SECRET_ACCESS_KEY = os.environ.get("AWS_S3_SECRET_ACCESS_KEY", None)
 AWS_STORAGE_BUCKET_NAME = os.environ.get("AWS_STORAGE_BUCKET_NAME", None)
 AWS_S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL", None)
 AWS_S3_SIGNATURE_VERSION = "s3v4"
+# downloaded files bigger than that are spooled to disk (encrypted files are read by chunks)
+AWS_S3_MAX_MEMORY_SIZE = ENV_INT("AWS_S3_MAX_MEMORY_SIZE", 64 * 1024 * 1024)
 
 AWS_S3_VERIFY = os.environ.get("AWS_S3_VERIFY", None)
 if os.environ.get("AWS_S3_VERIFY") == "False":